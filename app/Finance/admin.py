@@ -4,4 +4,6 @@ from django.contrib import admin
 from .models import *
 
 # Register the Department model with the admin site
-admin.site.register(Department)
+@admin.register(Department)
+class DepartmentAdmin(admin.ModelAdmin):
+    list_select_related = ("ManagerId",)   # Each department's name shows its manager
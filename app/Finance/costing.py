@@ -0,0 +1,367 @@
+from collections import defaultdict, deque
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from app.sharding import FanOut, ShardAliases, ShardFor
+from Sales.archive import ReadAcrossArchive
+from Sales.graphing import DateToDatetime, TruncateForGranularity
+
+CENT = Decimal("0.01")
+UNIT_COST_PLACES = Decimal("0.0001")
+SALE_COLUMNS = ("SalesId", "ProductId", "StoreId", "Quantity", "TotalAmount", "SaleTimestamp")
+
+# Margin groupings and the SaleCost values each one groups by
+MARGIN_GROUPS = {
+    "product": ("ProductId", "ProductId__ProductName"),
+    "store": ("StoreId", "StoreId__StoreName"),
+    "period": ("Period",),
+}
+
+
+class LotQueue:
+    """
+    One product's open lots, oldest first, and its sales still waiting for units.
+
+    Both incremental costing and the full rebuild run sales and lots through this class, so
+    they apply exactly the same first in, first out and rounding rules.
+    """
+
+    def __init__(self):
+        self.lots = deque()     # CostLot instances with units left, in the order they are consumed
+        self.waiting = deque()  # SaleCost instances with Uncosted units, oldest sale first
+        self.changed = {}       # Lots whose Remaining changed, by id()
+
+    def _Take(self, quantity):
+        # Consumes up to quantity units from the oldest lots, returns their cost and the units left uncovered
+        cost = Decimal(0)
+        while quantity > 0 and self.lots:
+            lot = self.lots[0]
+            taken = min(quantity, lot.Remaining)
+            lot.Remaining -= taken
+            quantity -= taken
+            cost += taken * lot.UnitCost
+            self.changed[id(lot)] = lot
+            if lot.Remaining == 0:
+                self.lots.popleft()
+        return cost, max(quantity, 0)
+
+    def CostSale(self, record):
+        # Costs a new SaleCost from the open lots, leaving it waiting when they run out
+        cost, record.Uncosted = self._Take(record.Quantity)
+        record.Cost = cost.quantize(CENT)
+        if record.Uncosted:
+            self.waiting.append(record)
+
+    def AddLot(self, lot):
+        """
+        Queues a newly received lot and hands its units to the sales waiting for them.
+
+        Returns:
+            list: The SaleCost records whose Cost and Uncosted changed.
+        """
+        self.lots.append(lot)
+        filled = []
+        while self.waiting and self.lots:
+            record = self.waiting[0]
+            cost, record.Uncosted = self._Take(record.Uncosted)
+            record.Cost = (record.Cost + cost).quantize(CENT)
+            filled.append(record)
+            if record.Uncosted:
+                break
+            self.waiting.popleft()
+        return filled
+
+
+def _NewLot(order):
+    # Builds the CostLot of a delivered purchase order, without saving it
+    from Finance.models import CostLot
+
+    return CostLot(
+        ProductId_id=order.ProductId_id,
+        PurchaseOrderId=order,
+        ReceivedDate=order.DeliveryDate or order.OrderDate,
+        Quantity=order.Quantity,
+        UnitCost=(order.FullCost / order.Quantity).quantize(UNIT_COST_PLACES),
+        Remaining=order.Quantity,
+    )
+
+
+def _NewSaleCost(row):
+    # Builds the SaleCost of a sale row with SALE_COLUMNS, without saving it
+    from Finance.models import SaleCost
+
+    salesId, productId, storeId, quantity, amount, timestamp = row
+    return SaleCost(
+        SalesId=salesId, ProductId_id=productId, StoreId_id=storeId, SaleTimestamp=timestamp,
+        Quantity=quantity, Revenue=amount, Cost=Decimal(0),
+    )
+
+
+def _DeliveredOrders():
+    # Delivered purchase orders that can become lots, ones without a quantity have no unit cost
+    from Procurement.models import PurchaseOrder
+
+    return PurchaseOrder.objects.filter(OrderStatus=PurchaseOrder.DELIVERED, Quantity__gt=0)
+
+
+def _LoadQueues(productIds):
+    # Loads the open lots and waiting sales of the given products, two queries however many there are
+    from Finance.models import CostLot, SaleCost
+
+    queues = defaultdict(LotQueue)
+    for lot in CostLot.objects.filter(ProductId__in=productIds, Remaining__gt=0).order_by("ReceivedDate", "CostLotId"):
+        queues[lot.ProductId_id].lots.append(lot)
+    for record in SaleCost.objects.filter(ProductId__in=productIds, Uncosted__gt=0).order_by("SaleTimestamp", "SalesId"):
+        queues[record.ProductId_id].waiting.append(record)
+    return queues
+
+
+def _SaveLots(queues):
+    # Writes back the Remaining units of existing lots consumed while costing, one executemany for all of them
+    from Finance.models import CostLot
+
+    changed = [lot for queue in queues.values() for lot in queue.changed.values() if lot.pk is not None]
+    if changed:
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {connection.ops.quote_name(CostLot._meta.db_table)} SET Remaining = %s WHERE CostLotId = %s",
+                [(lot.Remaining, lot.pk) for lot in changed],
+            )
+
+
+def _InsertSaleCosts(records):
+    # Inserts new SaleCost rows with one executemany, bulk_create's per-value preparation dominates large batches
+    from Finance.models import SaleCost
+
+    columns = ("SalesId", "ProductId_id", "StoreId_id", "SaleTimestamp", "Quantity", "Revenue", "Cost", "Uncosted")
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO {} ({}) VALUES ({})".format(
+                connection.ops.quote_name(SaleCost._meta.db_table),
+                ", ".join(connection.ops.quote_name(column) for column in columns),
+                ", ".join(["%s"] * len(columns)),
+            ),
+            [
+                (
+                    record.SalesId, record.ProductId_id, record.StoreId_id,
+                    connection.ops.adapt_datetimefield_value(record.SaleTimestamp), record.Quantity,
+                    connection.ops.adapt_decimalfield_value(record.Revenue),
+                    connection.ops.adapt_decimalfield_value(record.Cost), record.Uncosted,
+                )
+                for record in records
+            ],
+        )
+
+
+def SyncLots():
+    """
+    Creates lots for purchase orders delivered since the last run and costs the sales waiting for them.
+
+    Returns:
+        int: Number of lots created.
+    """
+    from Finance.models import CostLot, SaleCost
+
+    orders = list(_DeliveredOrders().filter(cost_lot__isnull=True).order_by("DeliveryDate", "PurchaseOrderId"))
+    if not orders:
+        return 0
+
+    with transaction.atomic():
+        queues = _LoadQueues({order.ProductId_id for order in orders})
+        lots, filled = [], []
+        for order in orders:
+            lot = _NewLot(order)
+            filled.extend(queues[order.ProductId_id].AddLot(lot))
+            lots.append(lot)
+        _SaveLots(queues)
+        CostLot.objects.bulk_create(lots, batch_size=1000)     # Saved with the units left after filling
+        SaleCost.objects.bulk_update(filled, ["Cost", "Uncosted"], batch_size=1000)
+    return len(lots)
+
+
+def CostNewSales(batch_size=None):
+    """
+    Costs the sales recorded since the last run, in batches, against the open lots of their products.
+
+    Each database holding sales (every shard, or the default one) has a watermark in CostingState,
+    so only new sales are read. Sales of a batch are costed in time order across shards. A sale
+    recorded with an earlier timestamp than sales already costed is costed when it arrives, a full
+    rebuild would cost it in timestamp order instead.
+
+    Args:
+        batch_size (int, optional): Sales read per database per batch, defaults to COSTING_BATCH_SIZE.
+
+    Returns:
+        int: Number of sales costed.
+    """
+    from Finance.models import CostingState
+    from Sales.models import Sales
+
+    batch_size = batch_size or settings.COSTING_BATCH_SIZE
+    costed = 0
+    while True:
+        positions = dict(CostingState.objects.values_list("Database", "LastSalesId"))
+        batches = dict(zip(ShardAliases(), FanOut(
+            lambda alias: list(
+                Sales.objects.using(alias).filter(SalesId__gt=positions.get(alias, 0))
+                .order_by("SalesId").values_list(*SALE_COLUMNS)[:batch_size]
+            )
+        )))
+        if not any(batches.values()):
+            return costed
+        rows = sorted(
+            (row for batch in batches.values() for row in batch if row[1] is not None),  # Sales without a product can't be costed
+            key=lambda row: (row[5], row[0]),
+        )
+
+        with transaction.atomic():
+            queues = _LoadQueues({row[1] for row in rows})
+            records = []
+            for row in rows:
+                record = _NewSaleCost(row)
+                queues[record.ProductId_id].CostSale(record)
+                records.append(record)
+            _InsertSaleCosts(records)
+            _SaveLots(queues)
+            for alias, batch in batches.items():
+                if batch:
+                    CostingState.objects.update_or_create(Database=alias, defaults={"LastSalesId": batch[-1][0]})
+        costed += len(records)
+
+
+def RunCosting():
+    """
+    Brings cost of goods up to date: new lots first, so new sales can be costed against them.
+
+    Returns:
+        dict: Number of lots created and sales costed.
+    """
+    return {"Lots": SyncLots(), "Sales": CostNewSales()}
+
+
+def ComputeFifoCosts():
+    """
+    Works out the cost of every sale from scratch, from all delivered purchase orders and all sales.
+
+    Lots become available at the start of their delivery date and sales are costed in timestamp
+    order, archived sales included. Nothing is saved.
+
+    Returns:
+        tuple: Unsaved CostLot instances, SaleCost instances and the last SalesId per database.
+    """
+    events = []
+    for order in _DeliveredOrders().order_by("DeliveryDate", "PurchaseOrderId"):
+        lot = _NewLot(order)
+        events.append((DateToDatetime(lot.ReceivedDate), 0, order.PurchaseOrderId, lot))
+    for rows in ReadAcrossArchive(lambda sales: list(sales.filter(ProductId__isnull=False).values_list(*SALE_COLUMNS))):
+        events.extend((row[5], 1, row[0], row) for row in rows)
+    events.sort(key=lambda event: event[:3])     # Lots received on a day come before that day's sales
+
+    queues = defaultdict(LotQueue)
+    lots, records, watermarks = [], [], {}
+    for _, kind, _, item in events:
+        if kind == 0:
+            queues[item.ProductId_id].AddLot(item)
+            lots.append(item)
+        else:
+            record = _NewSaleCost(item)
+            queues[record.ProductId_id].CostSale(record)
+            records.append(record)
+            alias = ShardFor(record.StoreId_id)
+            watermarks[alias] = max(watermarks.get(alias, 0), record.SalesId)
+    return lots, records, watermarks
+
+
+def VerifyCosting():
+    """
+    Compares the persisted cost of goods with a full rebuild, without changing anything.
+
+    Returns:
+        dict: Number of sales checked, and lists of (SalesId, expected, persisted) "Mismatched"
+        costs, "Missing" SalesIds without a persisted cost and "Unexpected" persisted SalesIds.
+    """
+    from Finance.models import SaleCost
+
+    _, records, _ = ComputeFifoCosts()
+    expected = {record.SalesId: (record.Cost, record.Uncosted) for record in records}
+    persisted = {salesId: (cost, uncosted) for salesId, cost, uncosted in SaleCost.objects.values_list("SalesId", "Cost", "Uncosted")}
+    return {
+        "Checked": len(expected),
+        "Mismatched": [
+            (salesId, value, persisted[salesId])
+            for salesId, value in expected.items()
+            if salesId in persisted and persisted[salesId] != value
+        ],
+        "Missing": sorted(expected.keys() - persisted.keys()),
+        "Unexpected": sorted(persisted.keys() - expected.keys()),
+    }
+
+
+def RebuildCosting():
+    """
+    Replaces all lots, sale costs and watermarks with a full rebuild from history.
+
+    Returns:
+        dict: Number of lots and sales written.
+    """
+    from Finance.models import CostingState, CostLot, SaleCost
+
+    lots, records, watermarks = ComputeFifoCosts()
+    with transaction.atomic():
+        SaleCost.objects.all().delete()
+        CostLot.objects.all().delete()
+        CostingState.objects.all().delete()
+        CostLot.objects.bulk_create(lots, batch_size=1000)
+        _InsertSaleCosts(records)
+        CostingState.objects.bulk_create(
+            [CostingState(Database=alias, LastSalesId=salesId) for alias, salesId in watermarks.items()]
+        )
+    return {"Lots": len(lots), "Sales": len(records)}
+
+
+def GetMargins(group="product", start_date=None, end_date=None, granularity="month"):
+    """
+    Returns revenue, cost of goods and margin of the costed sales, grouped by product, store or period.
+
+    Revenue of units still waiting for a lot is included with no cost, their number is reported as
+    Uncosted so such margins can be told apart.
+
+    Args:
+        group (str): One of MARGIN_GROUPS.
+        start_date (date or str, optional): Only sales on or after this date.
+        end_date (date or str, optional): Only sales on or before this date.
+        granularity (str): Period length when grouping by period, as for the sales graph.
+
+    Returns:
+        list: Dictionaries with the group's keys, Units, Revenue, Cost, Uncosted, Margin and MarginPercent.
+
+    Raises:
+        ValueError: For an unknown group or granularity.
+    """
+    from Finance.models import SaleCost
+
+    if group not in MARGIN_GROUPS:
+        raise ValueError(f"Group must be one of: {', '.join(MARGIN_GROUPS)}.")
+
+    records = SaleCost.objects.all()
+    if start_date:
+        records = records.filter(SaleTimestamp__gte=DateToDatetime(start_date))
+    if end_date:
+        records = records.filter(SaleTimestamp__lte=DateToDatetime(end_date, end_of_day=True))
+    if group == "period":
+        records = records.annotate(Period=TruncateForGranularity(granularity))
+
+    keys = MARGIN_GROUPS[group]
+    rows = list(
+        records.values(*keys)
+        .annotate(Units=Sum("Quantity"), Revenue=Sum("Revenue"), Cost=Sum("Cost"), Uncosted=Sum("Uncosted"))
+        .order_by(*keys)
+    )
+    for row in rows:   # SQLite adds decimals up as floats, round the totals back to cents
+        row["Revenue"], row["Cost"] = Decimal(row["Revenue"]).quantize(CENT), Decimal(row["Cost"]).quantize(CENT)
+        row["Margin"] = row["Revenue"] - row["Cost"]
+        row["MarginPercent"] = round(row["Margin"] / row["Revenue"] * 100, 2) if row["Revenue"] else None
+    return rows
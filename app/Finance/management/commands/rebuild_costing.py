@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Finance.costing import RebuildCosting, VerifyCosting
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes FIFO cost of goods for every sale from all delivered purchase orders and compares it "
+        "with the incrementally maintained costs. With --apply the persisted costs are replaced instead. "
+        "Pause the fifo-costing job while applying."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--apply", action="store_true", help="Replace the persisted lots and sale costs with the rebuild.")
+        parser.add_argument("--show", type=int, default=10, help="Number of differing sales to list.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options["apply"]:
+            result = RebuildCosting()
+            self.stdout.write(
+                f"Rebuilt {result['Lots']} lots and {result['Sales']} sale costs in {time.perf_counter() - started:.2f}s."
+            )
+            return
+
+        result = VerifyCosting()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Checked {result['Checked']} sales in {elapsed:.2f}s: {len(result['Mismatched'])} mismatched, "
+            f"{len(result['Missing'])} not costed yet, {len(result['Unexpected'])} costed but no longer found."
+        )
+        for salesId, expected, persisted in result["Mismatched"][:options["show"]]:
+            self.stdout.write(f"  sale {salesId}: expected cost {expected[0]} ({expected[1]} uncosted), has {persisted[0]} ({persisted[1]} uncosted)")
+        if result["Mismatched"]:
+            raise CommandError("Persisted costs differ from a full rebuild, run with --apply to replace them.")
@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Finance', '0002_initial'),
+        ('Inventory', '0006_store_version'),
+        ('Procurement', '0004_supplier_purchaseorder_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostingState',
+            fields=[
+                ('CostingStateId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('Database', models.CharField(max_length=100, unique=True)),
+                ('LastSalesId', models.BigIntegerField(default=0)),
+                ('UpdatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CostLot',
+            fields=[
+                ('CostLotId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('ReceivedDate', models.DateField()),
+                ('Quantity', models.IntegerField()),
+                ('UnitCost', models.DecimalField(decimal_places=4, max_digits=14)),
+                ('Remaining', models.IntegerField()),
+                ('ProductId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_lots', to='Inventory.product')),
+                ('PurchaseOrderId', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cost_lot', to='Procurement.purchaseorder')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ProductId', 'Remaining'], name='Finance_cos_Product_f8d517_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SaleCost',
+            fields=[
+                ('SaleCostId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('SalesId', models.BigIntegerField(unique=True)),
+                ('SaleTimestamp', models.DateTimeField(db_index=True)),
+                ('Quantity', models.IntegerField()),
+                ('Revenue', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('Cost', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('Uncosted', models.IntegerField(default=0)),
+                ('ProductId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sale_costs', to='Inventory.product')),
+                ('StoreId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sale_costs', to='Inventory.store')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ProductId', 'Uncosted'], name='Finance_sal_Product_e0b9ec_idx')],
+            },
+        ),
+    ]
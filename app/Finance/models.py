@@ -34,3 +34,65 @@ class Department(models.Model):
             raise ValueError("Budget must be a non-negative integer.")
 
     
+
+
+class CostLot(models.Model):
+    """
+    Units received by a delivered purchase order, consumed first in, first out by sales of the product.
+
+    Lots are created by Finance.costing from delivered purchase orders, Remaining goes down as
+    sales are costed against the lot.
+    """
+
+    CostLotId = models.AutoField(primary_key=True, unique=True)         # Unique identifier for the lot
+    ProductId = models.ForeignKey("Inventory.Product", on_delete=models.CASCADE, related_name="cost_lots")
+    PurchaseOrderId = models.OneToOneField(                             # The delivered order the units came from
+        "Procurement.PurchaseOrder", null=True, on_delete=models.SET_NULL, related_name="cost_lot"
+    )
+    ReceivedDate = models.DateField()                                   # Delivery date, lots are consumed in this order
+    Quantity = models.IntegerField()                                    # Units received
+    UnitCost = models.DecimalField(max_digits=14, decimal_places=4)     # FullCost of the order divided by its quantity
+    Remaining = models.IntegerField()                                   # Units not yet consumed by sales
+
+    class Meta:
+        indexes = [models.Index(fields=["ProductId", "Remaining"])]    # Finds a product's open lots
+
+    def __str__(self):  # Returns the lot's product, remaining units and unit cost
+        return f"Lot {self.CostLotId} - Product {self.ProductId_id}: {self.Remaining}/{self.Quantity} at {self.UnitCost}"
+
+
+class SaleCost(models.Model):
+    """
+    Cost of goods of one sale, worked out first in, first out from the product's lots.
+
+    Sales may live in a shard or the archive, so the sale is kept as a plain id. Units that no lot
+    covered yet are counted in Uncosted and costed as soon as a lot for the product arrives.
+    """
+
+    SaleCostId = models.AutoField(primary_key=True, unique=True)        # Unique identifier for the record
+    SalesId = models.BigIntegerField(unique=True)                       # The costed sale
+    ProductId = models.ForeignKey("Inventory.Product", on_delete=models.CASCADE, related_name="sale_costs")
+    StoreId = models.ForeignKey("Inventory.Store", on_delete=models.CASCADE, related_name="sale_costs")
+    SaleTimestamp = models.DateTimeField(db_index=True)                 # When the sale was made, for per-period margins
+    Quantity = models.IntegerField()                                    # Units sold
+    Revenue = models.DecimalField(max_digits=15, decimal_places=2)      # TotalAmount of the sale
+    Cost = models.DecimalField(max_digits=15, decimal_places=2)         # Cost of the units costed so far
+    Uncosted = models.IntegerField(default=0)                           # Units still waiting for a lot
+
+    class Meta:
+        indexes = [models.Index(fields=["ProductId", "Uncosted"])]     # Finds sales waiting for a lot
+
+    def __str__(self):  # Returns the sale with its revenue and cost
+        return f"Sale {self.SalesId} - Revenue: {self.Revenue} - Cost: {self.Cost}"
+
+
+class CostingState(models.Model):
+    # How far incremental costing has got through the sales of one database (a shard or the default one)
+
+    CostingStateId = models.AutoField(primary_key=True, unique=True)
+    Database = models.CharField(max_length=100, unique=True)            # Database alias holding the sales
+    LastSalesId = models.BigIntegerField(default=0)                     # Sales up to this id have been costed
+    UpdatedAt = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.Database} costed up to sale {self.LastSalesId}"
@@ -1,3 +1,100 @@
+from datetime import timedelta
+from decimal import Decimal
+
 from django.test import TestCase
+from django.utils import timezone
+
+from app.testutils import MakeProducts, MakePurchaseOrders, MakeSales, MakeStaff, MakeStores, QueryBudgetTestCase
+from Finance.costing import GetMargins, RunCosting, VerifyCosting
+from Finance.models import CostLot, Department, SaleCost
+from Procurement.models import PurchaseOrder
+from Sales.models import Sales
+
+
+class DepartmentQueryBudgetTests(QueryBudgetTestCase):
+
+    def testGetDepartmentStaff(self):
+        def Build(size):
+            department = Department.objects.create(DepartmentName="Sales", Budget=1000)
+            MakeStaff(size, department)
+            return (department,)
+
+        self.assertQueryBudget(1, Build, lambda department: list(department.GetDepartmentStaff()))
+
+
+class CostingQueryBudgetTests(QueryBudgetTestCase):
+
+    def Sold(self, size):   # `size` products, each delivered once and sold in `size` stores
+        products = MakeProducts(size)
+        MakePurchaseOrders(
+            products, status=PurchaseOrder.DELIVERED, quantity=size,
+            delivered=timezone.localdate() - timedelta(days=60),
+        )
+        MakeSales(size * size, MakeStores(size), products)
+        return ()
+
+    def testRunCosting(self):
+        # Orders, lots and sales are read in bulk and written with one statement or executemany each,
+        # the second batch read finds no more sales
+        self.assertQueryBudget(22, self.Sold, RunCosting)
+
+    def testGetMargins(self):
+        def Build(size):
+            self.Sold(size)
+            RunCosting()
+            return ()
+
+        for group in ("product", "store", "period"):
+            with self.subTest(group=group):
+                self.assertQueryBudget(1, Build, lambda: GetMargins(group))
+
+    def testMarginsView(self):
+        def Build(size):
+            self.Sold(size)
+            RunCosting()
+            return ()
+
+        self.assertQueryBudget(1, Build, lambda: self.client.get("/Finance/margins/", {"group": "store"}))
+
+
+class FifoCostingTests(TestCase):
+
+    def setUp(self):
+        self.product, self.store = MakeProducts(1)[0], MakeStores(1)[0]
+        self.now = timezone.now()
+
+    def Delivered(self, days_ago, quantity, cost):
+        MakePurchaseOrders(
+            [self.product], status=PurchaseOrder.DELIVERED, quantity=quantity, cost=cost,
+            delivered=timezone.localdate() - timedelta(days=days_ago),
+        )
+
+    def Sold(self, days_ago, quantity):
+        return Sales.objects.create(
+            StoreId=self.store, ProductId=self.product, PaymentMethod="Card", TotalAmount=Decimal(quantity * 5),
+            Quantity=quantity, SaleTimestamp=self.now - timedelta(days=days_ago),
+        ).pk
+
+    def Costs(self):
+        return {salesId: (cost, uncosted) for salesId, cost, uncosted in SaleCost.objects.values_list("SalesId", "Cost", "Uncosted")}
+
+    def testFirstInFirstOut(self):
+        self.Delivered(10, 5, "10.00")      # 2.00 a unit
+        self.Delivered(5, 5, "20.00")       # 4.00 a unit
+        first, across = self.Sold(8, 3), self.Sold(4, 4)
+        self.assertEqual(RunCosting(), {"Lots": 2, "Sales": 2})
+        self.assertEqual(
+            self.Costs(), {first: (Decimal("6.00"), 0), across: (Decimal("12.00"), 0)}   # 2 at 2.00 and 2 at 4.00
+        )
+
+        waiting = self.Sold(0, 5)   # Only 3 units left, 2 wait for the next delivery
+        self.assertEqual(RunCosting(), {"Lots": 0, "Sales": 1})
+        self.assertEqual(self.Costs()[waiting], (Decimal("12.00"), 2))
+
+        self.Delivered(0, 10, "30.00")      # 3.00 a unit, fills the waiting sale first
+        self.assertEqual(RunCosting(), {"Lots": 1, "Sales": 0})
+        self.assertEqual(self.Costs()[waiting], (Decimal("18.00"), 0))
+        self.assertEqual(list(CostLot.objects.order_by("ReceivedDate").values_list("Remaining", flat=True)), [0, 0, 8])
 
-# Create your tests here.
+        verified = VerifyCosting()      # The incremental costs agree with a rebuild from history
+        self.assertEqual(verified, {"Checked": 3, "Mismatched": [], "Missing": [], "Unexpected": []})
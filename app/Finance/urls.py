@@ -0,0 +1,7 @@
+from django.urls import path
+
+from . import views
+# store for each modules related URL
+urlpatterns = [
+    path("margins/", views.GetMarginsView, name="margins"),
+]
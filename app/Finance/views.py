@@ -1,3 +1,26 @@
-from django.shortcuts import render
+from django.http import JsonResponse
 
-# Create your views here.
+from app.responses import FastJsonResponse, compress_response
+from Finance.costing import GetMargins
+
+
+@compress_response
+def GetMarginsView(request):
+    """
+    Function-based view returning revenue, cost of goods and margins.
+    :param request: The HTTP request object, with optional 'group' ('product', 'store' or 'period'),
+        'start_date', 'end_date' and 'granularity' query parameters.
+    :return: A JsonResponse with one row per product, store or period.
+    """
+    group = request.GET.get("group", "product")
+    try:
+        margins = GetMargins(
+            group,
+            start_date=request.GET.get("start_date"),
+            end_date=request.GET.get("end_date"),
+            granularity=request.GET.get("granularity", "month"),
+        )
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return FastJsonResponse({"group": group, "margins": margins})
@@ -4,4 +4,6 @@ from django.contrib import admin
 from .models import *
 
 # Register the Staff model with the admin site
-admin.site.register(Staff)
+@admin.register(Staff)
+class StaffAdmin(admin.ModelAdmin):
+    list_select_related = ("DepartmentId",)    # Each staff member's name shows their department
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('HR', '0002_remove_staff_hiredate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='staff',
+            name='Version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
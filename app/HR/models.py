@@ -2,6 +2,7 @@ from django.db import models
 from Finance.models import Department
 from django.db.models import Sum, Avg, Count
 from datetime import datetime, timedelta
+from app.concurrency import EditWithVersionCheck
 
 class Staff(models.Model):
     # Unique identifier for each staff member
@@ -16,6 +17,9 @@ class Staff(models.Model):
     # Salary of the staff member
     Salary = models.IntegerField()
 
+    # Incremented on every edit, detects concurrent overwrites
+    Version = models.IntegerField(default=0)
+
     # Foreign key to the Department model
     DepartmentId = models.ForeignKey(
         Department,
@@ -41,7 +45,6 @@ class Staff(models.Model):
             "Role": self.Role,
             "Salary": self.Salary,
             "Department": self.DepartmentId.DepartmentName if self.DepartmentId else None,
-            "StartingDate": self.StartingDate,
         }
 
     def EditStaffData(self, **kwargs):
@@ -66,18 +69,15 @@ class Staff(models.Model):
             if not (isinstance(update_data['Salary'], int) and update_data['Salary'] >= 0):
                 raise ValueError("Salary must be a non-negative integer.")
 
-        # Update the fields with new values
-        for field, value in update_data.items():
-            setattr(self, field, value)
-        self.full_clean()  # Validate all fields
-        self.save()
+        # Validate and write only the changed fields, raises ConcurrentUpdateError on a stale edit
+        EditWithVersionCheck(self, update_data)
 
 
     def AssignDepartment(self, DepartmentId):
        
         if isinstance(DepartmentId, Department): # Assigns the staff member to a department
-            self.DepartmentId = DepartmentId   # The department instance to assign to the staff member
-            self.save()
+            # Write only the department, raises ConcurrentUpdateError on a stale staff member
+            EditWithVersionCheck(self, {"DepartmentId": DepartmentId})
         else:
             raise ValueError("Invalid department instance.")
 
@@ -96,31 +96,34 @@ class Staff(models.Model):
         Raises:
             ValueError: If an error occurs during the calculation.
         """
+        from django.utils import timezone
+        from Sales.archive import ReadAcrossArchive
+
         try:
-            # Define the date range for the analysi
-            end_date = datetime.now()
+            # Define the date range for the analysis
+            end_date = timezone.now()
             start_date = end_date - timedelta(days=date_range)
 
-            
-            sales_data = Staff.sales.filter(# Aggregate sales data for the staff member within the date range
-                StaffId=self.StaffId,
-                SalesDate__range=[start_date, end_date]
-            ).aggregate(
-                
-                total_sales=Sum('total_amount'),
-                average_daily_sales=Avg('total_amount'),
-                total_transactions=Count('id'),
-            )
+            def Totals(sales_queryset):  # Runs against the Sales table and, for old ranges, the archive
+                return sales_queryset.filter(
+                    StaffId=self.StaffId,
+                    SaleTimestamp__range=[start_date, end_date],
+                ).aggregate(total_sales=Sum("TotalAmount"), total_transactions=Count("SalesId"))
+
+            # One aggregate per table read, added up
+            results = ReadAcrossArchive(Totals, start_date.date())
+            total_sales = sum(result["total_sales"] or 0 for result in results)
+            total_transactions = sum(result["total_transactions"] for result in results)
 
             # Calculate additional metrics
             performance_metrics = {
                 "staff_name": self.StaffName,
-                "period_total_sales": sales_data["total_sales"] or 0,
-                "average_daily_sales": sales_data["average_daily_sales"] or 0,
-                
-                "total_transactions": sales_data["total_transactions"] or 0,
-                "sales_per_day": (sales_data["total_sales"] or 0) / date_range,
-                "performance_index": (sales_data["total_sales"] or 0) / (self.Salary or 1),  # Normalise by salary
+                "period_total_sales": total_sales,
+                "average_daily_sales": total_sales / total_transactions if total_transactions else 0,
+
+                "total_transactions": total_transactions,
+                "sales_per_day": total_sales / date_range,
+                "performance_index": total_sales / (self.Salary or 1),  # Normalise by salary
             }
 
             return performance_metrics
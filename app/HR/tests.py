@@ -1,3 +1,31 @@
-from django.test import TestCase
+from app.testutils import MakeSales, MakeStaff, MakeStores, QueryBudgetTestCase
+from Finance.models import Department
+from HR.models import Staff
 
-# Create your tests here.
+
+class StaffQueryBudgetTests(QueryBudgetTestCase):
+
+    def testGetStaffData(self):
+        def Build(size):
+            MakeStaff(size, Department.objects.create(DepartmentName="Sales", Budget=1000))
+            return ()
+
+        # Loaded with their department, any number of staff members is read in one query
+        self.assertQueryBudget(
+            1, Build, lambda: [staff.GetStaffData() for staff in Staff.objects.select_related("DepartmentId")]
+        )
+
+    def testGetPerformanceData(self):
+        def Build(size):
+            staff = MakeStaff(1)[0]
+            MakeSales(size, MakeStores(1), staff=[staff])
+            return (staff,)
+
+        # The archive boundary and one aggregate
+        self.assertQueryBudget(2, Build, lambda staff: staff.GetPerformanceData())
+
+    def testEditStaffData(self):
+        def Build(size):
+            return (Staff.objects.get(pk=MakeStaff(size)[0].pk),)
+
+        self.assertQueryBudget(1, Build, lambda staff: staff.EditStaffData(Salary=25000))
@@ -6,4 +6,14 @@ from .models import *
 # Register the Product, Store, and StockLocation models to be accessible through the Django admin interface.
 admin.site.register(Product)
 admin.site.register(Store)
-admin.site.register(ProductLocation)
+
+
+@admin.register(ProductLocation)
+class ProductLocationAdmin(admin.ModelAdmin):
+    list_select_related = ("ProductId", "StoreId")     # Each row's name shows its product and store
+
+
+@admin.register(ProductPrice)
+class ProductPriceAdmin(admin.ModelAdmin):
+    list_display = ("ProductId", "OldPrice", "Price", "EffectiveFrom", "Reason")
+    list_select_related = ("ProductId",)
@@ -5,3 +5,6 @@ from django.apps import AppConfig
 class InventoryConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"  # Default primary key type for models
     name = "Inventory"  # Name of the app
+
+    def ready(self):
+        from Inventory import signals  # Keeps the in-process store locator in sync with stock changes
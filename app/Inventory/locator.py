@@ -0,0 +1,253 @@
+import heapq
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db.models import Sum
+
+from app.sharding import FanOut
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.19   # Length of one degree of latitude
+
+
+def Haversine(lat1, lon1, lat2, lon2):
+    # Great-circle distance in kilometres between two coordinates
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class StoreLocator:
+    """
+    In-process index answering "nearest stores with enough of product X".
+
+    Stores with coordinates are placed in a uniform latitude/longitude grid, and each grid cell
+    keeps a bitmask of the stores in it. Every product has a bitmap of the stores holding it plus
+    the quantity at each of them. A lookup walks grid rings outwards from the query point, skips a
+    cell with one AND of its mask against the product bitmap, and stops as soon as no unvisited
+    ring can hold a closer store.
+
+    Product availability is refreshed lazily: writes only mark a product stale (see
+    InvalidateProducts) and it is reloaded with one query on its next lookup, or after
+    STORE_LOCATOR_TTL seconds so changes made by other processes are picked up too. Bitmaps are
+    stamped with the generation of the grid they were built against, and a lookup only uses a
+    bitmap together with that same grid.
+    """
+
+    def __init__(self, cellSize=None, ttl=None):
+        self.cellSize = cellSize or settings.STORE_LOCATOR_CELL_DEGREES
+        self.ttl = settings.STORE_LOCATOR_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        self._storesLoadedAt = None
+        self._generation = 0    # Bumped every time the store grid is rebuilt
+        self._products = {}     # ProductId -> (loaded at, bitmap of stores, {store index: quantity}, grid generation)
+        self._stale = set()     # ProductIds whose availability must be reloaded
+
+    # ------------------------------------------------------------------ loading
+
+    def _Cell(self, lat, lon):
+        return (math.floor(lat / self.cellSize), math.floor(lon / self.cellSize))
+
+    def LoadStores(self):
+        # Rebuilds the store grid from every store with coordinates
+        from Inventory.models import Store
+
+        stores = list(
+            Store.objects.filter(Latitude__isnull=False, Longitude__isnull=False)
+            .order_by("StoreId")
+            .values_list("StoreId", "StoreName", "Latitude", "Longitude")
+        )
+        cells = {}
+        for index, (_, _, lat, lon) in enumerate(stores):
+            cells[self._Cell(lat, lon)] = cells.get(self._Cell(lat, lon), 0) | (1 << index)
+
+        with self._lock:
+            self._generation += 1
+            self.stores = stores
+            self.storeIndex = {storeId: index for index, (storeId, _, _, _) in enumerate(stores)}
+            self.cells = cells
+            self.cellIndex = {}  # Cells grouped by latitude row, for ring walks
+            for row, column in cells:
+                self.cellIndex.setdefault(row, []).append(column)
+            self.rows = (min(r for r, _ in cells), max(r for r, _ in cells)) if cells else (0, 0)
+            self.columns = (min(c for _, c in cells), max(c for _, c in cells)) if cells else (0, 0)
+            self._products = {}  # Store positions changed, product bitmaps must be rebuilt
+            self._stale = set()
+            self._storesLoadedAt = time.monotonic()
+
+    def _LoadProduct(self, productId):
+        # Loads one product's per-store quantities with a single aggregate query
+        from Inventory.models import ProductLocation
+
+        with self._lock:    # Store indexes are only meaningful in the grid they were read from
+            generation, storeIndex = self._generation, self.storeIndex
+        bitmap, quantities = 0, {}
+        rows = FanOut(  # A store's stock is all in one shard, so shards never return the same store
+            lambda alias: list(
+                ProductLocation.objects.using(alias)
+                .filter(ProductId=productId)
+                .values("StoreId")
+                .annotate(Total=Sum("Quantity"))
+                .values_list("StoreId", "Total")
+            )
+        )
+        for storeId, quantity in (row for shardRows in rows for row in shardRows):
+            index = storeIndex.get(storeId)
+            if index is not None and quantity > 0:
+                bitmap |= 1 << index
+                quantities[index] = quantity
+
+        entry = (time.monotonic(), bitmap, quantities, generation)
+        with self._lock:
+            if generation == self._generation:  # The grid was rebuilt meanwhile, don't cache a bitmap against the old one
+                self._products[productId] = entry
+                self._stale.discard(productId)
+        return entry
+
+    def LoadAll(self):
+        # Loads the availability of every product in one query, used to warm the index
+        from Inventory.models import ProductLocation
+
+        self.LoadStores()
+        with self._lock:
+            generation, storeIndex = self._generation, self.storeIndex
+        products = {}
+        rows = FanOut(
+            lambda alias: list(
+                ProductLocation.objects.using(alias)
+                .values("ProductId", "StoreId")
+                .annotate(Total=Sum("Quantity"))
+                .values_list("ProductId", "StoreId", "Total")
+            )
+        )
+        for productId, storeId, quantity in (row for shardRows in rows for row in shardRows):
+            index = storeIndex.get(storeId)
+            if index is not None and quantity > 0:
+                _, bitmap, quantities = products.get(productId, (None, 0, {}))
+                quantities[index] = quantity
+                products[productId] = (None, bitmap | (1 << index), quantities)
+
+        now = time.monotonic()
+        with self._lock:
+            if generation == self._generation:
+                self._products = {
+                    productId: (now, bitmap, q, generation) for productId, (_, bitmap, q) in products.items()
+                }
+
+    def Invalidate(self, productIds=None, stores=False):
+        # Marks products (or, with stores=True, the whole store grid) for reloading on next use
+        with self._lock:
+            if stores:
+                self._storesLoadedAt = None
+            if productIds is not None:
+                self._stale.update(productIds)
+
+    def _Availability(self, productId):
+        # Returns the product's bitmap and quantities with the grid they were built against
+        while True:
+            if self._storesLoadedAt is None or time.monotonic() - self._storesLoadedAt > self.ttl:
+                self.LoadStores()
+            entry = self._products.get(productId)
+            if entry is None or productId in self._stale or time.monotonic() - entry[0] > self.ttl:
+                entry = self._LoadProduct(productId)
+            with self._lock:
+                if entry[3] == self._generation:
+                    return entry[1], entry[2], (self.stores, self.cells, self.cellIndex, self.rows, self.columns)
+            # The grid was rebuilt while the product loaded, load it again against the new one
+
+    # ------------------------------------------------------------------ querying
+
+    def _RingCells(self, grid, row, column, ring):
+        # Yields the occupied cells on the square ring at Chebyshev distance `ring` from (row, column)
+        _, cells, cellIndex, rows, _ = grid
+        for r in range(max(row - ring, rows[0]), min(row + ring, rows[1]) + 1):
+            columns = cellIndex.get(r)
+            if not columns:
+                continue
+            if abs(r - row) == ring:    # Top and bottom edges: every column within the ring
+                for c in columns:
+                    if abs(c - column) <= ring:
+                        yield (r, c)
+            else:                       # Sides: only the two edge columns
+                for c in (column - ring, column + ring) if ring else (column,):
+                    if (r, c) in cells:
+                        yield (r, c)
+
+    def Nearest(self, productId, lat, lon, quantity=1, limit=5):
+        """
+        Returns the nearest stores holding at least `quantity` of a product.
+
+        Args:
+            productId (int): Product to look for.
+            lat, lon (float): Query coordinates in degrees.
+            quantity (int): Minimum quantity the store must have.
+            limit (int): Maximum number of stores to return.
+
+        Returns:
+            list: Dictionaries with StoreId, StoreName, DistanceKm and Quantity, nearest first.
+        """
+        bitmap, quantities, grid = self._Availability(productId)
+        if not bitmap:
+            return []
+
+        stores, cells, _, rows, columns = grid     # Read once, a concurrent LoadStores swaps in a new grid
+        row, column = self._Cell(lat, lon)
+        maxRing = max(  # Ring beyond which there are no stores at all
+            abs(row - rows[0]), abs(row - rows[1]), abs(column - columns[0]), abs(column - columns[1])
+        )
+
+        best = []   # Max-heap (negated distance) of the closest matches found so far
+        for ring in range(maxRing + 1):
+            if len(best) == limit:
+                # Any store in this ring is at least (ring - 1) cells away along one axis, a degree
+                # of longitude being the shorter one and shrinking towards the poles
+                bound = (ring - 1) * self.cellSize * KM_PER_DEGREE * math.cos(
+                    math.radians(min(abs(lat) + ring * self.cellSize, 89.0))
+                )
+                if bound > -best[0][0]:
+                    break
+            for cell in self._RingCells(grid, row, column, ring):
+                candidates = cells[cell] & bitmap
+                while candidates:
+                    bit = candidates & -candidates
+                    index = bit.bit_length() - 1
+                    candidates ^= bit
+                    if quantities[index] < quantity:
+                        continue
+                    storeId, storeName, storeLat, storeLon = stores[index]
+                    distance = Haversine(lat, lon, storeLat, storeLon)
+                    item = (-distance, storeId, storeName, quantities[index])
+                    if len(best) < limit:
+                        heapq.heappush(best, item)
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, item)
+
+        return [
+            {"StoreId": storeId, "StoreName": storeName, "DistanceKm": round(-negative, 3), "Quantity": stock}
+            for negative, storeId, storeName, stock in sorted(best, reverse=True)
+        ]
+
+
+_locator = None
+
+
+def GetStoreLocator():
+    # Returns the process-wide StoreLocator, created on first use
+    global _locator
+    if _locator is None:
+        _locator = StoreLocator()
+    return _locator
+
+
+def InvalidateProducts(productIds):
+    # Marks products whose stock changed so their availability is reloaded on the next lookup
+    if _locator is not None:
+        _locator.Invalidate(productIds=productIds)
+
+
+def InvalidateStores():
+    # Marks the store grid for reloading after a store is added, moved or removed
+    if _locator is not None:
+        _locator.Invalidate(stores=True)
@@ -0,0 +1,49 @@
+import time
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from Inventory.rebalancing import RebalanceStock
+
+
+def StoreThreshold(value):
+    # Parses a STORE_ID=UNITS option value
+    storeId, _, units = value.partition("=")
+    try:
+        return int(storeId), int(units)
+    except ValueError:
+        raise ValueError(f"Expected STORE_ID=UNITS, got {value}")
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves surplus stock between stores so every store holds at least a minimum of each product it stocks. "
+        "Transfers are planned for all products at once and applied in one atomic batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threshold", type=int, required=True, help="Minimum units per stocked product in every store.")
+        parser.add_argument(
+            "--store-threshold", type=StoreThreshold, action="append", default=[], metavar="STORE_ID=UNITS",
+            help="Different minimum for one store, can be repeated.",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="Only print the plan.")
+        parser.add_argument("--show", type=int, default=20, help="Number of transfers to list.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            result = RebalanceStock(
+                options["threshold"], store_thresholds=dict(options["store_threshold"]), dry_run=options["dry_run"]
+            )
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+        elapsed = time.perf_counter() - started
+
+        for productId, fromStore, toStore, quantity in result["Transfers"][:options["show"]]:
+            self.stdout.write(f"  product {productId}: {quantity} from store {fromStore} to store {toStore}")
+        action = "Planned" if options["dry_run"] else "Made"
+        self.stdout.write(
+            f"{action} {len(result['Transfers'])} transfers moving {result['Units']} units in {elapsed:.2f}s, "
+            f"{result['Missing']} units short with no surplus left to move."
+        )
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:15
+
+from django.db import migrations, models
+
+
+def CreateSearchIndex(apps, schema_editor):
+    # The FTS5 trigram index is SQLite specific, other backends fall back to LIKE queries
+    if schema_editor.connection.vendor == "sqlite":
+        from Inventory.search import CreateSearchIndex
+        with schema_editor.connection.cursor() as cursor:
+            CreateSearchIndex(cursor)
+
+
+def DropSearchIndex(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        from Inventory.search import DropSearchIndex
+        with schema_editor.connection.cursor() as cursor:
+            DropSearchIndex(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0003_rename_reorderlevel_product_orderlimit_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='ProductType',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.RunPython(CreateSearchIndex, DropSearchIndex),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0004_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='Latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='store',
+            name='Longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
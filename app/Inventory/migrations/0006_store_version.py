@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0005_store_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='store',
+            name='Version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
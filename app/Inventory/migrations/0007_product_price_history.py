@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-19 16:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0006_store_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPrice',
+            fields=[
+                ('ProductPriceId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('OldPrice', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('Price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('EffectiveFrom', models.DateTimeField()),
+                ('Reason', models.CharField(blank=True, max_length=200)),
+                ('ProductId', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='PriceHistory', to='Inventory.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['ProductId', 'EffectiveFrom'], name='productprice_product_from')],
+            },
+        ),
+    ]
@@ -1,7 +1,14 @@
-from django.db import models
+from django.db import connection, models, transaction
 from django.core.exceptions import ValidationError
-from django.db.models import Sum, Avg
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Avg, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
 from datetime import datetime, timedelta
+from decimal import Decimal
+from app.concurrency import ConcurrentUpdateError, EditWithVersionCheck
+from app.sharding import FanOut, GroupByShard, ShardedQuerySet, ShardFor
+
+MAX_PRICE = Decimal("99999999.99")     # Largest price the DecimalField(max_digits=10, decimal_places=2) prices hold
 
 
 class Product(models.Model):
@@ -9,7 +16,7 @@ class Product(models.Model):
 
     ProductId = models.AutoField(primary_key=True, unique=True)     # Unique identifier for the product
     ProductName = models.CharField(max_length=200)                  # Name of the product
-    ProductType = models.CharField(max_length=100)                     # ProductType the product belongs to
+    ProductType = models.CharField(max_length=100, db_index=True)      # ProductType the product belongs to
 
     Price = models.DecimalField(max_digits=10, decimal_places=2)    # Price of the product
     StockAmount = models.IntegerField()                              # Quantity of the product available in stock
@@ -30,12 +37,16 @@ class Product(models.Model):
         )
 
     def GetAllStores(self): # Returns all stores that stock this product.
-        return self.ProductLocation_set.values("StoreId__StoreName", "StoreId__Location")
-
-    def GetStockAmount(self): #  Returns the total stock level for this product across all stores
-        return (
-            self.ProductLocation_set.aggregate(TotalStock=Sum("Quantity"))["TotalStock"]
-            or 0
+        return self.ProductLocation.values("StoreId__StoreName", "StoreId__Location")
+
+    def GetStockAmount(self): #  Returns the total stock level for this product across all stores (and shards)
+        return sum(
+            FanOut(
+                lambda alias: ProductLocation.objects.using(alias)
+                .filter(ProductId=self)
+                .aggregate(TotalStock=Sum("Quantity"))["TotalStock"]
+                or 0
+            )
         )
 
     # Transfers stock of this product between stores
@@ -44,8 +55,8 @@ class Product(models.Model):
         if quantity <= 0: # quantity, Quantity of stock to transfer.
             raise ValueError("Quantity must be greater than zero.")
 
-        from_stock = self.ProductLocation.filter(StoreId=from_store).first() # from_store, Store instance to transfer from
-        to_stock = self.ProductLocation.filter(StoreId=to_store).first() #  to_store, Store instance to transfer to
+        from_stock = ProductLocation.objects.using(ShardFor(from_store.pk)).filter(ProductId=self, StoreId=from_store).first() # from_store, Store instance to transfer from
+        to_stock = ProductLocation.objects.using(ShardFor(to_store.pk)).filter(ProductId=self, StoreId=to_store).first() #  to_store, Store instance to transfer to
 
         if not from_stock or from_stock.Quantity < quantity:# Check if there is enough stock in the source store to transfer the requested quantity
             raise ValidationError("Insufficient stock in the source store.")
@@ -57,12 +68,12 @@ class Product(models.Model):
 
         if to_stock: # Update the stock
             to_stock.Quantity += quantity
+            to_stock.save()# Save the updated stock
 
         else:# If the product doesn't exist in the destination store, create a new stock entry
             ProductLocation.objects.create(
                 ProductId=self, StoreId=to_store, Quantity=quantity
             )
-        to_stock.save()# Save the updated stock
 
     def EditOrderLimit(self, new_reorder_level):
        # Updates the reorder level for this product, new_reorder_level: New reorder level (integer)
@@ -71,11 +82,153 @@ class Product(models.Model):
         self.OrderLimit = new_reorder_level
         self.save()
 
+    def SetPrice(self, price, reason=""):
+        # Changes this product's price and keeps the old one in its history, price: New price (Decimal)
+        price = Decimal(str(price))
+        if not price.is_finite() or price < 0 or price > MAX_PRICE:
+            raise ValueError(f"Price must be between 0 and {MAX_PRICE}.")
+        Product._Reprice(Product.objects.filter(pk=self.pk), Value(price), reason)
+        self.Price = price
+
+    def GetPriceAsOf(self, when):
+        # Returns the price this product had at `when`, a datetime or a date (the price at the end of that day)
+        return Product.PricesAsOf([self.pk], when)[self.pk]
+
+    @classmethod
+    def Reprice(cls, product_type=None, supplier=None, percent=None, amount=None, reason=""):
+        """
+        Changes the price of every product of a ProductType or supplier at once and records the change.
+
+        The prices are changed with one UPDATE ... SET Price = ROUND(Price * x, 2) and the history is
+        written with one INSERT ... SELECT over the same products, in the same transaction, so no
+        product is loaded into Python whatever the number of products repriced. Nothing is changed
+        when a new price would be negative or too large for the Price column.
+
+        Args:
+            product_type (str): Reprice the products of this ProductType.
+            supplier (int): Reprice the products of this SupplierId, both filters may be combined.
+            percent (Decimal): Change in percent, e.g. 5 for a 5% rise or -10 for a 10% cut.
+            amount (Decimal): Change in currency added to every price, give either percent or amount.
+            reason (str): Note kept with the history rows.
+
+        Returns:
+            int: Number of products repriced.
+
+        Raises:
+            ValueError: If the filters or the change are invalid, or some new price out of range.
+        """
+        if product_type is None and supplier is None:
+            raise ValueError("A product type or supplier is required.")
+        if (percent is None) == (amount is None):
+            raise ValueError("Give either a percent or an amount.")
+
+        products = cls.objects.all()
+        if product_type is not None:
+            products = products.filter(ProductType=product_type)
+        if supplier is not None:
+            products = products.filter(SupplierId=supplier)
+
+        price = models.DecimalField(max_digits=10, decimal_places=2)
+        if percent is not None:
+            percent = Decimal(str(percent))
+            if not percent.is_finite():
+                raise ValueError("percent must be a finite number.")
+            if percent <= -100:
+                raise ValueError("A price can't be cut by 100% or more.")
+            change = F("Price") * Value(1 + percent / 100, output_field=price)
+        else:
+            amount = Decimal(str(amount))
+            if not amount.is_finite():
+                raise ValueError("amount must be a finite number.")
+            change = F("Price") + Value(amount, output_field=price)
+        return cls._Reprice(products, Round(change, 2, output_field=price), reason, checked=True)
+
+    @classmethod
+    def _Reprice(cls, products, new_price, reason, checked=False):
+        # Writes the history rows of `products` and then their new price, both in SQL. `checked`
+        # first counts the new prices out of range in SQL, reading them back could overflow the column.
+        quote = connection.ops.quote_name
+        columns = ", ".join(
+            quote(ProductPrice._meta.get_field(name).column)
+            for name in ("ProductId", "OldPrice", "Price", "EffectiveFrom", "Reason")
+        )
+        history = products.annotate(
+            NewPrice=new_price,
+            From=Value(timezone.now(), output_field=models.DateTimeField()),
+            Note=Value(reason, output_field=models.CharField()),
+        ).values_list("ProductId", "Price", "NewPrice", "From", "Note")
+        sql, params = history.query.sql_with_params()
+
+        with transaction.atomic():
+            if checked:
+                invalid = products.annotate(NewPrice=new_price).aggregate(
+                    Negative=Count("pk", filter=Q(NewPrice__lt=0)), TooLarge=Count("pk", filter=Q(NewPrice__gt=MAX_PRICE)),
+                )
+                if invalid["Negative"]:
+                    raise ValueError("The change would make some prices negative.")
+                if invalid["TooLarge"]:
+                    raise ValueError(f"The change would make some prices larger than {MAX_PRICE}.")
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {quote(ProductPrice._meta.db_table)} ({columns}) {sql}", params)
+            return products.update(Price=new_price)
+
+    @classmethod
+    def PricesAsOf(cls, productIds, when):
+        """
+        Returns the prices products had at a point in time, in one query.
+
+        Each product's price is read from its newest history row at or before `when`, an index seek on
+        (ProductId, EffectiveFrom). Products changed only later had the old price of their first
+        change, and products never changed have their current price.
+
+        Args:
+            productIds (iterable): Products to price.
+            when (datetime): Point in time, a date stands for the end of that day.
+
+        Returns:
+            dict: ProductId -> price, for the products that exist.
+        """
+        if not isinstance(when, datetime):
+            when = datetime.combine(when, datetime.max.time())
+        if timezone.is_naive(when):
+            when = timezone.make_aware(when)
+
+        history = ProductPrice.objects.filter(ProductId=OuterRef("pk"))
+        before = history.filter(EffectiveFrom__lte=when).order_by("-EffectiveFrom", "-ProductPriceId")
+        after = history.filter(EffectiveFrom__gt=when).order_by("EffectiveFrom", "ProductPriceId")
+        prices = cls.objects.filter(pk__in=productIds).annotate(
+            PriceAsOf=Coalesce(Subquery(before.values("Price")[:1]), Subquery(after.values("OldPrice")[:1]), "Price")
+        ).values_list("pk", "PriceAsOf")
+        cents = Decimal("0.01")    # SQLite returns computed decimals unscaled
+        return {productId: price.quantize(cents) for productId, price in prices}
+
+
+class ProductPrice(models.Model):
+    # A price change of a product, the price applies from EffectiveFrom until the product's next change
+
+    ProductPriceId = models.AutoField(primary_key=True, unique=True)   # Unique identifier for the price change
+    ProductId = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="PriceHistory",
+        db_index=False,                                                 # Covered by the (ProductId, EffectiveFrom) index
+    )
+    OldPrice = models.DecimalField(max_digits=10, decimal_places=2)    # Price before the change, answers lookups older than the history
+    Price = models.DecimalField(max_digits=10, decimal_places=2)       # Price from EffectiveFrom on
+    EffectiveFrom = models.DateTimeField()                             # When the price changed
+    Reason = models.CharField(max_length=200, blank=True)              # Note given with the change, e.g. the repricing it was part of
+
+    class Meta:
+        indexes = [models.Index(fields=["ProductId", "EffectiveFrom"], name="productprice_product_from")]
+
+    def __str__(self):
+        return f"{self.ProductId_id}: {self.OldPrice} -> {self.Price} from {self.EffectiveFrom:%Y-%m-%d %H:%M}"
+
 
 class Store(models.Model):
     StoreId = models.AutoField(primary_key=True, unique=True)   # Unique identifier for the store
     StoreName = models.CharField(max_length=200)                # Name of the store
     Location = models.CharField(max_length=200)                 # Location of the store (e.g., address)
+    Latitude = models.FloatField(null=True, blank=True)         # Store coordinates in degrees, used for nearest-store lookups
+    Longitude = models.FloatField(null=True, blank=True)
     ContactNumber = models.CharField(max_length=15)             # Contact number for the store
     ManagerId = models.OneToOneField(
         "HR.Staff",                                             # The store manager, a relation to the Staff model in the HR app
@@ -85,12 +238,13 @@ class Store(models.Model):
 
     TotalSales = models.IntegerField()                          # The total sales amount
     OperatingHours = models.IntegerField()                      # The number of hours the store operates per day
+    Version = models.IntegerField(default=0)                    # Incremented on every edit, detects concurrent overwrites
 
     def __str__(self): # Returns a string representation of the store with its name and location
         return f"{self.StoreName} - {self.Location}"
 
     def GetAllProducts(self): # Returns all products stocked in this store.
-        return self.ProductLocation_set.values("ProductId__ProductName", "Quantity")
+        return self.ProductLocation.values("ProductId__ProductName", "Quantity")
 
     def ViewStorePerformance(self):
         # Returns the store's performance metrics
@@ -135,12 +289,12 @@ class Store(models.Model):
                     raise ValidationError("Operating hours must be between 1 and 24")
 
             
-            for field, value in update_data.items():                                 # Update the fields
-                setattr(self, field, value)
-            self.full_clean()                       # Validate all fields
-            self.save()
+            EditWithVersionCheck(self, update_data)     # Validate and write only the changed fields
             return True
 
+        except ConcurrentUpdateError:
+            raise                                       # Let the caller reload the store and retry
+
         except ValidationError as ve:
             raise ValidationError(f"Validation error: {str(ve)}")   #Error with validation
         
@@ -162,6 +316,8 @@ class ProductLocation(models.Model):
     Quantity = models.IntegerField()                        # The timestamp when the stock location record is created.                   
     Date = models.DateTimeField(auto_now_add=True)                  
 
+    objects = ShardedQuerySet.as_manager()                  # New rows go to their store's shard when sharding is on
+
     def __str__(self):# Returns a string representation of the stock location, showing the product name, store name, and quantity
         return f"{self.ProductId.ProductName} - {self.StoreId.StoreName} - Amount: {self.Quantity}"
 
@@ -180,3 +336,48 @@ class ProductLocation(models.Model):
             raise ValidationError("Insufficient stock for the operation.")
         self.Quantity += quantity
         self.save()
+
+
+    @classmethod
+    def ReceiveStock(cls, receipts):
+        """
+        Adds received quantities to the stock of many (product, store) pairs at once.
+
+        Existing stock rows are updated with one bulk UPDATE and missing ones are created with one
+        bulk INSERT per shard, so the number of queries does not depend on the number of pairs.
+
+        Args:
+            receipts (dict): (ProductId, StoreId) -> quantity received.
+
+        Returns:
+            int: Total number of units received.
+        """
+        receipts = {pair: quantity for pair, quantity in receipts.items() if quantity}
+        if not receipts:
+            return 0
+
+        for alias, storeIds in GroupByShard({storeId for _, storeId in receipts}).items():
+            shardReceipts = {pair: quantity for pair, quantity in receipts.items() if pair[1] in storeIds}
+            with transaction.atomic(using=alias):
+                locations = {}  # First stock row for each requested pair
+                for location in cls.objects.using(alias).select_for_update().filter(
+                    ProductId__in={productId for productId, _ in shardReceipts},
+                    StoreId__in=storeIds,
+                ).order_by("ProductLocationId"):
+                    locations.setdefault((location.ProductId_id, location.StoreId_id), location)
+
+                updated, created = [], []
+                for (productId, storeId), quantity in shardReceipts.items():
+                    location = locations.get((productId, storeId))
+                    if location:
+                        location.Quantity += quantity
+                        updated.append(location)
+                    else:
+                        created.append(cls(ProductId_id=productId, StoreId_id=storeId, Quantity=quantity))
+
+                cls.objects.using(alias).bulk_update(updated, ["Quantity"])
+                cls.objects.using(alias).bulk_create(created)
+
+        from Inventory.locator import InvalidateProducts   # Bulk writes don't send the signals the locator listens to
+        InvalidateProducts({productId for productId, _ in receipts})
+        return sum(receipts.values())
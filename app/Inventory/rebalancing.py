@@ -0,0 +1,229 @@
+from contextlib import ExitStack
+
+import numpy as np
+from django.core.exceptions import ValidationError
+from django.db import connections, transaction
+from django.db.models import Count, Min, Sum
+
+from app.sharding import FanOut, GroupByShard
+
+
+class StockMatrix:
+    """
+    Stock of every product in every store, loaded with one grouped query per shard.
+
+    Attributes:
+        productIds (ndarray): ProductId of each row.
+        storeIds (ndarray): StoreId of each column.
+        quantities (ndarray): Units per product and store, rows holding several stock rows are summed.
+        locationIds (ndarray): ProductLocationId of the first stock row per cell, 0 where the store
+            doesn't stock the product.
+        rowCounts (ndarray): Number of stock rows per cell.
+    """
+
+    def __init__(self, productIds, storeIds, quantities, locationIds, rowCounts):
+        self.productIds = productIds
+        self.storeIds = storeIds
+        self.quantities = quantities
+        self.locationIds = locationIds
+        self.rowCounts = rowCounts
+
+    @property
+    def stocked(self):
+        # Cells where the store carries the product, even with no units left
+        return self.locationIds > 0
+
+    @classmethod
+    def Load(cls):
+        from Inventory.models import ProductLocation
+
+        def Shard(alias):   # Rows are read as the database returns them, the ORM would build millions of tuples
+            sql, params = (
+                ProductLocation.objects.using(alias)
+                .values("ProductId", "StoreId")
+                .annotate(Total=Sum("Quantity"), FirstId=Min("ProductLocationId"), Rows=Count("ProductLocationId"))
+                .values_list("ProductId", "StoreId", "Total", "FirstId", "Rows")
+                .order_by()
+                .query.sql_with_params()
+            )
+            with connections[alias].cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+        rows = [row for shard in FanOut(Shard) for row in shard]
+        data = np.array(rows, dtype=np.int64).reshape(-1, 5)
+        productIds, productIndex = np.unique(data[:, 0], return_inverse=True)
+        storeIds, storeIndex = np.unique(data[:, 1], return_inverse=True)
+
+        quantities = np.zeros((len(productIds), len(storeIds)), dtype=np.int64)
+        locationIds = np.zeros((len(productIds), len(storeIds)), dtype=np.int64)
+        rowCounts = np.zeros((len(productIds), len(storeIds)), dtype=np.int64)
+        quantities[productIndex, storeIndex] = data[:, 2]
+        locationIds[productIndex, storeIndex] = data[:, 3]
+        rowCounts[productIndex, storeIndex] = data[:, 4]
+        return cls(productIds, storeIds, quantities, locationIds, rowCounts)
+
+
+def PlanRebalancing(matrix, minimums):
+    """
+    Works out transfers that bring every store up to its minimum stock of each product it carries.
+
+    A greedy transportation solver: for each product the largest shortfall is filled from the
+    largest surplus first, so most shortfalls are covered by a single transfer and the plan has
+    at most (stores short + stores with surplus - 1) transfers per product. Donors never go below
+    their own minimum, and stores only receive products they already stock.
+
+    Args:
+        matrix (StockMatrix): Current stock.
+        minimums (ndarray): Minimum units per store, aligned with matrix.storeIds.
+
+    Returns:
+        tuple: List of (ProductId, FromStoreId, ToStoreId, quantity) transfers, and the number of
+        units still missing because there was not enough surplus anywhere.
+    """
+    stocked = matrix.stocked
+    deficit = np.where(stocked, np.clip(minimums - matrix.quantities, 0, None), 0)
+    surplus = np.where(stocked, np.clip(matrix.quantities - minimums, 0, None), 0)
+    rows = np.nonzero(deficit.any(axis=1) & surplus.any(axis=1))[0]  # Only products that can be rebalanced
+
+    # Stores sorted by shortfall and by surplus for every product at once, largest first
+    takerOrder = np.argsort(-deficit[rows], axis=1, kind="stable")
+    giverOrder = np.argsort(-surplus[rows], axis=1, kind="stable")
+
+    transfers = []
+    productIds, storeIds = matrix.productIds.tolist(), matrix.storeIds.tolist()
+    for position, row in enumerate(rows.tolist()):
+        takers = takerOrder[position][: np.count_nonzero(deficit[row])].tolist()
+        givers = giverOrder[position][: np.count_nonzero(surplus[row])].tolist()
+        needs, spares = deficit[row].tolist(), surplus[row].tolist()
+        taker = giver = 0
+        while taker < len(takers) and giver < len(givers):
+            to, frm = takers[taker], givers[giver]
+            amount = min(needs[to], spares[frm])
+            transfers.append((productIds[row], storeIds[frm], storeIds[to], amount))
+            needs[to] -= amount
+            spares[frm] -= amount
+            if needs[to] == 0:
+                taker += 1
+            if spares[frm] == 0:
+                giver += 1
+
+    moved = sum(transfer[3] for transfer in transfers)
+    return transfers, int(deficit.sum()) - moved
+
+
+def _SpreadWithdrawals(stock, withdrawals):
+    """
+    Splits units taken from cells holding several stock rows into per-row UPDATE parameters.
+
+    Args:
+        stock (QuerySet): ProductLocation rows of one shard.
+        withdrawals (dict): (ProductId, StoreId) -> units to take.
+
+    Returns:
+        list: (change, ProductLocationId, change) tuples for ApplyTransfers' guarded update.
+    """
+    if not withdrawals:
+        return []
+    rows = (
+        stock.filter(ProductId__in={p for p, _ in withdrawals}, StoreId__in={s for _, s in withdrawals}, Quantity__gt=0)
+        .order_by("ProductLocationId")
+        .values_list("ProductLocationId", "ProductId", "StoreId", "Quantity")
+    )
+    remaining, params = dict(withdrawals), []
+    for locationId, productId, storeId, quantity in rows:
+        left = remaining.get((productId, storeId), 0)
+        if left:
+            taken = min(left, quantity)
+            params.append((-taken, locationId, -taken))
+            remaining[(productId, storeId)] = left - taken
+    if any(remaining.values()):
+        raise ValidationError("Stock changed since the rebalancing plan was made, nothing was transferred.")
+    return params
+
+
+def ApplyTransfers(matrix, transfers):
+    """
+    Carries out planned transfers as one atomic batch of stock updates per shard.
+
+    Each stock row gets its net change in a single executemany, guarded so no row goes below zero.
+    Units received go to the first stock row of the cell. Units given by a store whose stock of
+    the product is spread over several rows are taken from those rows in id order, read inside
+    the transaction. If stock was sold or moved since the plan was made and a guard fails, every
+    shard's updates are rolled back together. Across shards that is best effort: the shards
+    commit one after the other.
+
+    Args:
+        matrix (StockMatrix): The stock the plan was made from.
+        transfers (list): (ProductId, FromStoreId, ToStoreId, quantity) tuples from PlanRebalancing.
+
+    Returns:
+        int: Number of stock rows updated.
+
+    Raises:
+        ValidationError: If a source store no longer holds enough stock, nothing is changed then.
+    """
+    from Inventory.locator import InvalidateProducts
+    from Inventory.models import ProductLocation
+
+    productIndex = {productId: index for index, productId in enumerate(matrix.productIds.tolist())}
+    storeIndex = {storeId: index for index, storeId in enumerate(matrix.storeIds.tolist())}
+    changes = {}    # (ProductId, StoreId) -> net change in units
+    for productId, fromStore, toStore, quantity in transfers:
+        changes[(productId, fromStore)] = changes.get((productId, fromStore), 0) - quantity
+        changes[(productId, toStore)] = changes.get((productId, toStore), 0) + quantity
+    if not changes:
+        return 0
+
+    table = connections["default"].ops.quote_name(ProductLocation._meta.db_table)
+    sql = f"UPDATE {table} SET Quantity = Quantity + %s WHERE ProductLocationId = %s AND Quantity + %s >= 0"
+    groups = GroupByShard({storeId for _, storeId in changes})
+    updated = 0
+
+    with ExitStack() as stack:
+        for alias in groups:    # All shards' transactions stay open until every batch succeeded
+            stack.enter_context(transaction.atomic(using=alias))
+        for alias, storeIds in groups.items():
+            params, spread = [], {}
+            for (productId, storeId), change in changes.items():
+                if storeId not in storeIds or not change:
+                    continue
+                cell = productIndex[productId], storeIndex[storeId]
+                if change < 0 and matrix.rowCounts[cell] > 1:
+                    spread[(productId, storeId)] = -change
+                else:
+                    params.append((change, int(matrix.locationIds[cell]), change))
+            params += _SpreadWithdrawals(ProductLocation.objects.using(alias), spread)
+            with connections[alias].cursor() as cursor:
+                cursor.executemany(sql, params)
+                if cursor.rowcount != len(params):
+                    raise ValidationError("Stock changed since the rebalancing plan was made, nothing was transferred.")
+            updated += len(params)
+
+    InvalidateProducts({productId for productId, _ in changes})  # Raw updates don't send the locator's signals
+    return updated
+
+
+def RebalanceStock(threshold, store_thresholds=None, dry_run=False):
+    """
+    Loads all stock, plans transfers that lift every store to its minimum and carries them out.
+
+    Args:
+        threshold (int): Minimum units of each stocked product every store should hold.
+        store_thresholds (dict, optional): StoreId -> minimum, overriding the threshold for those stores.
+        dry_run (bool): Only plan, don't change any stock.
+
+    Returns:
+        dict: The "Transfers", the units they move, units still "Missing" and rows "Updated".
+    """
+    matrix = StockMatrix.Load()
+    overrides = store_thresholds or {}
+    minimums = np.array([overrides.get(storeId, threshold) for storeId in matrix.storeIds.tolist()], dtype=np.int64)
+    transfers, missing = PlanRebalancing(matrix, minimums)
+    updated = 0 if dry_run else ApplyTransfers(matrix, transfers)
+    return {
+        "Transfers": transfers,
+        "Units": sum(transfer[3] for transfer in transfers),
+        "Missing": missing,
+        "Updated": updated,
+    }
@@ -0,0 +1,162 @@
+from django.db import connection
+
+SEARCH_TABLE = "Inventory_product_search"  # FTS5 index over Product, created by migration 0004
+MIN_TRIGRAM_LENGTH = 3                      # The trigram tokenizer cannot match shorter terms
+
+
+def CreateSearchIndex(cursor):
+    """
+    Creates the FTS5 trigram index over Product, the triggers that keep it in sync and a
+    case-insensitive index on ProductName for prefix lookups.
+
+    The index is an external-content table, so it stores only the trigram index and reads names
+    back from Inventory_product. Triggers fire for every insert, update and delete, including
+    bulk ORM operations that bypass save() and signals.
+    """
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "ProductName, ProductType, content='Inventory_product', content_rowid='ProductId', tokenize='trigram')"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON Inventory_product BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}(rowid, ProductName, ProductType) "
+        "VALUES (new.ProductId, new.ProductName, new.ProductType); END"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON Inventory_product BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, ProductName, ProductType) "
+        "VALUES ('delete', old.ProductId, old.ProductName, old.ProductType); END"
+    )
+    cursor.execute(  # Only re-index when a searchable column changes, stock and price updates are free
+        f"CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update "
+        "AFTER UPDATE OF ProductName, ProductType ON Inventory_product BEGIN "
+        f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, ProductName, ProductType) "
+        "VALUES ('delete', old.ProductId, old.ProductName, old.ProductType); "
+        f"INSERT INTO {SEARCH_TABLE}(rowid, ProductName, ProductType) "
+        "VALUES (new.ProductId, new.ProductName, new.ProductType); END"
+    )
+    cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")  # Index existing products
+    cursor.execute(  # Case-insensitive name index used for prefix lookups
+        "CREATE INDEX IF NOT EXISTS Inventory_product_name_nocase ON Inventory_product (ProductName COLLATE NOCASE)"
+    )
+
+
+def DropSearchIndex(cursor):
+    # Removes the FTS5 index, its triggers and the prefix index
+    cursor.execute("DROP INDEX IF EXISTS Inventory_product_name_nocase")
+    for suffix in ("insert", "delete", "update"):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {SEARCH_TABLE}_{suffix}")
+    cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+def _Quote(term):
+    # Quotes a term as an FTS5 string so user input can't inject query syntax
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _Trigrams(term):
+    # Returns the distinct trigrams of a term, used for fuzzy matching
+    return list(dict.fromkeys(term[i:i + MIN_TRIGRAM_LENGTH] for i in range(len(term) - MIN_TRIGRAM_LENGTH + 1)))
+
+
+def _Match(cursor, match, productType, limit, exclude):
+    # Streams ProductIds matching an FTS5 query in rowid order, so LIMIT stops the scan early
+    sql = f"SELECT s.rowid FROM {SEARCH_TABLE} s"
+    params = [match]
+    if productType:  # CROSS JOIN keeps the FTS scan as the outer loop instead of probing it per product of the type
+        sql += " CROSS JOIN Inventory_product p ON p.ProductId = s.rowid"
+    sql += f" WHERE {SEARCH_TABLE} MATCH %s"
+    if productType:
+        sql += " AND p.ProductType = %s"
+        params.append(productType)
+    sql += " LIMIT %s"
+    params.append(limit + len(exclude))    # Over-fetch so excluded rows can be dropped afterwards
+    cursor.execute(sql, params)
+    return [row[0] for row in cursor.fetchall() if row[0] not in exclude][:limit]
+
+
+def _Prefix(cursor, query, productType, limit):
+    # Returns ProductIds whose name starts with the query, using the NOCASE index on ProductName
+    sql = (
+        "SELECT ProductId FROM Inventory_product "
+        "WHERE ProductName >= %s COLLATE NOCASE AND ProductName < %s COLLATE NOCASE"
+    )
+    params = [query, query + "\uffff"]
+    if productType:  # The unary + stops SQLite from choosing the ProductType index over the name index
+        sql += " AND +ProductType = %s"
+        params.append(productType)
+    sql += " ORDER BY ProductName COLLATE NOCASE LIMIT %s"
+    params.append(limit)
+    cursor.execute(sql, params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def SearchProducts(query, productType=None, limit=10, fuzzy=True):
+    """
+    Typeahead search over product names and types.
+
+    Names starting with the query come first, read from a case-insensitive index on ProductName.
+    Remaining slots are filled with substring matches from the FTS5 trigram index. When nothing
+    matches and ``fuzzy`` is on, names containing all but one of the query's trigrams are returned
+    instead, which tolerates a single typo. Every step streams matches without ranking, so the cost is bounded by ``limit``
+    rather than by how many products match.
+
+    Args:
+        query (str): Text typed by the user.
+        productType (str, optional): Only return products of this ProductType.
+        limit (int): Maximum number of results.
+        fuzzy (bool): Whether to fill up the results with approximate matches.
+
+    Returns:
+        list: Dictionaries with ProductId, ProductName, ProductType, Price and Match
+        ('prefix', 'substring' or 'fuzzy').
+    """
+    from Inventory.models import Product   # Imported here so migrations can use the index helpers above
+
+    query = " ".join(query.split())
+    if not query:
+        return []
+
+    if connection.vendor != "sqlite":  # No FTS5 index, fall back to LIKE queries
+        products = Product.objects.all()
+        if productType:
+            products = products.filter(ProductType=productType)
+        return [
+            dict(row, Match="substring")
+            for row in products.filter(ProductName__icontains=query)
+            .order_by("ProductName")
+            .values("ProductId", "ProductName", "ProductType", "Price")[:limit]
+        ]
+
+    matches = {}    # ProductId -> kind of match, in result order
+    with connection.cursor() as cursor:
+        for productId in _Prefix(cursor, query, productType, limit):
+            matches[productId] = "prefix"
+
+        if len(query) >= MIN_TRIGRAM_LENGTH and len(matches) < limit:
+            for productId in _Match(cursor, f"ProductName : {_Quote(query)}", productType, limit - len(matches), matches):
+                matches[productId] = "substring"
+
+        trigrams = _Trigrams(query.lower())
+        if fuzzy and not matches and len(trigrams) > 2:  # Only guess at typos when nothing matched as typed
+            # Leave each trigram out in turn, capped so long queries don't issue too many lookups
+            for skipped in range(min(len(trigrams), 8)):
+                if len(matches) >= limit:
+                    break
+                kept = " AND ".join(_Quote(t) for i, t in enumerate(trigrams) if i != skipped)
+                for productId in _Match(cursor, f"ProductName : ({kept})", productType, limit - len(matches), matches):
+                    matches[productId] = "fuzzy"
+
+    # Load the matched products through the ORM so Price comes back as a Decimal
+    products = Product.objects.in_bulk(list(matches))
+    return [
+        {
+            "ProductId": productId,
+            "ProductName": products[productId].ProductName,
+            "ProductType": products[productId].ProductType,
+            "Price": products[productId].Price,
+            "Match": kind,
+        }
+        for productId, kind in matches.items()
+        if productId in products
+    ]
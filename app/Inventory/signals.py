@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from Inventory.locator import InvalidateProducts, InvalidateStores
+from Inventory.models import ProductLocation, Store
+
+
+@receiver(post_save, sender=ProductLocation)
+@receiver(post_delete, sender=ProductLocation)
+def ProductLocationChanged(sender, instance, **kwargs):
+    # Stock for this product changed, reload its availability bitmap on the next lookup
+    InvalidateProducts([instance.ProductId_id])
+
+
+@receiver(post_save, sender=Store)
+@receiver(post_delete, sender=Store)
+def StoreChanged(sender, instance, **kwargs):
+    # A store was added, moved or removed, rebuild the store grid on the next lookup
+    InvalidateStores()
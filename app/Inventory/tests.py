@@ -1,3 +1,309 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from decimal import Decimal
 
+import numpy as np
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
 
+from app.sharding import FanOut, ShardFor
+from app.testutils import (
+    SHARDS, MakeProducts, MakeStock, MakeStores, MakeSuppliers, QueryBudgetTestCase, ShardedTestCase,
+)
+from Inventory.locator import GetStoreLocator, StoreLocator
+from Inventory.models import Product, ProductLocation, ProductPrice, Store
+from Inventory.rebalancing import ApplyTransfers, PlanRebalancing, RebalanceStock, StockMatrix
+
+
+class ProductQueryBudgetTests(QueryBudgetTestCase):
+
+    def Stocked(self, size):   # One product stocked in `size` stores
+        product = MakeProducts(1)[0]
+        MakeStock([product], MakeStores(size))
+        return (product,)
+
+    def testGetAllStores(self):
+        self.assertQueryBudget(1, self.Stocked, lambda product: list(product.GetAllStores()))
+
+    def testGetStockAmount(self):
+        self.assertQueryBudget(1, self.Stocked, lambda product: product.GetStockAmount())
+
+    def testTransferStock(self):
+        def Build(size):
+            product = MakeProducts(1)[0]
+            stores = MakeStores(size + 1)
+            MakeStock([product], stores[:size])
+            return product, stores[0], stores[size]
+
+        # Read both stock rows, update the source and create the destination row
+        self.assertQueryBudget(
+            4, Build, lambda product, from_store, to_store: product.TransferStock(from_store, to_store, 1)
+        )
+
+    def testEditOrderLimit(self):
+        self.assertQueryBudget(1, self.Stocked, lambda product: product.EditOrderLimit(5))
+
+
+class PriceHistoryTests(QueryBudgetTestCase):
+
+    def testReprice(self):
+        # Savepoint, the range check, the history INSERT ... SELECT, the UPDATE and the release
+        self.assertQueryBudget(5, lambda size: MakeProducts(size), lambda *products: Product.Reprice(product_type="Grocery", percent=10))
+
+    def testPricesAsOf(self):
+        def Build(size):
+            products = MakeProducts(size)
+            Product.Reprice(product_type="Grocery", amount=1)
+            return ([product.pk for product in products],)
+
+        self.assertQueryBudget(1, Build, lambda productIds: Product.PricesAsOf(productIds, timezone.now()))
+
+    def testRepriceKeepsHistory(self):
+        grocery, other = MakeProducts(2), MakeProducts(1, product_type="Toys", price="4.00")
+        before = timezone.now() - timedelta(seconds=1)
+
+        self.assertEqual(Product.Reprice(product_type="Grocery", percent="12.5", reason="Spring"), 2)
+        self.assertEqual(Product.Reprice(product_type="Grocery", amount="-0.25"), 2)
+        grocery[0].SetPrice("9.99", reason="Manual")
+
+        prices = Product.PricesAsOf([product.pk for product in grocery + other], timezone.now())
+        self.assertEqual(prices, {grocery[0].pk: Decimal("9.99"), grocery[1].pk: Decimal("11.00"), other[0].pk: Decimal("4.00")})
+        self.assertEqual(Product.objects.get(pk=grocery[1].pk).Price, Decimal("11.00"))
+        self.assertEqual(grocery[1].GetPriceAsOf(before), Decimal("10.00"))    # Older than the history, the first old price
+        self.assertEqual(grocery[1].GetPriceAsOf(before.date() - timedelta(days=1)), Decimal("10.00"))
+        self.assertEqual(
+            list(ProductPrice.objects.filter(ProductId=grocery[0]).order_by("pk").values_list("OldPrice", "Price", "Reason")),
+            [(Decimal("10.00"), Decimal("11.25"), "Spring"), (Decimal("11.25"), Decimal("11.00"), ""), (Decimal("11.00"), Decimal("9.99"), "Manual")],
+        )
+
+    def testRepriceRejectsNegativePrices(self):
+        products = MakeProducts(2, price="1.00")
+        with self.assertRaises(ValueError):
+            Product.Reprice(product_type="Grocery", amount=-2)
+        with self.assertRaises(ValueError):
+            Product.Reprice(product_type="Grocery", percent=-100)
+        with self.assertRaises(ValueError):
+            Product.Reprice(percent=5)     # No product type or supplier
+        for change in ({"percent": "Infinity"}, {"amount": "NaN"}, {"percent": "1e12"}, {"amount": "99999999.50"}):
+            with self.subTest(change=change), self.assertRaises(ValueError):
+                Product.Reprice(product_type="Grocery", **change)   # Not finite, or beyond max_digits=10
+        self.assertFalse(ProductPrice.objects.exists())
+        self.assertEqual(Product.PricesAsOf([products[0].pk], timezone.now()), {products[0].pk: Decimal("1.00")})
+
+
+class StoreQueryBudgetTests(QueryBudgetTestCase):
+
+    def Stocked(self, size):   # One store stocking `size` products
+        store = MakeStores(1)[0]
+        MakeStock(MakeProducts(size), [store])
+        return (store,)
+
+    def testGetAllProducts(self):
+        self.assertQueryBudget(1, self.Stocked, lambda store: list(store.GetAllProducts()))
+
+    def testViewStorePerformance(self):
+        self.assertQueryBudget(0, self.Stocked, lambda store: store.ViewStorePerformance())
+
+
+class ProductLocationQueryBudgetTests(QueryBudgetTestCase):
+
+    def testAdjustStock(self):
+        def Build(size):
+            stock = MakeStock(MakeProducts(size), MakeStores(1))
+            return (ProductLocation.objects.get(pk=stock[0].pk),)
+
+        self.assertQueryBudget(1, Build, lambda stock: stock.AdjustStock(-1))
+
+    def testReceiveStock(self):
+        def Build(size):
+            products, store = MakeProducts(size + 1), MakeStores(1)[0]
+            MakeStock(products[:size], [store])     # All pairs but one exist, the last one is created
+            return ({(product.pk, store.pk): 5 for product in products},)
+
+        # Savepoint, the locked read, one bulk update and one bulk insert
+        self.assertQueryBudget(5, Build, ProductLocation.ReceiveStock)
+
+
+class InventoryViewQueryBudgetTests(QueryBudgetTestCase):
+
+    def testRestockView(self):
+        def Build(size):
+            product = MakeProducts(1, supplier=MakeSuppliers(1)[0], order_limit=10 * size + 1)[0]
+            MakeStock([product], MakeStores(size))
+            return (product,)
+
+        def Call(product):
+            response = self.client.post(
+                "/Inventory/restock/", json.dumps({"productId": product.pk}), content_type="application/json"
+            )
+            self.assertIn("Purchase order", response.json()["message"])
+
+        self.assertQueryBudget(7, Build, Call)
+
+    def testSearchView(self):
+        def Build(size):
+            MakeProducts(size)
+            return ()
+
+        # No name starts with the query, so the prefix lookup, the trigram index and the product rows are read
+        self.assertQueryBudget(3, Build, lambda: self.client.get("/Inventory/search/", {"q": "duct"}))
+
+        Build(5)    # SQLite reads LIMIT -1 as no limit at all
+        self.assertEqual(len(self.client.get("/Inventory/search/", {"q": "duct", "limit": -1}).json()["results"]), 1)
+
+    def testNearestStoresView(self):
+        def Build(size):
+            product = MakeProducts(1)[0]
+            MakeStock([product], MakeStores(size))
+            GetStoreLocator().Invalidate(productIds=[product.pk], stores=True)
+            return (product,)
+
+        def Call(product):
+            response = self.client.get("/Inventory/nearest-stores/", {"productId": product.pk, "lat": 53.8, "lon": -1.55})
+            self.assertTrue(response.json()["stores"])
+
+        # Reloads the store grid and the product's availability
+        self.assertQueryBudget(2, Build, Call)
+
+        product, = Build(3)
+        for limit in (0, -1):
+            response = self.client.get(
+                "/Inventory/nearest-stores/", {"productId": product.pk, "lat": 53.8, "lon": -1.55, "limit": limit}
+            )
+            self.assertEqual(len(response.json()["stores"]), 1)
+
+    def testRepriceView(self):
+        def Build(size):
+            MakeProducts(size, supplier=MakeSuppliers(1)[0])
+            return ()
+
+        def Call():
+            response = self.client.post(
+                "/Inventory/reprice/", json.dumps({"productType": "Grocery", "percent": 5}), content_type="application/json"
+            )
+            self.assertGreater(response.json()["repriced"], 0)
+
+        self.assertQueryBudget(5, Build, Call)
+        Build(1)
+        for change in ({}, {"percent": "Infinity"}, {"percent": 1e12}):    # No change, not finite, overflowing
+            body = {"productType": "Grocery", **change}
+            response = self.client.post("/Inventory/reprice/", json.dumps(body), content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+
+    def testPricesView(self):
+        def Build(size):
+            return (",".join(str(product.pk) for product in MakeProducts(size)),)
+
+        def Call(productIds):
+            response = self.client.get("/Inventory/prices/", {"productIds": productIds, "at": "2024-01-01"})
+            self.assertEqual(set(response.json()["prices"].values()), {"10.00"})
+
+        self.assertQueryBudget(1, Build, Call)
+        self.assertEqual(self.client.get("/Inventory/prices/", {"productIds": "1", "at": "yesterday"}).status_code, 400)
+
+
+class StoreLocatorTests(TestCase):
+
+    def testGridRebuiltWhileAProductLoads(self):
+        first, second = MakeStores(2)
+        product = MakeProducts(1)[0]
+        MakeStock([product], [second])
+        locator = StoreLocator(ttl=60)
+        locator.LoadStores()
+        Store.objects.filter(pk=first.pk).update(Latitude=None)     # The second store moves to index 0
+        rebuilt = []
+
+        def RebuildGrid(execute, sql, params, many, context):
+            # Another thread rebuilds the grid while the product's stock is being read
+            if "Inventory_productlocation" in sql and not rebuilt:
+                rebuilt.append(sql)
+                locator.LoadStores()
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(RebuildGrid):
+            stores = locator.Nearest(product.pk, 53.8, -1.55)
+        self.assertTrue(rebuilt)
+        self.assertEqual([store["StoreId"] for store in stores], [second.pk])
+        _, bitmap, _, generation = locator._products[product.pk]
+        self.assertEqual((bitmap, generation), (1, locator._generation))   # Cached against the new grid
+
+
+class RebalancingPlanTests(SimpleTestCase):
+
+    def testPlanLiftsStoresToTheirMinimum(self):
+        rng = np.random.default_rng(7)
+        for trial in range(50):
+            stocked = rng.random((6, 8)) < 0.8
+            quantities = np.where(stocked, rng.integers(0, 15, (6, 8)), 0)
+            cells = np.arange(1, 49).reshape(6, 8)
+            matrix = StockMatrix(np.arange(100, 106), np.arange(1, 9), quantities, np.where(stocked, cells, 0), stocked * 1)
+            minimums = rng.integers(0, 8, 8)
+
+            transfers, missing = PlanRebalancing(matrix, minimums)
+            final, donors = quantities.copy(), set()
+            for productId, fromStore, toStore, amount in transfers:
+                row, giver, taker = productId - 100, fromStore - 1, toStore - 1
+                self.assertGreater(amount, 0)
+                self.assertTrue(stocked[row, giver] and stocked[row, taker])    # Only stores carrying the product
+                final[row, giver] -= amount
+                final[row, taker] += amount
+                donors.add((row, giver))
+
+            with self.subTest(trial=trial):
+                for row, giver in donors:   # Donors keep their own minimum
+                    self.assertGreaterEqual(final[row, giver], minimums[giver])
+                short = np.where(stocked, np.clip(minimums - final, 0, None), 0)
+                spare = np.where(stocked, np.clip(final - minimums, 0, None), 0)
+                self.assertEqual(short.sum(), missing)
+                # Every product is lifted to its minimums, or all of its surplus was used up
+                self.assertFalse((short.any(axis=1) & spare.any(axis=1)).any())
+                self.assertTrue((final.sum(axis=1) == quantities.sum(axis=1)).all())
+                self.assertFalse(final[~stocked].any())
+
+
+class RebalancingTests(TestCase):
+
+    def testDonorWithSeveralStockRows(self):
+        product, (donor, taker) = MakeProducts(1)[0], MakeStores(2)
+        rows = ProductLocation.objects.bulk_create(     # The donor's 12 units are split over two rows
+            ProductLocation(ProductId=product, StoreId=store, Quantity=quantity)
+            for store, quantity in ((donor, 2), (taker, 0), (donor, 10))
+        )
+
+        result = RebalanceStock(5)
+        self.assertEqual(result["Transfers"], [(product.pk, donor.pk, taker.pk, 5)])
+        self.assertEqual(result["Updated"], 3)
+        quantities = dict(ProductLocation.objects.values_list("pk", "Quantity"))
+        self.assertEqual([quantities[row.pk] for row in rows], [0, 5, 7])
+
+
+class ShardedRebalancingTests(ShardedTestCase):
+
+    def Quantities(self):
+        shards = FanOut(lambda alias: list(ProductLocation.objects.using(alias).values_list("pk", "Quantity")))
+        return {pk: quantity for rows in shards for pk, quantity in rows}
+
+    def testGuardFailureRollsBackEveryShard(self):
+        products, stores = MakeProducts(2), MakeStores(4)
+        donors = {}
+        for product, alias in zip(products, SHARDS):    # One donor and one store short in each shard
+            giver, taker = [store for store in stores if ShardFor(store.pk) == alias]
+            donors[alias] = ProductLocation.objects.create(ProductId=product, StoreId=giver, Quantity=20)
+            ProductLocation.objects.create(ProductId=product, StoreId=taker, Quantity=0)
+        before = self.Quantities()
+
+        matrix = StockMatrix.Load()
+        transfers, missing = PlanRebalancing(matrix, np.full(len(matrix.storeIds), 5))
+        self.assertEqual((len(transfers), missing), (2, 0))
+        for alias, donor in donors.items():     # Whichever shard is written first, the other one's guard fails
+            with self.subTest(failing=alias):
+                ProductLocation.objects.using(alias).filter(pk=donor.pk).update(Quantity=2)     # Sold since the plan
+                with self.assertRaises(ValidationError):
+                    ApplyTransfers(matrix, transfers)
+                self.assertEqual(self.Quantities(), {**before, donor.pk: 2})
+                ProductLocation.objects.using(alias).filter(pk=donor.pk).update(Quantity=20)
+
+        self.assertEqual(ApplyTransfers(matrix, transfers), 4)
+        self.assertEqual(sorted(self.Quantities().values()), [5, 5, 15, 15])
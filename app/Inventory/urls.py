@@ -3,6 +3,9 @@ from django.urls import path
 from . import views
 # store for each modules related URL
 urlpatterns = [
-        
-
+    path("restock/", views.RestockProduct, name="restock-product"),
+    path("search/", views.SearchProductsView, name="product-search"),
+    path("nearest-stores/", views.NearestStoresView, name="nearest-stores"),
+    path("reprice/", views.RepriceProductsView, name="reprice-products"),
+    path("prices/", views.PricesAsOfView, name="product-prices"),
 ]
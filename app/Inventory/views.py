@@ -1,7 +1,12 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from app.facade import Facade
+from app.responses import FastJsonResponse
+from django.utils.dateparse import parse_date, parse_datetime
+from decimal import Decimal, InvalidOperation
 from Inventory.models import Product
+from Inventory.locator import GetStoreLocator
+from Inventory.search import SearchProducts
 import json
 
 
@@ -41,4 +46,96 @@ def RestockProduct(request):
 
 
     # If not POST, return method not allowed
-    return JsonResponse({"error": "Only POST method is allowed."}, status=405)
\ No newline at end of file
+    return JsonResponse({"error": "Only POST method is allowed."}, status=405)
+
+
+def SearchProductsView(request):
+    """
+    Function-based view for product typeahead.
+    :param request: The HTTP request object, with 'q' and optional 'type', 'limit' and 'fuzzy' query parameters.
+    :return: A JsonResponse with the matching products.
+    """
+    query = request.GET.get("q", "")
+    product_type = request.GET.get("type")
+
+    try:
+        limit = max(1, min(int(request.GET.get("limit", 10)), 50))  # Typeahead never needs more than a handful of results
+    except ValueError:
+        return JsonResponse({"error": "limit must be an integer."}, status=400)
+    fuzzy = request.GET.get("fuzzy", "1") not in ("0", "false")
+
+    results = SearchProducts(query, productType=product_type, limit=limit, fuzzy=fuzzy)
+    return FastJsonResponse({"query": query, "results": results})
+
+
+def NearestStoresView(request):
+    """
+    Function-based view returning the nearest stores with enough stock of a product.
+    :param request: The HTTP request object, with 'productId', 'lat', 'lon' and optional 'quantity' and 'limit'.
+    :return: A JsonResponse with the stores, nearest first.
+    """
+    try:
+        product_id = int(request.GET["productId"])
+        lat = float(request.GET["lat"])
+        lon = float(request.GET["lon"])
+        quantity = int(request.GET.get("quantity", 1))
+        limit = max(1, min(int(request.GET.get("limit", 5)), 50))   # The locator needs room for one store
+    except KeyError as e:
+        return JsonResponse({"error": f"{e.args[0]} is required."}, status=400)
+    except ValueError:
+        return JsonResponse({"error": "productId, quantity and limit must be integers, lat and lon numbers."}, status=400)
+
+    stores = GetStoreLocator().Nearest(product_id, lat, lon, quantity=quantity, limit=limit)
+    return FastJsonResponse({"productId": product_id, "stores": stores})
+
+
+@csrf_exempt
+def RepriceProductsView(request):
+    """
+    Function-based view changing the price of every product of a type or supplier at once.
+    :param request: The HTTP request object, a JSON body with 'productType' and/or 'supplierId', and either
+        'percent' or 'amount', and an optional 'reason'.
+    :return: A JsonResponse with the number of products repriced.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST method is allowed."}, status=405)
+    try:
+        body = json.loads(request.body)
+        supplier = int(body["supplierId"]) if body.get("supplierId") is not None else None
+        percent, amount = (
+            Decimal(str(body[name])) if body.get(name) is not None else None for name in ("percent", "amount")
+        )
+        repriced = Product.Reprice(
+            product_type=body.get("productType"), supplier=supplier, percent=percent, amount=amount,
+            reason=str(body.get("reason", ""))[:200],
+        )
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON format."}, status=400)
+    except (InvalidOperation, TypeError):
+        return JsonResponse({"error": "percent and amount must be numbers, supplierId an integer."}, status=400)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return JsonResponse({"repriced": repriced})
+
+
+def PricesAsOfView(request):
+    """
+    Function-based view returning the prices products had at a point in time.
+    :param request: The HTTP request object, with 'productIds' (comma separated) and 'at', a date or datetime.
+    :return: A JsonResponse with the price of each product that exists, by ProductId.
+    """
+    try:
+        productIds = [int(productId) for productId in request.GET["productIds"].split(",")]
+        at = request.GET["at"]
+    except KeyError as e:
+        return JsonResponse({"error": f"{e.args[0]} is required."}, status=400)
+    except ValueError:
+        return JsonResponse({"error": "productIds must be comma separated integers."}, status=400)
+    try:
+        when = parse_datetime(at) or parse_date(at)
+    except ValueError:
+        when = None
+    if when is None:
+        return JsonResponse({"error": f"Invalid date: {at}, use YYYY-MM-DD or an ISO 8601 datetime."}, status=400)
+
+    return FastJsonResponse({"at": at, "prices": Product.PricesAsOf(productIds[:500], when)})
@@ -0,0 +1,5 @@
+from django.contrib import admin
+from .models import *
+
+# Registers the ScheduledJob model so job intervals can be tuned and jobs paused from the admin site.
+admin.site.register(ScheduledJob)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class OperationsConfig(AppConfig):
+    # Configuration for the Operations app, which holds background jobs and maintenance tooling
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "Operations" # app name
+
+    def ready(self):
+        from Operations import jobs  # Registers the periodic jobs with the scheduler
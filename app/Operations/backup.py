@@ -0,0 +1,281 @@
+import base64
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+import orjson
+from django.db import connections, transaction
+from django.utils import timezone
+
+MANIFEST = "manifest.json"
+SKIPPED_TABLES = {"django_migrations"}     # Restores go into a migrated database, which has its own
+
+
+class BackupRestarted(Exception):
+    # Writers kept changing the source while it was copied in steps
+    pass
+
+
+def SqliteDatabases():
+    # Aliases of the file-based SQLite databases, the ones that can be backed up
+    return [
+        alias for alias, database in connections.settings.items()
+        if database["ENGINE"] == "django.db.backends.sqlite3" and str(database["NAME"]) != ":memory:"
+    ]
+
+
+def BackupDatabase(alias, target, pages=256, pause=0.01, max_restarts=5, progress=None):
+    """
+    Copies a live SQLite database to a file with SQLite's online backup API.
+
+    The copy is made a few pages at a time with a pause after every step. The source is only
+    read-locked while a step runs, so writers wait at most one step. When another connection writes to the source, SQLite starts
+    the copy over. If that happens more than ``max_restarts`` times the database is copied in one
+    step instead, which holds the read lock for the whole copy but always finishes. The file is
+    written next to the target and only moved into place once it passes a quick check.
+
+    Args:
+        alias (str): Database to back up.
+        target (Path): File to write the snapshot to.
+        pages (int): Pages copied per step.
+        pause (float): Seconds between steps, when writers get their turn.
+        max_restarts (int): Restarts tolerated before falling back to a single step.
+        progress (callable, optional): Called with (pages copied, total pages) after every step.
+
+    Returns:
+        Path: The snapshot file.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    partial = target.with_name(target.name + ".partial")
+    partial.unlink(missing_ok=True)
+    restarts, remainingBefore = 0, None
+
+    def Step(status, remaining, total):
+        nonlocal restarts, remainingBefore
+        if remainingBefore is not None and remaining > remainingBefore:   # The source changed, SQLite started over
+            restarts += 1
+            if restarts > max_restarts:
+                raise BackupRestarted(f"{alias} changed {restarts} times during the backup")
+        remainingBefore = remaining
+        if progress:
+            progress(total - remaining, total)
+        if remaining:
+            time.sleep(pause)   # Runs after the step released its lock
+
+    source = sqlite3.connect(connections[alias].settings_dict["NAME"], timeout=30)
+    try:
+        destination = sqlite3.connect(partial)
+        try:
+            try:
+                source.backup(destination, pages=pages, progress=Step)
+            except BackupRestarted:
+                source.backup(destination, pages=-1)
+            check = destination.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            destination.close()
+    finally:
+        source.close()
+
+    if check != "ok":
+        partial.unlink()
+        raise sqlite3.DatabaseError(f"Backup of {alias} failed its integrity check: {check}")
+    os.replace(partial, target)
+    return target
+
+
+def _DataTables(connection):
+    # Tables holding data: no SQLite internals except sqlite_sequence, no virtual tables or their shadow tables
+    tables = dict(connection.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall())
+    virtual = [name for name, sql in tables.items() if sql and sql.upper().startswith("CREATE VIRTUAL TABLE")]
+    return sorted(
+        name for name in tables
+        if name not in SKIPPED_TABLES
+        and (name == "sqlite_sequence" or not name.startswith("sqlite_"))
+        and not any(name == table or name.startswith(f"{table}_") for table in virtual)
+    )
+
+
+def DumpDatabase(snapshot, directory, alias="default", batch_size=5000):
+    """
+    Writes every table of a database file as gzip-compressed NDJSON, one file per table.
+
+    Dumps are read from a snapshot made by BackupDatabase rather than from the live database,
+    so they are consistent across tables without holding a read lock on it. Each file starts
+    with a header line holding the table and its columns, followed by one JSON array per row.
+    JSON has no bytes, so BLOB columns are written as base64 and listed in the header.
+    A manifest lists the tables and their row counts.
+
+    Args:
+        snapshot (Path): SQLite file to dump.
+        directory (Path): Directory the files are written to.
+        alias (str): Database the snapshot was taken from, recorded in the manifest.
+        batch_size (int): Rows fetched at a time.
+
+    Returns:
+        dict: The manifest.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    source = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+    tables = {}
+    try:
+        for table in _DataTables(source):
+            cursor = source.execute(f'SELECT * FROM "{table}"')
+            columns = [column[0] for column in cursor.description]
+            declared = {name: kind for _, name, kind, *_ in source.execute(f'PRAGMA table_info("{table}")')}
+            blobs = [position for position, name in enumerate(columns) if "BLOB" in declared.get(name, "").upper()]
+            count = 0
+            with gzip.open(directory / f"{table}.ndjson.gz", "wb", compresslevel=6) as output:
+                header = {"table": table, "columns": columns, "base64": [columns[position] for position in blobs]}
+                output.write(orjson.dumps(header) + b"\n")
+                while rows := cursor.fetchmany(batch_size):
+                    if blobs:
+                        rows = [_EncodeBlobs(row, blobs) for row in rows]
+                    output.write(b"".join(orjson.dumps(row) + b"\n" for row in rows))
+                    count += len(rows)
+            tables[table] = count
+    finally:
+        source.close()
+
+    manifest = {"database": alias, "created": timezone.now().isoformat(), "snapshot": Path(snapshot).name, "tables": tables}
+    (directory / MANIFEST).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+def _EncodeBlobs(row, positions):
+    # The row with the BLOBs at the positions as base64 text
+    row = list(row)
+    for position in positions:
+        if row[position] is not None:
+            row[position] = base64.b64encode(row[position]).decode("ascii")
+    return row
+
+
+def _ReadDump(path):
+    # Yields the columns of a dump file, then its rows with base64 columns decoded back to bytes
+    with gzip.open(path, "rb") as lines:
+        header = orjson.loads(next(lines))
+        columns = header["columns"]
+        blobs = [columns.index(name) for name in header.get("base64", ())]     # Older dumps have no BLOB columns
+        yield columns
+        for line in lines:
+            row = orjson.loads(line)
+            for position in blobs:
+                if row[position] is not None:
+                    row[position] = base64.b64decode(row[position])
+            yield row
+
+
+def RestoreDump(directory, alias=None, batch_size=5000, progress=None):
+    """
+    Replaces the rows of every dumped table with the rows of a DumpDatabase dump.
+
+    The target must already be migrated to the same schema. Everything runs in one transaction
+    with foreign keys checked once at the end, like loaddata does. Triggers and secondary indexes of the database
+    are dropped while rows are loaded with executemany and recreated afterwards: building an index
+    once is much faster than updating it per row, and the outbox triggers don't publish restored
+    rows as new changes. Full-text indexes are rebuilt from the restored rows.
+
+    Args:
+        directory (Path): Directory holding the manifest and the table files.
+        alias (str, optional): Database to restore into, defaults to the one the dump was taken from.
+        batch_size (int): Rows inserted per executemany.
+        progress (callable, optional): Called with (table, rows restored) after every table.
+
+    Returns:
+        dict: Rows restored per table.
+
+    Raises:
+        ValueError: If a dumped table is missing from the target or its columns differ.
+    """
+    directory = Path(directory)
+    manifest = json.loads((directory / MANIFEST).read_text())
+    alias = alias or manifest["database"]
+    connection = connections[alias]
+    tables = [table for table in manifest["tables"] if table != "sqlite_sequence"]
+    quote = connection.ops.quote_name
+
+    with connection.constraint_checks_disabled(), transaction.atomic(using=alias), connection.cursor() as cursor:
+        targetTables = set(connection.introspection.table_names(cursor))
+        for table in tables:
+            if table not in targetTables:
+                raise ValueError(f"Table {table} does not exist in {alias}, migrate it first.")
+
+        cursor.execute(
+            "SELECT type, name, tbl_name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND sql IS NOT NULL"
+        )
+        deferred = [    # Every trigger and the indexes of restored tables, in the order they were created
+            (kind, name, sql) for kind, name, table, sql in cursor.fetchall() if kind == "trigger" or table in tables
+        ]
+        for kind, name, _ in deferred:
+            cursor.execute(f"DROP {kind.upper()} {quote(name)}")
+
+        restored = {}
+        for table in tables:
+            rows = _ReadDump(directory / f"{table}.ndjson.gz")
+            columns = next(rows)
+            targetColumns = {column.name for column in connection.introspection.get_table_description(cursor, table)}
+            if set(columns) != targetColumns:
+                raise ValueError(f"Columns of {table} differ between the dump and {alias}, migrate it to the same version.")
+
+            cursor.execute(f"DELETE FROM {quote(table)}")
+            sql = f"INSERT INTO {quote(table)} ({', '.join(map(quote, columns))}) VALUES ({', '.join(['%s'] * len(columns))})"
+            count, batch = 0, []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == batch_size:
+                    cursor.executemany(sql, batch)
+                    count, batch = count + len(batch), []
+            if batch:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+            restored[table] = count
+            if progress:
+                progress(table, count)
+
+        for _, _, sql in deferred:
+            cursor.execute(sql)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%USING fts5%'")
+        for (name,) in cursor.fetchall():   # External-content full-text indexes read the restored rows again
+            cursor.execute(f"INSERT INTO {quote(name)}({quote(name)}) VALUES ('rebuild')")
+
+        if "sqlite_sequence" in manifest["tables"]:     # Keep the id counters, shards reserve their own ranges
+            sequences = _ReadDump(directory / "sqlite_sequence.ndjson.gz")
+            next(sequences)
+            for name, seq in sequences:
+                if name in tables:
+                    cursor.execute("DELETE FROM sqlite_sequence WHERE name = %s", [name])
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [name, seq])
+
+        connection.check_constraints(table_names=tables)
+    return restored
+
+
+def RestoreSnapshot(snapshot, alias="default"):
+    """
+    Overwrites a database with a snapshot made by BackupDatabase, in a single backup step.
+
+    Stop the web workers and the scheduler first: the database is locked while it is copied,
+    and processes that keep running would hold caches of the old data.
+    """
+    connection = connections[alias]
+    connection.ensure_connection()
+    source = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+    try:
+        source.backup(connection.connection)
+    finally:
+        source.close()
+    connection.close()  # Later queries reconnect and see the restored schema
+
+
+def PruneBackups(directory, keep):
+    # Removes all but the newest ``keep`` backup folders, folder names sort by the time they were taken
+    folders = sorted(path for path in Path(directory).iterdir() if path.is_dir())
+    for folder in folders[:-keep] if keep else []:
+        shutil.rmtree(folder)
+    return folders[:-keep] if keep else []
@@ -0,0 +1,93 @@
+import logging
+
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from Operations.scheduler import RegisterJob
+
+logger = logging.getLogger(__name__)
+
+
+@RegisterJob("restock-sweep", interval=15 * 60, jitter=60)
+def RestockSweep():
+    """
+    Raises purchase orders for every product whose total stock has fallen below its order limit.
+
+    Candidates are found with one aggregate query, products that already have an open purchase
+    order are skipped so repeated sweeps don't order the same stock twice.
+    """
+    from app.facade import Facade
+    from app.sharding import FanOut, ShardingEnabled
+    from Inventory.models import Product, ProductLocation
+    from Procurement.models import PurchaseOrder
+
+    products = Product.objects.filter(SupplierId__isnull=False).exclude(
+        purchaseorder__OrderStatus__in=PurchaseOrder.OPEN_STATUSES
+    )
+
+    if ShardingEnabled():   # Stock lives in the shards, total it there and compare with the limits here
+        stock = {}
+        for rows in FanOut(
+            lambda alias: list(
+                ProductLocation.objects.using(alias)
+                .values("ProductId")
+                .annotate(Total=Sum("Quantity"))
+                .values_list("ProductId", "Total")
+            )
+        ):
+            for productId, total in rows:
+                stock[productId] = stock.get(productId, 0) + total
+        productIds = [
+            productId for productId, orderLimit in products.values_list("ProductId", "OrderLimit")
+            if stock.get(productId, 0) < orderLimit
+        ]
+    else:
+        productIds = (
+            products.annotate(TotalStock=Coalesce(Sum("ProductLocation__Quantity"), Value(0)))
+            .filter(TotalStock__lt=F("OrderLimit"))
+            .values_list("ProductId", flat=True)
+        )
+
+    facade = Facade()
+    for productId in productIds:
+        logger.info(facade.RestockProduct(productId))
+
+
+@RegisterJob("outbox-retention", interval=60 * 60, jitter=5 * 60)
+def OutboxRetention():
+    # Removes change-feed events older than OUTBOX_RETENTION_DAYS, so the outbox only holds recent deltas
+    from Operations.outbox import PruneOutbox
+
+    removed = PruneOutbox()
+    if removed:
+        logger.info("Removed %d expired outbox events", removed)
+
+
+@RegisterJob("fifo-costing", interval=5 * 60, jitter=30)
+def FifoCosting():
+    # Creates cost lots for newly delivered purchase orders and costs the sales recorded since the last run
+    from Finance.costing import RunCosting
+
+    result = RunCosting()
+    if result["Lots"] or result["Sales"]:
+        logger.info("Costed %d sales, %d new cost lots", result["Sales"], result["Lots"])
+
+
+@RegisterJob("sales-anomalies", interval=60, jitter=10)
+def SalesAnomalies():
+    # Updates the sales baselines with the sales recorded since the last run and flags the anomalies among them
+    from Sales.anomaly import RunDetection
+
+    result = RunDetection()
+    if result["Alerts"]:
+        logger.warning("Raised %d sales alerts while checking %d sales", result["Alerts"], result["Sales"])
+
+
+@RegisterJob("sales-sketches", interval=60, jitter=10)
+def SalesSketches():
+    # Adds the sales recorded since the last run to the percentile and distinct count sketches of their store and day
+    from Sales.sketches import UpdateSketches
+
+    added = UpdateSketches()
+    if added:
+        logger.info("Added %d sales to the sales sketches", added)
@@ -0,0 +1,440 @@
+import asyncio
+import io
+import itertools
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.client import HTTPConnection
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+from wsgiref.util import setup_testing_defaults
+
+import orjson
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.db import connections
+from django.utils import timezone
+
+# Relative weights of each kind of request in a generated mix, tills record sales far more often than
+# managers look at reports
+DEFAULT_MIX = {"record-sale": 6, "store-performance": 3, "restock": 1}
+MODES = ("threads", "asyncio")
+ACCEPT_ENCODING = "gzip, br"    # Sent like browsers do, so compression is part of the measured work
+
+
+def ParseMix(text):
+    # Parses "record-sale=6,restock=1" into weights, rejecting unknown request kinds
+    mix = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, weight = item.partition("=")
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Unknown request kind {name!r}, expected one of: {', '.join(DEFAULT_MIX)}.")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def GenerateRequests(count, mix=None, seed=0):
+    """
+    Builds a random mix of requests against the ids of the configured database.
+
+    Store-performance requests ask for ranges of one to ninety days ending within the last year,
+    one in ten asks for everything. The same seed and data give the same requests, so two builds
+    can be compared on identical traffic, or the list can be saved with SaveRequests and replayed.
+
+    Args:
+        count (int): Number of requests.
+        mix (dict, optional): Weight of each request kind, defaults to DEFAULT_MIX.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        list: Requests as dictionaries with a name, method, path, query and body.
+    """
+    from HR.models import Staff
+    from Inventory.models import Product, Store
+
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    storeIds = list(Store.objects.values_list("StoreId", flat=True))
+    productIds = list(Product.objects.values_list("ProductId", flat=True))
+    staffIds = list(Staff.objects.values_list("StaffId", flat=True)) or [None]
+    if not storeIds or not productIds:
+        raise ValueError("The database has no stores or products to generate requests for.")
+    today = timezone.localdate()
+
+    def Restock():
+        return {"method": "POST", "path": "/Inventory/restock/", "query": {}, "body": {"productId": rng.choice(productIds)}}
+
+    def StorePerformance():
+        query = {}
+        if rng.random() >= 0.1:
+            end = today - timedelta(days=rng.randint(0, 365))
+            query = {"start_date": str(end - timedelta(days=rng.randint(1, 90))), "end_date": str(end)}
+        return {"method": "GET", "path": "/Sales/performance/", "query": query, "body": None}
+
+    def RecordSale():
+        body = {
+            "storeId": rng.choice(storeIds), "productId": rng.choice(productIds), "staffId": rng.choice(staffIds),
+            "totalAmount": f"{rng.randint(100, 10000) / 100:.2f}", "quantity": rng.randint(1, 5),
+            "paymentMethod": rng.choice(("Card", "Cash")),
+        }
+        return {"method": "POST", "path": "/Sales/record/", "query": {}, "body": body}
+
+    builders = {"restock": Restock, "store-performance": StorePerformance, "record-sale": RecordSale}
+    names = [name for name, weight in mix.items() if weight > 0]
+    chosen = rng.choices(names, weights=[mix[name] for name in names], k=count)
+    return [{"name": name, **builders[name]()} for name in chosen]
+
+
+def SaveRequests(requests, path):
+    # Writes requests as NDJSON, one request per line
+    Path(path).write_bytes(b"".join(orjson.dumps(request) + b"\n" for request in requests))
+
+
+def LoadRequests(path):
+    """
+    Reads requests saved by SaveRequests, or recorded elsewhere in the same format.
+
+    Each line holds a JSON object with a method and path, and optionally a query dictionary, a
+    JSON body and a name that groups requests in the report (the path when missing).
+    """
+    requests = []
+    for line in Path(path).read_bytes().splitlines():
+        if line.strip():
+            request = orjson.loads(line)
+            request.setdefault("query", {})
+            request.setdefault("body", None)
+            request.setdefault("name", request["path"])
+            requests.append(request)
+    return requests
+
+
+def _Target(request):
+    query = urlencode(request["query"])
+    return f"{request['path']}?{query}" if query else request["path"]
+
+
+def _Body(request):
+    return orjson.dumps(request["body"]) if request["body"] is not None else b""
+
+
+class WsgiClient:
+    """
+    Sends requests straight through a WSGI application in this process, without sockets.
+
+    Args:
+        application: The WSGI application, usually app.wsgi.application.
+        host (str): Host header, must be allowed by ALLOWED_HOSTS.
+    """
+
+    def __init__(self, application, host="localhost"):
+        self.application = application
+        self.host = host
+
+    def Send(self, request):
+        # Returns the status code and body size of one request
+        body = _Body(request)
+        environ = {
+            "REQUEST_METHOD": request["method"], "PATH_INFO": request["path"], "QUERY_STRING": urlencode(request["query"]),
+            "CONTENT_TYPE": "application/json", "CONTENT_LENGTH": str(len(body)), "wsgi.input": io.BytesIO(body),
+            "HTTP_HOST": self.host, "HTTP_ACCEPT_ENCODING": ACCEPT_ENCODING,
+        }
+        setup_testing_defaults(environ)
+        status = []
+        response = self.application(environ, lambda line, headers, exc_info=None: status.append(line))
+        try:
+            size = sum(len(chunk) for chunk in response)
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+        return int(status[0].split()[0]), size
+
+
+class HttpClient:
+    # Sends requests to a running server over one keep-alive connection per thread
+
+    def __init__(self, url, host=None):
+        parts = urlsplit(url)
+        self.address = (parts.hostname, parts.port or 80)
+        self.host = host or parts.netloc
+        self.local = threading.local()
+
+    def Send(self, request):
+        for attempt in (1, 2):  # The server may have closed an idle keep-alive connection, retry once on a new one
+            connection = getattr(self.local, "connection", None)
+            reused = connection is not None
+            if connection is None:
+                connection = self.local.connection = HTTPConnection(*self.address, timeout=60)
+            try:
+                connection.request(
+                    request["method"], _Target(request), body=_Body(request),
+                    headers={"Host": self.host, "Content-Type": "application/json", "Accept-Encoding": ACCEPT_ENCODING},
+                )
+                response = connection.getresponse()
+                size = len(response.read())
+            except (ConnectionError, OSError):
+                connection.close()
+                self.local.connection = None
+                if reused and attempt == 1:
+                    continue
+                raise
+            if response.will_close:
+                connection.close()
+                self.local.connection = None
+            return response.status, size
+
+
+class AsyncHttpClient:
+    """
+    Sends requests to a running server with asyncio streams, one keep-alive connection per worker.
+
+    Only what the application's responses need of HTTP/1.1 is handled: Content-Length, chunked and
+    close-delimited bodies.
+    """
+
+    def __init__(self, url, host=None):
+        parts = urlsplit(url)
+        self.address = (parts.hostname, parts.port or 80)
+        self.host = host or parts.netloc
+
+    async def Send(self, request, streams):
+        # streams is the worker's one-item list holding its (reader, writer) pair, or None
+        for attempt in (1, 2):
+            reused = streams[0] is not None
+            if not reused:
+                streams[0] = await asyncio.open_connection(*self.address)
+            reader, writer = streams[0]
+            body = _Body(request)
+            head = (
+                f"{request['method']} {_Target(request)} HTTP/1.1\r\nHost: {self.host}\r\n"
+                f"Content-Type: application/json\r\nAccept-Encoding: {ACCEPT_ENCODING}\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            )
+            try:
+                writer.write(head.encode("latin-1") + body)
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionResetError("Connection closed before the response")
+            except (ConnectionError, OSError):
+                writer.close()
+                streams[0] = None
+                if reused and attempt == 1:
+                    continue
+                raise
+
+            status = int(line.split()[1])
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip().lower()
+            if "content-length" in headers:
+                size = len(await reader.readexactly(int(headers["content-length"])))
+            elif headers.get("transfer-encoding") == "chunked":
+                size = 0
+                while chunk := int((await reader.readline()).split(b";")[0], 16):
+                    size += len(await reader.readexactly(chunk + 2)) - 2
+                await reader.readline()
+            else:
+                size = len(await reader.read())
+                headers["connection"] = "close"
+            if headers.get("connection") == "close":
+                writer.close()
+                streams[0] = None
+            return status, size
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):  # Thousands of access log lines would only slow the server down
+        pass
+
+
+def StartServer(application, host="127.0.0.1"):
+    """
+    Serves a WSGI application from a background thread, with one thread per connection like runserver.
+
+    Returns:
+        tuple: The server, call its shutdown() and server_close() when done, and its base URL.
+    """
+    server = ThreadedWSGIServer((host, 0), _QuietHandler, allow_reuse_address=True)
+    server.set_app(application)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.1}, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+class _Schedule:
+    # Hands out requests to the workers: each request once, or round and round until the deadline
+
+    def __init__(self, requests, duration=None):
+        self.requests = itertools.cycle(requests) if duration else iter(requests)
+        self.deadline = time.perf_counter() + duration if duration else None
+        self.lock = threading.Lock()
+
+    def Next(self):
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return None
+        with self.lock:
+            return next(self.requests, None)
+
+
+def _Timed(send, request):
+    # One result: (name, status, seconds, bytes, error), status 0 when the request raised
+    started = time.perf_counter()
+    try:
+        status, size = send(request)
+        return request["name"], status, time.perf_counter() - started, size, None
+    except Exception as e:
+        return request["name"], 0, time.perf_counter() - started, 0, f"{type(e).__name__}: {e}"
+
+
+def RunThreads(client, requests, concurrency, duration=None):
+    """
+    Replays requests from ``concurrency`` threads, each sending its next request as soon as the last one finished.
+
+    Returns:
+        tuple: The results and the elapsed seconds.
+    """
+    schedule = _Schedule(requests, duration)
+
+    def Worker():
+        results = []
+        try:
+            while (request := schedule.Next()) is not None:
+                results.append(_Timed(client.Send, request))
+        finally:
+            connections.close_all()     # In-process requests open connections in this thread
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = [executor.submit(Worker) for _ in range(concurrency)]
+        results = [result for future in futures for result in future.result()]
+    return results, time.perf_counter() - started
+
+
+def RunAsyncio(client, requests, concurrency, duration=None):
+    """
+    Replays requests from ``concurrency`` asyncio tasks.
+
+    An AsyncHttpClient keeps every connection on the event loop. WSGI applications are
+    synchronous, so requests sent in-process run on a pool of ``concurrency`` threads.
+
+    Returns:
+        tuple: The results and the elapsed seconds.
+    """
+    schedule = _Schedule(requests, duration)
+
+    async def Worker(executor):
+        loop, results, streams = asyncio.get_running_loop(), [], [None]
+        while (request := schedule.Next()) is not None:
+            started = time.perf_counter()
+            try:
+                if isinstance(client, AsyncHttpClient):
+                    status, size = await client.Send(request, streams)
+                else:
+                    status, size = await loop.run_in_executor(executor, client.Send, request)
+                results.append((request["name"], status, time.perf_counter() - started, size, None))
+            except Exception as e:
+                results.append((request["name"], 0, time.perf_counter() - started, 0, f"{type(e).__name__}: {e}"))
+        if streams[0] is not None:
+            streams[0][1].close()
+        return results
+
+    async def Main():
+        with ThreadPoolExecutor(concurrency) as executor:
+            batches = await asyncio.gather(*(Worker(executor) for _ in range(concurrency)))
+            if not isinstance(client, AsyncHttpClient):
+                for _ in range(concurrency):    # Close the connections the pool threads opened
+                    executor.submit(connections.close_all)
+        return [result for batch in batches for result in batch]
+
+    started = time.perf_counter()
+    results = asyncio.run(Main())
+    return results, time.perf_counter() - started
+
+
+def Percentile(ordered, percent):
+    # Nearest-rank percentile of an already sorted list
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)] if ordered else None
+
+
+def _Rounded(value):
+    return round(value, 2) if value is not None else None
+
+
+def _Summary(results, elapsed):
+    latencies = sorted(seconds * 1000 for _, _, seconds, _, _ in results)
+    mean = sum(latencies) / len(latencies) if latencies else None
+    errors = sum(1 for _, status, _, _, _ in results if status == 0 or status >= 400)
+    statuses = {}
+    for _, status, _, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "errors": errors,
+        "error_rate": round(errors / len(results), 4) if results else 0,
+        "throughput_rps": round(len(results) / elapsed, 1) if elapsed else 0,
+        "latency_ms": {
+            **{f"p{percent}": _Rounded(Percentile(latencies, percent)) for percent in (50, 95, 99)},
+            "mean": _Rounded(mean), "max": _Rounded(latencies[-1] if latencies else None),
+        },
+        "bytes": sum(size for _, _, _, size, _ in results),
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def Summarise(results, elapsed, **details):
+    """
+    Builds the JSON report of a run: totals, then the same figures for each request name.
+
+    Requests that raised, status 0, and responses with a 4xx or 5xx status count as errors.
+    Latencies are in milliseconds, throughput in requests per second of the whole run.
+
+    Args:
+        results (list): Results returned by RunThreads or RunAsyncio.
+        elapsed (float): Seconds the run took.
+        **details: Description of the run (target, mode, concurrency, ...), copied into the report.
+
+    Returns:
+        dict: The report.
+    """
+    byName = {}
+    for result in results:
+        byName.setdefault(result[0], []).append(result)
+    endpoints = {name: _Summary(group, elapsed) for name, group in sorted(byName.items())}
+    samples = list(dict.fromkeys(error for *_, error in results if error))[:5]
+    return {**details, "duration_seconds": round(elapsed, 3), **_Summary(results, elapsed), "endpoints": endpoints, "error_samples": samples}
+
+
+def _Change(current, previous):
+    # Relative change in percent, None when there is nothing to compare
+    if current is None or not previous:
+        return None
+    return round((current - previous) / previous * 100, 1)
+
+
+def CompareReports(report, baseline):
+    """
+    Relative changes between a report and the report of an earlier build, in percent.
+
+    Returns:
+        dict: Throughput, error rate and latency percentile changes, overall and for each request name
+        present in both reports. Negative latency changes and positive throughput changes are improvements.
+    """
+    def Compare(current, previous):
+        return {
+            "throughput_rps": _Change(current["throughput_rps"], previous["throughput_rps"]),
+            "error_rate": round(current["error_rate"] - previous["error_rate"], 4),
+            **{key: _Change(current["latency_ms"][key], previous["latency_ms"][key]) for key in ("p50", "p95", "p99")},
+        }
+
+    return {
+        "label": baseline.get("label"),
+        "overall": Compare(report, baseline),
+        "endpoints": {
+            name: Compare(figures, baseline["endpoints"][name])
+            for name, figures in report["endpoints"].items() if name in baseline.get("endpoints", {})
+        },
+    }
@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from Operations.backup import BackupDatabase, DumpDatabase, PruneBackups, SqliteDatabases
+
+
+class Command(BaseCommand):
+    help = (
+        "Takes an online backup of the SQLite databases while the site keeps running, "
+        "optionally with compressed NDJSON dumps of every table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", action="append", dest="databases",
+            help="Database alias to back up, can be repeated. Defaults to every SQLite database.",
+        )
+        parser.add_argument("--output", help="Directory the backup folder is created in, defaults to BACKUP_DIR.")
+        parser.add_argument("--dump", action="store_true", help="Also write NDJSON dumps of every table.")
+        parser.add_argument("--pages", type=int, help="Pages copied per step, defaults to BACKUP_PAGES_PER_STEP.")
+        parser.add_argument("--pause", type=float, help="Seconds between steps, defaults to BACKUP_STEP_PAUSE.")
+        parser.add_argument("--keep", type=int, help="Backup folders to keep, defaults to BACKUP_KEEP. 0 keeps all.")
+
+    def handle(self, *args, **options):
+        available = SqliteDatabases()
+        databases = options["databases"] or available
+        unknown = set(databases) - set(available)
+        if unknown:
+            raise CommandError(f"Not file-based SQLite databases: {', '.join(sorted(unknown))}")
+
+        output = settings.BACKUP_DIR if options["output"] is None else options["output"]
+        folder = timezone.now().strftime("%Y%m%dT%H%M%SZ")
+        for alias in databases:
+            started = time.perf_counter()
+            snapshot = BackupDatabase(
+                alias,
+                f"{output}/{folder}/{alias}.sqlite3",
+                pages=options["pages"] or settings.BACKUP_PAGES_PER_STEP,
+                pause=settings.BACKUP_STEP_PAUSE if options["pause"] is None else options["pause"],
+                max_restarts=settings.BACKUP_MAX_RESTARTS,
+            )
+            self.stdout.write(f"Backed up {alias} to {snapshot} in {time.perf_counter() - started:.2f}s.")
+
+            if options["dump"]:
+                started = time.perf_counter()
+                manifest = DumpDatabase(snapshot, f"{output}/{folder}/{alias}", alias=alias)
+                self.stdout.write(
+                    f"  dumped {sum(manifest['tables'].values())} rows of {len(manifest['tables'])} tables "
+                    f"in {time.perf_counter() - started:.2f}s."
+                )
+
+        keep = settings.BACKUP_KEEP if options["keep"] is None else options["keep"]
+        for removed in PruneBackups(output, keep):
+            self.stdout.write(f"Removed old backup {removed}.")
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from app.concurrency import ConcurrentUpdateError
+from HR.models import Staff
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent read-modify-write edits against one Staff row, first with full save() and then "
+        "with version-checked partial updates, and reports lost updates and bytes written."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=4, help="Number of concurrent editors.")
+        parser.add_argument("--edits", type=int, default=50, help="Successful edits per editor.")
+
+    def LegacyEdit(self, staff_id):
+        # The previous edit path: every column is rewritten, so a stale read overwrites other edits
+        staff = Staff.objects.get(StaffId=staff_id)
+        staff.Salary = staff.Salary + 1
+        staff.full_clean()
+        staff.save()
+
+    def VersionedEdit(self, staff_id):
+        # The new edit path, retried from a fresh read when another editor got there first
+        while True:
+            staff = Staff.objects.get(StaffId=staff_id)
+            try:
+                staff.EditStaffData(Salary=staff.Salary + 1)
+                return
+            except ConcurrentUpdateError:
+                self.conflicts += 1
+
+    def Run(self, edit, staff_id, threads, edits):
+        # Runs the editors and returns (final salary, bytes of UPDATE statements sent, seconds)
+        written = [0]
+        lock = threading.Lock()
+
+        def CountBytes(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith("UPDATE"):
+                with lock:
+                    written[0] += len(sql) + sum(len(str(p)) for p in params or ())
+            return execute(sql, params, many, context)
+
+        def Editor():
+            with connection.execute_wrapper(CountBytes):
+                for _ in range(edits):
+                    edit(staff_id)
+            connection.close()
+
+        workers = [threading.Thread(target=Editor) for _ in range(threads)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+
+        return Staff.objects.get(StaffId=staff_id).Salary, written[0], elapsed
+
+    def handle(self, *args, **options):
+        if connections["default"].vendor == "sqlite" and ":memory:" in str(connections["default"].settings_dict["NAME"]):
+            self.stderr.write("The benchmark needs a file database so threads share the same data.")
+            return
+
+        threads, edits = options["threads"], options["edits"]
+        expected = threads * edits
+        staff = Staff.objects.create(StaffName="Contention Benchmark", Role="Benchmark", Salary=0)
+
+        try:
+            for name, edit in (("save()", self.LegacyEdit), ("versioned update", self.VersionedEdit)):
+                Staff.objects.filter(StaffId=staff.StaffId).update(Salary=0, Version=0)
+                self.conflicts = 0
+                salary, written, elapsed = self.Run(edit, staff.StaffId, threads, edits)
+                self.stdout.write(
+                    f"{name}: {salary}/{expected} increments kept, {expected - salary} lost, "
+                    f"{self.conflicts} conflicts retried, {written} bytes of UPDATE, {elapsed:.2f}s"
+                )
+        finally:
+            staff.delete()
@@ -0,0 +1,110 @@
+import multiprocessing
+import random
+import shutil
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+
+from Inventory.models import Store
+from Sales.models import Sales
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures sales write throughput with concurrent writers as the number of store shards grows. "
+        "Shards are created as temporary SQLite files, the configured databases are only read for store ids."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shards", default="1,2,4,8", help="Comma-separated shard counts to try.")
+        parser.add_argument("--writers", type=int, default=8, help="Concurrent writers.")
+        parser.add_argument("--sales", type=int, default=250, help="Sales recorded by each writer.")
+        parser.add_argument(
+            "--threads", action="store_true",
+            help="Run writers as threads of this process instead of separate processes (like WSGI workers).",
+        )
+
+    def CreateShards(self, directory, count):
+        # Registers `count` temporary SQLite shard aliases and creates their tables
+        Path(directory).mkdir()
+        aliases = []
+        for index in range(count):
+            alias = f"benchmark{count}_shard{index}"
+            connections.settings[alias] = connections.configure_settings({
+                "default": connections.settings["default"],     # Required by configure_settings, left as is
+                alias: {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": str(Path(directory) / f"{alias}.sqlite3"),
+                    "OPTIONS": {"init_command": "PRAGMA foreign_keys = OFF", "transaction_mode": "IMMEDIATE"},
+                }
+            })[alias]
+            aliases.append(alias)
+        with override_settings(SALES_SHARDS=aliases):
+            for alias in aliases:
+                call_command("migrate", database=alias, verbosity=0)
+                connections[alias].close()
+        return aliases
+
+    def DropShards(self, aliases):
+        for alias in aliases:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    def Write(self, storeIds, count):
+        # One writer: records sales one transaction at a time, like tills do
+        for _ in range(count):
+            Sales.objects.create(
+                StoreId_id=random.choice(storeIds),
+                PaymentMethod="Card",
+                TotalAmount=Decimal(random.randint(100, 10000)) / 100,
+            )
+        connections.close_all()
+
+    def handle(self, *args, **options):
+        storeIds = list(Store.objects.values_list("StoreId", flat=True)) or list(range(1, 51))
+        writers, perWriter = options["writers"], options["sales"]
+        directory = tempfile.mkdtemp(prefix="shard-benchmark-")
+
+        try:
+            for count in (int(value) for value in options["shards"].split(",")):
+                aliases = self.CreateShards(Path(directory) / str(count), count)
+                try:
+                    with override_settings(SALES_SHARDS=aliases):
+                        connections.close_all()     # Forked writers must open their own connections
+                        if options["threads"]:
+                            workers = [
+                                threading.Thread(target=self.Write, args=(storeIds, perWriter)) for _ in range(writers)
+                            ]
+                        else:
+                            workers = [
+                                multiprocessing.get_context("fork").Process(target=self.Write, args=(storeIds, perWriter))
+                                for _ in range(writers)
+                            ]
+                        started = time.perf_counter()
+                        for worker in workers:
+                            worker.start()
+                        for worker in workers:
+                            worker.join()
+                        elapsed = time.perf_counter() - started
+
+                        started = time.perf_counter()
+                        total = Sales().CalculateTotalSales()   # Fans out over the shards just written
+                        readTime = time.perf_counter() - started
+                        written = sum(Sales.objects.using(alias).count() for alias in aliases)
+                finally:
+                    self.DropShards(aliases)
+
+                self.stdout.write(
+                    f"{count} shard(s): {written} sales in {elapsed:.2f}s = {written / elapsed:8.0f} writes/s, "
+                    f"fan-out total {total} in {readTime * 1000:.1f} ms"
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
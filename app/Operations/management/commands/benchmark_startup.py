@@ -0,0 +1,78 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+DEFAULT_URLS = [
+    "/admin/login/",
+    "/Sales/performance/?start_date=2024-01-01&end_date=2024-01-07",
+    "/Sales/graph/?start_date=2024-01-01&end_date=2024-01-07",
+    "/Inventory/search/?q=pro",
+    "/Inventory/nearest-stores/?productId=1&lat=51.5&lon=-0.1",
+]
+
+# Runs in a fresh interpreter so every measurement starts from a cold process
+CHILD = """
+import json, sys, time
+config = json.loads(sys.argv[1])
+
+started = time.perf_counter()
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+result = {"Setup": time.perf_counter() - started}
+
+if config["warm"]:
+    from app.warmup import Warmup, WarmupWorker
+    started = time.perf_counter()
+    result["Warmup"] = sum(Warmup().values())
+    WarmupWorker(application, urls=[])
+    result["WarmupTotal"] = time.perf_counter() - started
+
+from app.warmup import _Request
+for key in ("First", "Second"):
+    result[key] = {}
+    for url in config["urls"]:
+        started = time.perf_counter()
+        _Request(application, url)
+        result[key][url] = time.perf_counter() - started
+
+print(json.dumps(result))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures worker start-up in fresh processes: Django setup time and the latency of the first "
+        "and second request to each URL, with and without the app.warmup stage."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", action="append", dest="urls", help="Path to request, may be repeated.")
+        parser.add_argument("--runs", type=int, default=5, help="Cold processes started per mode.")
+
+    def RunChild(self, urls, warm):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+        env.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+        output = subprocess.run(
+            [sys.executable, "-c", CHILD, json.dumps({"urls": urls, "warm": warm})],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        urls = options["urls"] or DEFAULT_URLS
+        for warm in (False, True):
+            runs = [self.RunChild(urls, warm) for _ in range(options["runs"])]
+            median = lambda values: statistics.median(values) * 1000  # noqa: E731
+
+            self.stdout.write(f"{'With' if warm else 'Without'} warm-up (median of {len(runs)} processes):")
+            self.stdout.write(f"  django setup      {median([r['Setup'] for r in runs]):8.1f} ms")
+            if warm:
+                self.stdout.write(f"  warm-up           {median([r['WarmupTotal'] for r in runs]):8.1f} ms")
+            for url in urls:
+                first, second = median([r["First"][url] for r in runs]), median([r["Second"][url] for r in runs])
+                self.stdout.write(f"  {url}\n      first {first:8.1f} ms   second {second:8.1f} ms")
@@ -0,0 +1,89 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Operations.loadtest import (
+    MODES, AsyncHttpClient, CompareReports, GenerateRequests, HttpClient, LoadRequests, ParseMix, RunAsyncio,
+    RunThreads, SaveRequests, StartServer, Summarise, WsgiClient,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a mix of restock, store-performance and sales requests against the WSGI application at a "
+        "fixed concurrency, and reports throughput, latency percentiles and error rates as JSON. "
+        "Restocks and sales write to the database, run it against a copy."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=1000, help="Requests to generate.")
+        parser.add_argument("--mix", help="Weights of the generated requests, e.g. record-sale=6,store-performance=3,restock=1.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the generated mix.")
+        parser.add_argument("--replay", help="NDJSON file of requests to replay instead of generating them.")
+        parser.add_argument("--record", help="Save the requests to this NDJSON file, to replay them on another build.")
+        parser.add_argument("--mode", choices=MODES, default="threads", help="Concurrency model of the clients.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight at once.")
+        parser.add_argument("--duration", type=float, help="Replay the requests in a loop for this many seconds.")
+        parser.add_argument("--warmup", type=int, default=20, help="Requests sent first and left out of the report.")
+        parser.add_argument("--url", help="Base URL of a running server, e.g. http://127.0.0.1:8000.")
+        parser.add_argument(
+            "--serve", action="store_true",
+            help="Start a threaded server for the application in this process and send requests over HTTP.",
+        )
+        parser.add_argument("--host", default="localhost", help="Host header of in-process requests.")
+        parser.add_argument("--label", help="Name of the build, copied into the report.")
+        parser.add_argument("--output", help="Write the report to this file as well as to standard output.")
+        parser.add_argument("--baseline", help="Report of an earlier run to compare with.")
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1:
+            raise CommandError("--concurrency must be at least 1.")
+        if options["url"] and options["serve"]:
+            raise CommandError("Use either --url or --serve.")
+
+        try:
+            if options["replay"]:
+                requests = LoadRequests(options["replay"])
+            else:
+                mix = ParseMix(options["mix"]) if options["mix"] else None
+                requests = GenerateRequests(options["requests"], mix=mix, seed=options["seed"])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not requests:
+            raise CommandError("There are no requests to send.")
+        if options["record"]:
+            SaveRequests(requests, options["record"])
+
+        server, url = None, options["url"]
+        if not url:
+            from app.wsgi import application
+
+            if options["serve"]:
+                server, url = StartServer(application)
+        try:
+            if url:
+                client = (AsyncHttpClient if options["mode"] == "asyncio" else HttpClient)(url)
+            else:
+                client = WsgiClient(application, host=options["host"])
+            run = RunAsyncio if options["mode"] == "asyncio" else RunThreads
+
+            if options["warmup"]:
+                run(client, requests[:options["warmup"]], min(options["concurrency"], options["warmup"]))
+            results, elapsed = run(client, requests, options["concurrency"], duration=options["duration"])
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        report = Summarise(
+            results, elapsed, label=options["label"], target=url or "wsgi", mode=options["mode"],
+            concurrency=options["concurrency"],
+        )
+        if options["baseline"]:
+            report["baseline"] = CompareReports(report, json.loads(Path(options["baseline"]).read_text()))
+
+        text = json.dumps(report, indent=2)
+        if options["output"]:
+            Path(options["output"]).write_text(text + "\n")
+        self.stdout.write(text)
@@ -0,0 +1,52 @@
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from Operations.backup import MANIFEST, RestoreDump, RestoreSnapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Restores a database from a backup_database snapshot file, or from an NDJSON dump folder into "
+        "a database migrated to the same version. Stop the web workers and the scheduler first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Snapshot file (<alias>.sqlite3) or dump folder (<alias>/) of a backup.")
+        parser.add_argument("--database", help="Database alias to restore into, defaults to the one backed up.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Rows inserted per batch when loading a dump.")
+        parser.add_argument("--noinput", "--no-input", action="store_false", dest="interactive", help="Don't ask for confirmation.")
+
+    def handle(self, *args, **options):
+        source = Path(options["source"])
+        dump = source.is_dir()
+        if dump and not (source / MANIFEST).exists():
+            raise CommandError(f"{source} has no {MANIFEST}, is it a dump folder?")
+        if not dump and not source.is_file():
+            raise CommandError(f"{source} does not exist.")
+        alias = options["database"] or (None if dump else source.stem)
+
+        if options["interactive"]:
+            target = alias or "the database the dump was taken from"
+            answer = input(f"This replaces the data of {target} with {source}. Type 'yes' to continue: ")
+            if answer != "yes":
+                raise CommandError("Restore cancelled.")
+
+        started = time.perf_counter()
+        if not dump:
+            RestoreSnapshot(source, alias)
+            self.stdout.write(f"Restored {alias} from {source} in {time.perf_counter() - started:.2f}s.")
+            return
+
+        try:
+            restored = RestoreDump(
+                source, alias, batch_size=options["batch_size"],
+                progress=lambda table, count: self.stdout.write(f"  {table}: {count} rows"),
+            )
+        except (ValueError, IntegrityError) as e:   # Nothing was changed, the restore runs in one transaction
+            raise CommandError(str(e))
+        self.stdout.write(
+            f"Restored {sum(restored.values())} rows of {len(restored)} tables in {time.perf_counter() - started:.2f}s."
+        )
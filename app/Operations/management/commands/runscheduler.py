@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from Operations.scheduler import GetRegisteredJobs, Scheduler
+
+
+class Command(BaseCommand):
+    help = "Runs the periodic job scheduler in the foreground."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run the due jobs once and exit.")
+        parser.add_argument("--poll", type=float, help="Seconds between checks for due jobs.")
+
+    def handle(self, *args, **options):
+        scheduler = Scheduler()
+        self.stdout.write(f"Scheduler {scheduler.owner} managing: {', '.join(GetRegisteredJobs())}")
+
+        if options["once"]:
+            ran = scheduler.RunPending()
+            self.stdout.write(f"Ran: {', '.join(ran) or 'nothing due'}")
+            return
+
+        try:
+            scheduler.RunForever(pollSeconds=options["poll"])
+        except KeyboardInterrupt:
+            self.stdout.write("Scheduler stopped.")
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:40
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledJob',
+            fields=[
+                ('ScheduledJobId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('Name', models.CharField(max_length=200, unique=True)),
+                ('Interval', models.IntegerField()),
+                ('Jitter', models.IntegerField(default=0)),
+                ('MaxBackoff', models.IntegerField(default=3600)),
+                ('Enabled', models.BooleanField(default=True)),
+                ('NextRunAt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('LeaseOwner', models.CharField(blank=True, default='', max_length=200)),
+                ('LeaseExpiresAt', models.DateTimeField(blank=True, null=True)),
+                ('LastRunAt', models.DateTimeField(blank=True, null=True)),
+                ('LastSuccessAt', models.DateTimeField(blank=True, null=True)),
+                ('LastError', models.TextField(blank=True, default='')),
+                ('ConsecutiveFailures', models.IntegerField(default=0)),
+                ('RunCount', models.IntegerField(default=0)),
+                ('FailureCount', models.IntegerField(default=0)),
+                ('LastDuration', models.FloatField(blank=True, null=True)),
+                ('TotalDuration', models.FloatField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:50
+
+from django.db import migrations, models
+
+
+def CreateOutboxTriggers(apps, schema_editor):
+    # The outbox triggers are SQLite specific, other backends need their own triggers
+    if schema_editor.connection.vendor == "sqlite":
+        from Operations.outbox import CreateOutboxTriggers
+        with schema_editor.connection.cursor() as cursor:
+            CreateOutboxTriggers(cursor)
+
+
+def DropOutboxTriggers(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        from Operations.outbox import DropOutboxTriggers
+        with schema_editor.connection.cursor() as cursor:
+            DropOutboxTriggers(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Operations', '0001_initial'),
+        ('Inventory', '0006_store_version'),
+        ('Procurement', '0004_supplier_purchaseorder_version'),
+        ('Sales', '0004_sales_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('OutboxEventId', models.BigAutoField(primary_key=True, serialize=False, unique=True)),
+                ('Topic', models.CharField(max_length=50)),
+                ('Action', models.CharField(max_length=10)),
+                ('ObjectId', models.BigIntegerField()),
+                ('Payload', models.JSONField()),
+                ('CreatedAt', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        # Runs wherever the outbox table is created, sales shards included (see app.routers.ShardRouter)
+        migrations.RunPython(CreateOutboxTriggers, DropOutboxTriggers, hints={"model_name": "outboxevent"}),
+    ]
@@ -0,0 +1,65 @@
+from django.db import models
+from django.utils import timezone
+
+
+class ScheduledJob(models.Model):
+    # A periodic job, with its schedule, lease and run-time metrics persisted so every worker shares them
+
+    ScheduledJobId = models.AutoField(primary_key=True, unique=True)    # Unique identifier for the job
+    Name = models.CharField(max_length=200, unique=True)                # Name the job is registered under in code
+
+    Interval = models.IntegerField()                                    # Seconds between successful runs
+    Jitter = models.IntegerField(default=0)                             # Up to this many seconds are added to each interval
+    MaxBackoff = models.IntegerField(default=3600)                      # Upper bound in seconds on the delay after failures
+    Enabled = models.BooleanField(default=True)                         # Disabled jobs are never picked up
+
+    NextRunAt = models.DateTimeField(default=timezone.now, db_index=True)   # When the job is next due
+    LeaseOwner = models.CharField(max_length=200, blank=True, default="")  # Worker currently running the job
+    LeaseExpiresAt = models.DateTimeField(null=True, blank=True)        # Lease end, after which another worker may take over
+
+    LastRunAt = models.DateTimeField(null=True, blank=True)             # Start of the most recent run
+    LastSuccessAt = models.DateTimeField(null=True, blank=True)         # End of the most recent successful run
+    LastError = models.TextField(blank=True, default="")                # Error from the most recent failed run
+    ConsecutiveFailures = models.IntegerField(default=0)                # Failures since the last success, drives the back-off
+
+    RunCount = models.IntegerField(default=0)                           # Total number of runs
+    FailureCount = models.IntegerField(default=0)                       # Total number of failed runs
+    LastDuration = models.FloatField(null=True, blank=True)             # Seconds taken by the most recent run
+    TotalDuration = models.FloatField(default=0)                        # Seconds taken by all runs, for the average
+
+    def __str__(self):  # Returns the job name with its interval and next due time
+        return f"{self.Name} - Every {self.Interval}s - Next: {self.NextRunAt:%Y-%m-%d %H:%M:%S}"
+
+    def GetMetrics(self):
+        # Returns the job's run-time metrics as a dictionary
+        return {
+            "Name": self.Name,
+            "RunCount": self.RunCount,
+            "FailureCount": self.FailureCount,
+            "ConsecutiveFailures": self.ConsecutiveFailures,
+            "LastDuration": self.LastDuration,
+            "AverageDuration": self.TotalDuration / self.RunCount if self.RunCount else None,
+            "LastRunAt": self.LastRunAt,
+            "LastSuccessAt": self.LastSuccessAt,
+            "NextRunAt": self.NextRunAt,
+            "LastError": self.LastError,
+        }
+
+
+class OutboxEvent(models.Model):
+    """
+    A change to a sale, stock level or purchase order, published to the change feed.
+
+    Rows are only ever written by the database triggers from Operations.outbox, in the same
+    transaction as the change itself. Each sales shard has its own outbox next to its rows.
+    """
+
+    OutboxEventId = models.BigAutoField(primary_key=True, unique=True)  # Position of the event in this database's feed
+    Topic = models.CharField(max_length=50)                             # "sales", "stock" or "purchase_order"
+    Action = models.CharField(max_length=10)                            # "insert", "update" or "delete"
+    ObjectId = models.BigIntegerField()                                 # Primary key of the changed row
+    Payload = models.JSONField()                                        # The changed row's key columns after the change
+    CreatedAt = models.DateTimeField(db_index=True)                     # When the change was made, used by the retention job
+
+    def __str__(self):  # Returns the event's topic, action and object
+        return f"{self.OutboxEventId} - {self.Topic} {self.Action} {self.ObjectId}"
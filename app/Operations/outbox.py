@@ -0,0 +1,205 @@
+import heapq
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+OUTBOX_TABLE = "Operations_outboxevent"
+
+# Topic -> (table, key column, actions published, payload as (name, column) pairs). Deleted sales are
+# not published: sales are only ever deleted by archive_sales, which moves them rather than removing them.
+OUTBOX_TOPICS = {
+    "sales": (
+        "Sales_sales", "SalesId", ("insert", "update"),
+        (("StoreId", "StoreId_id"), ("ProductId", "ProductId_id"), ("StaffId", "StaffId_id"),
+         ("PaymentMethod", "PaymentMethod"), ("TotalAmount", "TotalAmount"), ("SaleTimestamp", "SaleTimestamp")),
+    ),
+    "stock": (
+        "Inventory_productlocation", "ProductLocationId", ("insert", "update", "delete"),
+        (("ProductId", "ProductId_id"), ("StoreId", "StoreId_id"), ("Quantity", "Quantity")),
+    ),
+    "purchase_order": (
+        "Procurement_purchaseorder", "PurchaseOrderId", ("insert", "update", "delete"),
+        (("ProductId", "ProductId_id"), ("StoreId", "StoreId_id"), ("OrderStatus", "OrderStatus"),
+         ("Quantity", "Quantity"), ("FullCost", "FullCost"), ("DeliveryDate", "DeliveryDate")),
+    ),
+}
+
+
+class CursorExpired(Exception):
+    # The consumer's cursor points at events the retention job has already removed
+    pass
+
+
+def _TriggerName(topic, action):
+    return f"{OUTBOX_TABLE}_{topic}_{action}"
+
+
+def CreateOutboxTriggers(cursor):
+    """
+    Creates the SQLite triggers that write an OutboxEvent for every change to the tracked tables.
+
+    A trigger runs inside the statement that changed the row, so the event commits or rolls back
+    together with the change, including bulk ORM updates that bypass save() and signals. Only
+    tables present in this database get triggers: a shard holds sales and stock but no purchase orders.
+    Updates only publish an event when one of the payload columns changes.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in cursor.fetchall()}
+
+    for topic, (table, key, actions, payload) in OUTBOX_TOPICS.items():
+        if table not in tables:
+            continue
+        for action in actions:
+            row = "old" if action == "delete" else "new"
+            body = ", ".join(f"'{name}', {row}.{column}" for name, column in payload)
+            event = (
+                f"INSERT INTO {OUTBOX_TABLE} (Topic, Action, ObjectId, Payload, CreatedAt) "
+                f"VALUES ('{topic}', '{action}', {row}.{key}, json_object({body}), "
+                "strftime('%Y-%m-%d %H:%M:%f', 'now'))"
+            )
+            if action == "update":
+                columns = ", ".join(column for _, column in payload)
+                changed = " OR ".join(f"old.{column} IS NOT new.{column}" for _, column in payload)
+                timing = f"AFTER UPDATE OF {columns} ON {table} WHEN {changed}"
+            else:
+                timing = f"AFTER {action.upper()} ON {table}"
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {_TriggerName(topic, action)} {timing} BEGIN {event}; END")
+
+
+def DropOutboxTriggers(cursor):
+    # Removes the triggers created by CreateOutboxTriggers
+    for topic, (_, _, actions, _) in OUTBOX_TOPICS.items():
+        for action in actions:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {_TriggerName(topic, action)}")
+
+
+def OutboxDatabases():
+    # Databases with an outbox: the default one, which has purchase orders, and every sales shard
+    return list(dict.fromkeys(["default", *settings.SALES_SHARDS]))
+
+
+def ParseCursor(value):
+    """
+    Parses a change-feed cursor such as "default:120,shard0:55" into positions per database.
+
+    Databases missing from the cursor start from the beginning.
+
+    Raises:
+        ValueError: If the cursor is malformed or names an unknown database.
+    """
+    positions = dict.fromkeys(OutboxDatabases(), 0)
+    for part in filter(None, (value or "").split(",")):
+        alias, _, position = part.partition(":")
+        if alias not in positions or not position.isdigit():
+            raise ValueError(f"Invalid cursor: {value}")
+        positions[alias] = int(position)
+    return positions
+
+
+def FormatCursor(positions):
+    return ",".join(f"{alias}:{position}" for alias, position in positions.items())
+
+
+def _ReadDatabase(alias, position, topics, limit):
+    # Reads up to limit events after position from one database, raising CursorExpired when some were pruned
+    from Operations.models import OutboxEvent
+
+    events = OutboxEvent.objects.using(alias)
+    if position:
+        oldest = events.order_by("OutboxEventId").values_list("OutboxEventId", flat=True).first()
+        if oldest is not None and oldest > position + 1:    # Ids are gapless, rolled back inserts release theirs
+            raise CursorExpired(f"Events after {alias}:{position} were removed by the retention job")
+    events = events.filter(OutboxEventId__gt=position)
+    if topics:
+        events = events.filter(Topic__in=topics)
+    return [
+        (alias, row)
+        for row in events.order_by("OutboxEventId").values(
+            "OutboxEventId", "Topic", "Action", "ObjectId", "Payload", "CreatedAt"
+        )[:limit]
+    ]
+
+
+def ReadChanges(cursor=None, topics=None, limit=500, wait=0):
+    """
+    Reads the next batch of change events after a cursor, waiting for new ones if there are none.
+
+    SQLite lets one transaction write at a time, so events are numbered in commit order and a
+    cursor never skips an event committed after a later-numbered one. Events of different
+    databases are interleaved by time, and each database's events stay in order.
+
+    Args:
+        cursor (str, optional): Cursor returned by the previous call, None to start from the oldest event.
+        topics (list, optional): Topics to return ("sales", "stock", "purchase_order"), all by default.
+        limit (int): Most events returned.
+        wait (float): Seconds to long-poll for new events when there are none yet.
+
+    Returns:
+        dict: "events", the "cursor" to resume from and whether "more" events are already waiting.
+
+    Raises:
+        ValueError: If the cursor or a topic is invalid.
+        CursorExpired: If events after the cursor were already removed.
+    """
+    unknown = set(topics or ()) - set(OUTBOX_TOPICS)
+    if unknown:
+        raise ValueError(f"Unknown topics: {', '.join(sorted(unknown))}")
+    positions = ParseCursor(cursor)
+    deadline = time.monotonic() + wait
+
+    while True:
+        batches = [_ReadDatabase(alias, position, topics, limit + 1) for alias, position in positions.items()]
+        merged = list(heapq.merge(*batches, key=lambda item: item[1]["CreatedAt"]))
+        if merged or time.monotonic() >= deadline:
+            break
+        time.sleep(min(settings.CHANGE_FEED_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+
+    events = merged[:limit]
+    for alias, row in events:
+        positions[alias] = row["OutboxEventId"]
+    return {
+        "events": [
+            {
+                "Id": f"{alias}:{row['OutboxEventId']}",
+                "Topic": row["Topic"],
+                "Action": row["Action"],
+                "ObjectId": row["ObjectId"],
+                "Payload": row["Payload"],
+                "CreatedAt": row["CreatedAt"],
+            }
+            for alias, row in events
+        ],
+        "cursor": FormatCursor(positions),
+        "more": len(merged) > limit,
+    }
+
+
+def PruneOutbox(days=None, batch_size=5000):
+    """
+    Deletes outbox events older than the retention period from every outbox database.
+
+    Consumers that fall further behind than the retention period get CursorExpired and have to
+    resynchronise from the tables themselves.
+
+    Args:
+        days (int, optional): Events older than this many days are removed, defaults to OUTBOX_RETENTION_DAYS.
+        batch_size (int): Events removed per statement, keeps each write transaction short.
+
+    Returns:
+        int: Number of events removed.
+    """
+    from Operations.models import OutboxEvent
+
+    days = settings.OUTBOX_RETENTION_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    removed = 0
+    for alias in OutboxDatabases():
+        expired = OutboxEvent.objects.using(alias).filter(CreatedAt__lt=cutoff)
+        while True:     # Events are numbered in time order, so removing the oldest ids first keeps ids gapless
+            ids = list(expired.order_by("OutboxEventId").values_list("OutboxEventId", flat=True)[:batch_size])
+            if not ids:
+                break
+            removed += OutboxEvent.objects.using(alias).filter(OutboxEventId__lte=ids[-1]).delete()[0]
+    return removed
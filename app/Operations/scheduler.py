@@ -0,0 +1,217 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from Operations.models import ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+# Job name -> (callable, default interval, default jitter, default max back-off), filled by RegisterJob
+_JOBS = {}
+
+
+def RegisterJob(name, interval, jitter=0, maxBackoff=3600):
+    """
+    Decorator that registers a function as a periodic job.
+
+    The interval, jitter and back-off are only defaults used when the job's row is first created,
+    after that the values stored in ScheduledJob win so they can be tuned without a deploy.
+
+    Args:
+        name (str): Unique job name.
+        interval (int): Seconds between successful runs.
+        jitter (int): Up to this many random seconds are added to each interval.
+        maxBackoff (int): Upper bound in seconds on the delay between retries after failures.
+    """
+    def Decorator(function):
+        _JOBS[name] = (function, interval, jitter, maxBackoff)
+        return function
+
+    return Decorator
+
+
+def GetRegisteredJobs():
+    # Returns the registered job names
+    return sorted(_JOBS)
+
+
+class Scheduler:
+    """
+    Runs registered jobs when they are due, using a lease in the ScheduledJob table so that a job
+    only runs in one worker at a time across all processes and hosts.
+    """
+
+    def __init__(self, owner=None, leaseSeconds=None):
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.leaseSeconds = leaseSeconds or settings.SCHEDULER_LEASE_SECONDS
+
+    def SyncJobs(self):
+        # Creates a row for every registered job that doesn't have one yet
+        existing = set(ScheduledJob.objects.filter(Name__in=_JOBS).values_list("Name", flat=True))
+        ScheduledJob.objects.bulk_create(
+            [
+                ScheduledJob(Name=name, Interval=interval, Jitter=jitter, MaxBackoff=maxBackoff)
+                for name, (_, interval, jitter, maxBackoff) in _JOBS.items()
+                if name not in existing
+            ],
+            ignore_conflicts=True,  # Another worker may be creating the same rows
+        )
+
+    def AcquireLease(self, name):
+        """
+        Tries to take the lease on a due job with a single conditional UPDATE.
+
+        Returns:
+            bool: True if this worker now owns the job.
+        """
+        now = timezone.now()
+        return bool(
+            ScheduledJob.objects.filter(Name=name, Enabled=True, NextRunAt__lte=now)
+            .filter(Q(LeaseExpiresAt__isnull=True) | Q(LeaseExpiresAt__lt=now))
+            .update(LeaseOwner=self.owner, LeaseExpiresAt=now + timedelta(seconds=self.leaseSeconds))
+        )
+
+    def RenewLease(self, name):
+        """
+        Extends the lease on a job this worker is running by another lease period.
+
+        Returns:
+            bool: False if the lease was lost, another worker took the job over.
+        """
+        return bool(
+            ScheduledJob.objects.filter(Name=name, LeaseOwner=self.owner)
+            .update(LeaseExpiresAt=timezone.now() + timedelta(seconds=self.leaseSeconds))
+        )
+
+    def _Heartbeat(self, name, stopEvent):
+        # Renews the lease three times per lease period until the job finishes, so a job running
+        # longer than the lease isn't taken over and started again by another worker
+        try:
+            while not stopEvent.wait(self.leaseSeconds / 3):
+                if not self.RenewLease(name):
+                    logger.warning("Scheduled job %s lost its lease to another worker while running", name)
+                    return
+        except Exception:
+            logger.exception("Renewing the lease of scheduled job %s failed", name)
+        finally:
+            connection.close()  # The thread's own connection
+
+    def RunJob(self, name):
+        """
+        Runs a job this worker holds the lease for, then records the outcome and releases the lease.
+        A heartbeat thread keeps renewing the lease while the job runs.
+
+        Returns:
+            bool: True if the job succeeded.
+        """
+        job = ScheduledJob.objects.get(Name=name)
+        function = _JOBS[name][0]
+
+        started_at = timezone.now()
+        started = time.perf_counter()
+        stopHeartbeat = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._Heartbeat, args=(name, stopHeartbeat), name=f"scheduler-heartbeat-{name}", daemon=True
+        )
+        heartbeat.start()
+        try:
+            function()
+            succeeded, error = True, ""
+        except Exception as e:  # A failing job must not take the scheduler down with it
+            logger.exception("Scheduled job %s failed", name)
+            succeeded, error = False, f"{type(e).__name__}: {e}"
+        finally:
+            stopHeartbeat.set()
+            heartbeat.join()
+        duration = time.perf_counter() - started
+
+        finished_at = timezone.now()
+        if succeeded:
+            delay = job.Interval
+            changes = {"ConsecutiveFailures": 0, "LastSuccessAt": finished_at, "LastError": ""}
+        else:   # Exponential back-off from the interval, counting this failure, capped at MaxBackoff
+            delay = min(job.Interval * 2 ** (job.ConsecutiveFailures + 1), max(job.MaxBackoff, job.Interval))
+            changes = {
+                "ConsecutiveFailures": F("ConsecutiveFailures") + 1,
+                "FailureCount": F("FailureCount") + 1,
+                "LastError": error,
+            }
+        delay += random.uniform(0, job.Jitter)  # Spread workers out so they don't all wake at once
+
+        recorded = ScheduledJob.objects.filter(Name=name, LeaseOwner=self.owner).update(
+            NextRunAt=finished_at + timedelta(seconds=delay),
+            LastRunAt=started_at,
+            LastDuration=duration,
+            TotalDuration=F("TotalDuration") + duration,
+            RunCount=F("RunCount") + 1,
+            LeaseOwner="",
+            LeaseExpiresAt=None,
+            **changes,
+        )
+        if not recorded:    # Another worker took the job over, its run records the outcome
+            logger.warning("Scheduled job %s finished after losing its lease, this run isn't recorded", name)
+        return succeeded
+
+    def RunPending(self):
+        """
+        Runs every due job this worker manages to lease.
+
+        Returns:
+            list: Names of the jobs that were run.
+        """
+        self.SyncJobs()
+        due = ScheduledJob.objects.filter(
+            Name__in=_JOBS, Enabled=True, NextRunAt__lte=timezone.now()
+        ).values_list("Name", flat=True)
+
+        ran = []
+        for name in list(due):
+            if self.AcquireLease(name):
+                self.RunJob(name)
+                ran.append(name)
+        return ran
+
+    def RunForever(self, pollSeconds=None, stopEvent=None):
+        # Polls for due jobs until the stop event is set
+        pollSeconds = pollSeconds or settings.SCHEDULER_POLL_SECONDS
+        stopEvent = stopEvent or threading.Event()
+        while not stopEvent.is_set():
+            close_old_connections()  # Long-running loops must not hold on to broken connections
+            try:
+                self.RunPending()
+            except Exception:
+                logger.exception("Scheduler loop failed")
+            stopEvent.wait(pollSeconds + random.uniform(0, pollSeconds / 2))
+
+
+_background = None
+
+
+def StartBackgroundScheduler():
+    """
+    Starts the scheduler in a daemon thread of the current process, at most once.
+
+    Used by the WSGI/ASGI entry points when SCHEDULER_RUN_IN_PROCESS is set, and by gunicorn's
+    post_worker_init when the application is preloaded. The DB lease keeps jobs from running twice
+    even though every worker process starts its own thread. A process forked after the thread was
+    started has no copy of the thread, so it starts its own.
+    """
+    global _background
+    if _background is None or _background[2] != os.getpid():
+        stopEvent = threading.Event()
+        thread = threading.Thread(
+            target=Scheduler().RunForever, kwargs={"stopEvent": stopEvent}, name="scheduler", daemon=True
+        )
+        thread.start()
+        _background = (thread, stopEvent, os.getpid())
+    return _background
@@ -0,0 +1,281 @@
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from app.testutils import MakeProducts, MakeSales, MakeStock, MakeStores, QueryBudgetTestCase
+from Inventory.search import SearchProducts
+from Operations.backup import BackupDatabase, DumpDatabase, RestoreDump
+from Operations.loadtest import CompareReports, GenerateRequests, RunAsyncio, RunThreads, Summarise, WsgiClient
+from Operations.models import OutboxEvent, ScheduledJob
+from Operations.outbox import OUTBOX_TOPICS, _TriggerName
+from Operations.scheduler import _JOBS, RegisterJob, Scheduler
+from Sales.models import Sales, SalesSketch
+from Sales.sketches import UpdateSketches
+
+
+class ChangeFeedQueryBudgetTests(QueryBudgetTestCase):
+
+    def Recorded(self, size):   # Every sale and stock row writes an event through the outbox triggers
+        MakeSales(size, MakeStores(size), MakeProducts(size))
+        return ()
+
+    def testFirstRead(self):
+        self.assertQueryBudget(1, self.Recorded, lambda: self.client.get("/Operations/changes/"))
+
+    def testResume(self):
+        def Call():
+            cursor = self.client.get("/Operations/changes/", {"limit": 1}).json()["cursor"]
+            with self.assertNumQueries(2):  # The oldest event, to detect an expired cursor, and the next batch
+                self.client.get("/Operations/changes/", {"cursor": cursor, "topics": "sales"})
+
+        self.assertQueryBudget(3, self.Recorded, Call)
+
+    def testMigrationsKeepTriggers(self):
+        # Migrations that rebuild a tracked table on SQLite must recreate its triggers
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+            triggers = {row[0] for row in cursor.fetchall()}
+        expected = {_TriggerName(topic, action) for topic, (_, _, actions, _) in OUTBOX_TOPICS.items() for action in actions}
+        self.assertEqual(expected - triggers, set())
+
+
+class SchedulerTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        RegisterJob("test-flaky", interval=60, maxBackoff=1000)(self.Flaky)
+        self.addCleanup(_JOBS.pop, "test-flaky")
+        self.failing = True
+
+    def Flaky(self):
+        self.calls.append(timezone.now())
+        if self.failing:
+            raise RuntimeError("supplier feed down")
+
+    def Run(self, scheduler):
+        # Makes the job due, runs it and returns the seconds until it is next due
+        ScheduledJob.objects.filter(Name="test-flaky").update(NextRunAt=timezone.now())
+        self.assertTrue(scheduler.AcquireLease("test-flaky"))
+        scheduler.RunJob("test-flaky")
+        return (ScheduledJob.objects.get(Name="test-flaky").NextRunAt - timezone.now()).total_seconds()
+
+    def testLeaseContention(self):
+        first, second = Scheduler(owner="first"), Scheduler(owner="second")
+        first.SyncJobs()
+        self.assertTrue(first.AcquireLease("test-flaky"))
+        self.assertFalse(second.AcquireLease("test-flaky"))    # Held by the first worker
+        self.assertTrue(first.RenewLease("test-flaky"))
+
+        ScheduledJob.objects.filter(Name="test-flaky").update(LeaseExpiresAt=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(second.AcquireLease("test-flaky"))     # Expired, taken over
+        self.assertFalse(first.RenewLease("test-flaky"))
+        with self.assertLogs("Operations.scheduler", "WARNING"):    # The first run's outcome is dropped, not the second's lease
+            first.RunJob("test-flaky")
+        self.assertEqual(ScheduledJob.objects.get(Name="test-flaky").LeaseOwner, "second")
+
+    def testBackoff(self):
+        scheduler = Scheduler()
+        scheduler.SyncJobs()
+        with self.assertLogs("Operations.scheduler", "ERROR"):
+            delays = [self.Run(scheduler) for _ in range(5)]
+        for delay, expected in zip(delays, (120, 240, 480, 960, 1000)):     # Doubling from the first failure, capped
+            self.assertAlmostEqual(delay, expected, delta=1)
+
+        self.failing = False
+        self.assertAlmostEqual(self.Run(scheduler), 60, delta=1)
+        job = ScheduledJob.objects.get(Name="test-flaky")
+        self.assertEqual((job.ConsecutiveFailures, job.FailureCount, job.RunCount, job.LeaseOwner), (0, 5, 6, ""))
+
+    def testJitter(self):
+        self.failing = False
+        scheduler = Scheduler()
+        scheduler.SyncJobs()
+        ScheduledJob.objects.filter(Name="test-flaky").update(Jitter=30)
+        delays = [self.Run(scheduler) for _ in range(20)]
+        self.assertTrue(all(59 <= delay <= 90 for delay in delays), delays)
+        self.assertGreater(max(delays) - min(delays), 1)    # Spread out, not a fixed offset
+
+
+class SchedulerHeartbeatTests(TransactionTestCase):
+    # Not wrapped in a transaction: the heartbeat thread renews the lease on its own connection
+
+    def testLongJobKeepsItsLease(self):
+        scheduler, other = Scheduler(owner="first", leaseSeconds=0.3), Scheduler(owner="second", leaseSeconds=0.3)
+        takenOver = []
+
+        def Slow():
+            time.sleep(0.6)     # Twice the lease
+            takenOver.append(other.AcquireLease("test-slow"))
+
+        RegisterJob("test-slow", interval=60)(Slow)
+        self.addCleanup(_JOBS.pop, "test-slow")
+        scheduler.SyncJobs()
+        self.assertTrue(scheduler.AcquireLease("test-slow"))
+        self.assertTrue(scheduler.RunJob("test-slow"))
+        self.assertEqual(takenOver, [False])
+        job = ScheduledJob.objects.get(Name="test-slow")
+        self.assertEqual((job.RunCount, job.LeaseOwner), (1, ""))    # The run was recorded
+
+
+class BackupTests(TransactionTestCase):
+    # Backs up a file database of its own, the test databases live in memory
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        source = self.directory / "source.sqlite3"
+        with sqlite3.connect(source) as database:   # About 500 pages, copied in many small steps
+            database.execute("CREATE TABLE Rows (Id INTEGER PRIMARY KEY, Payload BLOB)")
+            database.executemany("INSERT INTO Rows (Payload) VALUES (?)", [(bytes(1000),)] * 2000)
+        database.close()
+        connections.settings["backup"] = connections.configure_settings(
+            {"default": connections.settings["default"], "backup": {"ENGINE": "django.db.backends.sqlite3", "NAME": source}}
+        )["backup"]
+        self.addCleanup(self.DropAlias)
+        self.source = source
+
+    def DropAlias(self):
+        connections["backup"].close()
+        del connections["backup"]
+        del connections.settings["backup"]
+
+    def Backup(self, writes, **kwargs):
+        """
+        Backs up the source while another connection commits ``writes`` rows (forever when None).
+
+        Returns:
+            tuple: Row ids in the snapshot, ids committed before the backup started, ids committed
+            once it finished, and the (copied, total) pages reported after each step.
+        """
+        stop, committed, steps = threading.Event(), [], []
+        before = self.Ids(self.source)
+
+        def Write():
+            writer = sqlite3.connect(self.source, timeout=30)
+            while not stop.is_set() and (writes is None or len(committed) < writes):
+                cursor = writer.execute("INSERT INTO Rows (Payload) VALUES (?)", (bytes(1000),))
+                writer.commit()
+                committed.append(cursor.lastrowid)
+                time.sleep(0.002)
+            writer.close()
+
+        thread = threading.Thread(target=Write)
+        thread.start()
+        try:
+            snapshot = BackupDatabase(
+                "backup", self.directory / "snapshot.sqlite3", progress=lambda *step: steps.append(step), **kwargs
+            )
+        finally:
+            stop.set()
+            thread.join()
+
+        with sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True) as copy:
+            self.assertEqual(copy.execute("PRAGMA integrity_check").fetchone()[0], "ok")
+        self.assertFalse(snapshot.with_name(snapshot.name + ".partial").exists())
+        return self.Ids(snapshot), before, self.Ids(self.source), steps
+
+    def Ids(self, path):
+        database = sqlite3.connect(path)
+        try:
+            return [row[0] for row in database.execute("SELECT Id FROM Rows ORDER BY Id")]
+        finally:
+            database.close()
+
+    def assertConsistent(self, ids, before, after):
+        # Every row committed before the backup, and a prefix of the ones committed during it
+        self.assertEqual(ids, after[:len(ids)])
+        self.assertGreaterEqual(len(ids), len(before))
+
+    def testWritesRestartTheCopy(self):
+        ids, before, after, steps = self.Backup(20, pages=8, pause=0.005, max_restarts=1000)
+        self.assertConsistent(ids, before, after)
+        remaining = [total - copied for copied, total in steps]
+        self.assertTrue(any(later > earlier for earlier, later in zip(remaining, remaining[1:])))     # Started over
+        self.assertEqual(steps[-1][0], steps[-1][1])    # Finished in steps
+
+    def testSingleStepFallback(self):
+        ids, before, after, steps = self.Backup(None, pages=8, pause=0.005, max_restarts=2)
+        self.assertConsistent(ids, before, after)
+        self.assertLess(steps[-1][0], steps[-1][1])     # Given up on stepping, copied in one go
+        self.assertGreater(len(ids), len(before))
+
+    @override_settings(BACKUP_KEEP=2, BACKUP_MAX_RESTARTS=0)
+    def testCommandKeepsTheNewestBackups(self):
+        output = self.directory / "backups"
+        for folder in ("20200101T000000Z", "20210101T000000Z", "20220101T000000Z"):
+            (output / folder).mkdir(parents=True)
+        call_command("backup_database", database=["backup"], output=str(output), stdout=StringIO())
+
+        folders = sorted(path.name for path in output.iterdir())
+        self.assertEqual(folders[0], "20220101T000000Z")
+        self.assertEqual(len(folders), 2)
+        self.assertEqual(self.Ids(output / folders[1] / "backup.sqlite3"), self.Ids(self.source))
+
+
+class DumpRestoreTests(TransactionTestCase):
+    # Not wrapped in a transaction: SQLite can't back up a database while a write transaction is open
+
+    def testRoundTrip(self):
+        stores, products = MakeStores(3), MakeProducts(5)
+        MakeStock(products, stores)
+        MakeSales(20, stores, products)
+        UpdateSketches()    # Sketches are BLOBs, which JSON can't hold as they are
+        sketches = list(SalesSketch.objects.order_by("pk").values_list("StoreId", "Day", "Amounts", "Products"))
+        events = OutboxEvent.objects.count()
+
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot = Path(directory) / "default.sqlite3"
+            target = sqlite3.connect(snapshot)
+            connection.connection.backup(target)    # The test database lives in memory, copy it to a file
+            target.close()
+            manifest = DumpDatabase(snapshot, Path(directory) / "default")
+
+            Sales.objects.all().delete()
+            SalesSketch.objects.all().delete()
+            restored = RestoreDump(Path(directory) / "default")
+
+        self.assertEqual(restored["Sales_sales"], manifest["tables"]["Sales_sales"])
+        self.assertEqual(Sales.objects.count(), 20)
+        self.assertEqual(list(SalesSketch.objects.order_by("pk").values_list("StoreId", "Day", "Amounts", "Products")), sketches)
+        self.assertEqual(OutboxEvent.objects.count(), events)   # Restored rows are not published again
+        self.assertEqual(len(SearchProducts("duct")), 5)        # The full-text index was rebuilt
+
+
+class LoadTestTests(TransactionTestCase):
+    # Not wrapped in a transaction: the worker threads open their own connections and must see the fixtures
+
+    def setUp(self):
+        stores, products = MakeStores(3), MakeProducts(5)
+        MakeStock(products, stores)
+        MakeSales(20, stores, products)
+
+    def testReplay(self):
+        from app.wsgi import application
+
+        # Without sales: the in-memory test database locks whole tables, concurrent writers fail instead of waiting
+        mix = {"store-performance": 1, "restock": 1}
+        requests = GenerateRequests(30, mix=mix, seed=1)
+        self.assertEqual(requests, GenerateRequests(30, mix=mix, seed=1))   # The same seed replays the same traffic
+
+        for run in (RunThreads, RunAsyncio):
+            with self.subTest(run=run.__name__):
+                results, elapsed = run(WsgiClient(application, host="testserver"), requests, concurrency=2)
+                report = Summarise(results, elapsed, target="wsgi")
+
+                self.assertEqual(report["requests"], 30)
+                self.assertEqual(report["errors"], 0, report["statuses"])
+                self.assertEqual(sum(figures["requests"] for figures in report["endpoints"].values()), 30)
+                latency = report["latency_ms"]
+                self.assertLessEqual(latency["p50"], latency["p95"])
+                self.assertLessEqual(latency["p95"], latency["p99"])
+                self.assertEqual(CompareReports(report, report)["overall"]["p95"], 0)
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.http import JsonResponse
+
+from app.responses import FastJsonResponse, compress_response
+from Operations.outbox import CursorExpired, ReadChanges
+
+
+@compress_response
+def ChangeFeedView(request):
+    """
+    Function-based view serving the change feed of sales, stock and purchase orders.
+    Consumers pass back the returned cursor to get the next batch. With 'wait' the request is held
+    open until new events arrive, so keep it within the worker timeout.
+    :param request: The HTTP request object, with optional 'cursor', 'topics' (comma-separated),
+        'limit' and 'wait' (seconds) query parameters.
+    :return: A JsonResponse with the events and the cursor to resume from, 410 if the cursor expired.
+    """
+    try:
+        limit = max(1, min(int(request.GET.get("limit", settings.CHANGE_FEED_BATCH_SIZE)), settings.CHANGE_FEED_BATCH_SIZE))
+        wait = max(0.0, min(float(request.GET.get("wait", 0)), settings.CHANGE_FEED_MAX_WAIT))
+    except ValueError:
+        return JsonResponse({"error": "limit must be an integer and wait a number."}, status=400)
+    topics = [topic for topic in request.GET.get("topics", "").split(",") if topic] or None
+
+    try:
+        changes = ReadChanges(request.GET.get("cursor"), topics=topics, limit=limit, wait=wait)
+    except CursorExpired as e:
+        return JsonResponse({"error": str(e)}, status=410)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return FastJsonResponse(changes)
@@ -5,5 +5,7 @@ from .models import *
 admin.site.register(Supplier)
 
 # Registers the PurchaseOrder model with the admin site for management.
-admin.site.register(PurchaseOrder)
+@admin.register(PurchaseOrder)
+class PurchaseOrderAdmin(admin.ModelAdmin):
+    list_select_related = ("ProductId",)   # Each order's name shows its product
 
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0003_rename_reorderlevel_product_orderlimit_and_more'),
+        ('Procurement', '0002_rename_totalamount_purchaseorder_fullcost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='Quantity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='StoreId',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchase_orders', to='Inventory.store'),
+        ),
+    ]
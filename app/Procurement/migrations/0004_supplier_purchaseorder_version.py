@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Procurement', '0003_purchaseorder_quantity_storeid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchaseorder',
+            name='Version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='Version',
+            field=models.IntegerField(default=0),
+        ),
+    ]
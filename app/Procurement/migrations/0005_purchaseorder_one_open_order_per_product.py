@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:19
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def CheckOpenOrders(apps, schema_editor):
+    # The constraint can't be created while a product has several open orders, name them instead of failing on the index
+    PurchaseOrder = apps.get_model("Procurement", "PurchaseOrder")
+    duplicated = list(
+        PurchaseOrder.objects.using(schema_editor.connection.alias)
+        .filter(OrderStatus__in=["Pending", "Approved", "Shipped"]).values_list("ProductId", flat=True)
+        .annotate(orders=Count("PurchaseOrderId")).filter(orders__gt=1).order_by("ProductId")
+    )
+    if duplicated:
+        raise RuntimeError(
+            f"Products {duplicated} have several open purchase orders, cancel all but one of each before migrating."
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0006_store_version'),
+        ('Procurement', '0004_supplier_purchaseorder_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(CheckOpenOrders, migrations.RunPython.noop, hints={"model_name": "purchaseorder"}),
+        migrations.AddConstraint(
+            model_name='purchaseorder',
+            constraint=models.UniqueConstraint(condition=models.Q(('OrderStatus__in', ['Pending', 'Approved', 'Shipped'])), fields=('ProductId',), name='one_open_order_per_product'),
+        ),
+    ]
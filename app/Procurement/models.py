@@ -1,7 +1,9 @@
-from django.db import models
-from Inventory.models import Product
-from django.db.models import Sum, Avg, Count
+from django.db import models, transaction
+from django.utils import timezone
+from Inventory.models import Product, ProductLocation
+from django.db.models import F, Sum, Avg, Count
 from datetime import datetime, timedelta
+from app.concurrency import EditWithVersionCheck
 
 class Supplier(models.Model):
     SupplierId = models.AutoField(primary_key=True, unique=True)    # Unique ID for the supplier.
@@ -10,6 +12,7 @@ class Supplier(models.Model):
     ContactDetails = models.CharField(max_length=200)               # Contact information for the supplier
     Location = models.CharField(max_length=200)                     # Location of the supplier
     ContractTerms = models.CharField(max_length=200)                # Terms of the contract with the supplier
+    Version = models.IntegerField(default=0)                        # Incremented on every edit, detects concurrent overwrites
 
 
     def __str__(self):  # String representation of the supplier, displaying the name and location
@@ -43,9 +46,10 @@ class Supplier(models.Model):
         )
 
 
-        # Aggregate total order amount and count the number of delivered orders
-        totalAmount = orders.aggregate(total=Sum("FullCost"))["total"] or 0
-        totalOrders = orders.count()
+        # Aggregate total order amount and count the number of delivered orders in one query
+        totals = orders.aggregate(total=Sum("FullCost"), count=Count("PurchaseOrderId"))
+        totalAmount = totals["total"] or 0
+        totalOrders = totals["count"]
 
 
         performance = { # Compile performance metrics into a dictionary
@@ -64,22 +68,45 @@ class Supplier(models.Model):
         'SupplierName', 'ContactDetails', 'Location', 'ContractTerms'
         
         :raises ValueError: If an invalid field is provided in kwargs
+        :raises ConcurrentUpdateError: If the supplier was changed by someone else since it was loaded
         """
         allowed_fields = {"SupplierName", "ContactDetails", "Location", "ContractTerms"}
 
-        for field, value in kwargs.items(): # Iterate through each field and value provided in kwargs
+        for field in kwargs: # Check every field provided in kwargs
 
             if field not in allowed_fields:# Check if the field is in the list of allowed fields
                 raise ValueError(f"Invalid field: {field}")
-            
-            # Update the field with the new value
-            setattr(self, field, value)
 
-        self.save()# Save the updated supplier data
+        EditWithVersionCheck(self, kwargs)# Write only the changed fields of the supplier
 
 
 
+# Purchase order statuses, also available as PurchaseOrder.PENDING, PurchaseOrder.OPEN_STATUSES, ...
+PENDING = "Pending"
+APPROVED = "Approved"
+SHIPPED = "Shipped"
+DELIVERED = "Delivered"
+CANCELLED = "Cancelled"
+OPEN_STATUSES = (PENDING, APPROVED, SHIPPED)     # Orders whose stock has not arrived yet
+
+
 class PurchaseOrder(models.Model):
+    # Order statuses and the statuses each one may move to
+    PENDING = PENDING
+    APPROVED = APPROVED
+    SHIPPED = SHIPPED
+    DELIVERED = DELIVERED
+    CANCELLED = CANCELLED
+
+    ALLOWED_TRANSITIONS = {
+        PENDING: {APPROVED, CANCELLED},
+        APPROVED: {SHIPPED, CANCELLED},
+        SHIPPED: {DELIVERED, CANCELLED},
+        DELIVERED: set(),
+        CANCELLED: set(),
+    }
+    OPEN_STATUSES = OPEN_STATUSES
+
     PurchaseOrderId = models.AutoField(primary_key=True, unique=True)       # A unique ID for each purchase order
     FullCost = models.DecimalField(max_digits=10, decimal_places=2)      # The total monetary amount of the purchase order
 
@@ -87,6 +114,21 @@ class PurchaseOrder(models.Model):
     OrderDate = models.DateField(auto_now_add=True)                     # The date when the order was created
     DeliveryDate = models.DateField(blank=True, null=True)              # The date when the order was delivered
     OrderStatus = models.CharField(max_length=200)                      # The status of the order
+    Quantity = models.IntegerField(default=0)                           # Number of units ordered
+    Version = models.IntegerField(default=0)                            # Incremented on every edit, detects concurrent overwrites
+
+    StoreId = models.ForeignKey(                                        # Store the order is delivered to
+        "Inventory.Store", null=True, blank=True, related_name="purchase_orders", on_delete=models.SET_NULL
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(    # At most one open order per product, restocks can't race into duplicates
+                fields=["ProductId"],
+                condition=models.Q(OrderStatus__in=list(OPEN_STATUSES)),
+                name="one_open_order_per_product",
+            ),
+        ]
 
 
 
@@ -95,12 +137,13 @@ class PurchaseOrder(models.Model):
 
     @classmethod
     def CreatePurchaseOrder(
-        cls, product, totalAmount, deliveryDate, orderStatus="Pending"
+        cls, product, totalAmount, deliveryDate=None, orderStatus="Pending", quantity=0, store=None
     ):
         """
         Creates a new purchase order
         :param product: Product instance to be ordered, totalAmount: Total amount of the purchase.
         :param deliveryDate: Expected delivery date, orderStatus: Status of the order. Default is 'Pending'.
+        :param quantity: Units ordered, store: Store instance the order is delivered to.
         """
 
         return cls.objects.create(  # Creates a new purchase order with the provided details
@@ -108,27 +151,98 @@ class PurchaseOrder(models.Model):
             FullCost=totalAmount,
             DeliveryDate=deliveryDate,
             OrderStatus=orderStatus,
+            Quantity=quantity,
+            StoreId=store,
         )
     
 
     def SetPurchaseOrder(self, **kwargs):
         """
-        Updates the purchase order's details.
+        Updates the purchase order's details. The status is changed with TransitionPurchaseOrders,
+        which checks ALLOWED_TRANSITIONS and receives the stock of delivered orders.
         :param kwargs: Dictionary of field names and their new values.
+        :raises ConcurrentUpdateError: If the order was changed by someone else since it was loaded
         """
         # Updates the purchase order with the provided valid fields
-        allowed_fields = {"FullCost", "DeliveryDate", "OrderStatus"}
+        allowed_fields = {"FullCost", "DeliveryDate"}
 
-        for field, value in kwargs.items():
+        for field in kwargs:
+            if field == "OrderStatus":
+                raise ValueError("OrderStatus can only be changed with TransitionPurchaseOrders.")
             if field not in allowed_fields:
                 raise ValueError(f"Invalid field: {field}")
-            
-            setattr(self, field, value)
-            
-        self.save()    # Save the changes to the database
+
+        EditWithVersionCheck(self, kwargs)    # Write only the changed columns to the database
 
 
     def GetPurchaseOrderStatus(self): # Retrieves the current status of the purchase order
         return self.OrderStatus
 
 
+    @classmethod
+    def TransitionPurchaseOrders(cls, purchaseOrderIds, newStatus, deliveryDate=None):
+        """
+        Moves many purchase orders to a new status at once.
+
+        Orders are grouped by their current status and each group is updated with a single UPDATE.
+        When the new status is 'Delivered', DeliveryDate is set and the ordered quantities are
+        received into ProductLocation in the same transaction.
+
+        :param purchaseOrderIds: Iterable of purchase order IDs to transition.
+        :param newStatus: The status to move the orders to.
+        :param deliveryDate: Date recorded as DeliveryDate, defaults to today for deliveries.
+        :return: Dictionary with the number of orders updated and units received.
+        :raises ValueError: If an order does not exist, a transition is not allowed, or a delivered
+            order has no destination store. No order is changed in that case.
+        """
+        if newStatus not in cls.ALLOWED_TRANSITIONS:
+            raise ValueError(f"Invalid status: {newStatus}")
+
+        orderIds = set(purchaseOrderIds)
+        if newStatus == cls.DELIVERED and deliveryDate is None:
+            deliveryDate = timezone.localdate()
+
+        with transaction.atomic():
+            orders = {  # Current status, product, store and quantity of every requested order
+                row[0]: row[1:]
+                for row in cls.objects.select_for_update()
+                .filter(PurchaseOrderId__in=orderIds)
+                .values_list("PurchaseOrderId", "OrderStatus", "ProductId", "StoreId", "Quantity")
+            }
+
+            missing = orderIds - orders.keys()
+            if missing:
+                raise ValueError(f"Purchase orders not found: {sorted(missing)}")
+
+            groups = {}     # Group the orders by their current status
+            for orderId, (status, productId, storeId, quantity) in orders.items():
+                if newStatus not in cls.ALLOWED_TRANSITIONS.get(status, ()):
+                    raise ValueError(f"Order {orderId} cannot move from {status} to {newStatus}.")
+                if newStatus == cls.DELIVERED and storeId is None:
+                    raise ValueError(f"Order {orderId} has no destination store to receive stock into.")
+                groups.setdefault(status, []).append(orderId)
+
+            changes = {"OrderStatus": newStatus, "Version": F("Version") + 1}
+            if deliveryDate is not None:
+                changes["DeliveryDate"] = deliveryDate
+
+            updated = 0
+            for status, groupIds in groups.items():     # One UPDATE per current status
+                count = cls.objects.filter(PurchaseOrderId__in=groupIds, OrderStatus=status).update(**changes)
+                if count != len(groupIds):  # Another process changed some of these orders meanwhile
+                    raise ValueError(f"Purchase orders in status {status} were modified concurrently.")
+                updated += count
+
+            received = 0
+            if newStatus == cls.DELIVERED:  # Receive the delivered stock into each destination store
+                receipts = {}
+                for status, productId, storeId, quantity in orders.values():
+                    receipts[(productId, storeId)] = receipts.get((productId, storeId), 0) + quantity
+                received = ProductLocation.ReceiveStock(receipts)
+                Product.objects.filter(ProductId__in={productId for productId, _ in receipts}).update(
+                    LastPurchaseDate=deliveryDate
+                )
+
+        return {"Updated": updated, "Received": received}
+
+
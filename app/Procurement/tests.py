@@ -1,3 +1,64 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.utils import timezone
+
+from app.testutils import MakeProducts, MakePurchaseOrders, MakeStock, MakeStores, MakeSuppliers, QueryBudgetTestCase
+from Procurement.models import PurchaseOrder, Supplier
+
+
+class SupplierQueryBudgetTests(QueryBudgetTestCase):
+
+    def Delivered(self, size):  # A supplier with `size` products, each delivered once last week
+        supplier = MakeSuppliers(1)[0]
+        MakePurchaseOrders(
+            MakeProducts(size, supplier=supplier), status=PurchaseOrder.DELIVERED,
+            delivered=timezone.localdate() - timedelta(days=7),
+        )
+        return (Supplier.objects.get(pk=supplier.pk),)
+
+    def testGetSupplierProducts(self):
+        self.assertQueryBudget(1, self.Delivered, lambda supplier: list(supplier.GetSupplierProducts()))
+
+    def testGetSupplierPerformance(self):
+        self.assertQueryBudget(1, self.Delivered, lambda supplier: supplier.GetSupplierPerformance())
+
+    def testEditSupplierData(self):
+        self.assertQueryBudget(1, self.Delivered, lambda supplier: supplier.EditSupplierData(ContractTerms="60 days"))
+
+
+class PurchaseOrderQueryBudgetTests(QueryBudgetTestCase):
+
+    def Pending(self, size):    # Orders for `size + 1` products, all but one already stocked by the store
+        store = MakeStores(1)[0]
+        products = MakeProducts(size + 1)
+        MakeStock(products[:size], [store])
+        return ([order.pk for order in MakePurchaseOrders(products, status=PurchaseOrder.SHIPPED, store=store)],)
+
+    def testCreatePurchaseOrder(self):
+        def Build(size):
+            return (MakeProducts(size)[0],)
+
+        self.assertQueryBudget(1, Build, lambda product: PurchaseOrder.CreatePurchaseOrder(product, 100))
+
+    def testSetPurchaseOrder(self):
+        def Build(size):
+            return (PurchaseOrder.objects.get(pk=MakePurchaseOrders(MakeProducts(size))[0].pk),)
+
+        self.assertQueryBudget(1, Build, lambda order: order.SetPurchaseOrder(FullCost=75))
+
+        order, = Build(1)
+        with self.assertRaises(ValueError):     # Would skip the allowed transitions and the stock receipt
+            order.SetPurchaseOrder(OrderStatus=PurchaseOrder.DELIVERED)
+        self.assertEqual(PurchaseOrder.objects.get(pk=order.pk).OrderStatus, PurchaseOrder.PENDING)
+
+    def testTransitionPurchaseOrders(self):
+        # Savepoint, the locked read and one update for the orders sharing a status
+        self.assertQueryBudget(
+            4, self.Pending, lambda orderIds: PurchaseOrder.TransitionPurchaseOrders(orderIds, PurchaseOrder.CANCELLED)
+        )
+
+    def testDeliverPurchaseOrders(self):
+        # As above, plus receiving the stock and stamping the products' LastPurchaseDate
+        self.assertQueryBudget(
+            10, self.Pending, lambda orderIds: PurchaseOrder.TransitionPurchaseOrders(orderIds, PurchaseOrder.DELIVERED)
+        )
@@ -3,4 +3,20 @@ from django.contrib import admin
 from .models import *
 
 # Registers the Sales model with Django admin site to allow management through the admin interface
-admin.site.register(Sales)
+@admin.register(Sales)
+class SalesAdmin(admin.ModelAdmin):
+    list_select_related = ("StoreId",)   # Each row's name shows its store, joined instead of a query per row
+
+
+@admin.register(SalesAlert)
+class SalesAlertAdmin(admin.ModelAdmin):
+    list_display = ("Kind", "Day", "StoreId", "ProductId", "Value", "Expected", "ZScore")
+    list_filter = ("Kind",)
+    list_select_related = ("StoreId", "ProductId")
+
+
+@admin.register(SalesSketch)
+class SalesSketchAdmin(admin.ModelAdmin):
+    list_display = ("StoreId", "Day", "SalesCount")
+    list_select_related = ("StoreId",)
+    exclude = ("Amounts", "Products")    # Serialized sketches, not editable
@@ -0,0 +1,363 @@
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from app.sharding import FanOut, ShardAliases, ShardFor
+from Sales.archive import ReadAcrossArchive
+from Sales.models import AnomalyState, Sales, SalesAlert, SalesBaseline
+
+SALE_COLUMNS = ("SalesId", "StoreId", "ProductId", "TotalAmount", "SaleTimestamp")
+WEEKDAY_MIN_DAYS = 4    # Days of a weekday needed before it is its own baseline, the EWMA is used until then
+
+# Columns of SalesBaseline written back after each batch
+BASELINE_COLUMNS = (
+    "AmountCount", "AmountMean", "AmountM2", "Day", "DayTotal", "DayCount", "DayMean", "DayM2", "Ewma", "EwmVar", "Weekdays",
+)
+
+
+def _Push(count, mean, m2, value):
+    # Welford's update of a running count, mean and sum of squared differences with one more value
+    count += 1
+    delta = value - mean
+    mean += delta / count
+    return count, mean, m2 + delta * (value - mean)
+
+
+def _PushZeros(count, mean, m2, zeros):
+    # Adds ``zeros`` values of 0 at once, Chan's parallel form of Welford's update
+    if not zeros:
+        return count, mean, m2
+    total = count + zeros
+    return total, mean * count / total, m2 + mean * mean * count * zeros / total
+
+
+def _Deviation(count, m2):
+    return math.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+
+
+def _ZScore(value, mean, deviation):
+    return (value - mean) / deviation if deviation > 0 else None
+
+
+def SeriesOf(storeId, productId):
+    # (Series, ProductId) of the store's total, and of the store and product when the sale has a product
+    return [(f"{storeId}:", None)] + ([(f"{storeId}:{productId}", productId)] if productId is not None else [])
+
+
+class Detector:
+    """
+    Updates sales baselines one sale at a time and collects the alerts they raise.
+
+    Every sale updates the running statistics of its store and of its store and product, both in
+    constant time. Sale amounts are scored against the store and product's running mean and
+    deviation. Daily revenue is scored when a day closes: when the series sees a sale on a later
+    day, or when CloseDays reaches it. Days without sales close with no revenue, so a store that
+    stops selling shows up as a revenue drop. A day is compared with the mean and deviation of the
+    same weekday once there are WEEKDAY_MIN_DAYS of them, and with the EWMA before that. Drops are
+    flagged in every series, spikes only in store totals.
+
+    Sales are expected in time order. One recorded with an earlier day than its series' open day
+    still counts towards the sale amounts, but no longer towards daily revenue.
+
+    Args:
+        baselines (dict): SalesBaseline instances by Series, updated in place. Missing series are created.
+        alert (bool): Whether anomalies create SalesAlert instances, off when replaying history.
+    """
+
+    def __init__(self, baselines, alert=True):
+        self.baselines = baselines
+        self.alert = alert
+        self.alerts = []    # Unsaved SalesAlert instances
+        self.created = []   # Series that have no row yet
+        # Settings are read once per detector rather than once per sale
+        self.threshold, self.alpha = settings.ANOMALY_Z_THRESHOLD, settings.ANOMALY_EWMA_ALPHA
+        self.minSales, self.minDays = settings.ANOMALY_MIN_SALES, settings.ANOMALY_MIN_DAYS
+        self.zone = timezone.get_current_timezone()
+
+    def _Baseline(self, key, storeId, productId):
+        baseline = self.baselines.get(key)
+        if baseline is None:
+            baseline = self.baselines[key] = SalesBaseline(Series=key, StoreId_id=storeId, ProductId_id=productId)
+            self.created.append(baseline)
+        return baseline
+
+    def _Alert(self, baseline, kind, day, value, expected, zScore, salesId=None):
+        if self.alert:
+            self.alerts.append(SalesAlert(
+                Kind=kind, StoreId_id=baseline.StoreId_id, ProductId_id=baseline.ProductId_id, SalesId=salesId,
+                Day=day, Value=round(value, 2), Expected=round(expected, 2), ZScore=round(zScore, 2),
+            ))
+
+    def Observe(self, salesId, storeId, productId, amount, timestamp):
+        # Adds one sale to its series
+        amount, day = float(amount), timestamp.astimezone(self.zone).date()
+        for key, seriesProductId in SeriesOf(storeId, productId):
+            baseline = self._Baseline(key, storeId, seriesProductId)
+
+            if baseline.ProductId_id is not None and baseline.AmountCount >= self.minSales:
+                zScore = _ZScore(amount, baseline.AmountMean, _Deviation(baseline.AmountCount, baseline.AmountM2))
+                if zScore is not None and zScore >= self.threshold:     # Only unusually large sales, small ones are normal
+                    self._Alert(baseline, SalesAlert.SALE_SPIKE, day, amount, baseline.AmountMean, zScore, salesId)
+            baseline.AmountCount, baseline.AmountMean, baseline.AmountM2 = _Push(
+                baseline.AmountCount, baseline.AmountMean, baseline.AmountM2, amount
+            )
+
+            if baseline.Day is None:
+                baseline.Day, baseline.DayTotal = day, amount
+            elif day == baseline.Day:
+                baseline.DayTotal += amount
+            elif day > baseline.Day:
+                self.CloseDays(baseline, day)
+                baseline.DayTotal = amount
+
+    def CloseDays(self, baseline, until):
+        """
+        Closes a series' open day and the days without sales after it, up to but not including ``until``.
+
+        The first day without sales is scored like any other, so an outage raises one drop. The
+        days after it are added to the statistics together in constant time, so a series that
+        wakes up after months costs the same as one that sold yesterday.
+        """
+        self._CloseDay(baseline, baseline.Day, baseline.DayTotal)
+        first = baseline.Day + timedelta(days=1)
+        if first < until:
+            self._CloseDay(baseline, first, 0.0)
+            self._FoldEmptyDays(baseline, first + timedelta(days=1), (until - first).days - 1)
+        baseline.Day, baseline.DayTotal = until, 0.0
+
+    def _FoldEmptyDays(self, baseline, first, count):
+        # Adds ``count`` days without sales from ``first`` on to the baseline, without scoring them
+        if count <= 0:
+            return
+        baseline.DayCount, baseline.DayMean, baseline.DayM2 = _PushZeros(baseline.DayCount, baseline.DayMean, baseline.DayM2, count)
+        for offset in range(7):
+            weekday = baseline.Weekdays[(first.weekday() + offset) % 7]
+            weekday[:] = _PushZeros(*weekday, count // 7 + (offset < count % 7))
+        # After k days of revenue 0 the EWMA is m·r^k and its variance r^k·(v + m²·(1 - r^k)), with r = 1 - alpha
+        decay = (1 - self.alpha) ** count
+        baseline.EwmVar = decay * (baseline.EwmVar + baseline.Ewma * baseline.Ewma * (1 - decay))
+        baseline.Ewma *= decay
+
+    def _CloseDay(self, baseline, day, value):
+        # Scores one day's revenue against the baseline, then adds it to the baseline
+        weekday = baseline.Weekdays[day.weekday()]
+        if baseline.DayCount >= self.minDays:
+            if weekday[0] >= WEEKDAY_MIN_DAYS:
+                expected, deviation = weekday[1], _Deviation(weekday[0], weekday[2])
+            else:
+                expected, deviation = baseline.Ewma, math.sqrt(baseline.EwmVar)
+            zScore = _ZScore(value, expected, deviation)
+            if zScore is not None and zScore <= -self.threshold:
+                self._Alert(baseline, SalesAlert.REVENUE_DROP, day, value, expected, zScore)
+            elif zScore is not None and zScore >= self.threshold and baseline.ProductId_id is None:
+                # Products selling a few times a month make any day with a sale look like a spike
+                self._Alert(baseline, SalesAlert.REVENUE_SPIKE, day, value, expected, zScore)
+
+        if baseline.DayCount == 0:
+            baseline.Ewma, baseline.EwmVar = value, 0.0
+        else:   # Exponentially weighted mean and variance, recent days count the most
+            delta = value - baseline.Ewma
+            baseline.Ewma += self.alpha * delta
+            baseline.EwmVar = (1 - self.alpha) * (baseline.EwmVar + self.alpha * delta * delta)
+        baseline.DayCount, baseline.DayMean, baseline.DayM2 = _Push(baseline.DayCount, baseline.DayMean, baseline.DayM2, value)
+        weekday[:] = _Push(*weekday, value)
+
+
+def _LoadBaselines(keys):
+    # Loads the baselines of the given series, one query per 5000 of them
+    keys, baselines = list(keys), {}
+    for start in range(0, len(keys), 5000):
+        for baseline in SalesBaseline.objects.filter(Series__in=keys[start:start + 5000]):
+            baselines[baseline.Series] = baseline
+    return baselines
+
+
+def _SaveBaselines(detector):
+    """
+    Inserts the new baselines and writes back the changed ones, one executemany each.
+
+    bulk_create and bulk_update spend most of their time preparing values field by field, which
+    dominates at tens of thousands of rows.
+    """
+    quote, table = connection.ops.quote_name, SalesBaseline._meta.db_table
+    fields = [SalesBaseline._meta.get_field(column) for column in BASELINE_COLUMNS]
+    keys = [SalesBaseline._meta.get_field(column) for column in ("Series", "StoreId", "ProductId")]
+
+    def Values(baseline, fields):
+        return [field.get_db_prep_save(getattr(baseline, field.attname), connection) for field in fields]
+
+    created = {id(baseline) for baseline in detector.created}
+    changed = [baseline for baseline in detector.baselines.values() if id(baseline) not in created]
+    with connection.cursor() as cursor:
+        if detector.created:
+            columns = ", ".join(quote(field.column) for field in keys + fields)
+            cursor.executemany(
+                f"INSERT INTO {quote(table)} ({columns}) VALUES ({', '.join(['%s'] * (len(keys) + len(fields)))})",
+                [Values(baseline, keys + fields) for baseline in detector.created],
+            )
+        if changed:
+            cursor.executemany(
+                f"UPDATE {quote(table)} SET {', '.join(f'{quote(field.column)} = %s' for field in fields)} "
+                f"WHERE SalesBaselineId = %s",
+                [Values(baseline, fields) + [baseline.pk] for baseline in changed],
+            )
+    detector.created = []
+
+
+def DetectNewSales(batch_size=None):
+    """
+    Updates the baselines with the sales recorded since the last run and records the alerts they raise.
+
+    Like cost of goods, each database holding sales has a watermark, in AnomalyState, so every
+    sale is read once. Only the baselines of the series in a batch are loaded.
+
+    Args:
+        batch_size (int, optional): Sales read per database per batch, defaults to ANOMALY_BATCH_SIZE.
+
+    Returns:
+        dict: Number of sales checked and alerts raised.
+    """
+    batch_size = batch_size or settings.ANOMALY_BATCH_SIZE
+    checked = raised = 0
+    while True:
+        positions = dict(AnomalyState.objects.values_list("Database", "LastSalesId"))
+        batches = dict(zip(ShardAliases(), FanOut(
+            lambda alias: list(
+                Sales.objects.using(alias).filter(SalesId__gt=positions.get(alias, 0))
+                .order_by("SalesId").values_list(*SALE_COLUMNS)[:batch_size]
+            )
+        )))
+        if not any(batches.values()):
+            return {"Sales": checked, "Alerts": raised}
+        rows = sorted((row for batch in batches.values() for row in batch), key=lambda row: (row[4], row[0]))
+
+        with transaction.atomic():
+            detector = Detector(_LoadBaselines({key for row in rows for key, _ in SeriesOf(row[1], row[2])}))
+            for row in rows:
+                detector.Observe(*row)
+            _SaveBaselines(detector)
+            SalesAlert.objects.bulk_create(detector.alerts, batch_size=1000)
+            for alias, batch in batches.items():
+                if batch:
+                    AnomalyState.objects.update_or_create(Database=alias, defaults={"LastSalesId": batch[-1][0]})
+        checked += len(rows)
+        raised += len(detector.alerts)
+
+
+def CloseIdleDays(today=None, batch_size=5000):
+    """
+    Closes the open days of series that had no sales since, scoring them as days without revenue.
+
+    Only series whose open day is before today are read, so after the first run of a day this
+    finds nothing until the next one.
+
+    Returns:
+        int: Number of alerts raised.
+    """
+    today = today or timezone.localdate()
+    raised = 0
+    while True:
+        with transaction.atomic():
+            stale = list(SalesBaseline.objects.filter(Day__lt=today).order_by("SalesBaselineId")[:batch_size])
+            if not stale:
+                return raised
+            detector = Detector({baseline.Series: baseline for baseline in stale})
+            for baseline in stale:
+                detector.CloseDays(baseline, today)
+            _SaveBaselines(detector)
+            SalesAlert.objects.bulk_create(detector.alerts, batch_size=1000)
+        raised += len(detector.alerts)
+
+
+def RunDetection():
+    """
+    Brings the baselines up to date: new sales first, so yesterday's late sales count before yesterday closes.
+
+    Returns:
+        dict: Number of sales checked and alerts raised.
+    """
+    result = DetectNewSales()
+    result["Alerts"] += CloseIdleDays()
+    return result
+
+
+def RebuildBaselines(alert=False):
+    """
+    Replaces every baseline with one built from all sales, archived ones included, in time order.
+
+    Run once on a database with existing history, after which DetectNewSales keeps the baselines
+    up to date from the watermarks set here.
+
+    Args:
+        alert (bool): Also record the alerts history would have raised, existing alerts are kept either way.
+
+    Returns:
+        dict: Number of sales read, baselines written and alerts raised.
+    """
+    rows = sorted(
+        (row for rows in ReadAcrossArchive(lambda sales: list(sales.values_list(*SALE_COLUMNS))) for row in rows),
+        key=lambda row: (row[4], row[0]),
+    )
+    detector = Detector({}, alert=alert)
+    watermarks = {}
+    for row in rows:
+        detector.Observe(*row)
+        alias = ShardFor(row[1])
+        watermarks[alias] = max(watermarks.get(alias, 0), row[0])
+    today = timezone.localdate()
+    for baseline in detector.baselines.values():
+        if baseline.Day < today:
+            detector.CloseDays(baseline, today)
+
+    with transaction.atomic():
+        SalesBaseline.objects.all().delete()
+        AnomalyState.objects.all().delete()
+        _SaveBaselines(detector)
+        SalesAlert.objects.bulk_create(detector.alerts, batch_size=1000)
+        AnomalyState.objects.bulk_create(
+            [AnomalyState(Database=alias, LastSalesId=salesId) for alias, salesId in watermarks.items()]
+        )
+    return {"Sales": len(rows), "Baselines": len(detector.baselines), "Alerts": len(detector.alerts)}
+
+
+def GetAlerts(store=None, product=None, kind=None, since=None, limit=100):
+    """
+    Returns the newest alerts, optionally for one store, product, kind or from a date on.
+
+    Args:
+        store (int, optional): Store ID.
+        product (int, optional): Product ID.
+        kind (str, optional): One of SalesAlert.KINDS.
+        since (date or str, optional): Only alerts about this day or later.
+        limit (int): Most alerts returned.
+
+    Returns:
+        list: Alerts as dictionaries, newest first.
+
+    Raises:
+        ValueError: If the kind or the date is invalid.
+    """
+    alerts = SalesAlert.objects.all()
+    if kind is not None:
+        if kind not in SalesAlert.KINDS:
+            raise ValueError(f"kind must be one of: {', '.join(SalesAlert.KINDS)}.")
+        alerts = alerts.filter(Kind=kind)
+    if store is not None:
+        alerts = alerts.filter(StoreId=store)
+    if product is not None:
+        alerts = alerts.filter(ProductId=product)
+    if since is not None:
+        day = parse_date(since) if isinstance(since, str) else since
+        if day is None:
+            raise ValueError(f"Invalid date: {since}, use YYYY-MM-DD.")
+        alerts = alerts.filter(Day__gte=day)
+    return list(
+        alerts.order_by("-Day", "-SalesAlertId").values(
+            "SalesAlertId", "Kind", "StoreId", "StoreId__StoreName", "ProductId", "ProductId__ProductName",
+            "SalesId", "Day", "Value", "Expected", "ZScore", "CreatedAt",
+        )[:limit]
+    )
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class SalesConfig(AppConfig):       # Configures the Sales app for Django, specifying default auto field type
     default_auto_field = "django.db.models.BigAutoField"
     name = "Sales"  # app name
+
+    def ready(self):
+        from app.sharding import ReserveShardIdRanges
+
+        post_migrate.connect(ReserveShardIdRanges, sender=self)     # Give every new shard its own id range
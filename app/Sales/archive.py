@@ -0,0 +1,246 @@
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from app.sharding import FanOut, ShardAliases, ShardingEnabled
+from Sales.graphing import DateToDatetime
+
+logger = logging.getLogger(__name__)
+
+# Fields copied from Sales to ArchivedSales, foreign keys are copied as their raw ids
+ARCHIVED_FIELDS = ("SalesId", "PaymentMethod", "TotalAmount", "Quantity", "StoreId", "ProductId", "StaffId", "SaleDate", "SaleTimestamp")
+SEQUENCE_TIMEOUT = 10      # Seconds a reader keeps retrying while batches are being moved before giving up
+SEQUENCE_WAIT = 0.01        # Seconds to wait before checking again whether a batch has finished moving
+CLOSED_MOVE = {"MoveStartedAt": None, "MoveOwner": "", "MoveDatabase": "", "MoveFirstId": None, "MoveLastId": None}
+
+
+def GetArchiveState():
+    # Returns the single SalesArchive bookkeeping row, creating it on first use
+    from Sales.models import SalesArchive
+
+    state, _ = SalesArchive.objects.get_or_create(ArchiveId=1)
+    return state
+
+
+def ArchiveDate(value):
+    # Converts an optional date filter (date or ISO string) to a date, for comparing against ArchivedBefore
+    return DateToDatetime(value).date() if value else None
+
+
+def ReadAcrossArchive(query, start_date=None, detached_query=None):
+    """
+    Runs a query against the Sales table, on every shard when sharding is on, and when the date
+    range reaches into the archive, against ArchivedSales as well.
+
+    ArchivedSales has the same column names as Sales, so ``query`` usually receives a queryset of
+    either model and applies the same filters and aggregates to both. Ranges starting on or after
+    the archive boundary only ever touch the Sales table.
+
+    Args:
+        query (callable): Takes a queryset and returns a result computed from it.
+        start_date (date or str, optional): Start of the requested range, None for all time.
+        detached_query (callable, optional): Used instead of ``query`` for the archive and the
+            shards, for queries that follow relations into tables those databases don't have.
+
+    Returns:
+        list: One partial result per shard (a single one without sharding), followed by the
+        archive result when the archive was read.
+    """
+    from Sales.models import ArchivedSales, Sales, SalesArchive
+
+    detached_query = detached_query or query
+
+    def Hot():
+        if ShardingEnabled():   # Each shard computes its partial result in its own thread
+            return FanOut(lambda alias: detached_query(Sales.objects.using(alias)))
+        return [query(Sales.objects.all())]
+
+    state = SalesArchive.objects.filter(ArchiveId=1).values_list("ArchivedBefore", "Generation", "MoveStartedAt").first()
+    if state is None or state[0] is None:  # Nothing has ever been archived
+        return Hot()
+    start = ArchiveDate(start_date)
+    if start is not None and start >= state[0]:
+        return Hot()
+
+    (_, generation, moveStartedAt), results = state, None
+    deadline = time.monotonic() + SEQUENCE_TIMEOUT
+    while time.monotonic() < deadline:
+        if generation % 2 == 0:     # No batch is half-moved, read both tables and check nothing moved meanwhile
+            results = Hot() + [detached_query(ArchivedSales.objects.all())]
+            current = SalesArchive.objects.filter(ArchiveId=1).values_list("Generation", "MoveStartedAt").first()
+            if current[0] == generation:
+                return results
+            generation, moveStartedAt = current
+        else:
+            if _IsStale(moveStartedAt):     # The run moving the batch died, finish its move instead of waiting
+                RecoverArchive()
+            else:
+                time.sleep(SEQUENCE_WAIT)
+            generation, moveStartedAt = (
+                SalesArchive.objects.filter(ArchiveId=1).values_list("Generation", "MoveStartedAt").first()
+            )
+
+    logger.warning("Sales archive kept changing while being read, a moving batch may be counted twice")
+    return results or Hot() + [detached_query(ArchivedSales.objects.all())]
+
+
+def _IsStale(moveStartedAt):
+    # Whether a batch marked at this time should have finished moving long ago, moves from before the
+    # time was recorded count as stale
+    return moveStartedAt is None or moveStartedAt < timezone.now() - timedelta(seconds=settings.SALES_ARCHIVE_MOVE_TIMEOUT)
+
+
+def RecoverArchive(stale_only=True):
+    """
+    Finishes a batch move left open by an archive run that died between marking and completing it.
+
+    Until then Generation stays odd, and every read spanning the archive would wait for the move.
+    The batch's sales that reached the archive are removed from the Sales table and the move is
+    closed, those that didn't stay where they are for the next run. Closing only succeeds for
+    the move that was read, so concurrent recoveries finish it once.
+
+    Args:
+        stale_only (bool): Leave moves started less than SALES_ARCHIVE_MOVE_TIMEOUT ago alone, they
+            may still be running. archive_sales passes False, only one run may execute at a time.
+
+    Returns:
+        bool: True if an open move was closed.
+    """
+    from Sales.models import ArchivedSales, Sales, SalesArchive
+
+    state = SalesArchive.objects.filter(ArchiveId=1).first()
+    if state is None or state.Generation % 2 == 0 or (stale_only and not _IsStale(state.MoveStartedAt)):
+        return False
+
+    alias, moved = state.MoveDatabase or "default", 0
+    with transaction.atomic(using=alias), transaction.atomic():
+        if state.MoveLastId is not None:
+            batch = ArchivedSales.objects.filter(SalesId__range=(state.MoveFirstId, state.MoveLastId))
+            archived = list(batch.values_list("SalesId", flat=True))
+            moved = Sales.objects.using(alias).filter(SalesId__in=archived).delete()[1].get(Sales._meta.label, 0)
+        closed = SalesArchive.objects.filter(ArchiveId=1, Generation=state.Generation).update(
+            Generation=F("Generation") + 1, ArchivedRows=F("ArchivedRows") + moved, **CLOSED_MOVE
+        )
+    if closed:
+        logger.warning(
+            "Closed a sales archive move left open by %s since %s, %d sales finished moving",
+            state.MoveOwner or "an unknown run", state.MoveStartedAt, moved,
+        )
+    return bool(closed)
+
+
+def MergeTotals(results):
+    """
+    Adds up (key, total) rows coming from the Sales table and the archive.
+
+    Args:
+        results (list): Lists of (key, total) pairs, one per table read.
+
+    Returns:
+        list: (key, total) pairs ordered by key, one per distinct key.
+    """
+    merged = {}
+    for rows in results:
+        for key, total in rows:
+            merged[key] = merged.get(key, 0) + total
+    return sorted(merged.items(), key=lambda item: item[0])
+
+
+def _CopyToArchive(archive_db, rows):
+    # Inserts raw database rows into ArchivedSales, skipping sales that are already there
+    from Sales.models import ArchivedSales
+
+    connection = connections[archive_db]
+    fields = [ArchivedSales._meta.get_field(name) for name in ARCHIVED_FIELDS]
+    sql = "{} {} ({}) VALUES ({}) {}".format(
+        connection.ops.insert_statement(on_conflict=OnConflict.IGNORE),
+        connection.ops.quote_name(ArchivedSales._meta.db_table),
+        ", ".join(connection.ops.quote_name(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+        connection.ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None) or "",
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def ArchiveSales(before, batch_size=5000, pause=0, progress=None):
+    """
+    Moves sales dated before ``before`` from the Sales table into ArchivedSales, in batches.
+
+    Each batch is copied into the archive database and then deleted from the Sales table. The copy
+    ignores rows already in the archive, so a run interrupted between the two steps is simply
+    resumed by running it again, which first finishes the interrupted batch (see RecoverArchive).
+    The archive boundary is moved before the first batch so readers start looking in the archive
+    before any row arrives there.
+
+    Readers spanning both tables retry when a batch moves while they read, so pausing between
+    batches lets long analytics queries through while an archive run is in progress. Only one
+    archive run should execute at a time.
+
+    Args:
+        before (date): Sales whose SaleDate and SaleTimestamp are both before this date are archived.
+        batch_size (int): Number of sales moved per batch.
+        pause (float): Seconds to wait between batches.
+        progress (callable, optional): Called with the number of rows moved after every batch.
+
+    Returns:
+        int: Number of sales moved.
+    """
+    from Sales.models import Sales, SalesArchive
+
+    archive_db = settings.SALES_ARCHIVE_DATABASE
+    cutoff = DateToDatetime(before)
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    state = GetArchiveState()
+    if state.ArchivedBefore is None or before > state.ArchivedBefore:  # The boundary never moves backwards
+        SalesArchive.objects.filter(ArchiveId=1).update(ArchivedBefore=before)
+    RecoverArchive(stale_only=False)    # An interrupted run left a batch half-moved
+
+    columns = [Sales._meta.get_field(name).attname for name in ARCHIVED_FIELDS]
+    moved = 0
+    for alias in ShardAliases():    # Every shard's sales, or just the default database's
+        candidates = Sales.objects.using(alias).filter(SaleDate__lt=before, SaleTimestamp__lt=cutoff).order_by("SalesId")
+        last_id = 0
+        while True:  # Keyset pagination, so each batch starts where the previous one ended
+            # Rows are copied as the database returns them, skipping the ORM's per-value conversions both ways
+            sql, params = candidates.filter(SalesId__gt=last_id).values_list(*columns)[:batch_size].query.sql_with_params()
+            with connections[alias].cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            ids = [row[0] for row in rows]
+            last_id = ids[-1]
+
+            # Mark the batch as moving, readers spanning the archive wait until it is done
+            SalesArchive.objects.filter(ArchiveId=1).update(
+                Generation=F("Generation") + 1, MoveStartedAt=timezone.now(), MoveOwner=owner, MoveDatabase=alias,
+                MoveFirstId=ids[0], MoveLastId=ids[-1],
+            )
+
+            with transaction.atomic(using=archive_db):  # Rows copied by an interrupted run are already there and skipped
+                _CopyToArchive(archive_db, rows)
+
+            # Removing the rows and ending the move happen together, unless the rows live in a shard:
+            # a crash in between then leaves the move open and the next run or a reader closes it
+            with transaction.atomic(using=alias), transaction.atomic():
+                Sales.objects.using(alias).filter(SalesId__in=ids).delete()
+                SalesArchive.objects.filter(ArchiveId=1).update(
+                    Generation=F("Generation") + 1, ArchivedRows=F("ArchivedRows") + len(ids), **CLOSED_MOVE
+                )
+
+            moved += len(ids)
+            if progress:
+                progress(moved)
+            if pause:
+                time.sleep(pause)
+
+    return moved
@@ -0,0 +1,353 @@
+import json
+import os
+from contextlib import contextmanager
+from datetime import date
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+
+try:  # NumPy is optional, the columnar mirror is only available when it is installed
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the environment
+    np = None
+
+try:  # Refreshes lock the mirror with flock, or with msvcrt on Windows which doesn't have it
+    import fcntl
+except ImportError:  # pragma: no cover - depends on the platform
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:  # pragma: no cover - depends on the platform
+    msvcrt = None
+
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()  # Dates are stored as days since 1970-01-01
+NULL_ID = -1  # Stored in place of a missing ProductId or StaffId
+
+# Column name -> NumPy dtype for every array that is mirrored to disk
+COLUMNS = {
+    "SalesId": "int64",
+    "SaleDate": "int32",    # Local day of SaleTimestamp, the day the ORM totals and graphs use
+    "StoreId": "int32",
+    "ProductId": "int32",
+    "StaffId": "int32",
+    "PaymentMethod": "int16",
+    "TotalAmount": "int64",  # Amount in pence so sums stay exact
+}
+
+# Dimensions that can be grouped or filtered on, derived dimensions are computed from SaleDate
+DIMENSIONS = {"SaleDate", "SaleWeek", "SaleMonth", "StoreId", "ProductId", "StaffId", "PaymentMethod"}
+
+
+class ColumnarSalesStore:
+    """
+    Memory-mapped columnar mirror of the Sales table for in-process ad-hoc analytics.
+
+    Every column lives in its own flat binary file under ``directory`` and is opened with
+    ``numpy.memmap``, so queries read straight from the page cache. The mirror is append-only
+    and is brought up to date from a watermark on ``SalesId`` with ``Refresh``. Refreshes hold an
+    exclusive lock on the directory, so two of them never append the same sales twice.
+    """
+
+    def __init__(self, directory=None):
+        if np is None:
+            raise ImproperlyConfigured("NumPy is required for the columnar sales store.")
+
+        self.directory = Path(directory or settings.SALES_COLUMNAR_DIR)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._columns = None        # Cached memory maps, reopened when the row count changes
+        self._columns_count = None
+
+    # ------------------------------------------------------------------ metadata
+
+    def _MetaPath(self):
+        return self.directory / "meta.json"
+
+    def _ColumnPath(self, name):
+        return self.directory / f"{name}.bin"
+
+    @contextmanager
+    def _Locked(self):
+        # Holds an exclusive lock on the mirror across processes and threads, writers wait for each other
+        if fcntl is None and msvcrt is None:
+            raise ImproperlyConfigured("The columnar sales store can't be refreshed without fcntl or msvcrt file locks.")
+        with open(self.directory / "refresh.lock", "a+b") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)   # Released when the file is closed
+                yield
+                return
+            lock_file.seek(0)
+            while True:     # LK_LOCK gives up after ten seconds, keep waiting like flock does
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def GetMeta(self):
+        # Returns the committed row count, the SalesId watermark and the payment method dictionary
+        try:
+            with open(self._MetaPath()) as meta_file:
+                return json.load(meta_file)
+        except FileNotFoundError:
+            return {"Count": 0, "Watermark": 0, "PaymentMethods": []}
+
+    def _WriteMeta(self, meta):
+        # Written to a temporary file and renamed so readers never see a half-written watermark
+        temp_path = self._MetaPath().with_suffix(".tmp")
+        with open(temp_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+            meta_file.flush()
+            os.fsync(meta_file.fileno())
+        os.replace(temp_path, self._MetaPath())
+
+    # ------------------------------------------------------------------ loading
+
+    def Refresh(self, batch_size=100000):
+        """
+        Appends every sale with a SalesId above the watermark to the column files.
+
+        Args:
+            batch_size (int): Number of rows fetched from the database per round trip.
+
+        Returns:
+            int: Number of rows appended.
+        """
+        with self._Locked():    # Another refresh would append from the same watermark
+            return self._Refresh(batch_size)
+
+    def _Refresh(self, batch_size):
+        from Sales.models import Sales
+
+        meta = self.GetMeta()
+        payment_codes = {name: code for code, name in enumerate(meta["PaymentMethods"])}
+        appended = 0
+
+        # Drop anything written after the last committed count, e.g. by an interrupted refresh
+        for name, dtype in COLUMNS.items():
+            path = self._ColumnPath(name)
+            with open(path, "ab") as column_file:
+                column_file.truncate(meta["Count"] * np.dtype(dtype).itemsize)
+
+        while True:
+            rows = list(
+                Sales.objects.filter(SalesId__gt=meta["Watermark"])
+                .order_by("SalesId")
+                .values_list(
+                    "SalesId", "SaleTimestamp", "StoreId", "ProductId", "StaffId", "PaymentMethod", "TotalAmount"
+                )[:batch_size]
+            )
+            if not rows:
+                break
+
+            sales_ids, timestamps, store_ids, product_ids, staff_ids, payments, amounts = zip(*rows)
+
+            for payment in set(payments):  # Extend the payment method dictionary with unseen values
+                if payment not in payment_codes:
+                    payment_codes[payment] = len(meta["PaymentMethods"])
+                    meta["PaymentMethods"].append(payment)
+
+            batch = {
+                "SalesId": np.fromiter(sales_ids, dtype=COLUMNS["SalesId"], count=len(rows)),
+                "SaleDate": np.fromiter(
+                    (timezone.localtime(t).toordinal() - EPOCH_ORDINAL for t in timestamps),
+                    dtype=COLUMNS["SaleDate"], count=len(rows),
+                ),
+                "StoreId": np.fromiter(store_ids, dtype=COLUMNS["StoreId"], count=len(rows)),
+                "ProductId": np.fromiter(
+                    (NULL_ID if p is None else p for p in product_ids), dtype=COLUMNS["ProductId"], count=len(rows)
+                ),
+                "StaffId": np.fromiter(
+                    (NULL_ID if s is None else s for s in staff_ids), dtype=COLUMNS["StaffId"], count=len(rows)
+                ),
+                "PaymentMethod": np.fromiter(
+                    (payment_codes[p] for p in payments), dtype=COLUMNS["PaymentMethod"], count=len(rows)
+                ),
+                "TotalAmount": np.fromiter(
+                    (int(a * 100) for a in amounts), dtype=COLUMNS["TotalAmount"], count=len(rows)
+                ),
+            }
+
+            for name, values in batch.items():
+                with open(self._ColumnPath(name), "ab") as column_file:
+                    column_file.write(values.tobytes())
+                    column_file.flush()
+                    os.fsync(column_file.fileno())
+
+            # Only advance the committed count once every column has been written
+            meta["Count"] += len(rows)
+            meta["Watermark"] = sales_ids[-1]
+            self._WriteMeta(meta)
+            appended += len(rows)
+
+        return appended
+
+    def Rebuild(self, batch_size=100000):
+        # Discards the mirror and reloads it from scratch, needed after sales are edited or deleted
+        with self._Locked():
+            for name in COLUMNS:
+                self._ColumnPath(name).unlink(missing_ok=True)
+            self._MetaPath().unlink(missing_ok=True)
+            self._columns = None
+            return self._Refresh(batch_size)
+
+    def _Columns(self, meta):
+        # Opens (or reuses) read-only memory maps sized to the committed row count
+        count = meta["Count"]
+        if self._columns is None or self._columns_count != (count, meta["Watermark"]):
+            self._columns = {
+                name: (
+                    np.memmap(self._ColumnPath(name), dtype=dtype, mode="r", shape=(count,))
+                    if count
+                    else np.empty(0, dtype=dtype)
+                )
+                for name, dtype in COLUMNS.items()
+            }
+            self._columns_count = (count, meta["Watermark"])
+        return self._columns
+
+    # ------------------------------------------------------------------ querying
+
+    def _DimensionValues(self, columns, dimension, payment_methods):
+        # Returns the integer array backing a dimension, deriving week and month buckets from SaleDate
+        if dimension == "PaymentMethod":  # Codes follow arrival order, rank them so groups sort by name
+            ranks = np.argsort(np.argsort(np.array(payment_methods, dtype=object))).astype(np.int16)
+            return ranks[columns["PaymentMethod"]] if len(ranks) else columns["PaymentMethod"]
+        if dimension == "SaleWeek":  # Day 0 (1970-01-01) was a Thursday, shift so weeks start on Monday
+            days = columns["SaleDate"].astype(np.int64)
+            return days - (days + 3) % 7
+        if dimension == "SaleMonth":
+            days = columns["SaleDate"].astype("datetime64[D]")
+            return days.astype("datetime64[M]").astype(np.int64)
+        return columns[dimension]
+
+    def _Decode(self, dimension, value, payment_methods):
+        # Converts a stored integer back to the value the ORM would return for the same dimension
+        value = int(value)
+        if dimension in ("SaleDate", "SaleWeek"):
+            return date.fromordinal(value + EPOCH_ORDINAL)
+        if dimension == "SaleMonth":
+            return date(1970 + value // 12, value % 12 + 1, 1)
+        if dimension == "PaymentMethod":
+            return payment_methods[value]
+        if dimension in ("ProductId", "StaffId") and value == NULL_ID:
+            return None
+        return value
+
+    def _Encode(self, dimension, value, payment_codes):
+        # Converts a filter value to the stored integer representation
+        if dimension in ("SaleDate", "SaleWeek", "SaleMonth"):
+            raise ValueError("Filter dates with start_date and end_date.")
+        if dimension == "PaymentMethod":
+            return payment_codes.get(value, NULL_ID)
+        return NULL_ID if value is None else int(value)
+
+    def Query(self, group_by=(), start_date=None, end_date=None, filters=None):
+        """
+        Runs a vectorised filter and group-by over the mirrored sales.
+
+        Args:
+            group_by (list): Dimensions to group by, from DIMENSIONS.
+            start_date (datetime.date, optional): Only include sales on or after this date.
+            end_date (datetime.date, optional): Only include sales on or before this date.
+            filters (dict, optional): Dimension -> value or list of values to keep.
+
+        Returns:
+            list: Dictionaries keyed by the group-by dimensions plus TotalSales and SalesCount,
+            ordered by the dimensions, matching ``values(...).annotate(Sum("TotalAmount"))``.
+        """
+        group_by = list(group_by)
+        unknown = (set(group_by) | set(filters or {})) - DIMENSIONS
+        if unknown:
+            raise ValueError(f"Unknown dimensions: {', '.join(sorted(unknown))}")
+
+        meta = self.GetMeta()
+        columns = self._Columns(meta)
+        payment_codes = {name: code for code, name in enumerate(meta["PaymentMethods"])}
+
+        # Build a boolean mask for the date range and any dimension filters
+        mask = None
+        if start_date:
+            mask = columns["SaleDate"] >= start_date.toordinal() - EPOCH_ORDINAL
+        if end_date:
+            condition = columns["SaleDate"] <= end_date.toordinal() - EPOCH_ORDINAL
+            mask = condition if mask is None else mask & condition
+        for dimension, wanted in (filters or {}).items():
+            wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+            codes = [self._Encode(dimension, value, payment_codes) for value in wanted]
+            condition = np.isin(columns[dimension], codes)
+            mask = condition if mask is None else mask & condition
+
+        amounts = columns["TotalAmount"] if mask is None else columns["TotalAmount"][mask]
+
+        if not group_by:
+            if not len(amounts):
+                return [{"TotalSales": None, "SalesCount": 0}]
+            return [{"TotalSales": _ToDecimal(int(amounts.sum())), "SalesCount": int(len(amounts))}]
+
+        # Factorise each dimension into codes, a plain offset when the value range is small
+        codes, uniques = [], []
+        for dimension in group_by:
+            values = self._DimensionValues(columns, dimension, meta["PaymentMethods"])
+            values = values if mask is None else values[mask]
+            if not len(values):
+                return []
+            low, high = int(values.min()), int(values.max())
+            if high - low < 1 << 20:
+                codes.append(values - values.dtype.type(low))
+                uniques.append(np.arange(low, high + 1))
+            else:
+                unique_values, inverse = np.unique(values, return_inverse=True)
+                codes.append(inverse.reshape(-1))
+                uniques.append(unique_values)
+
+        # Combine the per-dimension codes into one group key and aggregate with bincount
+        shape = tuple(len(u) for u in uniques)
+        key_space = int(np.prod(shape, dtype=np.float64))
+        weights = amounts.astype(np.float64)
+        if key_space < 1 << 26:
+            group_keys = codes[-1].astype(np.int32)
+            stride = shape[-1]
+            for code, size in zip(reversed(codes[:-1]), reversed(shape[:-1])):
+                group_keys = group_keys + code.astype(group_keys.dtype) * stride
+                stride *= size
+            counts = np.bincount(group_keys, minlength=key_space)
+            totals = np.bincount(group_keys, weights=weights, minlength=key_space)
+            groups = np.flatnonzero(counts)
+            totals, counts = totals[groups], counts[groups]
+            group_codes = np.unravel_index(groups, shape)
+        else:  # Too many combinations for a dense key space, fall back to sorting the stacked codes
+            stacked = np.stack(codes, axis=1)
+            unique_rows, inverse = np.unique(stacked, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            totals = np.bincount(inverse, weights=weights)
+            counts = np.bincount(inverse)
+            group_codes = unique_rows.T
+
+        # Groups come out ordered by the dimension codes, which follow the decoded sort order
+        results = []
+        payment_names = sorted(meta["PaymentMethods"])
+        decoded = [
+            [self._Decode(dimension, value, payment_names) for value in uniques[i][group_codes[i]].tolist()]
+            for i, dimension in enumerate(group_by)
+        ]
+        for row, (total, count) in enumerate(zip(np.rint(totals).astype(np.int64).tolist(), counts.tolist())):
+            result = {dimension: decoded[i][row] for i, dimension in enumerate(group_by)}
+            result["TotalSales"] = _ToDecimal(total)
+            result["SalesCount"] = count
+            results.append(result)
+        return results
+
+
+def _ToDecimal(pence):
+    # Converts a pence total back to the two-decimal-place value returned by the ORM
+    return (Decimal(pence) / 100).quantize(Decimal("0.01"))
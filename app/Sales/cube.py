@@ -0,0 +1,245 @@
+from decimal import Decimal
+from itertools import combinations
+
+from django.db.models import Count, F, IntegerField, Max, Min, Sum
+from django.db.models.functions import Round, TruncMonth, TruncWeek
+
+from app.responses import ColumnarEncoder
+from Sales.archive import ReadAcrossArchive
+
+# Dimensions a cube can be broken down by. ProductType is looked up from ProductId after the scan,
+# because the archive and the shards have no products table to join.
+DIMENSIONS = ("StoreId", "ProductId", "StaffId", "PaymentMethod", "ProductType", "SaleDate", "SaleWeek", "SaleMonth")
+FILTERS = ("StoreId", "ProductId", "StaffId", "PaymentMethod", "ProductType")
+
+
+def _Pence():
+    # Sale amount in pence, so partial sums merge exactly
+    return Round(F("TotalAmount") * 100, output_field=IntegerField())
+
+
+# Partial aggregates read from the database, with the function merging two partials of the same group
+PARTIALS = {
+    "TotalSales": (lambda: Sum(_Pence()), lambda a, b: a + b),
+    "SalesCount": (lambda: Count("*"), lambda a, b: a + b),
+    "Quantity": (lambda: Sum("Quantity"), lambda a, b: a + b),
+    "MinSale": (lambda: Min(_Pence()), min),
+    "MaxSale": (lambda: Max(_Pence()), max),
+}
+PENCE = {"TotalSales", "MinSale", "MaxSale"}   # Partials returned as amounts
+CENTS = Decimal("0.01")
+
+# Measure -> partials it is computed from
+MEASURES = {
+    "TotalSales": ("TotalSales",),
+    "SalesCount": ("SalesCount",),
+    "Quantity": ("Quantity",),
+    "AverageSale": ("TotalSales", "SalesCount"),
+    "MinSale": ("MinSale",),
+    "MaxSale": ("MaxSale",),
+}
+
+MAX_CUBE_DIMENSIONS = 6     # A full cube has 2^n grouping sets
+LABELLED = {"StoreId": ("Inventory", "Store", "StoreName"), "ProductId": ("Inventory", "Product", "ProductName"),
+            "StaffId": ("HR", "Staff", "StaffName")}
+
+
+def _Column(dimension):
+    # Expression grouped on in SQL for a dimension, week and month buckets are truncated by the database
+    if dimension == "SaleWeek":
+        return TruncWeek("SaleDate")
+    if dimension == "SaleMonth":
+        return TruncMonth("SaleDate")
+    return F("ProductId" if dimension == "ProductType" else dimension)
+
+
+def GroupingSets(dimensions, grouping="cube"):
+    """
+    Expands a grouping specification into the grouping sets to compute.
+
+    Args:
+        dimensions (list): Dimensions of the cube.
+        grouping (str or list): "cube" for every subset of the dimensions, "rollup" for the
+            hierarchy dimensions[:n], ..., dimensions[:1], (), or a list of dimension lists.
+
+    Returns:
+        list: Tuples of dimensions, finest first, without duplicates.
+    """
+    if grouping == "cube":
+        if len(dimensions) > MAX_CUBE_DIMENSIONS:
+            raise ValueError(f"A cube has at most {MAX_CUBE_DIMENSIONS} dimensions, use rollup or explicit grouping sets.")
+        sets = [subset for size in range(len(dimensions), -1, -1) for subset in combinations(dimensions, size)]
+    elif grouping == "rollup":
+        sets = [tuple(dimensions[:size]) for size in range(len(dimensions), -1, -1)]
+    elif isinstance(grouping, str):
+        raise ValueError("grouping must be cube, rollup or a list of grouping sets.")
+    else:
+        sets = []
+        for subset in grouping:
+            unknown = set(subset) - set(dimensions)
+            if unknown:
+                raise ValueError(f"Grouping set uses dimensions that are not in the cube: {', '.join(sorted(unknown))}")
+            sets.append(tuple(dimension for dimension in dimensions if dimension in subset))    # Cube order
+    return list(dict.fromkeys(sets))
+
+
+def _Merge(target, partials, mergers):
+    # Folds one group's partial aggregates into the accumulated ones
+    for position, (value, merge) in enumerate(zip(partials, mergers)):
+        current = target[position]
+        target[position] = value if current is None else current if value is None else merge(current, value)
+
+
+def _SortKey(key):
+    # Orders group keys like SQL sorts them ascending, missing values first
+    return tuple((value is not None, value) for value in key)
+
+
+def BuildCube(dimensions, measures=("TotalSales", "SalesCount"), grouping="cube", start_date=None, end_date=None,
+              filters=None, labels=False, columnar=False):
+    """
+    Aggregates sales over several grouping levels at once, e.g. per store and payment method, per
+    store, per payment method and overall, for one dashboard call.
+
+    The sales are read in a single pass: one GROUP BY at the finest level, on every shard and on the
+    archive when the range reaches it. Every grouping set is then rolled up from those groups with
+    in-memory hash aggregation, so adding a breakdown costs no extra scan. The database never sees
+    GROUPING SETS, which SQLite doesn't support, and partial results of shards and the archive have
+    to be merged in Python anyway. Only mergeable partials (sums, counts, minimums and maximums) are
+    read, averages are derived from them.
+
+    Args:
+        dimensions (list): Dimensions of the cube, from DIMENSIONS.
+        measures (list): Measures of every group, from MEASURES.
+        grouping (str or list): Grouping sets, see GroupingSets.
+        start_date (datetime.date, optional): Only include sales on or after this date.
+        end_date (datetime.date, optional): Only include sales on or before this date.
+        filters (dict, optional): Dimension from FILTERS -> value or list of values to keep.
+        labels (bool): Also return the names of the stores, products and staff in the groups.
+        columnar (bool): Return each grouping set's rows as one list per column.
+
+    Returns:
+        dict: "groupings", one {"by": dimensions, "rows": rows} per grouping set, finest first, with
+        rows ordered by their dimensions, "labels" when requested, and for the columnar format
+        "codes", the label lists of the dictionary-encoded PaymentMethod and ProductType columns.
+    """
+    from Inventory.models import Product
+
+    dimensions, measures = list(dict.fromkeys(dimensions)), list(dict.fromkeys(measures))
+    unknown = set(dimensions) - set(DIMENSIONS) | set(measures) - set(MEASURES) | set(filters or {}) - set(FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown dimensions or measures: {', '.join(sorted(unknown))}")
+    if not measures:
+        raise ValueError("At least one measure is required.")
+    sets = GroupingSets(dimensions, grouping)
+
+    filters, conditions = dict(filters or {}), {}
+    for dimension, wanted in filters.items():
+        wanted = list(wanted) if isinstance(wanted, (list, tuple, set)) else [wanted]
+        filters[dimension] = wanted
+        if dimension != "ProductType":
+            conditions[f"{dimension}__in"] = wanted
+    if "ProductType" in filters:    # Filtered as the ids of the products of those types
+        typed = set(Product.objects.filter(ProductType__in=filters["ProductType"]).values_list("ProductId", flat=True))
+        conditions["ProductId__in"] = typed & set(conditions.get("ProductId__in", typed))
+
+    partials = list(dict.fromkeys(name for measure in measures for name in MEASURES[measure]))
+    mergers = [PARTIALS[name][1] for name in partials]
+    columns = list(dict.fromkeys("ProductId" if dimension == "ProductType" else dimension for dimension in dimensions))
+
+    def Scan(sales_queryset):
+        if start_date:
+            sales_queryset = sales_queryset.filter(SaleDate__gte=start_date)
+        if end_date:
+            sales_queryset = sales_queryset.filter(SaleDate__lte=end_date)
+        sales_queryset = sales_queryset.filter(**conditions)
+        if not columns:     # Just the grand total, values_list() without names would select every field
+            totals = sales_queryset.aggregate(Rows=Count("*"), **{name: PARTIALS[name][0]() for name in partials})
+            return [tuple(totals[name] for name in partials)] if totals["Rows"] else []
+        names = [f"Group{position}" for position in range(len(columns))]
+        return list(
+            sales_queryset.annotate(**{name: _Column(column) for name, column in zip(names, columns)})
+            .values_list(*names)
+            .annotate(**{name: PARTIALS[name][0]() for name in partials})
+            .order_by()
+        )
+
+    results = ReadAcrossArchive(Scan, start_date)
+
+    # Key every group by the cube's dimensions, merging the shards and the archive
+    types = {}
+    if "ProductType" in dimensions:
+        productIds = {row[columns.index("ProductId")] for rows in results for row in rows}
+        types = dict(Product.objects.filter(ProductId__in=productIds - {None}).values_list("ProductId", "ProductType"))
+    positions = [columns.index("ProductId" if dimension == "ProductType" else dimension) for dimension in dimensions]
+    base = {}
+    for rows in results:
+        for row in rows:
+            key = tuple(
+                types.get(row[position]) if dimension == "ProductType" else row[position]
+                for dimension, position in zip(dimensions, positions)
+            )
+            accumulated = base.get(key)
+            if accumulated is None:
+                base[key] = list(row[len(columns):])
+            else:
+                _Merge(accumulated, row[len(columns):], mergers)
+
+    encoder = ColumnarEncoder(labelled=[d for d in ("PaymentMethod", "ProductType") if d in dimensions]) if columnar else None
+    groupings = []
+    for subset in sets:
+        if subset == tuple(dimensions):
+            groups = base
+        else:   # Roll the finest groups up to this grouping set
+            keep = [dimensions.index(dimension) for dimension in subset]
+            groups = {}
+            for key, values in base.items():
+                key = tuple(key[position] for position in keep)
+                accumulated = groups.get(key)
+                if accumulated is None:
+                    groups[key] = list(values)
+                else:
+                    _Merge(accumulated, values, mergers)
+        if not subset and not groups:  # The grand total exists even without sales, like SQL's
+            groups[()] = [0 if name in ("TotalSales", "SalesCount", "Quantity") else None for name in partials]
+
+        rows = []
+        for key in sorted(groups, key=_SortKey):
+            values = dict(zip(partials, groups[key]))
+            rows.append((*key, *(_Measure(measure, values) for measure in measures)))
+
+        names = (*subset, *measures)
+        rows = encoder.Table(rows, names) if columnar else [dict(zip(names, row)) for row in rows]
+        groupings.append({"by": list(subset), "rows": rows})
+
+    cube = {"dimensions": dimensions, "measures": measures, "groupings": groupings}
+    if columnar:
+        cube["codes"] = encoder.Labels()
+    if labels:
+        cube["labels"] = _Labels(dimensions, base)
+    return cube
+
+
+def _Measure(measure, values):
+    # Computes a measure from its group's merged partials, amounts are converted back from pence
+    if measure == "AverageSale":
+        count = values["SalesCount"]
+        return (Decimal(int(values["TotalSales"])) / count / 100).quantize(CENTS) if count else None
+    value = values[MEASURES[measure][0]]
+    if measure in PENCE and value is not None:
+        return (Decimal(int(value)) / 100).quantize(CENTS)
+    return value
+
+
+def _Labels(dimensions, groups):
+    # Names of the stores, products and staff appearing in the groups, by dimension and id
+    from django.apps import apps
+
+    labels = {}
+    for position, dimension in enumerate(dimensions):
+        if dimension in LABELLED:
+            app_label, model_name, field = LABELLED[dimension]
+            model = apps.get_model(app_label, model_name)
+            ids = {key[position] for key in groups} - {None}
+            labels[dimension] = dict(model.objects.filter(pk__in=ids).values_list("pk", field)) if ids else {}
+    return labels
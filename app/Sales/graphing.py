@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta
+
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.utils import timezone
+
+# Supported sales graph granularities and the SQL truncation function used for each
+GRANULARITIES = {
+    "hour": TruncHour,
+    "day": TruncDay,
+    "week": TruncWeek,
+    "month": TruncMonth,
+}
+MAX_GRAPH_BUCKETS = 10_000  # Most points a graph may span, every empty bucket in a range is filled with a zero
+
+
+def TruncateForGranularity(granularity, field_name="SaleTimestamp"):
+    """
+    Returns the database expression that buckets a datetime field by the given granularity.
+
+    Raises:
+        ValueError: If the granularity is not one of GRANULARITIES.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Granularity must be one of: {', '.join(GRANULARITIES)}.")
+    return GRANULARITIES[granularity](field_name, tzinfo=timezone.get_current_timezone())
+
+
+def BucketStart(value, granularity):
+    # Truncates a naive local datetime to the start of its bucket, mirroring the SQL Trunc functions
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if granularity == "hour":
+        return value
+    value = value.replace(hour=0)
+    if granularity == "week":
+        return value - timedelta(days=value.weekday())
+    if granularity == "month":
+        return value.replace(day=1)
+    return value
+
+
+def NextBucket(value, granularity):
+    # Returns the start of the bucket after the one starting at the given naive local datetime
+    if granularity == "hour":
+        return value + timedelta(hours=1)
+    if granularity == "day":
+        return value + timedelta(days=1)
+    if granularity == "week":
+        return value + timedelta(weeks=1)
+    if value.month == 12:
+        return value.replace(year=value.year + 1, month=1)
+    return value.replace(month=value.month + 1)
+
+
+def _ToLocal(value):
+    # Buckets are stepped in naive local time so DST shifts don't skew them
+    return timezone.make_naive(value, timezone.get_current_timezone()) if timezone.is_aware(value) else value
+
+
+def CheckBucketCount(start, end, granularity):
+    """
+    Checks that a range spans at most MAX_GRAPH_BUCKETS buckets of the given granularity.
+
+    Raises:
+        ValueError: If filling the range would create more buckets than that.
+    """
+    first, last = BucketStart(_ToLocal(start), granularity), BucketStart(_ToLocal(end), granularity)
+    if granularity == "month":
+        count = (last.year - first.year) * 12 + last.month - first.month + 1
+    else:
+        step = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}[granularity]
+        count = (last - first) // step + 1
+    if count > MAX_GRAPH_BUCKETS:
+        raise ValueError(
+            f"A graph has at most {MAX_GRAPH_BUCKETS} points, use a shorter date range or a coarser granularity."
+        )
+
+
+def FillGaps(points, granularity, start=None, end=None):
+    """
+    Inserts zero-valued buckets so the series has one point per bucket.
+
+    Args:
+        points (list): (aware datetime, value) pairs ordered by time, as returned by the database.
+        granularity (str): One of GRANULARITIES.
+        start (datetime, optional): First bucket to include, defaults to the first point.
+        end (datetime, optional): Last bucket to include, defaults to the last point.
+
+    Returns:
+        list: (aware datetime, value) pairs with missing buckets set to 0.
+
+    Raises:
+        ValueError: If the series would have more than MAX_GRAPH_BUCKETS points.
+    """
+    current_tz = timezone.get_current_timezone()
+
+    existing = {_ToLocal(moment): value for moment, value in points}
+    if not existing and (start is None or end is None):
+        return []
+
+    first = BucketStart(_ToLocal(start) if start else min(existing), granularity)
+    last = BucketStart(_ToLocal(end) if end else max(existing), granularity)
+    CheckBucketCount(first, last, granularity)  # Before building the list, the range comes from the client
+
+    filled = []
+    bucket = first
+    while bucket <= last:
+        filled.append((timezone.make_aware(bucket, current_tz), existing.get(bucket, 0)))
+        bucket = NextBucket(bucket, granularity)
+    return filled
+
+
+def DownsampleLTTB(points, max_points):
+    """
+    Reduces a series to at most max_points with the Largest-Triangle-Three-Buckets algorithm.
+
+    LTTB keeps the first and last points and, for each bucket in between, the point forming the
+    largest triangle with the previously kept point and the average of the next bucket, which
+    preserves the visual shape (peaks and troughs) of the series.
+
+    Args:
+        points (list): (datetime, value) pairs ordered by time.
+        max_points (int): Maximum number of points to return, at least 3.
+
+    Returns:
+        list: The selected (datetime, value) pairs, in order.
+    """
+    if max_points is None or len(points) <= max_points:
+        return list(points)
+    if max_points < 3:
+        raise ValueError("max_points must be at least 3.")
+
+    xs = [moment.timestamp() for moment, _ in points]
+    ys = [float(value) for _, value in points]
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (max_points - 2)
+    selected = 0  # Index of the most recently kept point
+
+    for bucket in range(max_points - 2):
+        # Average of the next bucket, used as the third vertex of the triangle
+        next_start = int((bucket + 1) * bucket_size) + 1
+        next_end = min(int((bucket + 2) * bucket_size) + 1, len(points))
+        average_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        average_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        # Pick the point in the current bucket that forms the largest triangle
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+        best_area, best_index = -1.0, start
+        for index in range(start, end):
+            area = abs(
+                (xs[selected] - average_x) * (ys[index] - ys[selected])
+                - (xs[selected] - xs[index]) * (average_y - ys[selected])
+            )
+            if area > best_area:
+                best_area, best_index = area, index
+
+        sampled.append(points[best_index])
+        selected = best_index
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def DateToDatetime(value, end_of_day=False):
+    # Converts an optional date (or ISO date string) filter to an aware datetime at the start or end of the day
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if end_of_day:
+        value = value.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return timezone.make_aware(value) if timezone.is_naive(value) else value
@@ -0,0 +1,44 @@
+import time
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from Sales.archive import ArchiveSales, GetArchiveState
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves sales older than the archive horizon into the archive database in batches. "
+        "Safe to interrupt, running it again resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, help="Archive sales older than this many days, defaults to SALES_ARCHIVE_DAYS.")
+        parser.add_argument("--before", type=date.fromisoformat, help="Archive sales before this date (YYYY-MM-DD) instead.")
+        parser.add_argument("--batch-size", type=int, help="Sales moved per batch, defaults to SALES_ARCHIVE_BATCH_SIZE.")
+        parser.add_argument("--pause", type=float, help="Seconds between batches, defaults to SALES_ARCHIVE_PAUSE.")
+
+    def handle(self, *args, **options):
+        before = options["before"]
+        if before is None:
+            days = settings.SALES_ARCHIVE_DAYS if options["days"] is None else options["days"]
+            before = timezone.localdate() - timedelta(days=days)
+        if before > timezone.localdate():
+            raise CommandError("Refusing to archive sales from the future.")
+
+        started = time.perf_counter()
+        moved = ArchiveSales(
+            before,
+            batch_size=options["batch_size"] or settings.SALES_ARCHIVE_BATCH_SIZE,
+            pause=settings.SALES_ARCHIVE_PAUSE if options["pause"] is None else options["pause"],
+            progress=lambda count: self.stdout.write(f"  moved {count} sales"),
+        )
+        elapsed = time.perf_counter() - started
+
+        state = GetArchiveState()
+        self.stdout.write(
+            f"Archived {moved} sales before {before} in {elapsed:.2f}s, "
+            f"the archive holds {state.ArchivedRows} sales before {state.ArchivedBefore}."
+        )
@@ -0,0 +1,90 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import Client
+from django.test.utils import override_settings
+
+from app.facade import Facade
+from app.responses import DumpJson, brotli, orjson
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures encode time, payload size and conditional GET savings for the analytics endpoints, "
+        "and compares the row and columnar formats."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--repeat", type=int, default=20, help="Number of timed runs per measurement.")
+        parser.add_argument("--start-date", help="Optional start date passed to the endpoints.")
+        parser.add_argument("--end-date", help="Optional end date passed to the endpoints.")
+
+    def Time(self, function, repeat):
+        # Returns the median wall time of a callable in milliseconds
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return timings[len(timings) // 2]
+
+    def handle(self, *args, **options):
+        repeat = options["repeat"]
+        data = Facade().GetStorePerformance(options["start_date"], options["end_date"])
+
+        # Serialisation: the previous JsonResponse encoder against DumpJson
+        baseline = json.dumps(data, cls=DjangoJSONEncoder).encode()
+        fast = DumpJson(data)
+        baseline_ms = self.Time(lambda: json.dumps(data, cls=DjangoJSONEncoder).encode(), repeat)
+        fast_ms = self.Time(lambda: DumpJson(data), repeat)
+
+        self.stdout.write(f"Rows: {len(data['store_sales'])} store, {len(data['product_sales'])} product")
+        self.stdout.write(f"Encode DjangoJSONEncoder: {baseline_ms:.2f} ms, {len(baseline)} bytes")
+        self.stdout.write(f"Encode {'orjson' if orjson else 'compact json'}: {fast_ms:.2f} ms, {len(fast)} bytes")
+
+        # Compression of the fast body
+        gzipped = gzip.compress(fast, compresslevel=6, mtime=0)
+        gzip_ms = self.Time(lambda: gzip.compress(fast, compresslevel=6, mtime=0), repeat)
+        self.stdout.write(f"gzip: {gzip_ms:.2f} ms, {len(gzipped)} bytes ({len(gzipped) / len(fast):.1%})")
+        if brotli is not None:
+            compressed = brotli.compress(fast, quality=4)
+            brotli_ms = self.Time(lambda: brotli.compress(fast, quality=4), repeat)
+            self.stdout.write(f"brotli: {brotli_ms:.2f} ms, {len(compressed)} bytes ({len(compressed) / len(fast):.1%})")
+
+        # Row dictionaries against the columnar format, from the query results to the encoded body
+        for response_format in ("rows", "columnar"):
+            columnar = response_format == "columnar"
+            payload = Facade().GetStorePerformance(options["start_date"], options["end_date"], columnar=columnar)
+            body = DumpJson(payload)
+            build_ms = self.Time(
+                lambda: Facade().GetStorePerformance(options["start_date"], options["end_date"], columnar=columnar), repeat
+            )
+            encode_ms = self.Time(lambda: DumpJson(payload), repeat)
+            sizes = f"gzip {len(gzip.compress(body, compresslevel=6, mtime=0))} bytes"
+            if brotli is not None:
+                sizes += f", brotli {len(brotli.compress(body, quality=4))} bytes"
+            self.stdout.write(
+                f"Format {response_format}: query and build {build_ms:.2f} ms, encode {encode_ms:.2f} ms, "
+                f"{len(body)} bytes ({sizes})"
+            )
+
+        # Full request against a conditional request answered from the ETag
+        params = {k: v for k, v in (("start_date", options["start_date"]), ("end_date", options["end_date"])) if v}
+        with override_settings(ALLOWED_HOSTS=["testserver"]):
+            client = Client(HTTP_ACCEPT_ENCODING="gzip, br")
+            for name in ("store-performance", "sales-graph"):
+                for response_format in ("rows", "columnar"):
+                    path = "/Sales/performance/" if name == "store-performance" else "/Sales/graph/"
+                    query = {**params, "format": response_format}
+                    response = client.get(path, query)
+                    etag = response["ETag"]
+                    full_ms = self.Time(lambda: client.get(path, query), repeat)
+                    cached_ms = self.Time(lambda: client.get(path, query, HTTP_IF_NONE_MATCH=etag), repeat)
+                    self.stdout.write(
+                        f"{path}?format={response_format}: full {full_ms:.2f} ms, {len(response.content)} bytes "
+                        f"({response.get('Content-Encoding', 'identity')}); 304 {cached_ms:.2f} ms, 0 bytes"
+                    )
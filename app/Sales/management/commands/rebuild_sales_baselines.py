@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Sales.anomaly import RebuildBaselines
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the sales anomaly baselines from every sale, archived ones included, and moves the "
+        "watermarks of the sales-anomalies job past them. Pause the job while rebuilding."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--alerts", action="store_true", help="Also record the alerts the history would have raised.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = RebuildBaselines(alert=options["alerts"])
+        self.stdout.write(
+            f"Read {result['Sales']} sales into {result['Baselines']} baselines in {time.perf_counter() - started:.2f}s, "
+            f"{result['Alerts']} alerts raised."
+        )
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from Sales.sketches import RebuildSketches
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the per store and day sales sketches from every sale, archived ones included, and moves "
+        "the watermarks of the sales-sketches job past them. Pause the job while rebuilding."
+    )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = RebuildSketches()
+        self.stdout.write(
+            f"Read {result['Sales']} sales into {result['Sketches']} sketches in {time.perf_counter() - started:.2f}s."
+        )
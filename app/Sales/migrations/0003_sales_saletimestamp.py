@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:08
+
+from datetime import datetime, time
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def BackfillSaleTimestamp(apps, schema_editor):
+    # Existing sales only recorded a date, so their timestamp is set to midnight on that date
+    Sales = apps.get_model("Sales", "Sales")
+    current_tz = django.utils.timezone.get_current_timezone()
+    dates = Sales.objects.using(schema_editor.connection.alias).values_list("SaleDate", flat=True).distinct()
+    for sale_date in dates:
+        Sales.objects.using(schema_editor.connection.alias).filter(SaleDate=sale_date).update(
+            SaleTimestamp=django.utils.timezone.make_aware(datetime.combine(sale_date, time.min), current_tz)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sales', '0002_rename_dateofsale_sales_saledate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sales',
+            name='SaleTimestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(BackfillSaleTimestamp, migrations.RunPython.noop),
+    ]
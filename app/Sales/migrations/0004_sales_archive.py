@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sales', '0003_sales_saletimestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedSales',
+            fields=[
+                ('SalesId', models.IntegerField(primary_key=True, serialize=False)),
+                ('PaymentMethod', models.CharField(max_length=200)),
+                ('TotalAmount', models.DecimalField(decimal_places=2, max_digits=15)),
+                ('StoreId', models.IntegerField()),
+                ('ProductId', models.IntegerField(null=True)),
+                ('StaffId', models.IntegerField(null=True)),
+                ('SaleDate', models.DateField(db_index=True)),
+                ('SaleTimestamp', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesArchive',
+            fields=[
+                ('ArchiveId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('ArchivedBefore', models.DateField(null=True)),
+                ('Generation', models.PositiveBigIntegerField(default=0)),
+                ('ArchivedRows', models.PositiveBigIntegerField(default=0)),
+                ('UpdatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sales', '0004_sales_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedsales',
+            name='Quantity',
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='sales',
+            name='Quantity',
+            field=models.IntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:10
+
+from django.db import migrations
+
+
+def CreateOutboxTriggers(apps, schema_editor):
+    # Adding Quantity rebuilt Sales_sales on SQLite, which drops the table's triggers
+    if schema_editor.connection.vendor == "sqlite":
+        from Operations.outbox import CreateOutboxTriggers
+        with schema_editor.connection.cursor() as cursor:
+            CreateOutboxTriggers(cursor)     # Triggers that still exist are left as they are
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sales', '0005_sales_quantity'),
+        ('Operations', '0002_outboxevent'),
+    ]
+
+    operations = [
+        # Runs wherever the Sales table lives, sales shards included (see app.routers.ShardRouter)
+        migrations.RunPython(CreateOutboxTriggers, migrations.RunPython.noop, hints={"model_name": "sales"}),
+    ]
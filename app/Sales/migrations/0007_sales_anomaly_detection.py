@@ -0,0 +1,60 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:34
+
+import Sales.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0006_store_version'),
+        ('Sales', '0006_restore_outbox_triggers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomalyState',
+            fields=[
+                ('AnomalyStateId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('Database', models.CharField(max_length=100, unique=True)),
+                ('LastSalesId', models.BigIntegerField(default=0)),
+                ('UpdatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesAlert',
+            fields=[
+                ('SalesAlertId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('Kind', models.CharField(choices=[('sale-spike', 'sale-spike'), ('revenue-drop', 'revenue-drop'), ('revenue-spike', 'revenue-spike')], max_length=20)),
+                ('SalesId', models.BigIntegerField(null=True)),
+                ('Day', models.DateField()),
+                ('Value', models.FloatField()),
+                ('Expected', models.FloatField()),
+                ('ZScore', models.FloatField()),
+                ('CreatedAt', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('ProductId', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sales_alerts', to='Inventory.product')),
+                ('StoreId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_alerts', to='Inventory.store')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesBaseline',
+            fields=[
+                ('SalesBaselineId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('Series', models.CharField(max_length=50, unique=True)),
+                ('AmountCount', models.IntegerField(default=0)),
+                ('AmountMean', models.FloatField(default=0)),
+                ('AmountM2', models.FloatField(default=0)),
+                ('Day', models.DateField(db_index=True, null=True)),
+                ('DayTotal', models.FloatField(default=0)),
+                ('DayCount', models.IntegerField(default=0)),
+                ('DayMean', models.FloatField(default=0)),
+                ('DayM2', models.FloatField(default=0)),
+                ('Ewma', models.FloatField(default=0)),
+                ('EwmVar', models.FloatField(default=0)),
+                ('Weekdays', models.JSONField(default=Sales.models._EmptyWeekdays)),
+                ('ProductId', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sales_baselines', to='Inventory.product')),
+                ('StoreId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_baselines', to='Inventory.store')),
+            ],
+        ),
+    ]
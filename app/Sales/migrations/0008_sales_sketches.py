@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Inventory', '0007_product_price_history'),
+        ('Sales', '0007_sales_anomaly_detection'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SketchState',
+            fields=[
+                ('SketchStateId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('Database', models.CharField(max_length=100, unique=True)),
+                ('LastSalesId', models.BigIntegerField(default=0)),
+                ('UpdatedAt', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesSketch',
+            fields=[
+                ('SalesSketchId', models.AutoField(primary_key=True, serialize=False, unique=True)),
+                ('Day', models.DateField(db_index=True)),
+                ('SalesCount', models.IntegerField(default=0)),
+                ('Amounts', models.BinaryField()),
+                ('Products', models.BinaryField()),
+                ('StoreId', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_sketches', to='Inventory.store')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('StoreId', 'Day'), name='one_sketch_per_store_day')],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 17:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Sales', '0008_sales_sketches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='salesarchive',
+            name='MoveDatabase',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='salesarchive',
+            name='MoveFirstId',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='salesarchive',
+            name='MoveLastId',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='salesarchive',
+            name='MoveOwner',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='salesarchive',
+            name='MoveStartedAt',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
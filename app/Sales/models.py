@@ -1,12 +1,20 @@
 from django.db import models
+from django.utils import timezone
 from Inventory.models import Store, Product
 from HR.models import Staff
+from app.responses import ColumnarEncoder
+from app.sharding import ShardedQuerySet
+from Sales.archive import MergeTotals, ReadAcrossArchive
+from Sales.graphing import CheckBucketCount, DateToDatetime, DownsampleLTTB, FillGaps, TruncateForGranularity
+
+GRAPH_COLUMNS = ("Period", "TotalSales")
 
 class Sales(models.Model):
 
     SalesId = models.AutoField(primary_key=True, unique=True)            # Primary key for the sales record
     PaymentMethod = models.CharField(max_length=200)                    # Payment method used for the sale
     TotalAmount = models.DecimalField(max_digits=15, decimal_places=2)  # Total amount for the sale
+    Quantity = models.IntegerField(default=1)                           # Units of the product sold, used for costing
 
     StoreId = models.ForeignKey(Store, on_delete=models.CASCADE, related_name='sales')   # ForeignKey to Store model
     ProductId = models.ForeignKey(Product, on_delete=models.SET_NULL, related_name='sales', null=True)  # ForeignKey to Product model
@@ -19,6 +27,9 @@ class Sales(models.Model):
         related_name='sales'
     )
     SaleDate = models.DateField(auto_now_add=True)    # Date when the sale occurred
+    SaleTimestamp = models.DateTimeField(default=timezone.now, db_index=True)  # Exact time of the sale, used for hourly graphs
+
+    objects = ShardedQuerySet.as_manager()  # New sales go to their store's shard when sharding is on
 
     def __str__(self):  # String representation of the sale with its ID, total amount, and store name
         return f"Id: {self.SalesId} - Total: {self.TotalAmount} - Store: {self.StoreId.StoreName}"
@@ -27,11 +38,13 @@ class Sales(models.Model):
         """
         Returns the sales record data as a dictionary, including the sale's ID, payment method, total amount, store name,
         staff member handling the sale (if available), and the date of sale.
+        Load many sales with select_related("StoreId", "StaffId"), or every call runs two queries.
         """
         return {
             "SalesId": self.SalesId,                # Sale's unique identifier
             "PaymentMethod": self.PaymentMethod,    # Payment method used for the sale
             "TotalAmount": self.TotalAmount,        # Total value of the sale   
+            "Quantity": self.Quantity,              # Units sold
             "Store": self.StoreId.StoreName,        # Name of the store
             "Staff": self.StaffId.StaffName if self.StaffId else None,      # Name of the staff handling the sale, if available
             "SaleDate": self.SaleDate,      # Date when the sale was made
@@ -42,52 +55,225 @@ class Sales(models.Model):
         Calculates the total sales amount within the specified date range.
         start_date: Optional start date for filtering sales (datetime.date).
         end_date: Optional end date for filtering sales (datetime.date).
+        Sales are dated by SaleTimestamp, like GetSalesGraph, so the total matches the graph's points.
         """
         from django.db.models import Sum    # Import aggregate function for summing values
 
-    
-        sales_queryset = Sales.objects.all() # Start with all sales records
+        start = DateToDatetime(start_date)
+        end = DateToDatetime(end_date, end_of_day=True)
 
-        if start_date:   # If start_date is provided, filter sales from that date onward
-            sales_queryset = sales_queryset.filter(SaleDate__gte=start_date)
+        def Total(sales_queryset):  # Runs against the Sales table and, for old ranges, the archive
 
+            if start:   # If start_date is provided, filter sales from that date onward
+                sales_queryset = sales_queryset.filter(SaleTimestamp__gte=start)
 
-        if end_date:     # If end_date is provided, filter sales up until that date
-            sales_queryset = sales_queryset.filter(SaleDate__lte=end_date)
+            if end:     # If end_date is provided, filter sales up until that date
+                sales_queryset = sales_queryset.filter(SaleTimestamp__lte=end)
 
-        # Aggregate sales data and sum the TotalAmount for the filtered date range
-        total_sales = sales_queryset.aggregate(TotalSales=Sum("TotalAmount"))
+            # Aggregate sales data and sum the TotalAmount for the filtered date range
+            return sales_queryset.aggregate(TotalSales=Sum("TotalAmount"))["TotalSales"] or 0
 
         # Return the total sales amount or 0 if no sales are found
-        return total_sales["TotalSales"] or 0
+        return sum(ReadAcrossArchive(Total, start_date))
 
 
 
-    def GetSalesGraph(self, start_date=None, end_date=None):
+    def GetSalesGraph(self, start_date=None, end_date=None, granularity="day", max_points=None, columnar=False):
         """
         Generates sales data for a graph based on the given date range.
         start_date: Optional start date for filtering sales (datetime.date).
         end_date: Optional end date for filtering sales (datetime.date).
+        granularity: Size of each point on the graph, one of 'hour', 'day', 'week' or 'month'.
+        max_points: Optional upper bound on the number of points, long series are downsampled with LTTB.
+        columnar: Return {"Period": [...], "TotalSales": [...]} instead of one dictionary per point.
         """
         from django.db.models import Sum    # Import aggregate function to sum total sales
 
-        sales_queryset = Sales.objects.all()    # Start with all sales records
+        bucket = TruncateForGranularity(granularity)    # Raises ValueError for unknown granularities
+        start = DateToDatetime(start_date)
+        end = DateToDatetime(end_date, end_of_day=True)
+        if start and end:   # Refuse oversized ranges before querying, FillGaps checks ranges taken from the data
+            CheckBucketCount(start, end, granularity)
+
+        def Summary(sales_queryset):    # Runs against the Sales table and, for old ranges, the archive
+
+            if start:   # If start_date is provided, filter sales from that date onward
+                sales_queryset = sales_queryset.filter(SaleTimestamp__gte=start)
+
+            if end:    # If end_date is provided, filter sales up until that date
+                sales_queryset = sales_queryset.filter(SaleTimestamp__lte=end)
+
+            return list(    # Aggregate sales data by time bucket, the truncation is done in SQL
+                sales_queryset
+                .annotate(Period=bucket)
+                .values("Period")       # Group by the start of each bucket
+                .annotate(TotalSales=Sum("TotalAmount"))     # Calculate the sum of TotalAmount for each bucket
+                .values_list("Period", "TotalSales")
+            )
+
+        sales_summary = MergeTotals(ReadAcrossArchive(Summary, start_date))   # Buckets spanning both tables are added up
+
+        points = FillGaps(sales_summary, granularity, start, end)    # Add zero points for empty buckets
+        points = DownsampleLTTB(points, max_points)    # Bound the number of points if requested
+
+        if columnar:    # One list per column, straight from the point tuples
+            return ColumnarEncoder().Table(points, GRAPH_COLUMNS)
+
+        # Returns a list of dictionaries for graph plotting
+        return [{"Period": period, "TotalSales": total} for period, total in points]
+
+
+class ArchivedSales(models.Model):
+    """
+    Sales moved out of the Sales table by the archive_sales command.
+
+    The table lives in the SALES_ARCHIVE_DATABASE (see app.routers.ArchiveRouter), so stores,
+    products and staff are kept as plain ids: foreign keys can't point into another database.
+    """
+
+    SalesId = models.IntegerField(primary_key=True)                     # Same id the sale had in the Sales table
+    PaymentMethod = models.CharField(max_length=200)                    # Payment method used for the sale
+    TotalAmount = models.DecimalField(max_digits=15, decimal_places=2)  # Total amount for the sale
+    Quantity = models.IntegerField(default=1)                           # Units of the product sold
+    StoreId = models.IntegerField()                                     # Id of the store that made the sale
+    ProductId = models.IntegerField(null=True)                          # Id of the product sold, if known
+    StaffId = models.IntegerField(null=True)                            # Id of the staff member handling the sale
+    SaleDate = models.DateField(db_index=True)                          # Date when the sale occurred
+    SaleTimestamp = models.DateTimeField(db_index=True)                 # Exact time of the sale
+
+    def __str__(self):
+        return f"Archived sale {self.SalesId} - Total: {self.TotalAmount}"
+
+
+class SalesArchive(models.Model):
+    """
+    Single-row bookkeeping for the sales archive, kept in the default database next to Sales.
+
+    ArchivedBefore tells readers whether a date range can reach into the archive at all. Generation
+    works as a sequence lock: it is odd while a batch is being moved, and readers that span both
+    tables retry until they see the same even value before and after reading, so a sale is never
+    counted twice or missed while it moves. The Move fields describe the batch being moved, so a
+    move left open by a run that died can be finished by whoever finds it (see RecoverArchive).
+    """
+
+    ArchiveId = models.AutoField(primary_key=True, unique=True)
+    ArchivedBefore = models.DateField(null=True)        # Sales before this date may be in the archive
+    Generation = models.PositiveBigIntegerField(default=0)
+    ArchivedRows = models.PositiveBigIntegerField(default=0)   # Total rows moved so far
+    UpdatedAt = models.DateTimeField(auto_now=True)
+
+    MoveStartedAt = models.DateTimeField(null=True)         # When the batch being moved was marked
+    MoveOwner = models.CharField(max_length=200, blank=True)    # Host and process of the run moving it
+    MoveDatabase = models.CharField(max_length=100, blank=True) # Database the batch is moved out of
+    MoveFirstId = models.IntegerField(null=True)            # SalesId range of the batch
+    MoveLastId = models.IntegerField(null=True)
+
+    def __str__(self):
+        return f"Sales archived before {self.ArchivedBefore} ({self.ArchivedRows} rows)"
+
+
+def _EmptyWeekdays():
+    return [[0, 0.0, 0.0] for _ in range(7)]
+
+
+class SalesBaseline(models.Model):
+    """
+    Rolling statistics of one sales series, kept up to date one sale at a time by Sales.anomaly.
+
+    A series is a store's total, or one product in one store. Sale amounts and daily revenue have
+    running means and variances (Welford), daily revenue also has an exponentially weighted mean
+    and variance and a running mean and variance per weekday. Nothing here needs past sales to be
+    read again: each sale updates the row in constant time.
+    """
+
+    SalesBaselineId = models.AutoField(primary_key=True, unique=True)
+    Series = models.CharField(max_length=50, unique=True)               # "store:product", or "store:" for the store's total
+    StoreId = models.ForeignKey(Store, on_delete=models.CASCADE, related_name="sales_baselines")
+    ProductId = models.ForeignKey(Product, null=True, on_delete=models.CASCADE, related_name="sales_baselines")
+
+    AmountCount = models.IntegerField(default=0)                        # Sales seen
+    AmountMean = models.FloatField(default=0)                           # Mean sale amount
+    AmountM2 = models.FloatField(default=0)                             # Sum of squared differences from the mean, for the variance
+
+    Day = models.DateField(null=True, db_index=True)                    # The day still collecting sales
+    DayTotal = models.FloatField(default=0)                             # Revenue of that day so far
+    DayCount = models.IntegerField(default=0)                           # Closed days seen, days without sales included
+    DayMean = models.FloatField(default=0)                              # Mean daily revenue
+    DayM2 = models.FloatField(default=0)
+    Ewma = models.FloatField(default=0)                                 # Exponentially weighted mean of daily revenue
+    EwmVar = models.FloatField(default=0)                               # and its exponentially weighted variance
+    Weekdays = models.JSONField(default=_EmptyWeekdays)                 # [count, mean, M2] of daily revenue, Monday first
+
+    def __str__(self):
+        return f"Baseline {self.Series} - {self.AmountCount} sales, {self.DayCount} days"
+
+
+class SalesAlert(models.Model):
+    # A sale or a day of revenue that was far from its series' baseline when it was seen
+
+    SALE_SPIKE = "sale-spike"           # One sale much larger than the product usually sells for in the store
+    REVENUE_DROP = "revenue-drop"       # A day's revenue far below the usual for that weekday
+    REVENUE_SPIKE = "revenue-spike"     # A store's revenue for a day far above it
+    KINDS = (SALE_SPIKE, REVENUE_DROP, REVENUE_SPIKE)
+
+    SalesAlertId = models.AutoField(primary_key=True, unique=True)
+    Kind = models.CharField(max_length=20, choices=[(kind, kind) for kind in KINDS])
+    StoreId = models.ForeignKey(Store, on_delete=models.CASCADE, related_name="sales_alerts")
+    ProductId = models.ForeignKey(Product, null=True, on_delete=models.CASCADE, related_name="sales_alerts")  # None for the store's total
+    SalesId = models.BigIntegerField(null=True)                         # The flagged sale, for sale spikes
+    Day = models.DateField()                                            # Day of the sale or of the revenue
+    Value = models.FloatField()                                         # The sale amount or the day's revenue
+    Expected = models.FloatField()                                      # Baseline mean it was compared with
+    ZScore = models.FloatField()                                        # Standard deviations away from the baseline
+    CreatedAt = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.Kind} - Store {self.StoreId_id} - {self.Day}: {self.Value:.2f} (expected {self.Expected:.2f}, z={self.ZScore:.1f})"
+
+
+class AnomalyState(models.Model):
+    # How far anomaly detection has got through the sales of one database (a shard or the default one)
+
+    AnomalyStateId = models.AutoField(primary_key=True, unique=True)
+    Database = models.CharField(max_length=100, unique=True)            # Database alias holding the sales
+    LastSalesId = models.BigIntegerField(default=0)                     # Sales up to this id have updated the baselines
+    UpdatedAt = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.Database} checked up to sale {self.LastSalesId}"
+
+
+class SalesSketch(models.Model):
+    """
+    Approximate summaries of one store's sales on one day, kept up to date by Sales.sketches.
 
-        if start_date:   # If start_date is provided, filter sales from that date onward
-            sales_queryset = sales_queryset.filter(SaleDate__gte=start_date)
+    Amounts holds a KLL quantile sketch of the sale amounts and Products a HyperLogLog sketch of
+    the products sold, both serialized. Sketches of any days and stores merge into a sketch of
+    all their sales, so percentiles and distinct counts over a date range are read from one row
+    per store and day instead of from the sales.
+    """
 
+    SalesSketchId = models.AutoField(primary_key=True, unique=True)
+    StoreId = models.ForeignKey(Store, on_delete=models.CASCADE, related_name="sales_sketches")
+    Day = models.DateField(db_index=True)                               # Local date of the sales
+    SalesCount = models.IntegerField(default=0)                         # Sales summarised, exact
+    Amounts = models.BinaryField()                                      # KLL sketch of the sale amounts
+    Products = models.BinaryField()                                     # HyperLogLog sketch of the ProductIds sold
 
-        if end_date:    # If end_date is provided, filter sales up until that date
-            sales_queryset = sales_queryset.filter(SaleDate__lte=end_date)
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["StoreId", "Day"], name="one_sketch_per_store_day")]
 
-        sales_summary = (    # Aggregate sales data by date, summing the total sales for each day
-            sales_queryset
+    def __str__(self):
+        return f"Sketch of store {self.StoreId_id} on {self.Day} - {self.SalesCount} sales"
 
-            .values("SaleDate")       # Group by the date of sale
-            .annotate(TotalSales=Sum("TotalAmount"))     # Calculate the sum of TotalAmount for each date
-            .order_by("SaleDate") # Order the results by the date of sale
-        )
 
-        return list(sales_summary)  # Returns a list of dictionaries for graph plotting
+class SketchState(models.Model):
+    # How far the sales sketches have got through the sales of one database (a shard or the default one)
 
+    SketchStateId = models.AutoField(primary_key=True, unique=True)
+    Database = models.CharField(max_length=100, unique=True)            # Database alias holding the sales
+    LastSalesId = models.BigIntegerField(default=0)                     # Sales up to this id are in the sketches
+    UpdatedAt = models.DateTimeField(auto_now=True)
 
+    def __str__(self):
+        return f"{self.Database} sketched up to sale {self.LastSalesId}"
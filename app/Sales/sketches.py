@@ -0,0 +1,403 @@
+import hashlib
+import math
+import random
+import re
+import struct
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from app.sharding import FanOut, ShardAliases, ShardFor
+from Sales.archive import ReadAcrossArchive
+from Sales.models import Sales, SalesSketch, SketchState
+
+SKETCH_COLUMNS = ("SalesId", "StoreId", "ProductId", "TotalAmount", "SaleTimestamp")
+SKETCH_GROUPS = ("store", "day", "total")       # Values of QuerySketches' ``by``
+DEFAULT_QUANTILES = (0.5, 0.9, 0.99)
+MIN_LEVEL_WIDTH = 8     # Smallest capacity of a KLL level, lower levels would compact after every few items
+CENTS = Decimal("0.01")
+
+_KLL_HEADER = struct.Struct(">HQddB")    # k, count, min, max and number of levels of a serialized KLL sketch
+_NON_ZERO = re.compile(rb"[^\x00]")       # Finds the used registers of a HyperLogLog sketch
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(66)]     # 2^-rank of every possible HyperLogLog register
+_coin = random.Random()     # Picks which half of a KLL level survives a compaction
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch of the distinct values added to it.
+
+    Each value is hashed to 64 bits: the first ``precision`` bits pick one of 2^precision
+    registers, which keeps the longest run of leading zeros seen in the other bits. The count is
+    estimated from the harmonic mean of the registers, with linear counting while many registers
+    are still empty. Sketches merge by taking the larger register, so the sketch of a union is
+    exactly the merge of the sketches. The relative standard error is 1.04 / sqrt(2^precision).
+
+    Args:
+        precision (int, optional): Bits of the register index, defaults to SKETCH_HLL_PRECISION.
+    """
+
+    def __init__(self, precision=None):
+        self.precision = precision or settings.SKETCH_HLL_PRECISION
+        if not 4 <= self.precision <= 16:
+            raise ValueError("HyperLogLog precision must be between 4 and 16.")
+        self.registers = bytearray(1 << self.precision)
+
+    def Add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index, rest = hashed >> bits, hashed & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1     # Position of the first set bit after the index
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def Merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("HyperLogLog sketches of different precisions can't be merged, rebuild them.")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def Estimate(self):
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(map(_INVERSE_POWERS.__getitem__, self.registers))
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:   # Small counts are more accurate from the share of empty registers
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def StandardError(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def Serialize(self):
+        # Few used registers are stored as (index, rank) pairs, a day of one store rarely fills many
+        used = len(self.registers) - self.registers.count(0)
+        if used * 3 < len(self.registers):
+            pairs = (item for match in _NON_ZERO.finditer(self.registers) for item in (match.start(), ord(match[0])))
+            return struct.pack(f">cB{'HB' * used}", b"S", self.precision, *pairs)
+        return struct.pack(">cB", b"D", self.precision) + bytes(self.registers)
+
+    def MergeSerialized(self, data):
+        # Merges a serialized sketch without building it, sparse ones only touch their used registers
+        data = bytes(data)
+        if data[1] != self.precision:
+            raise ValueError("HyperLogLog sketches of different precisions can't be merged, rebuild them.")
+        registers = self.registers
+        if data[:1] == b"D":
+            self.registers = bytearray(map(max, registers, data[2:]))
+        else:
+            for index, rank in struct.iter_unpack(">HB", data[2:]):
+                if rank > registers[index]:
+                    registers[index] = rank
+        return self
+
+    @classmethod
+    def Deserialize(cls, data):
+        return cls(bytes(data)[1]).MergeSerialized(data)
+
+
+class KllSketch:
+    """
+    KLL quantile sketch of the numbers added to it.
+
+    Items go into level 0. When the sketch holds more items than its levels' capacities allow,
+    the lowest full level is sorted and every other item, starting at a random offset, moves up
+    one level with twice the weight. The rest are dropped. Capacities shrink by 2/3 per level
+    below the top, so the sketch keeps O(k) items whatever the number added. Sketches merge by
+    concatenating their levels and compacting again. Merging sketches of many days and stores
+    gives the same accuracy as one sketch of all their values.
+
+    Args:
+        k (int, optional): Capacity of the top level, defaults to SKETCH_KLL_K.
+    """
+
+    def __init__(self, k=None):
+        self.k = k or settings.SKETCH_KLL_K
+        self.levels = [[]]
+        self.count = 0
+        self.min = self.max = None
+        self._size = 0
+        self._Resize()
+
+    def _Resize(self):
+        # Capacity of each level and of the sketch, they change whenever a level is added on top
+        depth = len(self.levels)
+        self._capacities = [max(MIN_LEVEL_WIDTH, math.ceil(self.k * (2 / 3) ** (depth - level - 1))) for level in range(depth)]
+        self._capacity = sum(self._capacities)
+
+    def Add(self, value):
+        value = float(value)
+        self.levels[0].append(value)
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self._size += 1
+        if self._size >= self._capacity:
+            self._Compact()
+
+    def _Compact(self):
+        while self._size >= self._capacity:
+            level = next(level for level, items in enumerate(self.levels) if len(items) >= self._capacities[level])
+            if level + 1 == len(self.levels):
+                self.levels.append([])
+                self._Resize()
+            items = sorted(self.levels[level])
+            kept = [items.pop()] if len(items) % 2 else []  # Items move up in pairs, so the total weight stays exact
+            self.levels[level + 1].extend(items[_coin.getrandbits(1)::2])
+            self.levels[level] = kept
+            self._size = sum(map(len, self.levels))
+
+    def Merge(self, other):
+        if not other.count:
+            return self
+        if len(other.levels) > len(self.levels):
+            self.levels.extend([] for _ in range(len(other.levels) - len(self.levels)))
+            self._Resize()
+        for level, items in enumerate(other.levels):
+            self.levels[level].extend(items)
+        self.count += other.count
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._size += other._size
+        if self._size >= self._capacity:
+            self._Compact()
+        return self
+
+    def Quantiles(self, quantiles):
+        """
+        Args:
+            quantiles (list): Fractions between 0 and 1, e.g. 0.9 for the 90th percentile.
+
+        Returns:
+            list: The estimated value of each quantile, None for an empty sketch.
+        """
+        if not self.count:
+            return [None] * len(quantiles)
+        weighted = sorted((value, 1 << level) for level, items in enumerate(self.levels) for value in items)
+        results = {}
+        position, seen = 0, 0
+        for quantile in sorted(set(quantiles)):
+            if quantile <= 0:
+                results[quantile] = self.min
+                continue
+            target = quantile * self.count
+            while position < len(weighted) - 1 and seen + weighted[position][1] < target:
+                seen += weighted[position][1]
+                position += 1
+            results[quantile] = self.max if quantile >= 1 else weighted[position][0]
+        return [results[quantile] for quantile in quantiles]
+
+    def RankError(self):
+        # Normalised rank error at 99% confidence, the published empirical fit for KLL sketches
+        return 2.296 / self.k ** 0.9723
+
+    def Serialize(self):
+        values = [value for items in self.levels for value in items]
+        return _KLL_HEADER.pack(self.k, self.count, self.min or 0.0, self.max or 0.0, len(self.levels)) + struct.pack(
+            f">{len(self.levels)}I{len(values)}d", *map(len, self.levels), *values
+        )
+
+    def MergeSerialized(self, data):
+        # Merges a serialized sketch without building it
+        data = bytes(data)
+        _, count, low, high, depth = _KLL_HEADER.unpack_from(data)
+        if not count:
+            return self
+        sizes = struct.unpack_from(f">{depth}I", data, _KLL_HEADER.size)
+        values = struct.unpack_from(f">{sum(sizes)}d", data, _KLL_HEADER.size + 4 * depth)
+        if depth > len(self.levels):
+            self.levels.extend([] for _ in range(depth - len(self.levels)))
+            self._Resize()
+        start = 0
+        for level, size in enumerate(sizes):
+            self.levels[level].extend(values[start:start + size])
+            start += size
+        self.count += count
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        self._size += len(values)
+        if self._size >= self._capacity:
+            self._Compact()
+        return self
+
+    @classmethod
+    def Deserialize(cls, data):
+        return cls(_KLL_HEADER.unpack_from(bytes(data))[0]).MergeSerialized(data)
+
+
+def _Keys(rows):
+    # (StoreId, local date) of each sale row
+    zone = timezone.get_current_timezone()
+    return [(row[1], row[4].astimezone(zone).date()) for row in rows]
+
+
+def _Fold(sketches, rows, keys):
+    # Adds sales to the sketches of their store and day, creating the missing ones
+    for (_, _, productId, amount, _), key in zip(rows, keys):
+        sketch = sketches.get(key)
+        if sketch is None:
+            sketch = sketches[key] = [0, KllSketch(), HyperLogLog()]
+        sketch[0] += 1
+        sketch[1].Add(amount)
+        if productId is not None:
+            sketch[2].Add(productId)
+
+
+def _LoadSketches(keys):
+    # The stored sketches of the given (StoreId, Day) pairs, deserialized, in one query
+    stored = SalesSketch.objects.filter(StoreId__in={storeId for storeId, _ in keys}, Day__in={day for _, day in keys})
+    return {
+        (storeId, day): [count, KllSketch.Deserialize(amounts), HyperLogLog.Deserialize(products)]
+        for storeId, day, count, amounts, products in stored.values_list("StoreId", "Day", "SalesCount", "Amounts", "Products")
+        if (storeId, day) in keys
+    }
+
+
+def _SaveSketches(sketches):
+    # Inserts or replaces the sketches with one upsert per thousand rows
+    SalesSketch.objects.bulk_create(
+        [
+            SalesSketch(StoreId_id=storeId, Day=day, SalesCount=count, Amounts=amounts.Serialize(), Products=products.Serialize())
+            for (storeId, day), (count, amounts, products) in sketches.items()
+        ],
+        update_conflicts=True, unique_fields=["StoreId", "Day"], update_fields=["SalesCount", "Amounts", "Products"],
+        batch_size=1000,
+    )
+
+
+def UpdateSketches(batch_size=None):
+    """
+    Folds the sales recorded since the last run into the sketches of their store and day.
+
+    Like the anomaly baselines, each database holding sales has a watermark, in SketchState, so
+    every sale is added once. Only the sketches of the store days in a batch are read and written.
+
+    Args:
+        batch_size (int, optional): Sales read per database per batch, defaults to SKETCH_BATCH_SIZE.
+
+    Returns:
+        int: Number of sales added.
+    """
+    batch_size = batch_size or settings.SKETCH_BATCH_SIZE
+    added = 0
+    while True:
+        positions = dict(SketchState.objects.values_list("Database", "LastSalesId"))
+        batches = dict(zip(ShardAliases(), FanOut(
+            lambda alias: list(
+                Sales.objects.using(alias).filter(SalesId__gt=positions.get(alias, 0))
+                .order_by("SalesId").values_list(*SKETCH_COLUMNS)[:batch_size]
+            )
+        )))
+        rows = [row for batch in batches.values() for row in batch]
+        if not rows:
+            return added
+
+        with transaction.atomic():
+            keys = _Keys(rows)
+            sketches = _LoadSketches(set(keys))
+            _Fold(sketches, rows, keys)
+            _SaveSketches(sketches)
+            for alias, batch in batches.items():
+                if batch:
+                    SketchState.objects.update_or_create(Database=alias, defaults={"LastSalesId": batch[-1][0]})
+        added += len(rows)
+
+
+def RebuildSketches():
+    """
+    Replaces every sketch with ones built from all sales, archived ones included.
+
+    Run once on a database with existing history, after which UpdateSketches keeps the sketches
+    up to date from the watermarks set here.
+
+    Returns:
+        dict: Number of sales read and sketches written.
+    """
+    rows = [row for rows in ReadAcrossArchive(lambda sales: list(sales.values_list(*SKETCH_COLUMNS))) for row in rows]
+    sketches, watermarks = {}, {}
+    _Fold(sketches, rows, _Keys(rows))
+    for row in rows:
+        alias = ShardFor(row[1])
+        watermarks[alias] = max(watermarks.get(alias, 0), row[0])
+
+    with transaction.atomic():
+        SalesSketch.objects.all().delete()
+        SketchState.objects.all().delete()
+        _SaveSketches(sketches)
+        SketchState.objects.bulk_create(
+            [SketchState(Database=alias, LastSalesId=salesId) for alias, salesId in watermarks.items()]
+        )
+    return {"Sales": len(rows), "Sketches": len(sketches)}
+
+
+def _Percentile(quantile):
+    # Name of a quantile in the results, e.g. p90 for 0.9
+    return f"p{quantile * 100:g}"
+
+
+def QuerySketches(stores=None, start_date=None, end_date=None, quantiles=DEFAULT_QUANTILES, by="store"):
+    """
+    Returns approximate sale amount percentiles and distinct products sold over a date range.
+
+    The stored sketches of every store and day in the range are read in one query and merged, so
+    the cost depends on the number of store days, not on the number of sales. Sales recorded
+    since the last run of the sales-sketches job are not included yet.
+
+    Args:
+        stores (list, optional): StoreIds to include, all stores by default.
+        start_date (date or str, optional): First day included.
+        end_date (date or str, optional): Last day included.
+        quantiles (list): Fractions between 0 and 1 to estimate.
+        by (str): "store" for one row per store, "day" for one row per day, "total" for one row.
+
+    Returns:
+        dict: "rows" with the SalesCount, Percentiles and DistinctProducts of each group, and the
+        error bounds of the estimates: "RankError", the fraction of sales a percentile may be
+        off by, and "DistinctError", the relative standard error of the distinct counts.
+    """
+    if by not in SKETCH_GROUPS:
+        raise ValueError(f"by must be one of: {', '.join(SKETCH_GROUPS)}.")
+    quantiles = [float(quantile) for quantile in quantiles]
+    if not quantiles or not all(0 <= quantile <= 1 for quantile in quantiles):
+        raise ValueError("Quantiles must be between 0 and 1.")
+
+    sketches = SalesSketch.objects.all()
+    if stores:
+        sketches = sketches.filter(StoreId__in=stores)
+    for lookup, value in (("Day__gte", start_date), ("Day__lte", end_date)):
+        if value:
+            day = parse_date(value) if isinstance(value, str) else value
+            if day is None:
+                raise ValueError(f"Invalid date: {value}, use YYYY-MM-DD.")
+            sketches = sketches.filter(**{lookup: day})
+
+    groups = {}
+    for storeId, day, count, amounts, products in sketches.values_list("StoreId", "Day", "SalesCount", "Amounts", "Products"):
+        key = storeId if by == "store" else day if by == "day" else None
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [count, KllSketch.Deserialize(amounts), HyperLogLog.Deserialize(products)]
+        else:
+            group[0] += count
+            group[1].MergeSerialized(amounts)
+            group[2].MergeSerialized(products)
+
+    rows = []
+    for key in sorted(groups, key=lambda key: (key is not None, key)):
+        count, amounts, products = groups[key]
+        row = {"StoreId": key} if by == "store" else {"Day": key} if by == "day" else {}
+        row["SalesCount"] = count
+        row["Percentiles"] = {
+            _Percentile(quantile): None if value is None else Decimal(repr(value)).quantize(CENTS)
+            for quantile, value in zip(quantiles, amounts.Quantiles(quantiles))
+        }
+        row["DistinctProducts"] = products.Estimate()
+        rows.append(row)
+
+    return {
+        "RankError": round(KllSketch().RankError(), 4),
+        "DistinctError": round(HyperLogLog().StandardError(), 4),
+        "rows": rows,
+    }
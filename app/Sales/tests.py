@@ -1,3 +1,574 @@
-from django.test import TestCase
+import json
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pathlib import Path
 
-# Create your tests here.
+from django.db import connection
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from app.facade import Facade
+from app.testutils import MakeProducts, MakeSales, MakeStaff, MakeStores, QueryBudgetTestCase
+from Sales.anomaly import CloseIdleDays, DetectNewSales, RebuildBaselines
+from Sales.archive import (
+    ARCHIVED_FIELDS, SEQUENCE_TIMEOUT, ArchiveSales, GetArchiveState, ReadAcrossArchive, RecoverArchive,
+)
+from Sales.columnar import ColumnarSalesStore, np
+from Sales.cube import BuildCube, GroupingSets
+from Sales.graphing import MAX_GRAPH_BUCKETS, DateToDatetime, DownsampleLTTB, FillGaps
+from Sales.models import ArchivedSales, Sales, SalesAlert, SalesArchive, SalesBaseline, SalesSketch
+from Sales.sketches import HyperLogLog, KllSketch, QuerySketches, RebuildSketches, UpdateSketches
+
+
+class SalesQueryBudgetTests(QueryBudgetTestCase):
+
+    def Recorded(self, size):   # `size` sales spread over `size` stores, products and staff members
+        MakeSales(size, MakeStores(size), MakeProducts(size), MakeStaff(size))
+        return ()
+
+    def testGetSalesData(self):
+        # Loaded with their store and staff member, any number of sales is read in one query
+        self.assertQueryBudget(
+            1, self.Recorded,
+            lambda: [sale.GetSalesData() for sale in Sales.objects.select_related("StoreId", "StaffId")],
+        )
+
+    def testCalculateTotalSales(self):
+        # The archive boundary and the total
+        self.assertQueryBudget(2, self.Recorded, lambda: Sales().CalculateTotalSales())
+
+    def testGetSalesGraph(self):
+        for granularity in ("hour", "day", "week", "month"):
+            with self.subTest(granularity=granularity):
+                self.assertQueryBudget(2, self.Recorded, lambda: Sales().GetSalesGraph(granularity=granularity))
+
+
+class SalesViewQueryBudgetTests(QueryBudgetTestCase):
+
+    def Recorded(self, size):
+        MakeSales(size, MakeStores(size), MakeProducts(size))
+        return ()
+
+    def testStorePerformanceView(self):
+        # The ETag watermark, the archive boundary and the product totals
+        self.assertQueryBudget(3, self.Recorded, lambda: self.client.get("/Sales/performance/"))
+
+    def testSalesGraphView(self):
+        self.assertQueryBudget(3, self.Recorded, lambda: self.client.get("/Sales/graph/", {"granularity": "day"}))
+
+    def testColumnarFormat(self):
+        # Same queries as the row format, only the shape of the response differs
+        for path, budget in (("/Sales/performance/", 3), ("/Sales/graph/", 3)):
+            with self.subTest(path=path):
+                self.assertQueryBudget(budget, self.Recorded, lambda: self.client.get(path, {"format": "columnar"}))
+
+    def testNotModified(self):
+        def Call():
+            etag = self.client.get("/Sales/graph/").headers["ETag"]
+            with self.assertNumQueries(1):  # Only the watermark is read to answer a revalidation
+                response = self.client.get("/Sales/graph/", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+        self.assertQueryBudget(4, self.Recorded, Call)
+
+    def testEditsChangeTheETag(self):
+        sale = MakeSales(2, MakeStores(1))[0]
+        etag = self.client.get("/Sales/performance/").headers["ETag"]
+        Sales.objects.filter(pk=sale.pk).update(TotalAmount=Decimal("7.00"))   # Published to the outbox, no new sale
+        response = self.client.get("/Sales/performance/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def testRecordSaleView(self):
+        def Build(size):
+            return MakeStores(1)[0], MakeProducts(1)[0]
+
+        def Call(store, product):
+            response = self.client.post(
+                "/Sales/record/", json.dumps({"storeId": store.pk, "productId": product.pk, "totalAmount": "4.50"}),
+                content_type="application/json",
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(Sales.objects.get(pk=response.json()["salesId"]).TotalAmount, 4.5)
+
+        # The insert, and the sale read back by the test
+        self.assertQueryBudget(2, Build, Call)
+
+    def testRecordSaleValidation(self):
+        for body, message in (
+            ({"totalAmount": "1.00"}, "storeId is required."),
+            ({"storeId": 1, "totalAmount": "lots"}, None),
+            ({"storeId": "one", "totalAmount": "1.00"}, None),
+            ({"storeId": 1, "totalAmount": "NaN"}, None),
+            ({"storeId": 1, "totalAmount": "Infinity"}, None),
+            ({"storeId": 1, "totalAmount": "1e30"}, None),     # Would make every read of the sales fail
+            ({"storeId": 1, "totalAmount": "1.00", "quantity": 0}, None),
+        ):
+            with self.subTest(body=body):
+                response = self.client.post("/Sales/record/", json.dumps(body), content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+                if message:
+                    self.assertEqual(response.json()["error"], message)
+        self.assertEqual(self.client.get("/Sales/record/").status_code, 405)
+
+        body = {"storeId": MakeStores(1)[0].pk, "totalAmount": 2.675}    # Rounded to pence, like the column
+        response = self.client.post("/Sales/record/", json.dumps(body), content_type="application/json")
+        self.assertEqual(Sales.objects.get(pk=response.json()["salesId"]).TotalAmount, Decimal("2.68"))
+
+
+class GraphTests(TestCase):
+
+    databases = {"default", "archive"}
+
+    def testFillGaps(self):
+        def At(*args):
+            return timezone.make_aware(datetime(*args))
+
+        # A point in the first and fourth bucket of each granularity, the start of the range is mid-bucket
+        buckets = {
+            "hour": [At(2026, 1, 31, 10), At(2026, 1, 31, 11), At(2026, 1, 31, 12), At(2026, 1, 31, 13)],
+            "day": [At(2026, 1, 31), At(2026, 2, 1), At(2026, 2, 2), At(2026, 2, 3)],
+            "week": [At(2026, 1, 26), At(2026, 2, 2), At(2026, 2, 9), At(2026, 2, 16)],     # Mondays
+            "month": [At(2026, 1, 1), At(2026, 2, 1), At(2026, 3, 1), At(2026, 4, 1)],
+        }
+        for granularity, expected in buckets.items():
+            with self.subTest(granularity=granularity):
+                points = [(expected[0], 5), (expected[3], 7)]
+                self.assertEqual(
+                    FillGaps(points, granularity), [(expected[0], 5), (expected[1], 0), (expected[2], 0), (expected[3], 7)]
+                )
+                ranged = FillGaps(points[1:], granularity, start=At(2026, 1, 31, 10, 30), end=expected[3])
+                self.assertEqual([moment for moment, _ in ranged], expected)
+                empty = FillGaps([], granularity, start=expected[0], end=expected[1])
+                self.assertEqual(empty, [(expected[0], 0), (expected[1], 0)])
+                self.assertEqual(FillGaps([], granularity), [])
+
+        with timezone.override("Europe/London"):    # Days stay at local midnight across the clock change
+            start = timezone.make_aware(datetime(2026, 3, 28))
+            days = FillGaps([], "day", start=start, end=start + timedelta(days=2))
+            self.assertEqual([timezone.localtime(moment).hour for moment, _ in days], [0, 0, 0])
+            self.assertEqual(days[2][0].timestamp() - days[1][0].timestamp(), 23 * 3600)   # The short day
+
+    def testBucketLimit(self):
+        start = timezone.make_aware(datetime(2026, 1, 1))
+        last = start + timedelta(hours=MAX_GRAPH_BUCKETS - 1)
+        self.assertEqual(len(FillGaps([], "hour", start=start, end=last)), MAX_GRAPH_BUCKETS)
+        with self.assertRaises(ValueError):
+            FillGaps([(start, 1)], "hour", end=last + timedelta(hours=1))
+        with self.assertRaises(ValueError):     # Ranges taken from the data are limited as well
+            FillGaps([(start, 1), (start + timedelta(days=MAX_GRAPH_BUCKETS), 1)], "day")
+
+        with self.assertNumQueries(0):  # Refused before any aggregation runs
+            with self.assertRaises(ValueError):
+                Sales().GetSalesGraph(start_date="0001-01-01", end_date="9999-12-31", granularity="hour")
+        response = self.client.get(
+            "/Sales/graph/", {"granularity": "hour", "start_date": "0001-01-01", "end_date": "9999-12-31"}
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/Sales/graph/", {"granularity": "month", "start_date": "2000-01-01"})
+        self.assertEqual(response.status_code, 200)
+
+    def testDownsampleLTTB(self):
+        start = timezone.make_aware(datetime(2026, 1, 1))
+        points = [(start + timedelta(hours=n), n % 7) for n in range(100)]
+        points[50] = (points[50][0], 1000)      # A spike LTTB must not smooth away
+
+        sampled = DownsampleLTTB(points, 10)
+        self.assertEqual(len(sampled), 10)
+        self.assertEqual((sampled[0], sampled[-1]), (points[0], points[-1]))    # Endpoints are always kept
+        self.assertIn(points[50], sampled)
+        self.assertEqual(sampled, sorted(sampled))
+        self.assertEqual(DownsampleLTTB(points[:3], 3), points[:3])
+        self.assertEqual(DownsampleLTTB(points, None), points)
+        with self.assertRaises(ValueError):
+            DownsampleLTTB(points, 2)
+
+    def testTotalsMatchTheGraph(self):
+        # Sales recorded today for earlier times: both methods go by SaleTimestamp, not the SaleDate they were saved on
+        MakeSales(20, MakeStores(2), amount="3.00", days=10)
+        since = timezone.localdate() - timedelta(days=4)
+        graph = Sales().GetSalesGraph(start_date=since, end_date=timezone.localdate())
+        total = Sales().CalculateTotalSales(start_date=since, end_date=timezone.localdate())
+        self.assertEqual(total, sum(point["TotalSales"] for point in graph))
+        self.assertEqual(total, Decimal("3.00") * Sales.objects.filter(SaleTimestamp__gte=DateToDatetime(since)).count())
+        self.assertLess(total, Decimal("60.00"))
+
+        performance = Facade().GetStorePerformance(since, timezone.localdate())   # The same range, split by store
+        self.assertEqual(sum(row["TotalSales"] for row in performance["store_sales"]), total)
+        self.assertEqual(sum(row["TotalSales"] for row in performance["product_sales"]), total)
+
+
+class SalesCubeTests(QueryBudgetTestCase):
+
+    def Recorded(self, size):
+        MakeSales(size, MakeStores(size), MakeProducts(size), MakeStaff(size))
+        return ()
+
+    def testBuildCube(self):
+        # The archive boundary, the scan and the types of the products sold
+        self.assertQueryBudget(3, self.Recorded, lambda: BuildCube(["StoreId", "ProductType", "SaleMonth"]))
+
+    def testCubeView(self):
+        def Call():
+            response = self.client.get("/Sales/cube/", {"dimensions": "StoreId,PaymentMethod", "labels": "1"})
+            self.assertEqual(len(response.json()["groupings"]), 4)
+
+        # The ETag watermark, the archive boundary, the scan and the store names
+        self.assertQueryBudget(4, self.Recorded, Call)
+
+    def testGroupingSets(self):
+        self.assertEqual(GroupingSets(["A", "B"]), [("A", "B"), ("A",), ("B",), ()])
+        self.assertEqual(GroupingSets(["A", "B", "C"], "rollup"), [("A", "B", "C"), ("A", "B"), ("A",), ()])
+        self.assertEqual(GroupingSets(["A", "B"], [["B", "A"], []]), [("A", "B"), ()])
+        with self.assertRaises(ValueError):
+            GroupingSets(["A"], [["B"]])
+
+    def testSubtotalsMatchQueries(self):
+        stores = MakeStores(3)
+        food, toys = MakeProducts(2, product_type="Food"), MakeProducts(1, product_type="Toys")
+        MakeSales(30, stores, food + toys, amount="2.50")
+        MakeSales(6, stores[:1], toys, amount="10.10")
+
+        cube = BuildCube(["StoreId", "ProductType"], ["TotalSales", "SalesCount", "AverageSale", "MaxSale"], labels=True)
+        groupings = {tuple(grouping["by"]): grouping["rows"] for grouping in cube["groupings"]}
+        self.assertEqual(list(groupings), [("StoreId", "ProductType"), ("StoreId",), ("ProductType",), ()])
+
+        grand = groupings[()][0]
+        self.assertEqual(
+            (grand["TotalSales"], grand["SalesCount"], grand["AverageSale"], grand["MaxSale"]),
+            (Decimal("135.60"), 36, Decimal("3.77"), Decimal("10.10")),
+        )
+        self.assertEqual(
+            [(row["ProductType"], row["TotalSales"]) for row in groupings[("ProductType",)]],
+            [("Food", Decimal("50.00")), ("Toys", Decimal("85.60"))],
+        )
+        for row in groupings[("StoreId",)]:
+            self.assertEqual(row["SalesCount"], Sales.objects.filter(StoreId=row["StoreId"]).count())
+        self.assertEqual(cube["labels"]["StoreId"], {store.pk: store.StoreName for store in stores})
+
+        filtered = BuildCube(["StoreId"], grouping="rollup", filters={"ProductType": "Toys", "StoreId": [stores[0].pk]})
+        self.assertEqual(filtered["groupings"][-1]["rows"], [{"TotalSales": Decimal("60.60"), "SalesCount": 6}])
+
+        total = self.client.get("/Sales/cube/", {"dimensions": "", "measures": "TotalSales,SalesCount"}).json()
+        self.assertEqual(total["groupings"], [{"by": [], "rows": [{"TotalSales": "135.60", "SalesCount": 36}]}])
+
+    def testEmptyCube(self):
+        cube = BuildCube(["StoreId"], ["TotalSales", "AverageSale"])
+        self.assertEqual(cube["groupings"][0], {"by": ["StoreId"], "rows": []})
+        self.assertEqual(cube["groupings"][1]["rows"], [{"TotalSales": Decimal("0.00"), "AverageSale": None}])
+        self.assertEqual(BuildCube([])["groupings"], [{"by": [], "rows": [{"TotalSales": Decimal("0.00"), "SalesCount": 0}]}])
+        self.assertEqual(self.client.get("/Sales/cube/", {"dimensions": "Colour"}).status_code, 400)
+
+
+class ColumnarStoreTests(TestCase):
+
+    def setUp(self):
+        self.stores, products = MakeStores(3), MakeProducts(4)
+        for amount, method in (("2.50", "Card"), ("10.10", "Cash"), ("0.99", "Voucher")):
+            MakeSales(20, self.stores, products + [None], MakeStaff(2) + [None], amount=amount, days=90)
+            Sales.objects.filter(PaymentMethod="Card", TotalAmount=Decimal(amount)).update(PaymentMethod=method)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ColumnarSalesStore(directory.name)
+        self.assertEqual(self.store.Refresh(batch_size=25), 60)
+
+    def testMatchesTheOrm(self):
+        # Days come from SaleTimestamp like the ORM totals, the sales were all saved with today's SaleDate
+        days = {
+            "SaleDate": TruncDate("SaleTimestamp"),
+            "SaleWeek": TruncWeek("SaleTimestamp", output_field=DateField()),
+            "SaleMonth": TruncMonth("SaleTimestamp", output_field=DateField()),
+        }
+        since = timezone.localdate() - timedelta(days=40)
+        stores = [store.pk for store in self.stores[:2]]
+        for group_by, filters in (
+            ([], {}), (["StoreId"], {}), (["PaymentMethod", "StoreId"], {}), (["ProductId", "StaffId"], {}),
+            (["SaleMonth"], {}), (["SaleWeek", "PaymentMethod"], {"StoreId": stores}),
+            (["SaleDate"], {"PaymentMethod": ["Cash"]}),
+        ):
+            with self.subTest(group_by=group_by, filters=filters):
+                sales = Sales.objects.filter(SaleTimestamp__gte=DateToDatetime(since))
+                sales = sales.filter(**{f"{name}__in": values for name, values in filters.items()})
+                if group_by:
+                    keys = [f"Day{name}" if name in days else name for name in group_by]   # Can't shadow SaleDate
+                    rows = (
+                        sales.annotate(**{f"Day{name}": days[name] for name in group_by if name in days})
+                        .values(*keys).annotate(TotalSales=Sum("TotalAmount"), SalesCount=Count("SalesId"))
+                        .order_by(*keys)
+                    )
+                    expected = [
+                        {**{name: row[key] for name, key in zip(group_by, keys)},
+                         "TotalSales": row["TotalSales"], "SalesCount": row["SalesCount"]}
+                        for row in rows
+                    ]
+                else:
+                    expected = [sales.aggregate(TotalSales=Sum("TotalAmount"), SalesCount=Count("SalesId"))]
+                self.assertTrue(expected[0]["SalesCount"])
+                self.assertEqual(self.store.Query(group_by, start_date=since, filters=filters), expected)
+
+    def testRefreshAppendsNewSales(self):
+        MakeSales(5, MakeStores(1))
+        self.assertEqual(self.store.Refresh(), 5)
+        self.assertEqual(self.store.Refresh(), 0)
+        self.assertEqual(self.store.Query()[0]["SalesCount"], 65)
+        self.assertEqual(self.store.Rebuild(), 65)
+
+
+class ColumnarRefreshTests(TransactionTestCase):
+    # Not wrapped in a transaction: the refreshing threads read the sales on their own connections
+
+    def testConcurrentRefreshes(self):
+        MakeSales(300, MakeStores(3))
+        with tempfile.TemporaryDirectory() as directory:
+            stores = [ColumnarSalesStore(directory) for _ in range(4)]
+
+            def Refresh(store):
+                try:
+                    return store.Refresh(batch_size=7)
+                finally:
+                    connection.close()
+
+            with ThreadPoolExecutor(len(stores)) as pool:
+                appended = list(pool.map(Refresh, stores))
+            self.assertEqual(sum(appended), 300)    # Each sale appended once, by whichever refresh got there first
+            salesIds = np.fromfile(Path(directory) / "SalesId.bin", dtype=np.int64)
+            self.assertEqual(sorted(salesIds.tolist()), sorted(Sales.objects.values_list("SalesId", flat=True)))
+
+
+class ArchiveTests(TestCase):
+    databases = {"default", "archive"}
+
+    def setUp(self):
+        # Sales over the last 30 days, dated like their timestamps, and a boundary ten days ago
+        MakeSales(40, MakeStores(2))
+        Sales.objects.update(SaleDate=TruncDate("SaleTimestamp"))
+        self.before = timezone.localdate() - timedelta(days=10)
+        self.old = Sales.objects.filter(SaleDate__lt=self.before, SaleTimestamp__lt=DateToDatetime(self.before)).count()
+
+    def Counted(self):
+        # Sales counted across the Sales table and the archive
+        return sum(ReadAcrossArchive(lambda sales: sales.count()))
+
+    def HalfMoved(self, startedAt):
+        # Leaves a batch the way an archive run that died after copying it would
+        batch = list(Sales.objects.filter(SaleDate__lt=self.before).order_by("SalesId")[:5])
+        ArchivedSales.objects.bulk_create(
+            ArchivedSales(**{name: getattr(sale, Sales._meta.get_field(name).attname) for name in ARCHIVED_FIELDS})
+            for sale in batch
+        )
+        SalesArchive.objects.create(
+            ArchiveId=1, ArchivedBefore=self.before, Generation=1, MoveStartedAt=startedAt, MoveOwner="till:42",
+            MoveDatabase="default", MoveFirstId=batch[0].pk, MoveLastId=batch[-1].pk,
+        )
+        return batch
+
+    def testArchiveSales(self):
+        self.assertGreater(self.old, 7)
+        self.assertEqual(ArchiveSales(self.before, batch_size=7), self.old)
+        self.assertEqual(ArchivedSales.objects.count(), self.old)
+        self.assertEqual(Sales.objects.count(), 40 - self.old)
+        self.assertEqual(self.Counted(), 40)
+        self.assertEqual(len(ReadAcrossArchive(lambda sales: sales.count(), start_date=self.before)), 1)   # Hot only
+
+        state = GetArchiveState()
+        self.assertEqual((state.Generation % 2, state.ArchivedRows, state.MoveStartedAt), (0, self.old, None))
+        self.assertEqual(ArchiveSales(self.before), 0)
+
+    def testReadersCloseAbandonedMoves(self):
+        batch = self.HalfMoved(timezone.now() - timedelta(hours=1))
+        started = time.monotonic()
+        with self.assertLogs("Sales.archive", "WARNING"):
+            self.assertEqual(self.Counted(), 40)     # Neither waits for the move nor counts the batch twice
+        self.assertLess(time.monotonic() - started, SEQUENCE_TIMEOUT / 2)
+
+        state = GetArchiveState()
+        self.assertEqual((state.Generation, state.ArchivedRows, state.MoveOwner), (2, len(batch), ""))
+        self.assertFalse(Sales.objects.filter(pk__in=[sale.pk for sale in batch]).exists())
+
+    def testRunsFinishInterruptedMoves(self):
+        self.HalfMoved(timezone.now())
+        self.assertFalse(RecoverArchive())  # Recent, the run may still be moving it
+        with self.assertLogs("Sales.archive", "WARNING"):
+            self.assertEqual(ArchiveSales(self.before), self.old - 5)
+        self.assertEqual(ArchivedSales.objects.count(), self.old)
+        self.assertEqual(GetArchiveState().ArchivedRows, self.old)
+        self.assertEqual(self.Counted(), 40)
+
+
+class AnomalyDetectionTests(TestCase):
+    databases = {"default", "archive"}
+
+    def Sell(self, store, product, amounts, start):
+        # One sale a day from `start` on
+        return Sales.objects.bulk_create(
+            Sales(StoreId=store, ProductId=product, PaymentMethod="Card", TotalAmount=Decimal(amount), SaleTimestamp=start + timedelta(days=n))
+            for n, amount in enumerate(amounts)
+        )
+
+    def setUp(self):
+        self.store, self.product = MakeStores(1)[0], MakeProducts(1)[0]
+        self.start = timezone.now() - timedelta(days=60)
+        self.Sell(self.store, self.product, [f"{10 + n % 3}.00" for n in range(40)], self.start)
+
+    def testSaleSpike(self):
+        self.assertEqual(DetectNewSales(), {"Sales": 40, "Alerts": 0})
+        spike = self.Sell(self.store, self.product, ["500.00"], self.start + timedelta(days=40))[0]
+
+        self.assertEqual(DetectNewSales(), {"Sales": 1, "Alerts": 1})
+        alert = SalesAlert.objects.get()
+        self.assertEqual((alert.Kind, alert.SalesId, alert.ProductId_id), (SalesAlert.SALE_SPIKE, spike.pk, self.product.pk))
+        self.assertEqual(SalesBaseline.objects.get(Series=f"{self.store.pk}:{self.product.pk}").AmountCount, 41)
+
+    def testRevenueDrop(self):
+        DetectNewSales()
+        self.assertEqual(CloseIdleDays(today=(self.start + timedelta(days=45)).date()), 2)   # The store and the product
+
+        drops = SalesAlert.objects.order_by("ProductId")
+        self.assertEqual([alert.Kind for alert in drops], [SalesAlert.REVENUE_DROP] * 2)
+        self.assertEqual(drops[0].Day, (self.start + timedelta(days=40)).date())    # Only the first day without sales
+        self.assertEqual(CloseIdleDays(today=(self.start + timedelta(days=45)).date()), 0)
+
+    def testRebuildMatchesIncremental(self):
+        DetectNewSales()
+        incremental = {baseline.Series: baseline for baseline in SalesBaseline.objects.all()}
+        self.assertEqual(RebuildBaselines(), {"Sales": 40, "Baselines": 2, "Alerts": 0})
+        self.assertEqual(DetectNewSales(), {"Sales": 0, "Alerts": 0})   # The rebuild moved the watermark
+        for baseline in SalesBaseline.objects.all():
+            self.assertEqual(baseline.AmountCount, incremental[baseline.Series].AmountCount)
+            self.assertAlmostEqual(baseline.AmountM2, incremental[baseline.Series].AmountM2)
+
+
+class AnomalyQueryBudgetTests(QueryBudgetTestCase):
+
+    def testDetectNewSales(self):
+        def Build(size):
+            MakeSales(size * 10, MakeStores(size), MakeProducts(size))
+            return ()
+
+        # The watermarks and the batch, then in a savepoint the baselines read and inserted and the
+        # watermark saved (five queries), and the watermarks and an empty batch again
+        self.assertQueryBudget(14, Build, DetectNewSales)
+
+    def testAlertsView(self):
+        def Build(size):
+            stores, products = MakeStores(size), MakeProducts(size)
+            SalesAlert.objects.bulk_create(
+                SalesAlert(Kind=SalesAlert.REVENUE_DROP, StoreId=store, ProductId=product, Day=timezone.localdate(), Value=0, Expected=10, ZScore=-5)
+                for store, product in zip(stores, products)
+            )
+            return ()
+
+        def Call():
+            response = self.client.get("/Sales/alerts/", {"kind": "revenue-drop"})
+            self.assertTrue(response.json()["alerts"][0]["StoreId__StoreName"])
+
+        self.assertQueryBudget(1, Build, Call)
+        self.assertEqual(self.client.get("/Sales/alerts/", {"kind": "nonsense"}).status_code, 400)
+
+
+class SketchTests(SimpleTestCase):
+
+    def testHyperLogLog(self):
+        evens, odds = HyperLogLog(), HyperLogLog()
+        for value in range(0, 40000, 2):
+            evens.Add(value)
+        for value in range(1, 40000, 2):
+            odds.Add(value)
+            odds.Add(value)     # Repeats don't count
+        self.assertLess(abs(evens.Estimate() - 20000) / 20000, 4 * evens.StandardError())
+
+        union = HyperLogLog()
+        for value in range(40000):
+            union.Add(value)
+        self.assertEqual(evens.Merge(odds).registers, union.registers)    # Merging is exact
+
+        small = HyperLogLog()
+        for value in range(25):
+            small.Add(value)
+        self.assertEqual(small.Estimate(), 25)
+        for sketch in (small, union):   # Sparse and dense forms
+            self.assertEqual(HyperLogLog.Deserialize(sketch.Serialize()).registers, sketch.registers)
+        self.assertEqual(HyperLogLog().MergeSerialized(small.Serialize()).Merge(union).registers, union.registers)
+
+    def testKllSketch(self):
+        values = list(range(100000))
+        random.Random(7).shuffle(values)
+        parts = [KllSketch() for _ in range(10)]
+        for position, value in enumerate(values):
+            parts[position % 10].Add(value)
+        merged = KllSketch()
+        for part in parts:
+            merged.MergeSerialized(part.Serialize())
+
+        self.assertEqual(merged.count, 100000)
+        self.assertLess(sum(map(len, merged.levels)), 1000)  # O(k) items kept
+        for quantile, estimate in zip((0, 0.5, 0.9, 0.99, 1), merged.Quantiles([0, 0.5, 0.9, 0.99, 1])):
+            self.assertLess(abs(estimate - quantile * 99999) / 100000, merged.RankError())
+
+        exact = KllSketch()     # Below the capacity nothing is compacted, quantiles are exact
+        for value in (5, 1, 4, 2, 3):
+            exact.Add(value)
+        self.assertEqual(KllSketch.Deserialize(exact.Serialize()).Quantiles([0.5, 0.8, 1]), [3, 4, 5])
+        self.assertEqual(KllSketch().Quantiles([0.5]), [None])
+
+
+class SalesSketchTests(QueryBudgetTestCase):
+
+    def Recorded(self, stores, products, amounts, days=1):
+        # One sale per amount, cycling through the stores and products, then through `days` days
+        now = timezone.now()
+        return Sales.objects.bulk_create(
+            Sales(
+                PaymentMethod="Card", TotalAmount=Decimal(amount), StoreId=stores[n % len(stores)],
+                ProductId=products[n % len(products)], SaleTimestamp=now - timedelta(days=n // len(stores) % days),
+            )
+            for n, amount in enumerate(amounts)
+        )
+
+    def testUpdateSketches(self):
+        def Build(size):
+            self.Recorded(MakeStores(size), MakeProducts(size), [10] * size * 10, days=3)
+            return ()
+
+        # The watermarks and the batch, then in a savepoint the sketches read and upserted and the
+        # watermark saved (six queries), and the watermarks and an empty batch again
+        self.assertQueryBudget(14, Build, UpdateSketches)
+
+    def testSketchesMatchSales(self):
+        stores, products = MakeStores(2), MakeProducts(3)
+        self.Recorded(stores, products, range(1, 61), days=2)
+        self.assertEqual(UpdateSketches(batch_size=25), 60)
+        self.assertEqual(SalesSketch.objects.count(), 4)
+
+        result = QuerySketches(by="total", quantiles=[0, 0.5, 1])
+        self.assertEqual(
+            result["rows"], [{"SalesCount": 60, "Percentiles": {"p0": 1, "p50": 30, "p100": 60}, "DistinctProducts": 3}]
+        )
+        stores = QuerySketches([stores[0].pk], start_date=timezone.localdate())["rows"]
+        self.assertEqual(stores[0]["SalesCount"], 15)   # Every fourth sale
+        self.assertEqual(stores[0]["DistinctProducts"], 3)
+
+        incremental = list(SalesSketch.objects.order_by("StoreId", "Day").values_list("StoreId", "Day", "SalesCount"))
+        self.assertEqual(RebuildSketches(), {"Sales": 60, "Sketches": 4})
+        self.assertEqual(list(SalesSketch.objects.order_by("StoreId", "Day").values_list("StoreId", "Day", "SalesCount")), incremental)
+        self.assertEqual(UpdateSketches(), 0)
+
+    def testSketchesView(self):
+        def Build(size):
+            self.Recorded(MakeStores(size), MakeProducts(size), [10] * size, days=size)
+            UpdateSketches()
+            return ()
+
+        def Call():
+            response = self.client.get("/Sales/sketches/", {"by": "day", "quantiles": "0.5,0.9"})
+            self.assertEqual(response.json()["rows"][0]["Percentiles"], {"p50": "10.00", "p90": "10.00"})
+
+        self.assertQueryBudget(1, Build, Call)
+        self.assertEqual(self.client.get("/Sales/sketches/", {"by": "week"}).status_code, 400)
+        self.assertEqual(self.client.get("/Sales/sketches/", {"quantiles": "1.5"}).status_code, 400)
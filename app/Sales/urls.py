@@ -0,0 +1,12 @@
+from django.urls import path
+
+from . import views
+# store for each modules related URL
+urlpatterns = [
+    path("performance/", views.GetStorePerformance, name="store-performance"),
+    path("graph/", views.GetSalesGraph, name="sales-graph"),
+    path("record/", views.RecordSaleView, name="record-sale"),
+    path("alerts/", views.GetAlertsView, name="sales-alerts"),
+    path("cube/", views.GetSalesCubeView, name="sales-cube"),
+    path("sketches/", views.GetSketchesView, name="sales-sketches"),
+]
@@ -1,9 +1,54 @@
+import hashlib
+import json
+from decimal import InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
+from django.db.models import Max, Subquery
 from django.http import JsonResponse
 from django.shortcuts import render
+from django.utils.dateparse import parse_date
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 
 from app.facade import Facade  # Importing the Facade layer to handle business logic.
+from app.sharding import FanOut
+from app.responses import RESPONSE_FORMATS, FastJsonResponse, compress_response
+from Operations.models import OutboxEvent
+from Sales.anomaly import GetAlerts
+from Sales.cube import CENTS, FILTERS, BuildCube
+from Sales.sketches import DEFAULT_QUANTILES, QuerySketches
+from Sales.models import Sales
+
+
+def SalesETag(request, *args, **kwargs):
+    """
+    Builds an ETag for analytics views from a cheap watermark instead of the response body.
+
+    The watermark is the newest SalesId and the newest outbox event of each shard: the outbox
+    triggers add an event whenever a sale is recorded or one of its published columns (store,
+    product, amount, time, ...) is edited, so combined with the query string (date range,
+    granularity, ...) it identifies the response without running any aggregation. The lookup is a
+    single query over two primary key indexes per shard.
+
+    Changes the outbox doesn't publish are not seen, and responses keep their ETag until the next
+    sale event: edits of a sale's Quantity or SaleDate alone, and edits of products and stores,
+    such as the ProductType and names the cube and performance views report.
+    """
+    def Watermark(alias):
+        last_event = OutboxEvent.objects.using(alias).order_by("-OutboxEventId").values("OutboxEventId")[:1]
+        last = Sales.objects.using(alias).aggregate(LastSalesId=Max("SalesId"), LastEventId=Max(Subquery(last_event)))
+        return f"{last['LastSalesId'] or 0}.{last['LastEventId'] or 0}"
 
+    watermark = ",".join(FanOut(Watermark))
+    query = "&".join(sorted(f"{key}={value}" for key, value in request.GET.items()))
+    return hashlib.md5(f"{request.path}|{watermark}|{query}".encode()).hexdigest()
 
+
+@compress_response
+@cache_control(private=True, no_cache=True)  # Clients may keep the body but must revalidate with the ETag
+@condition(etag_func=SalesETag)  # Answers If-None-Match with 304 before the view runs
 def GetStorePerformance(request):
 
     # Handles requests for sales performance data and returns it as a JSON response.
@@ -12,12 +57,178 @@ def GetStorePerformance(request):
     
     start_date = request.GET.get("start_date")  # Retrieves the optional 'start_date' from query parameters.
     end_date = request.GET.get("end_date")  # Retrieves the optional 'end_date' from query parameters.
+    response_format = request.GET.get("format", "rows")  # 'columnar' for one array per column and a label table.
+    if response_format not in RESPONSE_FORMATS:
+        return JsonResponse({"error": f"format must be one of: {', '.join(RESPONSE_FORMATS)}."}, status=400)
 
-    sales_data = facade.GetSalesPerformanceGraph(start_date, end_date)  # Fetches sales performance data filtered by dates.
+    try:
+        # Fetches sales performance data filtered by dates.
+        sales_data = facade.GetStorePerformance(start_date, end_date, columnar=response_format == "columnar")
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
 
-    return JsonResponse(
+    return FastJsonResponse(
         {
+            "format": response_format,
             "store_sales": sales_data["store_sales"],  # Includes store-wise sales performance.
             "product_sales": sales_data["product_sales"],  # Includes product-wise sales performance.
+            **({"labels": sales_data["labels"]} if "labels" in sales_data else {}),  # Store and product names of the columnar format.
         }
-    )
\ No newline at end of file
+    )
+
+
+@compress_response
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=SalesETag)
+def GetSalesGraph(request):
+
+    # Handles requests for time-bucketed sales graph data and returns it as a JSON response.
+
+    start_date = request.GET.get("start_date")  # Retrieves the optional 'start_date' from query parameters.
+    end_date = request.GET.get("end_date")  # Retrieves the optional 'end_date' from query parameters.
+    granularity = request.GET.get("granularity", "day")  # One of 'hour', 'day', 'week' or 'month'.
+    response_format = request.GET.get("format", "rows")  # 'columnar' for one array per column.
+    if response_format not in RESPONSE_FORMATS:
+        return JsonResponse({"error": f"format must be one of: {', '.join(RESPONSE_FORMATS)}."}, status=400)
+
+    try:
+        max_points = request.GET.get("max_points")  # Optional limit on the number of points returned.
+        max_points = int(max_points) if max_points else None
+
+        graph = Sales().GetSalesGraph(
+            start_date, end_date, granularity=granularity, max_points=max_points, columnar=response_format == "columnar"
+        )
+    except ValueError as e:  # Invalid granularity, date or max_points
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return FastJsonResponse({"granularity": granularity, "format": response_format, "points": graph})
+
+
+@csrf_exempt
+def RecordSaleView(request):
+    """
+    Function-based view for tills to record a sale.
+    :param request: The HTTP request object, a JSON body with 'storeId', 'totalAmount' and optional
+        'paymentMethod', 'quantity', 'productId' and 'staffId'.
+    :return: A JsonResponse with the new sale's ID, status 201.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST method is allowed."}, status=405)
+
+    try:
+        body = json.loads(request.body)
+        store_id = int(body["storeId"])
+        # Finite, rounded to pence and within the column's digits, an overflowing amount would be
+        # stored by SQLite but make every later read of the sales fail
+        amount_field = Sales._meta.get_field("TotalAmount")
+        total_amount = amount_field.clean(amount_field.to_python(str(body["totalAmount"])).quantize(CENTS), None)
+        quantity = int(body.get("quantity", 1))
+        if quantity < 1:
+            raise ValueError("quantity must be at least 1.")
+        product_id = int(body["productId"]) if body.get("productId") else None
+        staff_id = int(body["staffId"]) if body.get("staffId") else None
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON format."}, status=400)
+    except KeyError as e:
+        return JsonResponse({"error": f"{e.args[0]} is required."}, status=400)
+    except (TypeError, ValueError, InvalidOperation, ValidationError):
+        return JsonResponse(
+            {"error": "storeId, productId and staffId must be integers, quantity a positive integer and totalAmount "
+                      "an amount of at most 13 digits before the decimal point."},
+            status=400,
+        )
+
+    try:
+        sale = Sales.objects.create(   # Goes to the store's shard when sharding is on
+            StoreId_id=store_id,
+            ProductId_id=product_id,
+            StaffId_id=staff_id,
+            TotalAmount=total_amount,
+            Quantity=quantity,
+            PaymentMethod=str(body.get("paymentMethod", "Card")),
+        )
+    except IntegrityError:  # The store, product or staff member doesn't exist
+        return JsonResponse({"error": "Unknown storeId, productId or staffId."}, status=400)
+
+    return JsonResponse({"salesId": sale.SalesId}, status=201)
+
+
+def GetAlertsView(request):
+    """
+    Function-based view returning the newest sales alerts.
+    :param request: The HTTP request object, with optional 'store', 'product', 'kind', 'since' and 'limit'
+        query parameters.
+    :return: A JsonResponse with the alerts, newest first.
+    """
+    try:
+        store, product = (int(request.GET[name]) if request.GET.get(name) else None for name in ("store", "product"))
+        limit = min(int(request.GET.get("limit", 100)), 1000)
+        alerts = GetAlerts(store, product, kind=request.GET.get("kind"), since=request.GET.get("since"), limit=limit)
+    except ValueError as e:  # Invalid id, limit, kind or date
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return FastJsonResponse({"alerts": alerts})
+
+
+@compress_response
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=SalesETag)
+def GetSalesCubeView(request):
+    """
+    Function-based view returning sales totals for several grouping levels at once.
+    :param request: The HTTP request object, with 'dimensions' and optional 'measures' (comma separated),
+        'grouping' ('cube', 'rollup' or grouping sets separated by ';', e.g. 'StoreId,PaymentMethod;StoreId;'),
+        'start_date', 'end_date', 'labels', 'format' and a filter per dimension, e.g. 'StoreId=1,2'.
+    :return: A JsonResponse with one table per grouping set.
+    """
+    response_format = request.GET.get("format", "rows")
+    if response_format not in RESPONSE_FORMATS:
+        return JsonResponse({"error": f"format must be one of: {', '.join(RESPONSE_FORMATS)}."}, status=400)
+
+    def Split(value):
+        return [item for item in value.split(",") if item]
+
+    dimensions = Split(request.GET.get("dimensions", ""))
+    measures = Split(request.GET.get("measures", "")) or ["TotalSales", "SalesCount"]
+    grouping = request.GET.get("grouping", "cube")
+    if grouping not in ("cube", "rollup"):
+        grouping = [Split(subset) for subset in grouping.split(";")]
+    dates = {name: request.GET.get(name) for name in ("start_date", "end_date")}
+    for name, value in dates.items():
+        if value and parse_date(value) is None:
+            return JsonResponse({"error": f"Invalid {name}: {value}, use YYYY-MM-DD."}, status=400)
+
+    try:
+        filters = {
+            dimension: [value if dimension in ("PaymentMethod", "ProductType") else int(value) for value in values]
+            for dimension, values in ((dimension, Split(request.GET.get(dimension, ""))) for dimension in FILTERS)
+            if values
+        }
+        cube = BuildCube(
+            dimensions, measures, grouping, filters=filters, labels=request.GET.get("labels") in ("1", "true"),
+            columnar=response_format == "columnar", **dates,
+        )
+    except ValueError as e:  # Unknown dimension or measure, invalid grouping or id
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return FastJsonResponse({"format": response_format, **cube})
+
+
+def GetSketchesView(request):
+    """
+    Function-based view returning approximate sale amount percentiles and distinct products sold, from the sales sketches.
+    :param request: The HTTP request object, with optional 'store' (comma separated ids), 'start_date', 'end_date',
+        'quantiles' (comma separated fractions, e.g. 0.5,0.9) and 'by' ('store', 'day' or 'total') query parameters.
+    :return: A JsonResponse with one row per group and the error bounds of the estimates.
+    """
+    try:
+        stores = [int(store) for store in request.GET.get("store", "").split(",") if store]
+        quantiles = [float(quantile) for quantile in request.GET.get("quantiles", "").split(",") if quantile]
+        result = QuerySketches(
+            stores, request.GET.get("start_date"), request.GET.get("end_date"), quantiles or DEFAULT_QUANTILES,
+            by=request.GET.get("by", "store"),
+        )
+    except ValueError as e:  # Invalid id, quantile, date or grouping
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return FastJsonResponse(result)
@@ -14,3 +14,15 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402 - settings are only usable once the application is set up
+
+if settings.WARMUP_ON_STARTUP:  # Load modules, URL patterns and model metadata before the first request
+    from app.warmup import Warmup
+
+    Warmup()
+
+if settings.SCHEDULER_RUN_IN_PROCESS:  # Run periodic jobs in a background thread of this worker
+    from Operations.scheduler import StartBackgroundScheduler
+
+    StartBackgroundScheduler()
@@ -0,0 +1,74 @@
+from django.db.models import F
+
+
+class ConcurrentUpdateError(ValueError):
+    # Raised when a row was changed by someone else between being read and being written
+    pass
+
+
+def _CurrentValue(instance, field):
+    # Current value of a field, the raw key for foreign keys so comparing doesn't fetch the related row
+    return getattr(instance, instance._meta.get_field(field).attname)
+
+
+def _RawValue(value):
+    # Compares a model instance by its primary key
+    return getattr(value, "pk", value)
+
+
+def ApplyChanges(instance, changes):
+    """
+    Sets new field values on a model instance and validates only the fields that actually change.
+
+    Args:
+        instance: The model instance being edited.
+        changes (dict): Field name -> new value.
+
+    Returns:
+        list: Names of the fields whose value differs from the current one.
+
+    Raises:
+        ValidationError: If a changed field fails its model validation.
+    """
+    changed = [field for field, value in changes.items() if _CurrentValue(instance, field) != _RawValue(value)]
+    for field in changed:
+        setattr(instance, field, changes[field])
+
+    if changed:  # clean_fields on just the changed columns, no unique checks or queries like full_clean
+        others = [f.name for f in instance._meta.concrete_fields if f.name not in changed]
+        instance.clean_fields(exclude=others)
+    return changed
+
+
+def SaveChangedFields(instance, fields):
+    """
+    Writes only the given fields, guarded by the row's Version column.
+
+    Issues ``UPDATE ... SET <fields>, Version = Version + 1 WHERE pk = ? AND Version = ?``, so an
+    edit based on a stale read is detected instead of silently overwriting the other change.
+
+    Args:
+        instance: Model instance with a Version field, already holding the new values.
+        fields (list): Names of the fields to write.
+
+    Raises:
+        ConcurrentUpdateError: If the row's version no longer matches the instance's.
+    """
+    if not fields:  # Nothing changed, nothing to write
+        return False
+
+    model = type(instance)
+    updated = model._default_manager.filter(pk=instance.pk, Version=instance.Version).update(
+        Version=F("Version") + 1, **{field: getattr(instance, field) for field in fields}
+    )
+    if not updated:
+        raise ConcurrentUpdateError(
+            f"{model.__name__} {instance.pk} was modified by another user, reload it and try again."
+        )
+    instance.Version += 1
+    return True
+
+
+def EditWithVersionCheck(instance, changes):
+    # Validates and writes the changed fields of an instance in one version-checked UPDATE
+    return SaveChangedFields(instance, ApplyChanges(instance, changes))
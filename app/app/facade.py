@@ -1,7 +1,34 @@
-from Procurement import Supplier, PurchaseOrder
-from Inventory import Product
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Subquery
+
+from Procurement.models import Supplier, PurchaseOrder
 from Sales.models import Sales
-from Inventory.models import Product, Store
+from Inventory.models import Product, ProductLocation, Store
+from Sales.archive import MergeTotals, ReadAcrossArchive
+from Sales.graphing import DateToDatetime
+from app.profiling import profiled
+from app.responses import ColumnarEncoder
+from app.sharding import FanOut, ShardingEnabled
+from app.singleflight import SingleFlight
+
+
+STORE_COLUMNS = ("StoreId__StoreName", "TotalSales")
+PRODUCT_COLUMNS = ("StoreId__StoreName", "ProductId__ProductName", "TotalSales")
+
+
+def MergeRows(results, index):
+    # Adds up the totals (last item) of row tuples sharing the same keys, ordered by the last key like the SQL queries
+    merged = {}
+    for result in results:
+        for *key, total in result[index]:
+            key = tuple(key)
+            merged[key] = merged.get(key, 0) + total
+    ordered = sorted(merged.items(), key=lambda item: (item[0][-1] is not None, item[0][-1] or ""))
+    return [(*key, total) for key, total in ordered]
+
+
+_restocks = SingleFlight()   # Restocks in flight in this process, by product ID
+
 
 class Facade():
 
@@ -10,37 +37,67 @@ class Facade():
         self.stores = Store.objects.all()
         self.products = Product.objects.all()
 
+    @profiled()
     def RestockProduct(self, productId):
 
         """
         Triggers a purchase order if the product's stock is below its reorder level.
+
+        Concurrent restocks of the same product in this process share one check and its message.
+        Other processes are kept from ordering twice by the one_open_order_per_product constraint,
+        and a product with an open order is answered from the product query alone.
         Args:
             productId: The product ID to check.
         Returns:
             A message about what happened.
         """
 
+        message, _ = _restocks.Do(productId, self._Restock, productId)
+        return message
+
+
+    def _Restock(self, productId):
         try:
-            product = Product.objects.get(ProductId=productId)# Fetch the product
-            currentStock = product.GetStockLevel()# Get the current stock level for the product
+            product = Product.objects.select_related("SupplierId").annotate(    # Fetch the product with its supplier and open order
+                OpenOrderId=Subquery(
+                    PurchaseOrder.objects.filter(ProductId=OuterRef("pk"), OrderStatus__in=PurchaseOrder.OPEN_STATUSES)
+                    .values("PurchaseOrderId")[:1]
+                )
+            ).get(ProductId=productId)
+            if product.OpenOrderId is not None:    # Stock is already on its way
+                return f"Purchase order {product.OpenOrderId} for product ID {productId} is already open. No purchase order needed."
+            currentStock = product.GetStockAmount()# Get the current stock level for the product
 
-            if currentStock < product.ReorderLevel: # Check if the stock is below the reorder level
+            if currentStock < product.OrderLimit: # Check if the stock is below the reorder level
                 # Get the supplier associated with the product
-                supplier = Supplier.objects.get(SupplierId=product.SupplierId.SupplierId)
+                supplier = product.SupplierId
 
-                if not supplier.exists(): # If no supplier exists, return a message
+                if supplier is None: # If no supplier exists, return a message
                     return f"No supplier found for product ID {productId}."
 
                 # Calculate the reorder quantity and total amount
-                reorderQuantity = product.ReorderLevel - currentStock
+                reorderQuantity = product.OrderLimit - currentStock
                 totalAmount = reorderQuantity * product.Price
+                # Deliver to the store holding the least of this product, if it is stocked anywhere
+                lowest = [
+                    row for row in FanOut(
+                        lambda alias: ProductLocation.objects.using(alias).filter(ProductId=product)
+                        .order_by("Quantity").values_list("Quantity", "StoreId").first()
+                    ) if row
+                ]
+                store = Store.objects.filter(StoreId=min(lowest)[1]).first() if lowest else None
                 # Create a new purchase order with "Pending" status
-                purchaseOrder = PurchaseOrder.CreatePurchaseOrder(
-                    product=product,
-                    totalAmount=totalAmount,
-                    orderStatus="Pending",
-                    supplierId=supplier
-                )
+                try:
+                    with transaction.atomic():
+                        purchaseOrder = PurchaseOrder.CreatePurchaseOrder(
+                            product=product,
+                            totalAmount=totalAmount,
+                            orderStatus=PurchaseOrder.PENDING,
+                            quantity=reorderQuantity,
+                            store=store,
+                        )
+                except IntegrityError:  # Another process ordered the product since it was read
+                    return f"A purchase order for product ID {productId} is already open. No purchase order needed."
 
                 # Return a success message with purchase order details
                 return f"Purchase order {purchaseOrder.PurchaseOrderId} created for product ID {productId} with quantity {reorderQuantity}."
@@ -55,46 +112,88 @@ class Facade():
             return f"Error triggering purchase order: {str(e)}"
 
 
-    def GetStorePerformance(self, start_date=None, end_date=None):
+    @profiled()
+    def GetStorePerformance(self, start_date=None, end_date=None, columnar=False):
         """
         Retrieves sales data for graphing performance by stores and products.
         
         Args:
             start_date (datetime.date, optional): Start date to filter sales data.
             end_date (datetime.date, optional): End date to filter sales data.
+            columnar (bool): Return one list per column, with store and product names replaced by
+                indexes into shared "labels" lists, instead of one dictionary per row.
         
         Returns:
             dictionary: Contains store-wise and product-wise sales performance data.
         """
         try:
             from django.db.models import Sum
-            # Initialise sales queryset
-            sales_queryset = self.sales
-
-            # Filter sales data by start date if provided
-            if start_date:
-                sales_queryset = sales_queryset.filter(DateOfSale__gte=start_date)
-
-            # Filter sales data by end date if provided
-            if end_date:
-                sales_queryset = sales_queryset.filter(DateOfSale__lte=end_date)
-
-            # Aggregate sales data by product
-            product_sales = (
-                sales_queryset.values("StoreId__StoreName", "ProductId__ProductName")# Group by store and product
-                .annotate(TotalSales=Sum("TotalAmount"))# Calculate total sales per product
-                .order_by("ProductId__ProductName")# Sort results by product name
-            )
-
-            # Aggregate total sales grouped by store
-            store_sales = (
-                sales_queryset.values("StoreId__StoreName")# Group by store name
-                .annotate(TotalSales=Sum("TotalAmount")) # Calculate total sales per store
-                .order_by("StoreId__StoreName")# Sort results by store name
-            )
+            # Sales are dated by SaleTimestamp, like Sales.CalculateTotalSales and GetSalesGraph
+            start = DateToDatetime(start_date)
+            end = DateToDatetime(end_date, end_of_day=True)
+
+            def FilterDates(sales_queryset):
+                # Filter sales data by start date if provided
+                if start:
+                    sales_queryset = sales_queryset.filter(SaleTimestamp__gte=start)
+
+                # Filter sales data by end date if provided
+                if end:
+                    sales_queryset = sales_queryset.filter(SaleTimestamp__lte=end)
+                return sales_queryset
+
+            def Performance(sales_queryset):
+                sales_queryset = FilterDates(sales_queryset)
+
+                # Aggregate sales data by product, as (store, product, total) tuples
+                product_sales = (
+                    sales_queryset.values_list("StoreId__StoreName", "ProductId__ProductName")# Group by store and product
+                    .annotate(TotalSales=Sum("TotalAmount"))# Calculate total sales per product
+                    .order_by("ProductId__ProductName")# Sort results by product name
+                )
+
+                # Roll the product totals up to (store, total) tuples ordered by store name, instead of scanning the sales again
+                product_sales = list(product_sales)
+                store_sales = MergeTotals([[(store, total) for store, _, total in product_sales]])
+                return store_sales, product_sales
+
+            def PerformanceById(sales_queryset):
+                # The archive and shards can't join stores and products, so total per id and name them from the default database
+                totals = list(
+                    FilterDates(sales_queryset).values_list("StoreId", "ProductId").annotate(TotalSales=Sum("TotalAmount"))
+                )
+                storeNames = dict(Store.objects.filter(StoreId__in={s for s, _, _ in totals}).values_list("StoreId", "StoreName"))
+                productNames = dict(
+                    Product.objects.filter(ProductId__in={p for _, p, _ in totals if p}).values_list("ProductId", "ProductName")
+                )
+                product_sales = [
+                    (storeNames.get(storeId), productNames.get(productId), total) for storeId, productId, total in totals
+                ]
+                store_sales = {}
+                for store, _, total in product_sales:
+                    store_sales[store] = store_sales.get(store, 0) + total
+                return list(store_sales.items()), product_sales
+
+            results = ReadAcrossArchive(Performance, start_date, PerformanceById)
+            if len(results) == 1 and not ShardingEnabled():   # Only the unsharded Sales table was read
+                store_sales, product_sales = results[0]
+            else:                   # Add up the partial totals of the shards and the archive per store and product
+                store_sales = MergeRows(results, 0)
+                product_sales = MergeRows(results, 1)
+
+            if columnar:    # Transpose the tuples, names are sent once in the label lists
+                encoder = ColumnarEncoder(labelled=PRODUCT_COLUMNS[:2])
+                return {
+                    "store_sales": encoder.Table(store_sales, STORE_COLUMNS),
+                    "product_sales": encoder.Table(product_sales, PRODUCT_COLUMNS),
+                    "labels": encoder.Labels(),
+                }
 
             # Return aggregated sales data as a dictionary
-            return {"store_sales": list(store_sales), "product_sales": list(product_sales)}
+            return {
+                "store_sales": [dict(zip(STORE_COLUMNS, row)) for row in store_sales],
+                "product_sales": [dict(zip(PRODUCT_COLUMNS, row)) for row in product_sales],
+            }
 
         except Exception as e: # Raise a ValueError with the error message in case of failure
             raise ValueError(f"Error generating sales performance graph: {str(e)}")
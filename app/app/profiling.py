@@ -0,0 +1,177 @@
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import Resolver404, get_resolver, resolve
+
+_active = threading.local()    # Marks threads that are already being profiled, so profiles don't nest
+_profiledViews = set()         # Views decorated with profile_view
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler for a single thread.
+
+    A background thread wakes every ``interval`` seconds, grabs the target thread's current Python
+    stack with ``sys._current_frames`` and counts it. Nothing is hooked into the profiled code, so
+    the cost is one stack walk per sample rather than one callback per function call.
+    """
+
+    def __init__(self, interval=None, threadId=None):
+        self.interval = interval or settings.PROFILING_INTERVAL
+        self.threadId = threadId or threading.get_ident()
+        self.stacks = Counter()     # Collapsed stack -> number of samples
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _Sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.threadId)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def Start(self):
+        self._thread = threading.Thread(target=self._Sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def Stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.stacks
+
+    def __enter__(self):
+        return self.Start()
+
+    def __exit__(self, *exc_info):
+        self.Stop()
+
+
+def WriteCollapsed(stacks, tag, duration, directory=None):
+    """
+    Writes samples in the collapsed-stack format read by flamegraph.pl, speedscope and inferno.
+
+    Args:
+        stacks (Counter): Collapsed stack -> sample count, from SamplingProfiler.
+        tag (str): View or function name the profile belongs to.
+        duration (float): Wall time of the profiled call in seconds.
+
+    Returns:
+        Path: The file written, named after the tag and duration.
+    """
+    directory = Path(directory or settings.PROFILING_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    safe_tag = re.sub(r"[^A-Za-z0-9_.-]+", "_", tag)
+    path = directory / f"{safe_tag}-{duration * 1000:.0f}ms-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.collapsed"
+    with open(path, "w") as profile_file:
+        for stack, count in stacks.most_common():
+            profile_file.write(f"{stack} {count}\n")
+    return path
+
+
+def _Profile(tag, function, *args, **kwargs):
+    # Calls the function under the sampling profiler and writes its collapsed stacks
+    _active.profiling = True
+    profiler = SamplingProfiler().Start()
+    started = time.perf_counter()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        duration = time.perf_counter() - started
+        stacks = profiler.Stop()
+        _active.profiling = False
+        if stacks:
+            WriteCollapsed(stacks, tag, duration)
+
+
+def profile_view(view):
+    # Marks a view so every request to it is profiled by ProfilingMiddleware
+    view.profile = True
+    _profiledViews.add(view)
+    return view
+
+
+def profiled(rate=None):
+    """
+    Decorator that profiles calls to a function, e.g. a Facade method.
+
+    Args:
+        rate (float, optional): Fraction of calls to profile, defaults to PROFILING_FUNCTION_SAMPLE_RATE.
+            Calls made while the request is already being profiled are not profiled again.
+    """
+    def Decorator(function):
+        tag = f"{function.__module__}.{function.__qualname__}"
+
+        @wraps(function)
+        def Wrapper(*args, **kwargs):
+            sample_rate = settings.PROFILING_FUNCTION_SAMPLE_RATE if rate is None else rate
+            if sample_rate and not getattr(_active, "profiling", False) and random.random() < sample_rate:
+                return _Profile(tag, function, *args, **kwargs)
+            return function(*args, **kwargs)
+
+        return Wrapper
+
+    return Decorator
+
+
+class ProfilingMiddleware:
+    """
+    Profiles selected requests and writes a collapsed-stack file per request to PROFILING_DIR.
+
+    A request is profiled when any of the following holds:
+      * it carries the PROFILING_HEADER header, with PROFILING_HEADER_TOKEN as its value when a
+        token is configured (without a token the header is only honoured when DEBUG is on);
+      * the view is decorated with ``profile_view`` or named in PROFILING_VIEWS;
+      * it is picked by random sampling at PROFILING_SAMPLE_RATE.
+    The URL is only resolved for requests that may be profiled: when a request neither asks for a
+    profile nor is sampled, and no view is marked for profiling, it only pays for a header lookup
+    and a random number.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        get_resolver().url_patterns     # Imports the views, so those marked with profile_view are known
+
+    def Requested(self, request):
+        # Whether the request asks for a profile with the PROFILING_HEADER header
+        header = request.META.get(settings.PROFILING_HEADER)
+        if header is None:
+            return False
+        token = settings.PROFILING_HEADER_TOKEN
+        if token:   # Constant-time comparison, so the token can't be guessed from response times
+            return hmac.compare_digest(header.encode(), token.encode())
+        return settings.DEBUG
+
+    def __call__(self, request):
+        rate = settings.PROFILING_SAMPLE_RATE
+        selected = self.Requested(request) or (bool(rate) and random.random() < rate)
+        if not selected and not (_profiledViews or settings.PROFILING_VIEWS):
+            return self.get_response(request)
+
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return self.get_response(request)
+
+        view_name = match.view_name or match._func_path
+        if not (selected or getattr(match.func, "profile", False) or view_name in settings.PROFILING_VIEWS):
+            return self.get_response(request)
+
+        return _Profile(view_name, self.get_response, request)
@@ -0,0 +1,327 @@
+from django.apps import apps
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from app.sharding import FanOut, GroupByShard, IsSharded
+
+MAX_INCLUDE_DEPTH = 3       # Nesting levels a single read may include, e.g. "stock.product.supplier"
+MAX_ROOT_ROWS = 100         # Upper bound on top-level rows per read
+MAX_KEYS_PER_QUERY = 5000   # Keys sent in one IN (...), well below SQLite's 32766 variable limit
+RECENT_SALES = 10           # Sales included per store, product or staff member, newest first
+MAX_INCLUDED_ROWS = 50      # Rows of any other list include per parent, in key order
+MAX_INCLUDED_TOTAL = 10000  # Upper bound on the rows one read may include through list includes, over every path
+
+
+class Relation:
+    """
+    A nested include from one resource to another, resolved with one IN (...) query per level.
+
+    Args:
+        resource (str): Name of the included resource.
+        local (str): Column of the parent row holding the key, e.g. "StoreId" or "SupplierId_id".
+        remote (str): Column of the included rows matched against that key.
+        many (bool): Whether the parent has a list of included rows rather than a single one.
+        limit (int, optional): Keeps only the first rows per parent, in ``order_by`` order. Every list
+            include has one, so ValidateRead can bound the rows a read returns.
+        order_by (str, optional): Ordering of the included rows, "-" for descending.
+    """
+
+    def __init__(self, resource, local, remote, many=False, limit=None, order_by=None):
+        self.resource = resource
+        self.local = local
+        self.remote = remote
+        self.many = many
+        self.limit = limit
+        self.order_by = order_by
+
+
+class Resource:
+    # A model exposed by the read API, with the fields clients may ask for and its includes
+
+    def __init__(self, model, fields, relations):
+        self.label = model
+        self.fields = fields
+        self.relations = relations
+
+    @property
+    def model(self):
+        return apps.get_model(self.label)
+
+    @property
+    def key(self):
+        return self.model._meta.pk.attname
+
+
+RESOURCES = {
+    "store": Resource(
+        "Inventory.Store",
+        ("StoreName", "Location", "Latitude", "Longitude", "ContactNumber", "TotalSales", "OperatingHours"),
+        {
+            "stock": Relation("stock", "StoreId", "StoreId_id", many=True, limit=MAX_INCLUDED_ROWS, order_by="ProductId_id"),
+            "sales": Relation("sale", "StoreId", "StoreId_id", many=True, limit=RECENT_SALES, order_by="-SaleTimestamp"),
+            "manager": Relation("staff", "ManagerId_id", "StaffId"),
+        },
+    ),
+    "product": Resource(
+        "Inventory.Product",
+        ("ProductName", "ProductType", "Price", "StockAmount", "OrderLimit", "LastPurchaseDate"),
+        {
+            "stock": Relation(
+                "stock", "ProductId", "ProductId_id", many=True, limit=MAX_INCLUDED_ROWS, order_by="StoreId_id"
+            ),
+            "sales": Relation("sale", "ProductId", "ProductId_id", many=True, limit=RECENT_SALES, order_by="-SaleTimestamp"),
+            "supplier": Relation("supplier", "SupplierId_id", "SupplierId"),
+        },
+    ),
+    "stock": Resource(
+        "Inventory.ProductLocation",
+        ("Quantity", "Date"),
+        {
+            "product": Relation("product", "ProductId_id", "ProductId"),
+            "store": Relation("store", "StoreId_id", "StoreId"),
+        },
+    ),
+    "sale": Resource(
+        "Sales.Sales",
+        ("PaymentMethod", "TotalAmount", "Quantity", "SaleDate", "SaleTimestamp"),
+        {
+            "store": Relation("store", "StoreId_id", "StoreId"),
+            "product": Relation("product", "ProductId_id", "ProductId"),
+            "staff": Relation("staff", "StaffId_id", "StaffId"),
+        },
+    ),
+    "staff": Resource(
+        "HR.Staff",
+        ("StaffName", "Role"),      # Salaries are left out on purpose
+        {
+            "sales": Relation("sale", "StaffId", "StaffId_id", many=True, limit=RECENT_SALES, order_by="-SaleTimestamp"),
+        },
+    ),
+    "supplier": Resource(
+        "Procurement.Supplier",
+        ("SupplierName", "ContactDetails", "Location", "ContractTerms"),
+        {
+            "products": Relation(
+                "product", "SupplierId", "SupplierId_id", many=True, limit=MAX_INCLUDED_ROWS, order_by="ProductId"
+            ),
+        },
+    ),
+}
+
+
+def ParseIncludes(value):
+    """
+    Parses an include list such as "stock.product,sales.staff" into a nested dictionary.
+
+    Raises:
+        ValueError: If a path is nested deeper than MAX_INCLUDE_DEPTH.
+    """
+    tree = {}
+    for path in filter(None, (part.strip() for part in (value or "").split(","))):
+        names = path.split(".")
+        if len(names) > MAX_INCLUDE_DEPTH:
+            raise ValueError(f"Includes can be nested at most {MAX_INCLUDE_DEPTH} levels deep: {path}")
+        node = tree
+        for name in names:
+            node = node.setdefault(name, {})
+    return tree
+
+
+class Loader:
+    """
+    Per-request batch loader in the style of DataLoader.
+
+    Every level of a nested read asks for the rows of all its parents at once, so a relation costs
+    one IN (...) query (per shard for sharded models) however many rows it spans. Rows already
+    loaded during the request are served from the loader's cache, e.g. a store reached through
+    both its stock and its sales is only fetched once.
+    """
+
+    def __init__(self, fieldsets=None):
+        self.fieldsets = fieldsets or {}
+        self.cache = {}     # (resource, column, columns, limit, order) -> {key: [rows]}
+
+    def Fields(self, name):
+        # Fields returned for a resource: the requested sparse fieldset or all of them
+        return self.fieldsets.get(name) or RESOURCES[name].fields
+
+    def Load(self, name, column, keys, columns, limit=None, order_by=None):
+        """
+        Returns the rows of a resource whose ``column`` is one of ``keys``, grouped by that column.
+
+        Args:
+            name (str): Resource to load.
+            column (str): Column matched against the keys.
+            keys (iterable): Key values, duplicates and None are ignored.
+            columns (tuple): Columns to load for each row.
+            limit (int, optional): Keeps only the first rows per key, in ``order_by`` order.
+            order_by (str, optional): Ordering used with ``limit``.
+
+        Returns:
+            dict: Lists of row dictionaries by key.
+        """
+        # Rows are grouped by the matched column, and shards' rows merged by the ordering column
+        columns = tuple(dict.fromkeys((*columns, column, *([order_by.lstrip("-")] if order_by else []))))
+        cached = self.cache.setdefault((name, column, columns, limit, order_by), {})
+        missing = {key for key in keys if key is not None and key not in cached}
+        if missing:
+            for key in missing:
+                cached[key] = []
+            for row in self._Fetch(RESOURCES[name], column, sorted(missing), columns, limit, order_by):
+                if limit is None or len(cached[row[column]]) < limit:     # Each shard returns its own top rows
+                    cached[row[column]].append(row)
+        return cached
+
+    def _Fetch(self, resource, column, keys, columns, limit, order_by):
+        # Runs the batched IN (...) queries, on every shard holding matching rows for sharded models
+        def Query(queryset, keys):
+            rows = []
+            for start in range(0, len(keys), MAX_KEYS_PER_QUERY):
+                batch = queryset.filter(**{f"{column}__in": keys[start:start + MAX_KEYS_PER_QUERY]})
+                if limit:   # Top rows per key in the same query, numbered by a window function
+                    ordering = F(order_by.lstrip("-")).desc() if order_by.startswith("-") else F(order_by).asc()
+                    batch = batch.annotate(
+                        RowNumber=Window(RowNumber(), partition_by=[F(column)], order_by=ordering)
+                    ).filter(RowNumber__lte=limit)
+                if order_by:
+                    batch = batch.order_by(order_by)
+                rows.extend(batch.values(*columns))
+            return rows
+
+        model = resource.model
+        if not IsSharded(model):
+            return Query(model.objects.all(), keys)
+
+        if column == "StoreId_id":  # Keyed by store, only the shards of those stores hold rows
+            groups = GroupByShard(keys)
+            results = FanOut(lambda alias: Query(model.objects.using(alias), sorted(groups[alias])), groups)
+        else:
+            results = FanOut(lambda alias: Query(model.objects.using(alias), keys))
+        rows = [row for result in results for row in result]
+        if order_by:
+            rows.sort(key=lambda row: row[order_by.lstrip("-")], reverse=order_by.startswith("-"))
+        return rows
+
+    def Columns(self, name, include):
+        # Columns to load for a resource: its key, its requested fields and the keys its includes follow
+        resource = RESOURCES[name]
+        columns = [resource.key, *self.Fields(name)]
+        for relation_name in include:
+            columns.append(resource.relations[relation_name].local)
+        return tuple(dict.fromkeys(columns))
+
+    def Resolve(self, name, rows, include):
+        """
+        Turns loaded rows into response dictionaries and resolves their includes level by level.
+
+        Args:
+            name (str): Resource the rows belong to.
+            rows (list): Row dictionaries loaded with ``Columns(name, include)``.
+            include (dict): Nested includes, as returned by ParseIncludes.
+
+        Returns:
+            list: One dictionary per row, with "id", the requested fields and the includes.
+        """
+        resource = RESOURCES[name]
+        fields = self.Fields(name)
+        output = [{"id": row[resource.key], **{field: row[field] for field in fields}} for row in rows]
+
+        for relation_name, nested in include.items():
+            relation = resource.relations[relation_name]
+            columns = self.Columns(relation.resource, nested)
+            children = self.Load(
+                relation.resource, relation.remote, (row[relation.local] for row in rows), columns,
+                limit=relation.limit, order_by=relation.order_by,
+            )
+
+            # Every child row is resolved once, even when several parents share it
+            unique = {id(child): child for key in children for child in children[key]}
+            resolved = dict(zip(unique, self.Resolve(relation.resource, list(unique.values()), nested)))
+
+            for row, item in zip(rows, output):
+                matches = [resolved[id(child)] for child in children.get(row[relation.local], [])]
+                item[relation_name] = matches if relation.many else (matches[0] if matches else None)
+        return output
+
+
+def ValidateRead(name, fieldsets, include, roots=MAX_ROOT_ROWS):
+    """
+    Checks a read request against RESOURCES before anything is queried.
+
+    Args:
+        roots (int): Top-level rows the read can return, used to bound the rows its includes add.
+
+    Raises:
+        ValueError: For unknown resources, fields or includes, or list includes that could exceed MAX_INCLUDED_TOTAL rows.
+    """
+    if name not in RESOURCES:
+        raise ValueError(f"Unknown resource '{name}', expected one of: {', '.join(RESOURCES)}")
+    for resource_name, fields in fieldsets.items():
+        if resource_name not in RESOURCES:
+            raise ValueError(f"Unknown resource '{resource_name}' in fields")
+        unknown = set(fields) - set(RESOURCES[resource_name].fields)
+        if unknown:
+            raise ValueError(f"Unknown fields for {resource_name}: {', '.join(sorted(unknown))}")
+
+    def Check(resource_name, tree, rows):
+        # Returns the most rows the list includes below can add, with `rows` rows of resource_name
+        total = 0
+        for relation_name, nested in tree.items():
+            relation = RESOURCES[resource_name].relations.get(relation_name)
+            if relation is None:
+                raise ValueError(f"Unknown include '{relation_name}' for {resource_name}")
+            children = rows * relation.limit if relation.many else rows
+            total += (children if relation.many else 0) + Check(relation.resource, nested, children)
+        return total
+
+    if Check(name, include, roots) > MAX_INCLUDED_TOTAL:
+        raise ValueError(f"The includes could return more than {MAX_INCLUDED_TOTAL} rows, read fewer rows at once")
+
+
+def Read(name, ids=None, after=None, limit=20, fieldsets=None, include=None):
+    """
+    Reads top-level rows of a resource with sparse fieldsets and nested includes.
+
+    The number of queries depends on how deep the includes go, not on how many rows are returned:
+    one for the top-level rows and one per included relation (per shard for sales and stock).
+
+    Args:
+        name (str): Resource to read, a key of RESOURCES.
+        ids (list, optional): Primary keys to read, in the order they should be returned.
+        after (int, optional): Without ids, return rows whose key is greater than this one.
+        limit (int): Without ids, number of rows to return, at most MAX_ROOT_ROWS.
+        fieldsets (dict, optional): Fields to return per resource name, all fields by default.
+        include (dict, optional): Nested includes, as returned by ParseIncludes.
+
+    Returns:
+        list: The rows as dictionaries.
+
+    Raises:
+        ValueError: For unknown resources, fields or includes, or too many rows.
+    """
+    fieldsets, include = fieldsets or {}, include or {}
+    if ids is not None and len(ids) > MAX_ROOT_ROWS:
+        raise ValueError(f"At most {MAX_ROOT_ROWS} ids can be read at once")
+    limit = max(1, min(limit, MAX_ROOT_ROWS))
+    ValidateRead(name, fieldsets, include, roots=len(set(ids)) if ids is not None else limit)
+    loader = Loader(fieldsets)
+    resource = RESOURCES[name]
+    columns = loader.Columns(name, include)
+
+    if ids is not None:
+        found = loader.Load(name, resource.key, ids, columns)
+        rows = [found[key][0] for key in dict.fromkeys(ids) if found.get(key)]
+    else:
+        def Page(queryset):
+            if after is not None:
+                queryset = queryset.filter(**{f"{resource.key}__gt": after})
+            return list(queryset.order_by(resource.key).values(*columns)[:limit])
+
+        model = resource.model
+        if IsSharded(model):
+            pages = FanOut(lambda alias: Page(model.objects.using(alias)))
+            rows = sorted((row for page in pages for row in page), key=lambda row: row[resource.key])[:limit]
+        else:
+            rows = Page(model.objects.all())
+
+    return loader.Resolve(name, rows, include)
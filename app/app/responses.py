@@ -0,0 +1,161 @@
+import gzip
+import json
+from decimal import Decimal
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:  # orjson is optional, it is several times faster than the standard library encoder
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+try:  # brotli is optional, gzip is used when it is not installed
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+
+MIN_COMPRESS_SIZE = 1024  # Bodies smaller than this are sent uncompressed, compression would not pay off
+
+
+def _OrjsonDefault(value):
+    # Serialises the types orjson doesn't handle natively the same way DjangoJSONEncoder does
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError
+
+
+def DumpJson(data):
+    """
+    Serialises data to JSON bytes, using orjson when it is installed.
+
+    Decimals are written as strings and datetimes in ISO 8601 with a 'Z' suffix for UTC,
+    matching the output of DjangoJSONEncoder.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_OrjsonDefault, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+
+
+RESPONSE_FORMATS = ("rows", "columnar")     # Values of the ?format= parameter of the analytics views
+
+
+class ColumnarEncoder:
+    """
+    Builds columnar payloads: one list per column instead of one dictionary per row.
+
+    Row tuples, as returned by values_list, are transposed without creating a dictionary per
+    row, and column names are written once per table rather than once per row. Columns named in
+    ``labelled`` are dictionary-encoded: they hold indexes into a label list shared by every
+    table built with the same encoder, so a store name repeated on thousands of rows is sent once.
+
+    Args:
+        labelled (iterable): Names of the columns to dictionary-encode.
+    """
+
+    def __init__(self, labelled=()):
+        self.codes = {name: {} for name in labelled}   # Column -> {label: index}
+
+    def Table(self, rows, names):
+        """
+        Args:
+            rows (list): Row tuples.
+            names (tuple): Name of each tuple position.
+
+        Returns:
+            dict: One list per column, by name.
+        """
+        columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in names]
+        for position, name in enumerate(names):
+            codes = self.codes.get(name)
+            if codes is not None:
+                columns[position] = [codes.setdefault(value, len(codes)) for value in columns[position]]
+        return dict(zip(names, columns))
+
+    def Labels(self):
+        # Label lists of the encoded columns, position i holds the label of index i
+        return {name: list(codes) for name, codes in self.codes.items()}
+
+
+class FastJsonResponse(HttpResponse):
+    # JsonResponse equivalent that serialises with DumpJson
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=DumpJson(data), **kwargs)
+
+
+def AcceptedEncodings(header):
+    """
+    Parses an Accept-Encoding header into the quality value of each content coding.
+
+    Codings without a q parameter get 1, malformed ones 0, so ``br;q=0`` and ``gzip;q=0``
+    refuse that encoding rather than match it.
+
+    Returns:
+        dict: Lowercase coding (or "*") -> quality between 0 and 1.
+    """
+    accepted = {}
+    for part in header.split(","):
+        coding, *params = [item.strip() for item in part.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+                if not 0 <= quality <= 1:   # Out of range, or nan
+                    quality = 0.0
+        accepted[coding.lower()] = quality
+    return accepted
+
+
+def CompressResponse(request, response, min_size=MIN_COMPRESS_SIZE):
+    """
+    Compresses a response body with brotli or gzip, depending on what the client accepts.
+
+    Streaming, already-encoded and small responses are returned unchanged. A strong ETag is
+    weakened because the encoded bytes differ from the identity representation.
+    """
+    patch_vary_headers(response, ("Accept-Encoding",))
+
+    if response.streaming or response.has_header("Content-Encoding") or len(response.content) < min_size:
+        return response
+
+    accepted = AcceptedEncodings(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+    codings = ("br", "gzip") if brotli is not None else ("gzip",)
+    qualities = {coding: accepted.get(coding, accepted.get("*", 0.0)) for coding in codings}  # Unlisted ones get "*"'s
+    encoding = max(qualities, key=qualities.get)   # The first, brotli, wins ties
+    if qualities[encoding] <= 0:
+        return response
+    if encoding == "br":
+        body = brotli.compress(response.content, quality=4)
+    else:
+        body = gzip.compress(response.content, compresslevel=6, mtime=0)
+
+    if len(body) >= len(response.content):  # Incompressible body, keep the original
+        return response
+
+    response.content = body
+    response["Content-Length"] = str(len(body))
+    response["Content-Encoding"] = encoding
+    etag = response.get("ETag")
+    if etag and not etag.startswith("W/"):
+        response["ETag"] = f"W/{etag}"
+    return response
+
+
+def compress_response(view):
+    # View decorator that compresses large response bodies with CompressResponse
+    @wraps(view)
+    def Wrapper(request, *args, **kwargs):
+        return CompressResponse(request, view(request, *args, **kwargs))
+
+    return Wrapper
@@ -0,0 +1,68 @@
+from django.conf import settings
+
+# Models stored in the archive database, as "app_label.modelname"
+ARCHIVED_MODELS = {"Sales.archivedsales"}
+
+
+class ArchiveRouter:
+    """
+    Sends archived models to SALES_ARCHIVE_DATABASE and keeps everything else out of it.
+    """
+
+    def _IsArchived(self, model):
+        return f"{model._meta.app_label}.{model._meta.model_name}" in ARCHIVED_MODELS
+
+    def db_for_read(self, model, **hints):
+        return settings.SALES_ARCHIVE_DATABASE if self._IsArchived(model) else None
+
+    def db_for_write(self, model, **hints):
+        return settings.SALES_ARCHIVE_DATABASE if self._IsArchived(model) else None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        archived = f"{app_label}.{model_name}" in ARCHIVED_MODELS
+        if db == settings.SALES_ARCHIVE_DATABASE:
+            return archived     # Only archived tables (and no data migrations) go to the archive
+        return False if archived else None
+
+
+class ShardRouter:
+    """
+    Sends Sales and ProductLocation rows to the shard of their store when SALES_SHARDS is set.
+
+    Writes and reads of a single row, or of a store's reverse relations (``store.sales``), are
+    routed by StoreId. Queries with no store to go by fall through to the default database, so
+    code reading these tables across stores fans out with app.sharding.FanOut instead. Every other
+    model stays in the default database, even when reached from a sharded row.
+    """
+
+    def db_for_read(self, model, **hints):
+        from app.sharding import IsSharded, ShardFor, ShardingEnabled
+
+        if not ShardingEnabled():
+            return None
+        instance = hints.get("instance")
+        if not IsSharded(model):    # e.g. sale.StoreId, whose related store lives in the default database
+            return "default" if instance is not None and instance._state.db in settings.SALES_SHARDS else None
+        if instance is None:
+            return None
+        if IsSharded(type(instance)) and instance.StoreId_id is not None:
+            return ShardFor(instance.StoreId_id)
+        if instance._meta.label == "Inventory.Store" and instance.pk is not None:
+            return ShardFor(instance.pk)
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        from app.sharding import IsSharded
+
+        if IsSharded(type(obj1)) or IsSharded(type(obj2)):
+            return True     # Relations from sharded rows point into the default database
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        from app.sharding import SHARD_LOCAL_MODELS, SHARDED_MODELS
+
+        if db in settings.SALES_SHARDS:     # Only sharded and shard-local tables (and no data migrations)
+            return f"{app_label}.{model_name}" in SHARDED_MODELS | SHARD_LOCAL_MODELS
+        return None
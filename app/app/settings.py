@@ -36,6 +36,7 @@ INSTALLED_APPS = [
     "Procurement.apps.ProcurementConfig",
     "HR.apps.HrConfig",
     "Finance.apps.FinanceConfig",
+    "Operations.apps.OperationsConfig",
     "django.contrib.admin",
     "django.contrib.auth",
     "django.contrib.contenttypes",
@@ -45,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "app.profiling.ProfilingMiddleware",  # First, so profiles include the time spent in other middleware
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -82,9 +84,15 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+    },
+    "archive": {    # Cold storage for old sales, see Sales.archive and the archive_sales command
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "archive.sqlite3",
+    },
 }
 
+DATABASE_ROUTERS = ["app.routers.ArchiveRouter", "app.routers.ShardRouter"]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -126,3 +134,129 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Columnar sales mirror
+# Directory holding the memory-mapped column files used by Sales.columnar.ColumnarSalesStore
+
+SALES_COLUMNAR_DIR = BASE_DIR / "columnar"
+
+
+# Periodic job scheduler
+# Set SCHEDULER_RUN_IN_PROCESS to run the scheduler in a background thread of each WSGI/ASGI worker,
+# otherwise run it with the runscheduler management command.
+
+SCHEDULER_RUN_IN_PROCESS = False
+SCHEDULER_POLL_SECONDS = 5          # How often the scheduler looks for due jobs
+SCHEDULER_LEASE_SECONDS = 300       # How long a worker owns a job before another worker may take it over
+
+
+# Sampling profiler
+# Profiled requests and functions are written to PROFILING_DIR as collapsed stacks for flamegraph tools.
+
+PROFILING_DIR = BASE_DIR / "profiles"
+PROFILING_INTERVAL = 0.005              # Seconds between stack samples
+PROFILING_SAMPLE_RATE = 0.0             # Fraction of all requests to profile
+PROFILING_FUNCTION_SAMPLE_RATE = 0.0    # Fraction of calls to @profiled functions to profile
+PROFILING_VIEWS = []                    # View names to always profile, e.g. "store-performance"
+PROFILING_HEADER = "HTTP_X_PROFILE"     # Request header (X-Profile) that asks for a profile
+PROFILING_HEADER_TOKEN = None           # Required header value, without one the header only works with DEBUG on
+
+
+# Nearest-store locator
+# Grid cell size of the in-process store index, and how long cached availability may be served
+# before it is reloaded to pick up stock changes made by other processes.
+
+STORE_LOCATOR_CELL_DEGREES = 0.5
+STORE_LOCATOR_TTL = 30
+
+
+# Start-up warm-up
+# WARMUP_ON_STARTUP runs app.warmup.Warmup when wsgi.py or asgi.py is imported. Under gunicorn with
+# preload_app (see gunicorn.conf.py) that happens once in the master before forking, and each worker
+# then requests WARMUP_URLS in-process before it accepts traffic.
+
+WARMUP_ON_STARTUP = True
+WARMUP_URLS = []                    # e.g. ["/Inventory/search/?q=cha"], keep these cheap and read-only
+WARMUP_TEMPLATES = ["admin/login.html", "admin/index.html"]
+
+
+# Sales archive
+# archive_sales moves sales older than SALES_ARCHIVE_DAYS into ArchivedSales in the
+# SALES_ARCHIVE_DATABASE. Create its table once with: manage.py migrate --database archive
+
+SALES_ARCHIVE_DATABASE = "archive"
+SALES_ARCHIVE_DAYS = 365
+SALES_ARCHIVE_BATCH_SIZE = 5000
+SALES_ARCHIVE_PAUSE = 0.5           # Seconds between batches, leaves room for reports reading both tables
+SALES_ARCHIVE_MOVE_TIMEOUT = 120    # Seconds after which a batch still marked as moving is taken as abandoned
+
+
+# Store sharding
+# List database aliases in SALES_SHARDS to spread Sales and ProductLocation rows over them by
+# StoreId (see app.sharding and app.routers.ShardRouter), then run migrate --database for each.
+# Shards only hold those two tables, so SQLite shards must not enforce foreign keys, e.g.:
+#
+#     DATABASES["shard0"] = {
+#         "ENGINE": "django.db.backends.sqlite3",
+#         "NAME": BASE_DIR / "shard0.sqlite3",
+#         "OPTIONS": {"init_command": "PRAGMA foreign_keys = OFF", "transaction_mode": "IMMEDIATE"},
+#     }
+
+SALES_SHARDS = []
+SALES_SHARD_THREADS = 8             # Most threads used by one fan-out query
+
+
+# Change feed
+# Changes to sales, stock and purchase orders are written to an outbox table by triggers and
+# served from Operations/changes/. The outbox-retention job removes events older than
+# OUTBOX_RETENTION_DAYS, consumers further behind than that must resynchronise.
+
+OUTBOX_RETENTION_DAYS = 7
+CHANGE_FEED_BATCH_SIZE = 500        # Most events returned per request
+CHANGE_FEED_MAX_WAIT = 25           # Longest long-poll in seconds, keep it below proxy and worker timeouts
+CHANGE_FEED_POLL_INTERVAL = 0.5     # Seconds between checks for new events while long-polling
+
+
+# Cost of goods
+# The fifo-costing job turns delivered purchase orders into cost lots and costs new sales against
+# them first in, first out (see Finance.costing). Sales are costed in the order they arrive, so on
+# a database with existing history run rebuild_costing --apply once to cost it in timestamp order.
+# Without --apply, rebuild_costing compares the persisted costs with a full rebuild.
+
+COSTING_BATCH_SIZE = 5000           # Sales read per database per batch
+
+
+# Backups
+# backup_database copies every SQLite database to BACKUP_DIR/<time>/ with SQLite's online backup
+# API, a few pages at a time so writers are not held up, and with --dump also writes gzip NDJSON
+# dumps of every table. restore_database loads either kind back (see Operations.backup).
+
+BACKUP_DIR = BASE_DIR / "backups"
+BACKUP_PAGES_PER_STEP = 256         # Pages copied per step, the source is read-locked only during a step
+BACKUP_STEP_PAUSE = 0.01            # Seconds between steps, when writers get their turn
+BACKUP_MAX_RESTARTS = 5             # Copies restarted by writers before copying in a single step
+BACKUP_KEEP = 7                     # Backup folders kept, older ones are removed after each backup
+
+
+# Sales anomaly detection
+# The sales-anomalies job updates rolling baselines of every store and of every product in every
+# store with the sales recorded since its last run, and records sales and days of revenue that
+# are far from them as SalesAlert rows (see Sales.anomaly). On a database with existing history
+# run rebuild_sales_baselines once, so the baselines start from it.
+
+ANOMALY_Z_THRESHOLD = 3.5           # Standard deviations from the baseline at which a sale or a day is flagged
+ANOMALY_MIN_SALES = 30              # Sales of a product in a store before its sale amounts are scored
+ANOMALY_MIN_DAYS = 14               # Days of a series before its daily revenue is scored
+ANOMALY_EWMA_ALPHA = 0.1            # Weight of the newest day in the exponentially weighted mean
+ANOMALY_BATCH_SIZE = 5000           # Sales read per database per batch
+
+
+# Sales sketches
+# The sales-sketches job folds the sales recorded since its last run into one SalesSketch row per
+# store and day: a KLL sketch of the sale amounts and a HyperLogLog sketch of the products sold
+# (see Sales.sketches). On a database with existing history run rebuild_sales_sketches once.
+
+SKETCH_KLL_K = 200                  # Items kept in the top level of a quantile sketch, percentiles within about 1.3% of rank
+SKETCH_HLL_PRECISION = 12           # 2^12 registers per distinct count sketch, counts within about 1.6%
+SKETCH_BATCH_SIZE = 5000            # Sales read per database per batch
@@ -0,0 +1,124 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, models
+
+# Models whose rows live in the shard of their store, as "app_label.modelname"
+SHARDED_MODELS = {"Sales.sales", "Inventory.productlocation"}
+# Models every shard has its own table of, for rows about that shard's data (its change feed)
+SHARD_LOCAL_MODELS = {"Operations.outboxevent"}
+SHARD_ID_RANGE = 100_000_000    # Ids handed out by each shard, so ids stay unique across shards
+
+
+def ShardingEnabled():
+    # Whether Sales and ProductLocation rows are spread over the SALES_SHARDS databases
+    return bool(settings.SALES_SHARDS)
+
+
+def IsSharded(model):
+    return f"{model._meta.app_label}.{model._meta.model_name}" in SHARDED_MODELS
+
+
+def ShardAliases():
+    # Databases holding Sales and ProductLocation rows: the shards, or just the default database
+    return list(settings.SALES_SHARDS) or ["default"]
+
+
+def ShardFor(storeId):
+    """
+    Returns the database alias holding the Sales and ProductLocation rows of a store.
+
+    Stores are spread over the shards by id, so every shard serves a fixed group of stores and
+    their writes never wait on another group's.
+    """
+    shards = ShardAliases()
+    return shards[storeId % len(shards)]
+
+
+def GroupByShard(storeIds):
+    # Maps each shard alias to the set of the given store ids it holds
+    groups = {}
+    for storeId in storeIds:
+        groups.setdefault(ShardFor(storeId), set()).add(storeId)
+    return groups
+
+
+class ShardedQuerySet(models.QuerySet):
+    """
+    QuerySet for sharded models whose create() and bulk_create() route new rows by StoreId.
+
+    Django picks the database of a plain ``Model.objects.create()`` before the row exists, so the
+    router never sees its store. Without an explicit .using() these methods let each row's store
+    decide instead.
+    """
+
+    def create(self, **kwargs):
+        if self._db is not None or not ShardingEnabled():
+            return super().create(**kwargs)
+        instance = self.model(**kwargs)
+        instance.save(force_insert=True)    # Routed by the new row's StoreId
+        return instance
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None or not ShardingEnabled():
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        groups = {}
+        for instance in objs:
+            groups.setdefault(ShardFor(instance.StoreId_id), []).append(instance)
+        for alias, instances in groups.items():
+            self.using(alias).bulk_create(instances, *args, **kwargs)
+        return objs
+
+
+def _OnShard(function, alias):
+    # Runs one fan-out task in a worker thread, closing the thread's connection afterwards
+    try:
+        return function(alias)
+    finally:
+        connections[alias].close()
+
+
+def FanOut(function, aliases=None):
+    """
+    Runs a function against every shard, in parallel threads when there is more than one.
+
+    SQLite releases the GIL while it executes a query, so scans of separate shard files really do
+    run at the same time.
+
+    Args:
+        function (callable): Takes a database alias and returns that shard's partial result.
+        aliases (list, optional): Shards to query, defaults to all of them.
+
+    Returns:
+        list: The partial results, in the same order as the aliases.
+    """
+    aliases = ShardAliases() if aliases is None else list(aliases)
+    if len(aliases) == 1:   # No threads needed, and the caller's own connection (and transaction) is used
+        return [function(aliases[0])]
+    with ThreadPoolExecutor(max_workers=min(len(aliases), settings.SALES_SHARD_THREADS)) as pool:
+        return list(pool.map(lambda alias: _OnShard(function, alias), aliases))
+
+
+def ReserveShardIdRanges(using, **kwargs):
+    """
+    post_migrate handler giving each shard its own primary key range for the sharded tables.
+
+    Shard n hands out ids from n * SHARD_ID_RANGE onwards, so sales and stock rows keep globally
+    unique ids (the archive, the columnar mirror and ETags rely on that). Only SQLite's
+    AUTOINCREMENT counters are set, other databases need their sequences set up by hand.
+    """
+    from django.apps import apps
+
+    if using not in settings.SALES_SHARDS or connections[using].vendor != "sqlite":
+        return
+    start = (settings.SALES_SHARDS.index(using) + 1) * SHARD_ID_RANGE
+    with connections[using].cursor() as cursor:
+        for label in SHARDED_MODELS:
+            table = apps.get_model(label)._meta.db_table
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)", [table, start])
+            elif row[0] < start:
+                cursor.execute("UPDATE sqlite_sequence SET seq = %s WHERE name = %s", [start, table])
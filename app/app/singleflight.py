@@ -0,0 +1,59 @@
+import threading
+
+
+class _Call:
+    # A call in flight: the callers waiting for it block on ``done``
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0    # Callers that joined the call instead of running the function
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution, like Go's singleflight.
+
+    The first caller for a key runs the function, callers arriving while it runs wait for it and
+    get the same result, or the same exception. The key is forgotten as soon as the call
+    finishes, so results are shared but never cached. Only threads of one process are coalesced:
+    under gunicorn's sync workers each worker has its own map, and work that must not be
+    duplicated across processes needs a database guard as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}    # key -> _Call in flight
+
+    def Do(self, key, function, *args, **kwargs):
+        """
+        Runs ``function(*args, **kwargs)``, or waits for the call already running for ``key``.
+
+        Returns:
+            tuple: The result, and whether it was shared with a call already in flight.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
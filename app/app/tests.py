@@ -0,0 +1,422 @@
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, router
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import path
+
+from app.concurrency import ConcurrentUpdateError
+from app.facade import Facade
+from app.profiling import SamplingProfiler, WriteCollapsed, profile_view, profiled
+from app.readapi import MAX_INCLUDED_ROWS
+from app.responses import AcceptedEncodings, CompressResponse, brotli
+from app.sharding import SHARD_ID_RANGE, FanOut, GroupByShard, ReserveShardIdRanges, ShardFor
+from app.singleflight import SingleFlight
+from app.testutils import (
+    SHARDS, MakeProducts, MakePurchaseOrders, MakeSales, MakeStaff, MakeStock, MakeStores, MakeSuppliers,
+    QueryBudgetTestCase, ShardedTestCase,
+)
+from Finance.models import Department
+from HR.models import Staff
+from Inventory.models import ProductLocation, Store
+from Procurement.models import Supplier
+from Sales.models import Sales
+
+
+class FacadeQueryBudgetTests(QueryBudgetTestCase):
+
+    def testRestockProduct(self):
+        def Build(size):
+            product = MakeProducts(1, supplier=MakeSuppliers(1)[0], order_limit=10 * size + 1)[0]
+            MakeStock([product], MakeStores(size))
+            return (product,)
+
+        # The product with its supplier and open order, its stock, the emptiest store's stock row and store,
+        # and the new order in a savepoint
+        self.assertQueryBudget(7, Build, lambda product: Facade().RestockProduct(product.pk))
+
+    def testRestockNotNeeded(self):
+        def Build(size):
+            product = MakeProducts(1, order_limit=1)[0]
+            MakeStock([product], MakeStores(size))
+            return (product,)
+
+        self.assertQueryBudget(2, Build, lambda product: Facade().RestockProduct(product.pk))
+
+    def testRestockAlreadyOrdered(self):
+        def Build(size):
+            product = MakeProducts(1, supplier=MakeSuppliers(1)[0], order_limit=10 * size + 1)[0]
+            MakeStock([product], MakeStores(size))
+            MakePurchaseOrders([product], status="Shipped")
+            return (product,)
+
+        def Call(product):
+            self.assertIn("already open", Facade().RestockProduct(product.pk))
+
+        # The open order comes with the product, its stock is not read
+        self.assertQueryBudget(1, Build, Call)
+
+    def testGetStorePerformance(self):
+        def Build(size):
+            MakeSales(size, MakeStores(size), MakeProducts(size))
+            return ()
+
+        # The archive boundary and the product totals, store totals are rolled up from them
+        self.assertQueryBudget(2, Build, lambda: Facade().GetStorePerformance())
+
+
+class ReadViewQueryBudgetTests(QueryBudgetTestCase):
+
+    def Recorded(self, size):   # `size` stores stocking `size` products, with sales by `size` staff members
+        stores, products = MakeStores(size), MakeProducts(size, supplier=MakeSuppliers(1)[0])
+        MakeStock(products, stores)
+        MakeSales(size * 2, stores, products, MakeStaff(size))
+        return ()
+
+    def testReadStores(self):
+        def Call():
+            response = self.client.get("/read/store/", {"include": "stock.product.supplier,sales.staff", "limit": 100})
+            self.assertEqual(response.status_code, 200)
+
+        # The stores, then one query per included relation
+        self.assertQueryBudget(6, self.Recorded, Call)
+
+    def testReadProductsById(self):
+        def Call():
+            self.client.get("/read/product/", {"ids": "1,2,3", "include": "stock.store,sales", "fields[product]": "ProductName"})
+
+        self.assertQueryBudget(4, self.Recorded, Call)
+
+    def testListIncludesAreBounded(self):
+        store = MakeStores(1)[0]
+        products = MakeProducts(MAX_INCLUDED_ROWS + 5, supplier=MakeSuppliers(1)[0])
+        MakeStock(products, [store])
+
+        response = self.client.get("/read/store/", {"ids": str(store.pk), "include": "stock.product"})
+        stock = response.json()["data"][0]["stock"]
+        self.assertEqual([row["product"]["id"] for row in stock], [product.pk for product in products[:MAX_INCLUDED_ROWS]])
+
+        # Each supplier could include 50 products with 50 stock rows each
+        response = self.client.get("/read/supplier/", {"include": "products.stock", "limit": 100})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/read/supplier/", {"include": "products.stock", "limit": 2})
+        self.assertEqual(len(response.json()["data"][0]["products"]), MAX_INCLUDED_ROWS)
+
+
+class AdminQueryBudgetTests(QueryBudgetTestCase):
+
+    CHANGELISTS = (
+        "/admin/Sales/sales/", "/admin/Inventory/productlocation/", "/admin/Procurement/purchaseorder/",
+        "/admin/HR/staff/", "/admin/Finance/department/",
+    )
+
+    def Recorded(self, size):   # Rows whose names follow a foreign key, on every changelist
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        stores, products = MakeStores(size), MakeProducts(size)
+        MakeStock(products, stores[:1])
+        MakeSales(size, stores, products)
+        MakePurchaseOrders(products)
+        Department.objects.bulk_create(
+            Department(DepartmentName=f"Department {n}", Budget=1000, ManagerId=staff)
+            for n, staff in enumerate(MakeStaff(size))
+        )
+        MakeStaff(size, Department.objects.first())
+        return ()
+
+    def testChangelists(self):
+        for url in self.CHANGELISTS:
+            with self.subTest(url=url):
+                # The session, the user, the row counts and the page of rows with their related rows joined
+                self.assertQueryBudget(5, self.Recorded, lambda: self.assertEqual(self.client.get(url).status_code, 200))
+
+
+class VersionCheckTests(TestCase):
+    """
+    Edits based on a stale read must fail instead of overwriting the change made since.
+    """
+
+    def assertStaleEditFails(self, model, pk, edit, stale_edit):
+        first, second = model.objects.get(pk=pk), model.objects.get(pk=pk)
+        edit(first)
+        with self.assertRaises(ConcurrentUpdateError):
+            stale_edit(second)
+        return model.objects.get(pk=pk)
+
+    def testStaff(self):
+        staff = MakeStaff(1)[0]
+        department = Department.objects.create(DepartmentName="Sales", Budget=1000)
+        stored = self.assertStaleEditFails(
+            Staff, staff.pk, lambda s: s.EditStaffData(Salary=1), lambda s: s.AssignDepartment(department)
+        )
+        self.assertEqual((stored.Salary, stored.Version, stored.DepartmentId), (1, 1, None))
+
+        stored.AssignDepartment(department)     # A fresh read can be edited
+        other = Department.objects.create(DepartmentName="Stock", Budget=1000)
+        stored = self.assertStaleEditFails(
+            Staff, staff.pk, lambda s: s.AssignDepartment(other), lambda s: s.EditStaffData(Role="Manager")
+        )
+        self.assertEqual((stored.DepartmentId, stored.Role, stored.Version), (other, "Cashier", 3))
+
+    def testStore(self):
+        store = MakeStores(1)[0]
+        stored = self.assertStaleEditFails(
+            Store, store.pk, lambda s: s.edit_store_data(OperatingHours=8), lambda s: s.edit_store_data(StoreName="Other")
+        )
+        self.assertEqual((stored.OperatingHours, stored.StoreName, stored.Version), (8, store.StoreName, 1))
+
+    def testSupplier(self):
+        supplier = MakeSuppliers(1)[0]
+        stored = self.assertStaleEditFails(
+            Supplier, supplier.pk, lambda s: s.EditSupplierData(Location="York"), lambda s: s.EditSupplierData(Location="Hull")
+        )
+        self.assertEqual((stored.Location, stored.Version), ("York", 1))
+
+
+class CompressResponseTests(SimpleTestCase):
+
+    BODY = b'{"TotalSales": "10.00"}' * 200
+
+    def Encoding(self, header):
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=header)
+        return CompressResponse(request, HttpResponse(self.BODY)).get("Content-Encoding")
+
+    def testAcceptedEncodings(self):
+        self.assertEqual(
+            AcceptedEncodings("gzip, br;q=0.5, *;Q=0, deflate;q=x, identity;q=2"),
+            {"gzip": 1.0, "br": 0.5, "*": 0.0, "deflate": 0.0, "identity": 0.0},
+        )
+        self.assertEqual(AcceptedEncodings(""), {})
+
+    def testQualityValues(self):
+        best = "br" if brotli is not None else "gzip"
+        self.assertEqual(self.Encoding("gzip, br"), best)
+        self.assertEqual(self.Encoding("gzip, br;q=0"), "gzip")
+        self.assertEqual(self.Encoding("gzip;q=1, br;q=0.5"), "gzip")
+        self.assertEqual(self.Encoding("*"), best)
+        self.assertEqual(self.Encoding("*, br;q=0"), "gzip")
+        self.assertIsNone(self.Encoding("gzip;q=0"))
+        self.assertIsNone(self.Encoding("gzip;q=0, br;q=0.0"))
+        self.assertIsNone(self.Encoding("identity"))
+
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="br;q=0, gzip;q=0.8")
+        response = CompressResponse(request, HttpResponse(self.BODY))
+        self.assertEqual(gzip.decompress(response.content), self.BODY)
+
+
+def SlowView(request):
+    time.sleep(0.05)
+    return HttpResponse("done")
+
+
+urlpatterns = [     # URLconf of ProfilingTests
+    path("slow/", SlowView, name="slow"),
+    path("marked/", profile_view(lambda request: SlowView(request)), name="marked"),
+]
+
+
+@override_settings(ROOT_URLCONF="app.tests", PROFILING_HEADER_TOKEN="secret", PROFILING_INTERVAL=0.002)
+class ProfilingTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.enterContext(override_settings(PROFILING_DIR=self.directory))
+
+    def Profiles(self):
+        return sorted(path.name for path in self.directory.glob("*.collapsed"))
+
+    def testTokenRequestsAProfile(self):
+        self.assertEqual(self.client.get("/slow/").status_code, 200)
+        self.client.get("/slow/", HTTP_X_PROFILE="wrong")
+        self.assertEqual(self.Profiles(), [])
+
+        self.assertEqual(self.client.get("/slow/", HTTP_X_PROFILE="secret").status_code, 200)
+        (profile,) = self.directory.glob("*.collapsed")
+        self.assertTrue(profile.name.startswith("slow-"))
+        lines = profile.read_text().splitlines()
+        self.assertTrue(any("app.tests:SlowView" in line for line in lines))
+        for line in lines:  # "frame;frame;... count"
+            stack, count = line.rsplit(" ", 1)
+            self.assertTrue(stack and int(count) > 0)
+
+    def testMarkedViewsAndFunctions(self):
+        self.client.get("/marked/")
+        self.assertEqual(len(self.Profiles()), 1)
+
+        @profiled(rate=1)
+        def Work():
+            time.sleep(0.05)
+            return "done"
+
+        self.assertEqual(Work(), "done")
+        self.assertEqual(len(self.Profiles()), 2)
+        self.assertEqual(profiled(rate=0)(lambda: "skipped")(), "skipped")
+        self.assertEqual(len(self.Profiles()), 2)
+
+    def testSamplerAndWriter(self):
+        with SamplingProfiler(interval=0.002) as profiler:
+            time.sleep(0.05)
+        self.assertGreater(profiler.samples, 0)
+        self.assertEqual(sum(profiler.stacks.values()), profiler.samples)
+
+        path = WriteCollapsed(Counter({"a;b": 3, "a": 1}), "view/name", 0.25)
+        self.assertEqual(path.read_text(), "a;b 3\na 1\n")
+        self.assertTrue(path.name.startswith("view_name-250ms-"))
+
+
+# Runs in a fresh interpreter against an empty database file, as a gunicorn master preloading the application
+WARMUP_CHILD = """
+import json, os, runpy, threading, types
+os.environ["GUNICORN_PRELOAD_APP"] = "1"
+
+import app.wsgi
+from app import warmup
+from Operations import scheduler
+
+result = {"Master": [thread.name for thread in threading.enumerate()], "Scheduler": scheduler._background is not None}
+result["First"], result["Second"] = sorted(warmup.Warmup()), sorted(warmup.Warmup())
+result["Requests"] = sorted(warmup.WarmupWorker(app.wsgi.application, urls=["/Sales/performance/", "/nowhere/"]))
+
+hooks = runpy.run_path("gunicorn.conf.py")     # What gunicorn then runs in each worker
+hooks["post_fork"](None, None)
+hooks["post_worker_init"](types.SimpleNamespace(wsgi=app.wsgi.application))
+result["Worker"] = scheduler._background is not None and scheduler._background[0].is_alive()
+print(json.dumps(result))
+"""
+
+
+class WarmupTests(SimpleTestCase):
+
+    def testPreloadingMaster(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(f"{directory}/warmup_settings.py", "w") as settings_file:
+                settings_file.write(
+                    f"from {settings.SETTINGS_MODULE} import *\n"
+                    f"DATABASES = {{alias: {{'ENGINE': 'django.db.backends.sqlite3', 'NAME': '{directory}/' + alias}}"
+                    " for alias in ('default', 'archive')}\n"
+                    "WARMUP_ON_STARTUP = False\n"     # The child runs the warm-up itself, twice
+                    "SCHEDULER_RUN_IN_PROCESS = True\n"
+                )
+            env = dict(
+                os.environ, DJANGO_SETTINGS_MODULE="warmup_settings",
+                PYTHONPATH=os.pathsep.join([directory, *(path for path in sys.path if path)]),
+            )
+            output = subprocess.run(
+                [sys.executable, "-c", WARMUP_CHILD], env=env, cwd=settings.BASE_DIR, capture_output=True, text=True,
+                timeout=120,
+            )
+        self.assertEqual(output.returncode, 0, output.stderr)
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+
+        self.assertNotIn("scheduler", result["Master"])     # No thread may be running when the master forks
+        self.assertFalse(result["Scheduler"])
+        self.assertEqual(result["First"], ["Imports", "Models", "Templates", "Urls"])
+        self.assertEqual(result["Second"], [])  # The steps run once per process
+        self.assertEqual(result["Requests"], ["/Sales/performance/", "/nowhere/"])   # Unmigrated tables don't stop it
+        self.assertTrue(result["Worker"])   # Each worker starts its own scheduler after the fork
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def testConcurrentCallsShareOneRun(self):
+        flight, started, release, runs = SingleFlight(), threading.Event(), threading.Event(), []
+
+        def Work():
+            runs.append(1)
+            started.set()
+            release.wait(5)
+            return "done"
+
+        results = []
+        self.addCleanup(release.set)    # Never leave the leader blocked when an assertion fails
+        leader = threading.Thread(target=lambda: results.append(flight.Do(1, Work)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.Do(1, Work))) for _ in range(4)]
+        for follower in followers:
+            follower.start()
+        deadline = time.monotonic() + 5
+        while flight._calls[1].waiters < 4 and time.monotonic() < deadline:     # Every follower joins the leader
+            time.sleep(0.01)
+        self.assertEqual(flight._calls[1].waiters, 4)
+        release.set()
+        for thread in [leader, *followers]:
+            thread.join(5)
+
+        self.assertEqual(len(runs), 1)
+        self.assertCountEqual(results, [("done", False)] + [("done", True)] * 4)
+        self.assertEqual(flight.Do(1, lambda: "again"), ("again", False))   # Results are not kept
+
+    def testErrorsReachEveryCaller(self):
+        flight = SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.Do("key", lambda: 1 / 0)
+        self.assertEqual(flight._calls, {})
+
+
+class ShardingTests(ShardedTestCase):
+
+    def testRouting(self):
+        stores, products = MakeStores(4), MakeProducts(2)
+        self.assertEqual([ShardFor(store.pk) for store in stores], [SHARDS[store.pk % 2] for store in stores])
+        self.assertEqual(GroupByShard([1, 2, 3, 4]), {"shard1": {1, 3}, "shard0": {2, 4}})
+
+        sale = Sales.objects.create(PaymentMethod="Card", TotalAmount=Decimal("5.00"), StoreId=stores[0])
+        home, other = ShardFor(stores[0].pk), ShardFor(stores[1].pk)
+        self.assertTrue(Sales.objects.using(home).filter(pk=sale.pk).exists())
+        self.assertFalse(Sales.objects.using(other).filter(pk=sale.pk).exists())
+        self.assertFalse(Sales.objects.filter(pk=sale.pk).exists())     # Nothing lands in the default database
+
+        MakeStock(products, stores)
+        for store in stores:    # Reverse relations are read from the store's shard
+            self.assertEqual(store.ProductLocation.count(), 2)
+            self.assertEqual(ProductLocation.objects.using(ShardFor(store.pk)).filter(StoreId=store).count(), 2)
+        self.assertEqual(stores[0].sales.get(), sale)
+        self.assertEqual(router.db_for_read(Sales, instance=stores[1]), other)
+        self.assertEqual(router.db_for_write(Sales, instance=sale), home)
+        stored = Sales.objects.using(home).get(pk=sale.pk)
+        self.assertEqual(stored.StoreId.StoreName, stores[0].StoreName)     # Followed back into default
+
+        self.assertTrue(router.allow_migrate("shard0", "Sales", model_name="sales"))
+        self.assertTrue(router.allow_migrate("shard0", "Operations", model_name="outboxevent"))
+        self.assertFalse(router.allow_migrate("shard0", "Inventory", model_name="store"))
+        self.assertNotIn("Inventory_store", connections["shard0"].introspection.table_names())
+
+    def testIdRanges(self):
+        sales = MakeSales(8, MakeStores(2))
+        for sale in sales:
+            start = (SHARDS.index(ShardFor(sale.StoreId_id)) + 1) * SHARD_ID_RANGE
+            self.assertTrue(start < sale.pk < start + SHARD_ID_RANGE, sale.pk)
+        self.assertEqual(len({sale.pk for sale in sales}), 8)
+
+        ReserveShardIdRanges("shard0")  # Running it again never hands out ids twice
+        latest = Sales.objects.using("shard0").create(PaymentMethod="Card", TotalAmount=Decimal("5.00"), StoreId_id=2)
+        self.assertEqual(latest.pk, max(sale.pk for sale in sales if ShardFor(sale.StoreId_id) == "shard0") + 1)
+
+    def testFanOutMerges(self):
+        stores = MakeStores(3)
+        MakeSales(9, stores, MakeProducts(1), amount="2.00")
+
+        self.assertEqual(FanOut(lambda alias: alias), SHARDS)     # Results come back in shard order
+        counts = FanOut(lambda alias: Sales.objects.using(alias).count())
+        self.assertEqual(counts, [len([s for s in stores if ShardFor(s.pk) == alias]) * 3 for alias in SHARDS])
+        self.assertEqual(FanOut(lambda alias: Sales.objects.using(alias).count(), ["shard1"]), counts[1:])
+
+        performance = Facade().GetStorePerformance()
+        self.assertEqual(
+            {row["StoreId__StoreName"]: row["TotalSales"] for row in performance["store_sales"]},
+            {store.StoreName: Decimal("6.00") for store in stores},
+        )
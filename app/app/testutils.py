@@ -0,0 +1,170 @@
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+
+# Bulk fixtures for the test suites. Each factory saves all its rows with a single bulk_create,
+# so building a few hundred rows stays fast, and returns the saved instances with their keys.
+# bulk_create sends no signals: tests reading through the store locator invalidate it themselves.
+
+def MakeSuppliers(count):
+    from Procurement.models import Supplier
+
+    return Supplier.objects.bulk_create(
+        Supplier(SupplierName=f"Supplier {n}", ContactDetails=f"supplier{n}@example.com", Location="Leeds", ContractTerms="30 days")
+        for n in range(count)
+    )
+
+
+def MakeProducts(count, supplier=None, price="10.00", order_limit=50, product_type="Grocery"):
+    from Inventory.models import Product
+
+    return Product.objects.bulk_create(
+        Product(
+            ProductName=f"Product {n}", ProductType=product_type, Price=Decimal(price),
+            StockAmount=0, OrderLimit=order_limit, SupplierId=supplier,
+        )
+        for n in range(count)
+    )
+
+
+def MakeStores(count):
+    from Inventory.models import Store
+
+    return Store.objects.bulk_create(  # Stores are spread over a small grid around Leeds
+        Store(
+            StoreName=f"Store {n}", Location=f"Street {n}", Latitude=53.8 + (n % 10) * 0.01,
+            Longitude=-1.55 + (n // 10) * 0.01, ContactNumber="0113000000", TotalSales=0, OperatingHours=10,
+        )
+        for n in range(count)
+    )
+
+
+def MakeStock(products, stores, quantity=10):
+    # One stock row for every product in every store
+    from Inventory.models import ProductLocation
+
+    return ProductLocation.objects.bulk_create(
+        ProductLocation(ProductId=product, StoreId=store, Quantity=quantity) for product in products for store in stores
+    )
+
+
+def MakeStaff(count, department=None):
+    from HR.models import Staff
+
+    return Staff.objects.bulk_create(
+        Staff(StaffName=f"Staff {n}", Role="Cashier", Salary=20000, DepartmentId=department) for n in range(count)
+    )
+
+
+def MakeSales(count, stores, products=(None,), staff=(None,), amount="5.00", days=30):
+    """
+    Creates sales cycling through the given stores, products and staff, spread evenly over the last days.
+
+    Returns:
+        list: The saved sales.
+    """
+    from Sales.models import Sales
+
+    now = timezone.now()
+    return Sales.objects.bulk_create(
+        Sales(
+            PaymentMethod="Card", TotalAmount=Decimal(amount), Quantity=1,
+            StoreId=stores[n % len(stores)], ProductId=products[n % len(products)], StaffId=staff[n % len(staff)],
+            SaleTimestamp=now - timedelta(days=days) * (n / count),
+        )
+        for n in range(count)
+    )
+
+
+def MakePurchaseOrders(products, status="Pending", quantity=10, cost="50.00", delivered=None, store=None):
+    # One purchase order per product
+    from Procurement.models import PurchaseOrder
+
+    return PurchaseOrder.objects.bulk_create(
+        PurchaseOrder(
+            ProductId=product, FullCost=Decimal(cost), OrderStatus=status, Quantity=quantity,
+            DeliveryDate=delivered, StoreId=store,
+        )
+        for product in products
+    )
+
+
+class _Rollback(Exception):
+    pass
+
+
+class QueryBudgetTestCase(TestCase):
+    """
+    Checks that code paths run a fixed number of queries whatever the amount of data.
+
+    assertQueryBudget builds fixtures of every size in SIZES inside a savepoint, runs the code
+    under assertNumQueries and rolls the fixtures back, so an N+1 shows up as a failure at the
+    larger sizes.
+    """
+
+    databases = {"default", "archive"}
+    SIZES = (1, 10, 50)
+
+    def assertQueryBudget(self, budget, build, call):
+        """
+        Args:
+            budget (int): Queries ``call`` may run.
+            build (callable): Takes a size and returns the arguments passed to ``call``.
+            call (callable): The code under test.
+        """
+        for size in self.SIZES:
+            with self.subTest(size=size):
+                try:
+                    with transaction.atomic():
+                        args = build(size)
+                        with self.assertNumQueries(budget):
+                            call(*args)
+                        raise _Rollback
+                except _Rollback:
+                    pass
+
+
+SHARDS = ["shard0", "shard1"]   # Aliases of the shard databases set up by ShardedTestCase
+
+
+class ShardedTestCase(TransactionTestCase):
+    """
+    Runs tests with SALES_SHARDS set to two SQLite shard databases, migrated for the class.
+
+    The shards are temporary files rather than in-memory databases, so FanOut's worker threads
+    see the same data as the test.
+    """
+
+    databases = "__all__"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        shards = {
+            alias: {
+                "ENGINE": "django.db.backends.sqlite3", "NAME": f"{cls.directory.name}/{alias}.sqlite3",
+                "OPTIONS": {"init_command": "PRAGMA foreign_keys = OFF"},   # Stores and products stay in default
+            }
+            for alias in SHARDS
+        }
+        connections.settings.update(connections.configure_settings({"default": connections.settings["default"], **shards}))
+        cls.enterClassContext(override_settings(SALES_SHARDS=SHARDS))
+        for alias in SHARDS:
+            call_command("migrate", database=alias, verbosity=0)
+            connections[alias].close()  # Migrating turns foreign key checks back on for the connection
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in SHARDS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+        cls.directory.cleanup()
@@ -1,8 +1,13 @@
 from django.contrib import admin
 from django.urls import include, path
 
+from app import views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
-    # path("Inventory/", include("Inventory.urls")),
-    # path("Sales/", include("Sales.urls")),
+    path("Inventory/", include("Inventory.urls")),
+    path("Sales/", include("Sales.urls")),
+    path("Operations/", include("Operations.urls")),
+    path("Finance/", include("Finance.urls")),
+    path("read/<str:resource>/", views.ReadView, name="read"),
 ]
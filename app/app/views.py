@@ -0,0 +1,37 @@
+from django.http import JsonResponse
+
+from app.readapi import ParseIncludes, Read
+from app.responses import FastJsonResponse, compress_response
+
+
+@compress_response
+def ReadView(request, resource):
+    """
+    Function-based view for nested reads over stores, products, stock, sales, staff and suppliers.
+    :param request: The HTTP request object, with optional 'ids' (comma-separated), 'after', 'limit',
+        'include' (e.g. "stock.product,sales.staff") and 'fields[<resource>]' (comma-separated) parameters.
+    :param resource: Name of the top-level resource, e.g. "store".
+    :return: A JsonResponse with the rows and their includes.
+    """
+    try:
+        ids = [int(value) for value in request.GET["ids"].split(",") if value] if "ids" in request.GET else None
+        after = int(request.GET["after"]) if "after" in request.GET else None
+        limit = int(request.GET.get("limit", 20))
+    except ValueError:
+        return JsonResponse({"error": "ids, after and limit must be integers."}, status=400)
+
+    fieldsets = {
+        key[len("fields["):-1]: tuple(field for field in value.split(",") if field)
+        for key, value in request.GET.items()
+        if key.startswith("fields[") and key.endswith("]")
+    }
+
+    try:
+        data = Read(
+            resource, ids=ids, after=after, limit=limit,
+            fieldsets=fieldsets, include=ParseIncludes(request.GET.get("include")),
+        )
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return FastJsonResponse({"resource": resource, "data": data})
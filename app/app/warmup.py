@@ -0,0 +1,191 @@
+import importlib
+import io
+import logging
+import pkgutil
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.template import TemplateDoesNotExist, engines
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.utils import translation
+
+logger = logging.getLogger(__name__)
+
+# Submodules that are never needed to serve a request
+SKIPPED_MODULES = ("migrations", "management", "tests")
+
+_warmedUp = False   # Set once Warmup has run in this process, or in the master this process was forked from
+
+
+def ImportProjectModules():
+    """
+    Imports every module of the project's own apps, plus the project package itself.
+
+    Django only imports models and admin modules during setup, views, facades and helpers such as
+    the search or graphing modules are otherwise imported by the first request that needs them.
+
+    Returns:
+        int: Number of modules imported.
+    """
+    packages = [config.module for config in apps.get_app_configs() if config.path.startswith(str(settings.BASE_DIR))]
+    packages.append(importlib.import_module(settings.ROOT_URLCONF.split(".")[0]))
+
+    imported = 0
+    for package in packages:
+        for module in pkgutil.walk_packages(package.__path__, package.__name__ + "."):
+            if any(part in SKIPPED_MODULES for part in module.name.split(".")[1:]):
+                continue
+            if module.name.endswith((".wsgi", ".asgi", ".warmup")):  # Entry points import this module
+                continue
+            try:
+                importlib.import_module(module.name)
+                imported += 1
+            except Exception:  # An optional dependency may be missing, the module then fails as it would on use
+                logger.warning("Warm-up could not import %s", module.name, exc_info=True)
+    return imported
+
+
+def CompileUrlPatterns(resolver=None):
+    """
+    Compiles every URL pattern's regex and builds the resolver's reverse lookup tables, which
+    Django otherwise does on the first resolve() and reverse() calls.
+
+    Returns:
+        int: Number of URL patterns compiled.
+    """
+    resolver = resolver or get_resolver()
+    resolver.reverse_dict  # Populates the reverse, namespace and app lookup tables for the whole tree
+
+    compiled = 0
+    for pattern in resolver.url_patterns:
+        pattern.pattern.regex
+        if isinstance(pattern, URLResolver):
+            compiled += CompileUrlPatterns(pattern)
+        elif isinstance(pattern, URLPattern):
+            pattern.lookup_str
+            compiled += 1
+    return compiled
+
+
+def LoadModelMetadata():
+    """
+    Builds the cached field and relation lists of every model, so the first queries don't pay for
+    walking the whole app registry to find reverse relations.
+
+    Returns:
+        int: Number of models prepared.
+    """
+    models = apps.get_models(include_auto_created=True)
+    for model in models:
+        meta = model._meta
+        meta.get_fields()
+        meta.concrete_fields
+        meta.local_concrete_fields
+        meta.related_objects
+        meta.fields_map
+    return len(models)
+
+
+def LoadTemplates():
+    """
+    Creates the template engines, which loads every template tag library, compiles the
+    WARMUP_TEMPLATES and loads the translation catalogue of the default language.
+
+    Returns:
+        int: Number of templates compiled.
+    """
+    compiled = 0
+    for engine in engines.all():
+        for name in settings.WARMUP_TEMPLATES:
+            try:
+                engine.get_template(name)
+                compiled += 1
+            except TemplateDoesNotExist:
+                pass
+
+    with translation.override(settings.LANGUAGE_CODE):
+        translation.gettext("")
+    return compiled
+
+
+def Warmup():
+    """
+    Does the per-process start-up work that would otherwise fall on the first requests.
+
+    Safe to run before a pre-forking server forks its workers: no database connection is left
+    open, so every worker still opens its own. The steps run once per process, later calls (say
+    both wsgi.py and asgi.py being imported) return without doing anything.
+
+    Returns:
+        dict: Seconds spent in each step, empty when the warm-up already ran.
+    """
+    global _warmedUp
+    if _warmedUp:
+        return {}
+    _warmedUp = True
+
+    timings = {}
+    for name, step in (
+        ("Imports", ImportProjectModules),
+        ("Urls", CompileUrlPatterns),
+        ("Models", LoadModelMetadata),
+        ("Templates", LoadTemplates),
+    ):
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+
+    connections.close_all()  # Imports may have touched the database, a forked worker must not inherit that socket
+    logger.info("Warm-up finished: %s", ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings.items()))
+    return timings
+
+
+def _Request(application, url):
+    # Sends one GET through a WSGI application in-process and returns its status line
+    path, _, query = url.partition("?")
+    environ = {"PATH_INFO": path, "QUERY_STRING": query, "REQUEST_METHOD": "GET", "wsgi.input": io.BytesIO()}
+    setup_testing_defaults(environ)
+    status = []
+    body = application(environ, lambda line, headers, exc_info=None: status.append(line))
+    for _ in body:  # Drain streamed responses so the whole view runs
+        pass
+    if hasattr(body, "close"):
+        body.close()
+    return status[0] if status else None
+
+
+def WarmupWorker(application=None, urls=None):
+    """
+    Per-worker warm-up, run after the fork: opens the database connections and sends the
+    WARMUP_URLS requests through the application so view code paths, query compilation and
+    middleware are exercised once before real traffic arrives.
+
+    Args:
+        application: The WSGI application, a fresh handler is created when omitted.
+        urls (list, optional): Paths (with query string) to request, defaults to WARMUP_URLS.
+
+    Returns:
+        dict: Seconds taken by each warm-up request.
+    """
+    for alias in connections:
+        connections[alias].ensure_connection()
+
+    if application is None:
+        from django.core.handlers.wsgi import WSGIHandler
+
+        application = WSGIHandler()
+
+    timings = {}
+    for url in settings.WARMUP_URLS if urls is None else urls:
+        started = time.perf_counter()
+        try:
+            status = _Request(application, url)
+        except Exception:
+            logger.warning("Warm-up request to %s failed", url, exc_info=True)
+            continue
+        timings[url] = time.perf_counter() - started
+        logger.debug("Warm-up request %s -> %s", url, status)
+    return timings
@@ -14,3 +14,17 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402 - settings are only usable once the application is set up
+
+if settings.WARMUP_ON_STARTUP:  # Load modules, URL patterns and model metadata before the first request
+    from app.warmup import Warmup
+
+    Warmup()
+
+# Run periodic jobs in a background thread of this worker. A gunicorn master preloading the application
+# must not start threads before forking, gunicorn.conf.py starts the thread in each worker instead.
+if settings.SCHEDULER_RUN_IN_PROCESS and not os.environ.get("GUNICORN_PRELOAD_APP"):
+    from Operations.scheduler import StartBackgroundScheduler
+
+    StartBackgroundScheduler()
@@ -0,0 +1,44 @@
+# Gunicorn settings, picked up automatically when gunicorn is started from this directory:
+#     gunicorn app.wsgi
+import gc
+import multiprocessing
+import os
+
+wsgi_app = "app.wsgi:application"
+workers = multiprocessing.cpu_count() * 2 + 1
+
+# Import the application, and so run app.warmup.Warmup, once in the master before forking. The workers
+# then start with modules, URL patterns and model metadata already loaded, sharing those pages
+# copy-on-write instead of each building its own copy on its first requests.
+preload_app = True
+
+# Tells app/wsgi.py it is being preloaded in the master, which must not start threads before forking.
+# Threads don't survive a fork, and one holding a lock (logging, a database connection) at that moment
+# leaves the lock held forever in every worker. The scheduler is started in each worker below instead.
+os.environ["GUNICORN_PRELOAD_APP"] = "1"
+
+
+def when_ready(server):
+    # Everything preloaded is long-lived, keep the garbage collector from touching (and so copying) it in workers
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # A worker must never reuse a database connection inherited from the master
+    from django.db import connections
+
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    # Open this worker's own database connections and send WARMUP_URLS before it accepts requests,
+    # then start the worker's scheduler thread, which app/wsgi.py skipped in the master
+    from django.conf import settings
+
+    from app.warmup import WarmupWorker
+
+    WarmupWorker(worker.wsgi)
+    if settings.SCHEDULER_RUN_IN_PROCESS:
+        from Operations.scheduler import StartBackgroundScheduler
+
+        StartBackgroundScheduler()